@@ -0,0 +1,292 @@
+# ============================================================================
+# التحكم في قبول البوتات - NeurHostX V9.2
+# ============================================================================
+"""
+قبول تشغيل البوتات حسب سعة المضيف:
+- خانات التشغيل (MAX_CONCURRENT_BOTS) مع هامش ذاكرة ومعالج حي من psutil
+- طابور انتظار مرتب بأولوية الخطة ثم أولوية البوت ثم الأقدم
+- إفساح المجال للخطط الأعلى بتجميد أقل البوتات أولوية وإعادتها للطابور
+"""
+
+import time
+import asyncio
+import logging
+import itertools
+from typing import Dict, Optional, Set, Tuple
+
+from config import (
+    ADMIN_ID, PLANS, MAX_CONCURRENT_BOTS,
+    ADMISSION_MEMORY_RESERVE_MB, ADMISSION_CPU_MAX_PERCENT,
+    ADMISSION_RECHECK_SECONDS, ADMISSION_MAX_PREEMPTIONS, PREEMPTION_ENABLED,
+    HIBERNATE_RECLAIM_MEMORY,
+    WORKER_LOCAL_FALLBACK
+)
+from helpers import safe_html_escape
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+logger = logging.getLogger(__name__)
+
+
+class AdmissionController:
+    """بوابة التشغيل: تقبل البوت فوراً أو تضعه في الطابور"""
+
+    def __init__(self, pm):
+        self.pm = pm
+        self.db = pm.db
+        # bot_id -> مفتاح الترتيب (الأصغر أولاً)
+        self._queue: Dict[int, Tuple[int, int, int]] = {}
+        # بوتات قُبلت ولم تُسجَّل عمليتها بعد (تثبيت المتطلبات مثلاً)
+        self._reserved: Set[int] = set()
+        self._seq = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self.preemptions = 0
+        self._cpu_sample = (0.0, 0.0)
+
+    # ═══════════════════════════════════════════════════════════════════════
+    # الأولوية والسعة
+    # ═══════════════════════════════════════════════════════════════════════
+
+    def _plan(self, user_id: int) -> dict:
+        return PLANS.get(self.db.get_user_plan(user_id, ADMIN_ID), {})
+
+    def priority(self, bot) -> Tuple[int, int]:
+        """(أولوية الخطة، أولوية البوت): الأعلى يُقبل أولاً"""
+        bot_priority = bot[29] if len(bot) > 29 and bot[29] else 1
+        return self._plan(bot[1]).get('priority', 1), bot_priority
+
+    def running_slots(self) -> int:
+        """الخانات المحلية المشغولة: العمليات غير المجمّدة والحجوزات (بوتات العقد لها خاناتها)"""
+        active = {
+            bot_id for bot_id, data in self.pm.processes.items()
+            if not data.get('frozen_at') and not getattr(data['process'], 'remote', False)
+        }
+        return len(active | self._reserved)
+
+    def _cpu_percent(self) -> float:
+        """نسبة المعالج للمضيف (قراءة واحدة في الثانية على الأكثر لتكون ذات معنى)"""
+        now = time.monotonic()
+        sampled_at, value = self._cpu_sample
+        if now - sampled_at >= 1.0:
+            value = psutil.cpu_percent(None)
+            self._cpu_sample = (now, value)
+        return value
+
+    def blocked_by(self, memory_mb: int) -> Optional[str]:
+        """سبب عدم القبول الآن أو None إذا توفرت السعة (على عقدة أو محلياً)"""
+        if self.pm.nodes:
+            if self.pm.nodes.has_capacity(memory_mb):
+                return None
+            if not WORKER_LOCAL_FALLBACK:
+                return "nodes"
+        if self.running_slots() >= MAX_CONCURRENT_BOTS:
+            return "slots"
+        if psutil:
+            available_mb = psutil.virtual_memory().available / (1024 * 1024)
+            if available_mb - memory_mb < ADMISSION_MEMORY_RESERVE_MB:
+                return "memory"
+            if self._cpu_percent() >= ADMISSION_CPU_MAX_PERCENT:
+                return "cpu"
+        return None
+
+    # ═══════════════════════════════════════════════════════════════════════
+    # الطابور
+    # ═══════════════════════════════════════════════════════════════════════
+
+    def _key(self, bot) -> Tuple[int, int, int]:
+        plan_priority, bot_priority = self.priority(bot)
+        return -plan_priority, -bot_priority, next(self._seq)
+
+    def position(self, bot_id: int) -> Optional[int]:
+        """موقع البوت في الطابور (1 = التالي) أو None"""
+        key = self._queue.get(bot_id)
+        if key is None:
+            return None
+        return 1 + sum(1 for other in self._queue.values() if other < key)
+
+    def __len__(self):
+        return len(self._queue)
+
+    def is_queued(self, bot_id: int) -> bool:
+        return bot_id in self._queue
+
+    def discard(self, bot_id: int):
+        """إخراج البوت من الطابور (إيقاف يدوي أو تعذّر تشغيله)"""
+        self._queue.pop(bot_id, None)
+
+    def detach(self, bot_id: int):
+        """إخراج البوت مؤقتاً مع الاحتفاظ بمفتاح موقعه (لـ restore)"""
+        return self._queue.pop(bot_id, None)
+
+    def restore(self, bot_id: int, key):
+        """إعادة البوت إلى موقعه السابق في الطابور"""
+        self._queue[bot_id] = key
+        self._ensure_dispatcher()
+
+    def release(self, bot_id: int):
+        """تحرير حجز البوت بعد تسجيل عمليته أو فشل تشغيله"""
+        self._reserved.discard(bot_id)
+        self.wake()
+
+    def wake(self):
+        """خانة تحررت: فحص الطابور فوراً"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    # ═══════════════════════════════════════════════════════════════════════
+    # القبول
+    # ═══════════════════════════════════════════════════════════════════════
+
+    async def admit(self, bot) -> Tuple[bool, Optional[int]]:
+        """قبول البوت (مع حجز خانة) أو وضعه في الطابور
+
+        Returns:
+            (مقبول، موقعه في الطابور إن لم يُقبل)
+        """
+        bot_id = bot[0]
+        if bot_id in self._reserved:
+            return True, None
+
+        key = self._queue.get(bot_id) or self._key(bot)
+        memory_mb = self._plan(bot[1]).get('memory_limit_mb', 256)
+        # لا يتجاوز أحداً أسبق منه في الطابور
+        ahead = any(other < key for other_id, other in self._queue.items() if other_id != bot_id)
+
+        if not ahead:
+            reason = self.blocked_by(memory_mb)
+            if reason and PREEMPTION_ENABLED:
+                reason = await self._preempt_for(bot, key, memory_mb)
+            if reason is None:
+                self._queue.pop(bot_id, None)
+                self._reserved.add(bot_id)
+                return True, None
+
+        self._queue[bot_id] = key
+        self._ensure_dispatcher()
+        return False, self.position(bot_id)
+
+    def _preemptible(self, reason: Optional[str]) -> bool:
+        """هل يحرر التجميد هذا المورد؟
+
+        التجميد يحرر خانة دائماً، لكنه لا يحرر الذاكرة إلا إذا نُقلت ذاكرة البوت
+        المجمّد عبر cgroup v2، ولا يخفض قراءة المعالج فوراً (عينة مخزنة لثانية).
+        """
+        if reason == "slots":
+            return True
+        return (reason == "memory" and HIBERNATE_RECLAIM_MEMORY
+                and getattr(self.pm.limiter, "backend", None) == "cgroup2")
+
+    async def _preempt_for(self, bot, key, memory_mb) -> Optional[str]:
+        """تجميد أقل البوتات العاملة أولوية (الأحدث تشغيلاً أولاً) حتى تتوفر السعة
+
+        إذا بقي سبب المنع بعد التجميد تُذاب الضحايا فوراً: تجميد بلا فائدة
+        يترك الطرفين في الطابور.
+        """
+        requester = key[:2]
+        reason = self.blocked_by(memory_mb)
+        frozen = []
+        for _ in range(ADMISSION_MAX_PREEMPTIONS):
+            if reason is None or not self._preemptible(reason):
+                break
+            victims = []
+            for victim_id, data in self.pm.processes.items():
+                if data.get('frozen_at') or victim_id == bot[0] or getattr(data['process'], 'remote', False):
+                    continue
+                victim = self.db.get_bot(victim_id)
+                if not victim:
+                    continue
+                plan_priority, bot_priority = self.priority(victim)
+                victim_key = (-plan_priority, -bot_priority)
+                if victim_key > requester:
+                    victims.append((victim_key, data['started_at'], victim))
+            if not victims:
+                break
+
+            _, _, victim = max(victims, key=lambda v: (v[0], v[1]))
+            if not await self.pm.hibernate_bot(victim[0]):
+                break
+            frozen.append(victim)
+            reason = self.blocked_by(memory_mb)
+
+        if reason is not None:
+            for victim in frozen:
+                self.pm.resume_bot(victim[0])
+            if frozen:
+                logger.info(f"↩️ إذابة {len(frozen)} بوت - التجميد لم يوفر السعة للبوت {bot[0]} ({reason})")
+            return reason
+
+        for victim in frozen:
+            self.preemptions += 1
+            # المجمّد يتقدم المنتظرين من نفس الأولوية (استئنافه فوري وذاكرته محجوزة)
+            plan_priority, bot_priority, seq = self._key(victim)
+            self._queue[victim[0]] = (plan_priority, bot_priority, -seq)
+            self.db.update_bot_status(victim[0], "queued", self.pm.processes[victim[0]]['process'].pid)
+            self.db.add_event_log(victim[0], "INFO", f"⏸ تم تجميد البوت لإفساح المجال لبوت بأولوية أعلى (#{bot[0]})")
+            logger.info(f"⏸ تجميد البوت {victim[0]} لصالح البوت {bot[0]}")
+            await self.pm._send_owner(victim[1], (
+                f"⏸ <b>تم إيقاف البوت مؤقتاً</b>\n"
+                f"{'─' * 30}\n\n"
+                f"🤖 البوت: <code>{safe_html_escape(victim[3])}</code>\n\n"
+                f"المضيف ممتلئ وتم تجميد البوت مع الحفاظ على حالته.\n"
+                f"📋 موقعه في الطابور: <b>{self.position(victim[0])}</b>\n"
+                f"⏰ لا يُخصم وقت الاستضافة أثناء الانتظار."
+            ))
+        return None
+
+    # ═══════════════════════════════════════════════════════════════════════
+    # تشغيل الطابور
+    # ═══════════════════════════════════════════════════════════════════════
+
+    def close(self):
+        """إيقاف تشغيل الطابور (عند إيقاف المضيف) دون تغيير حالة البوتات المنتظرة"""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self._queue.clear()
+
+    def _ensure_dispatcher(self):
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._dispatch_loop())
+
+    async def _dispatch_loop(self):
+        """تشغيل رأس الطابور كلما توفرت السعة (عند تحرر خانة أو كل ADMISSION_RECHECK_SECONDS)"""
+        while self._queue:
+            self._wakeup.clear()
+            try:
+                await self._dispatch()
+            except Exception as e:
+                logger.exception(f"خطأ في تشغيل طابور الانتظار: {e}")
+            if not self._queue:
+                break
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=ADMISSION_RECHECK_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _dispatch(self):
+        while self._queue:
+            bot_id = min(self._queue, key=self._queue.get)
+            bot = self.db.get_bot(bot_id)
+            if not bot:
+                self.discard(bot_id)
+                continue
+            if self.blocked_by(self._plan(bot[1]).get('memory_limit_mb', 256)):
+                return
+
+            ok, msg = await self.pm.start_bot(bot_id, self.pm.application)
+            if self.is_queued(bot_id):
+                # سبقه بوت آخر على السعة
+                return
+            if not ok:
+                continue
+            await self.pm._send_owner(bot[1], (
+                f"✅ <b>تم تشغيل البوت من الطابور</b>\n"
+                f"{'─' * 30}\n\n"
+                f"🤖 البوت: <code>{safe_html_escape(bot[3])}</code>\n"
+                f"{msg}"
+            ))
@@ -3,18 +3,24 @@
 # ============================================================================
 
 import os
+import re
 import sys
+import time
+import secrets
 import logging
 from pathlib import Path
 from logging.handlers import RotatingFileHandler
 
 from telegram.ext import ApplicationBuilder
+from telegram.request import HTTPXRequest
 from config import (
     TELEGRAM_BOT_TOKEN, ADMIN_ID, DATABASE_FILE, BOTS_DIRECTORY, LOGS_DIRECTORY,
     ERROR_LOG_FILE, BACKUPS_DIRECTORY, VERSION, VERSION_NAME,
     validate_credentials
 )
 from settings_manager import settings_manager
+from update_scheduler import update_scheduler
+from metrics import telegram_api_seconds, telegram_api_errors_total, telegram_api_rate_limited_total
 
 def setup_logging():
     """إعداد نظام التسجيل المحسن"""
@@ -84,10 +90,58 @@ def check_requirements():
     Path("temp").mkdir(exist_ok=True)
     Path("uploads").mkdir(exist_ok=True)
 
+# تسمية method ثابتة: أسماء Bot API فقط، وتنزيل الملفات تحت base_file_url تسمية واحدة
+_API_METHOD_RE = re.compile(r"[a-z][A-Za-z]{1,63}")
+FILE_DOWNLOAD_METHOD = "getFile/download"
+
+
+def api_method_label(url: str) -> str:
+    """اسم method لمقاييس طلب Bot API بعدد قيم محدود"""
+    if "/file/bot" in url:
+        return FILE_DOWNLOAD_METHOD
+    name = url.rsplit('/', 1)[-1]
+    return name if _API_METHOD_RE.fullmatch(name) else "other"
+
+
+class MeteredRequest(HTTPXRequest):
+    """HTTPXRequest يسجل زمن كل طلب Bot API وأخطاءه (ومنها 429) في المقاييس"""
+
+    async def do_request(self, url, method, *args, **kwargs):
+        api_method = api_method_label(url)
+        started = time.perf_counter()
+        try:
+            code, payload = await super().do_request(url, method, *args, **kwargs)
+        except Exception as e:
+            telegram_api_errors_total.inc(method=api_method, code=type(e).__name__)
+            raise
+        finally:
+            telegram_api_seconds.observe(time.perf_counter() - started, method=api_method)
+        if code >= 400:
+            telegram_api_errors_total.inc(method=api_method, code=code)
+            if code == 429:
+                telegram_api_rate_limited_total.inc(method=api_method)
+        return code, payload
+
+
 def create_app():
-    """إنشاء تطبيق البوت"""
+    """إنشاء تطبيق البوت (bot_api_base_url في settings.json لخادم Bot API محلي أو وهمي)
+
+    التحديثات تُعالج بالتوازي بين المستخدمين وبالترتيب لكل مستخدم (update_scheduler).
+    """
     try:
-        app = ApplicationBuilder().token(TELEGRAM_BOT_TOKEN).build()
+        builder = (
+            ApplicationBuilder()
+            .token(TELEGRAM_BOT_TOKEN)
+            .concurrent_updates(update_scheduler)
+            # نفس أحجام مجمّع الاتصالات الافتراضية في PTB مع قياس الطلبات
+            .request(MeteredRequest(connection_pool_size=256))
+            .get_updates_request(MeteredRequest(connection_pool_size=1))
+        )
+        base_url = settings_manager.get("bot_api_base_url")
+        if base_url:
+            base_url = base_url.rstrip('/')
+            builder = builder.base_url(f"{base_url}/bot").base_file_url(f"{base_url}/file/bot")
+        app = builder.build()
         return app
     except Exception as e:
         logger = logging.getLogger(__name__)
@@ -95,6 +149,81 @@ def create_app():
         print(f"❌ خطأ حرج: {e}")
         sys.exit(1)
 
+# ═══════════════════════════════════════════════════════════════════════════
+# وضع التشغيل: polling أو webhook
+# ═══════════════════════════════════════════════════════════════════════════
+
+_WEBHOOK_DEFAULTS = {
+    "enabled": False,
+    "url": "",                 # العنوان العام (https) الذي يصل إليه Telegram
+    "listen": "0.0.0.0",
+    "port": 8443,
+    "path": "telegram",
+    "secret_token": "",        # فارغ = رمز عشوائي جديد عند كل تشغيل
+    "max_connections": 40,     # اتصالات Telegram المتزامنة (1-100)
+    "cert": None,
+    "key": None,
+    # False: ما احتفظ به Telegram أثناء إعادة التشغيل يُسلَّم بعد setWebhook
+    "drop_pending_updates": False,
+}
+_SECRET_TOKEN_RE = re.compile(r"^[A-Za-z0-9_-]{1,256}$")
+
+
+def webhook_settings() -> dict:
+    """قسم webhook من settings.json بعد الإكمال بالقيم الافتراضية والتحقق
+
+    secret_token يمكن تمريره عبر NEURHOST_WEBHOOK_SECRET بدل حفظه في الملف.
+    """
+    cfg = {**_WEBHOOK_DEFAULTS, **settings_manager.get_section("webhook")}
+    cfg["secret_token"] = os.getenv("NEURHOST_WEBHOOK_SECRET") or cfg["secret_token"] or secrets.token_urlsafe(32)
+    cfg["max_connections"] = min(100, max(1, int(cfg["max_connections"])))
+    cfg["path"] = str(cfg["path"]).strip("/")
+    return cfg
+
+
+def run_app(app, allowed_updates):
+    """تشغيل البوت بـ webhook إذا كان مفعلاً في settings.json، وإلا بـ polling
+
+    في وضع webhook يرفض الخادم المدمج أي طلب بلا ترويسة
+    X-Telegram-Bot-Api-Secret-Token الصحيحة. عند الإيقاف يتوقف استقبال
+    الطلبات أولاً ثم تُعالج التحديثات المستلمة قبل الخروج، ويبقى الـ webhook
+    مسجلاً فيحتفظ Telegram بما يصل أثناء التوقف.
+    """
+    logger = logging.getLogger(__name__)
+    cfg = webhook_settings()
+
+    if cfg["enabled"]:
+        error = None
+        if not cfg["url"]:
+            error = "webhook.url غير معيّن"
+        elif not _SECRET_TOKEN_RE.match(cfg["secret_token"]):
+            error = "webhook.secret_token يقبل فقط A-Z a-z 0-9 _ - (حتى 256 حرفاً)"
+        if error is None:
+            webhook_url = f"{cfg['url'].rstrip('/')}/{cfg['path']}"
+            logger.info(
+                f"🌐 وضع webhook: {webhook_url} ← {cfg['listen']}:{cfg['port']} "
+                f"(اتصالات متزامنة: {cfg['max_connections']})"
+            )
+            app.run_webhook(
+                listen=cfg["listen"],
+                port=int(cfg["port"]),
+                url_path=cfg["path"],
+                webhook_url=webhook_url,
+                secret_token=cfg["secret_token"],
+                max_connections=cfg["max_connections"],
+                cert=cfg["cert"],
+                key=cfg["key"],
+                drop_pending_updates=bool(cfg["drop_pending_updates"]),
+                allowed_updates=allowed_updates,
+            )
+            return
+        logger.error(f"❌ إعداد webhook غير صالح ({error}) - التشغيل بوضع polling")
+
+    app.run_polling(
+        drop_pending_updates=True,
+        allowed_updates=allowed_updates,
+    )
+
 def print_startup_banner():
     """طباعة بيان البداية المحسن"""
     banner = f"""
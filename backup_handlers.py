@@ -2,14 +2,17 @@
 # معالجات النسخ الاحتياطية - NeurHostX V9.0
 # ============================================================================
 
-import io
+import asyncio
 import logging
 from datetime import datetime, timezone
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputFile
 from telegram.ext import ContextTypes, ConversationHandler
 
-from config import ADMIN_ID, BOTS_DIRECTORY, DATABASE_FILE
+from pathlib import Path
+
+from config import ADMIN_ID, BOTS_DIRECTORY, DATABASE_FILE, BACKUPS_DIRECTORY
 from backup_system import BackupSystem
+from helpers import format_datetime
 
 logger = logging.getLogger(__name__)
 
@@ -18,6 +21,7 @@ WAIT_BACKUP_PASSWORD = "WAIT_BACKUP_PASSWORD"
 WAIT_RESTORE_FILE    = "WAIT_RESTORE_FILE"
 WAIT_RESTORE_PASS    = "WAIT_RESTORE_PASS"
 WAIT_CHANNEL_ID      = "WAIT_CHANNEL_ID"
+WAIT_RESTORE_SCOPE   = "WAIT_RESTORE_SCOPE"
 
 
 # ═══════════════════════════════════════════════════════════════════════════
@@ -37,6 +41,7 @@ async def backup_panel(update: Update, context: ContextTypes.DEFAULT_TYPE, db):
     channel_id = db.get_setting("backup_channel_id", "")
     auto_backup = db.get_setting("auto_backup_enabled", "0")
     channel_info = channel_id if channel_id else "غير مضبوطة"
+    last_auto = db.get_setting("last_auto_backup_at", "")
 
     keyboard = [
         [InlineKeyboardButton("📥 تحميل نسخة كاملة", callback_data="backup_download_now")],
@@ -56,7 +61,8 @@ async def backup_panel(update: Update, context: ContextTypes.DEFAULT_TYPE, db):
         f"💾 <b>لوحة النسخ الاحتياطية</b>\n"
         f"════════════════════════════\n\n"
         f"📡 قناة النسخ: <code>{channel_info}</code>\n"
-        f"🔄 النسخ التلقائي: {'✅ مفعّل' if auto_backup == '1' else '❌ معطّل'}\n\n"
+        f"🔄 النسخ التلقائي: {'✅ مفعّل' if auto_backup == '1' else '❌ معطّل'}\n"
+        f"🕐 آخر نسخة تلقائية: {format_datetime(last_auto) if last_auto else 'لا يوجد'}\n\n"
         f"{'─'*28}\n\n"
         f"📦 تشمل النسخة الاحتياطية:\n"
         f"   • جميع ملفات البوتات\n"
@@ -233,10 +239,12 @@ async def backup_receive_file(update: Update, context: ContextTypes.DEFAULT_TYPE
     )
 
     try:
+        # تحميل الملف مباشرة إلى القرص بدل الاحتفاظ به في الذاكرة
+        upload_path = Path(BACKUPS_DIRECTORY) / f"restore_upload_{update.effective_user.id}.zip"
+        upload_path.parent.mkdir(parents=True, exist_ok=True)
         tg_file = await context.bot.get_file(doc.file_id)
-        buf = io.BytesIO()
-        await tg_file.download_to_memory(buf)
-        context.user_data['restore_zip'] = buf.getvalue()
+        await tg_file.download_to_drive(str(upload_path))
+        context.user_data['restore_zip_path'] = str(upload_path)
 
         await msg.edit_text(
             "════════════════════════════\n"
@@ -252,34 +260,112 @@ async def backup_receive_file(update: Update, context: ContextTypes.DEFAULT_TYPE
         return ConversationHandler.END
 
 
+def _discard_restore_upload(context):
+    """حذف ملف الاستعادة المؤقت وتنظيف بيانات المحادثة"""
+    path = context.user_data.pop('restore_zip_path', None)
+    context.user_data.pop('restore_password', None)
+    context.user_data.pop('restore_folders', None)
+    context.user_data.pop('restore_has_db', None)
+    if path:
+        Path(path).unlink(missing_ok=True)
+
+
 async def backup_restore_execute(update: Update, context: ContextTypes.DEFAULT_TYPE, db):
-    """تنفيذ الاستعادة"""
+    """فحص النسخة وعرض خيارات الاستعادة"""
     password_text = update.message.text.strip()
     password = None if password_text.lower() == "none" else password_text
 
-    zip_data = context.user_data.get('restore_zip')
-    if not zip_data:
+    zip_path = context.user_data.get('restore_zip_path')
+    if not zip_path or not Path(zip_path).exists():
         await update.message.reply_text("❌ لم يتم العثور على ملف النسخة")
         return ConversationHandler.END
 
-    msg = await update.message.reply_text(
+    try:
+        info = await asyncio.to_thread(BackupSystem.inspect_backup, zip_path, BOTS_DIRECTORY, password)
+    except Exception as e:
+        _discard_restore_upload(context)
+        await update.message.reply_text(f"❌ تعذّر قراءة النسخة: {str(e)[:100]}")
+        return ConversationHandler.END
+
+    context.user_data['restore_password'] = password
+    context.user_data['restore_folders'] = info['folders']
+    context.user_data['restore_has_db'] = info['has_db']
+
+    await update.message.reply_text(
+        f"════════════════════════════\n"
+        f"📦 <b>محتوى النسخة</b>\n"
+        f"════════════════════════════\n\n"
+        f"📅 التاريخ: {info['meta'].get('timestamp', 'غير معروف')}\n"
+        f"🤖 مجلدات البوتات: {len(info['folders'])}\n"
+        f"🗄️ قاعدة البيانات: {'✅' if info['has_db'] else '❌'}\n\n"
+        f"اختر ما تريد استعادته:",
+        reply_markup=_restore_scope_keyboard(info['folders'], info['has_db']),
+        parse_mode="HTML"
+    )
+    return WAIT_RESTORE_SCOPE
+
+
+def _restore_scope_keyboard(folders, has_db: bool) -> InlineKeyboardMarkup:
+    """أزرار نطاق الاستعادة (كاملة / قاعدة البيانات / بوت واحد)"""
+    keyboard = [[InlineKeyboardButton("♻️ استعادة كاملة", callback_data="backup_restore_scope_all")]]
+    if has_db:
+        keyboard.append([InlineKeyboardButton("🗄️ قاعدة البيانات فقط", callback_data="backup_restore_scope_db")])
+    for idx, folder in enumerate(folders[:20]):
+        keyboard.append([InlineKeyboardButton(f"🤖 {folder}", callback_data=f"backup_restore_scope_bot_{idx}")])
+    keyboard.append([InlineKeyboardButton("❌ إلغاء", callback_data="backup_restore_scope_cancel")])
+    return InlineKeyboardMarkup(keyboard)
+
+
+async def backup_restore_scope(update: Update, context: ContextTypes.DEFAULT_TYPE, db, pm):
+    """تنفيذ الاستعادة للنطاق المختار"""
+    query = update.callback_query
+    await query.answer()
+
+    choice = query.data.replace("backup_restore_scope_", "")
+    zip_path = context.user_data.get('restore_zip_path')
+    if choice == "cancel" or not zip_path:
+        _discard_restore_upload(context)
+        await query.edit_message_text("❌ تم إلغاء الاستعادة")
+        return ConversationHandler.END
+
+    scope, bot_folder = choice, None
+    if choice.startswith("bot_"):
+        folders = context.user_data.get('restore_folders', [])
+        try:
+            bot_folder = folders[int(choice.replace("bot_", ""))]
+        except (ValueError, IndexError):
+            # الاستعلام أُجيب أعلاه ولا يقبل Telegram إجابة ثانية
+            await query.edit_message_text(
+                "❌ اختيار غير صحيح\n\nاختر ما تريد استعادته:",
+                reply_markup=_restore_scope_keyboard(folders, context.user_data.get('restore_has_db', False))
+            )
+            return WAIT_RESTORE_SCOPE
+        scope = "bot"
+
+    await query.edit_message_text(
         "════════════════════════════\n"
         "⏳ <b>جاري الاستعادة...</b>\n"
         "════════════════════════════",
         parse_mode="HTML"
     )
 
-    ok, result_msg = BackupSystem.restore_backup(zip_data, BOTS_DIRECTORY, DATABASE_FILE, password)
+    ok, result_msg = await BackupSystem.restore_from_file(
+        zip_path, BOTS_DIRECTORY, DATABASE_FILE,
+        password=context.user_data.get('restore_password'),
+        scope=scope, bot_folder=bot_folder,
+        pm=pm, application=context.application
+    )
+    _discard_restore_upload(context)
 
-    await msg.edit_text(
+    keyboard = [[InlineKeyboardButton("🔙 رجوع", callback_data="backup_panel")]]
+    await query.edit_message_text(
         f"════════════════════════════\n"
         f"{'✅' if ok else '❌'} <b>{'نجحت الاستعادة' if ok else 'فشلت الاستعادة'}</b>\n"
         f"════════════════════════════\n\n"
         f"{result_msg}",
+        reply_markup=InlineKeyboardMarkup(keyboard),
         parse_mode="HTML"
     )
-
-    context.user_data.pop('restore_zip', None)
     return ConversationHandler.END
 
 
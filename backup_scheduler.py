@@ -0,0 +1,258 @@
+# ============================================================================
+# جدولة النسخ الاحتياطي التلقائي - NeurHostX V9.2
+# ============================================================================
+"""
+مجدول النسخ الاحتياطي التلقائي المبني على JobQueue الخاص بالتطبيق:
+- تشغيل النسخ في خيط منفصل (لا يمر أبداً عبر مسار الطلبات)
+- فاصل زمني قابل للضبط مع تذبذب عشوائي (jitter)
+- منع التداخل بين عمليتي نسخ
+- سياسة احتفاظ: آخر N نسخة يومية و M نسخة أسبوعية
+- تسجيل المدة والحجم لكل عملية
+"""
+
+import time
+import random
+import asyncio
+import logging
+from pathlib import Path
+from datetime import datetime, timezone
+from typing import List, Optional, Tuple
+
+from config import BOTS_DIRECTORY, DATABASE_FILE, BACKUPS_DIRECTORY
+from backup_system import BackupSystem
+from settings_manager import settings_manager
+from helpers import get_current_time, format_size
+
+logger = logging.getLogger(__name__)
+
+# بادئة ملفات النسخ التلقائية داخل مجلد backups/
+AUTO_BACKUP_PREFIX = "auto_backup_"
+
+# فترة فحص الاستحقاق (بالثواني) - خفيفة جداً لأنها مجرد مقارنة أوقات
+CHECK_INTERVAL_SECONDS = 300
+
+
+def _as_utc(value) -> Optional[datetime]:
+    """تحويل قيمة وقت (نص ISO أو CURRENT_TIMESTAMP) إلى datetime بتوقيت UTC"""
+    try:
+        dt = datetime.fromisoformat(str(value))
+    except ValueError:
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt
+
+
+def select_backups_to_prune(entries: List[Tuple], keep_daily: int, keep_weekly: int) -> List[Tuple]:
+    """تحديد النسخ التي يجب حذفها وفق سياسة الاحتفاظ
+
+    تُحفظ أحدث نسخة في كل يوم لآخر keep_daily يوماً، وأحدث نسخة في كل
+    أسبوع (ISO) لآخر keep_weekly أسبوعاً. كل ما عدا ذلك يُحذف.
+
+    Args:
+        entries: قائمة (المعرّف، datetime الإنشاء، ...)
+        keep_daily: عدد الأيام المحتفظ بها
+        keep_weekly: عدد الأسابيع المحتفظ بها
+
+    Returns:
+        العناصر المطلوب حذفها
+    """
+    ordered = sorted(entries, key=lambda e: e[1], reverse=True)
+    keep = set()
+    days_seen = []
+    weeks_seen = []
+
+    for entry in ordered:
+        created = entry[1]
+        day_key = created.date()
+        week_key = created.isocalendar()[:2]
+
+        if day_key not in days_seen and len(days_seen) < keep_daily:
+            days_seen.append(day_key)
+            keep.add(entry[0])
+        if week_key not in weeks_seen and len(weeks_seen) < keep_weekly:
+            weeks_seen.append(week_key)
+            keep.add(entry[0])
+
+    return [e for e in ordered if e[0] not in keep]
+
+
+class BackupScheduler:
+    """مجدول النسخ الاحتياطي التلقائي"""
+
+    def __init__(self, db, bots_dir: str = BOTS_DIRECTORY, db_file: str = DATABASE_FILE,
+                 backups_dir: str = BACKUPS_DIRECTORY):
+        self.db = db
+        self.bots_dir = bots_dir
+        self.db_file = db_file
+        self.backups_dir = Path(backups_dir)
+        self._lock = asyncio.Lock()
+        self._next_jitter = None
+
+    # ═══════════════════════════════════════════════════════════════════════
+    # الإعدادات
+    # ═══════════════════════════════════════════════════════════════════════
+
+    def is_enabled(self) -> bool:
+        """هل النسخ التلقائي مفعّل؟ (إعداد قاعدة البيانات يتقدم على settings.json)"""
+        default = "1" if settings_manager.get("auto_backup_enabled", False) else "0"
+        return self.db.get_setting("auto_backup_enabled", default) == "1"
+
+    def interval_seconds(self) -> float:
+        """الفاصل الزمني بين النسخ بالثواني"""
+        hours = self.db.get_setting(
+            "auto_backup_interval_hours",
+            settings_manager.get("auto_backup_interval_hours", 24)
+        )
+        try:
+            return max(1.0, float(hours)) * 3600
+        except (TypeError, ValueError):
+            return 24 * 3600
+
+    def _jitter_seconds(self) -> float:
+        """تذبذب عشوائي ثابت لكل دورة حتى لا تتزامن النسخ مع أعمال أخرى"""
+        if self._next_jitter is None:
+            max_jitter = float(settings_manager.get("auto_backup_jitter_minutes", 15)) * 60
+            self._next_jitter = random.uniform(-max_jitter, max_jitter)
+        return self._next_jitter
+
+    def _last_run(self) -> Optional[datetime]:
+        """وقت آخر نسخة تلقائية ناجحة"""
+        value = self.db.get_setting("last_auto_backup_at")
+        if not value:
+            return None
+        return _as_utc(value)
+
+    def is_due(self) -> bool:
+        """هل حان وقت النسخة التالية؟"""
+        last = self._last_run()
+        if last is None:
+            return True
+        elapsed = (datetime.now(timezone.utc) - last).total_seconds()
+        return elapsed >= self.interval_seconds() + self._jitter_seconds()
+
+    # ═══════════════════════════════════════════════════════════════════════
+    # التسجيل في JobQueue
+    # ═══════════════════════════════════════════════════════════════════════
+
+    def install(self, application) -> bool:
+        """تسجيل مهمة الفحص الدوري في JobQueue الخاص بالتطبيق"""
+        job_queue = application.job_queue
+        if job_queue is None:
+            logger.warning(
+                "⚠️ JobQueue غير متاح - ثبّت python-telegram-bot[job-queue] لتفعيل النسخ التلقائي"
+            )
+            return False
+
+        job_queue.run_repeating(
+            self._tick,
+            interval=CHECK_INTERVAL_SECONDS,
+            first=random.uniform(30, 90),
+            name="auto_backup",
+            job_kwargs={"max_instances": 1, "coalesce": True},
+        )
+        logger.info("✅ تم تفعيل مجدول النسخ الاحتياطي التلقائي")
+        return True
+
+    async def _tick(self, context):
+        """فحص دوري خفيف: يشغّل النسخ فقط إذا كان مفعلاً ومستحقاً"""
+        try:
+            if not self.is_enabled() or not self.is_due():
+                return
+            await self.run_once(context.bot)
+        except Exception as e:
+            logger.error(f"❌ خطأ في مجدول النسخ الاحتياطي: {e}")
+
+    # ═══════════════════════════════════════════════════════════════════════
+    # التنفيذ
+    # ═══════════════════════════════════════════════════════════════════════
+
+    async def run_once(self, bot=None) -> Optional[dict]:
+        """تنفيذ نسخة تلقائية واحدة (بدون تداخل)
+
+        Returns:
+            ملخص العملية أو None إذا كانت هناك عملية جارية أو فشلت
+        """
+        if self._lock.locked():
+            logger.info("⏭️ تخطي النسخ التلقائي - هناك عملية جارية")
+            return None
+
+        async with self._lock:
+            ts = datetime.now(timezone.utc).strftime("%Y%m%d_%H%M%S")
+            target = self.backups_dir / f"{AUTO_BACKUP_PREFIX}{ts}.zip"
+
+            started = time.monotonic()
+            try:
+                size = await asyncio.to_thread(
+                    BackupSystem.create_full_backup_file, str(target), self.bots_dir, self.db_file
+                )
+            except Exception as e:
+                logger.error(f"❌ فشل إنشاء النسخة التلقائية: {e}")
+                return None
+            duration_ms = int((time.monotonic() - started) * 1000)
+
+            self.db.add_backup(None, str(target), size, kind='auto', duration_ms=duration_ms)
+            self.db.set_setting("last_auto_backup_at", get_current_time())
+            self._next_jitter = None
+            logger.info(
+                f"💾 نسخة تلقائية: {target.name} | {format_size(size)} | {duration_ms} ms"
+            )
+
+            channel_id = self.db.get_setting("backup_channel_id", "")
+            sent = False
+            if bot is not None and channel_id:
+                sent = await BackupSystem.send_auto_backup(
+                    bot, channel_id, self.bots_dir, self.db_file, backup_path=str(target)
+                )
+
+            pruned = await asyncio.to_thread(self.apply_retention)
+
+            return {
+                'path': str(target),
+                'size': size,
+                'duration_ms': duration_ms,
+                'sent': sent,
+                'pruned': pruned,
+            }
+
+    def apply_retention(self) -> int:
+        """تطبيق سياسة الاحتفاظ على مجلد backups/ وجدول backups
+
+        Returns:
+            عدد النسخ المحذوفة
+        """
+        keep_daily = int(settings_manager.get("auto_backup_keep_daily", 7))
+        keep_weekly = int(settings_manager.get("auto_backup_keep_weekly", 4))
+
+        entries = []
+        known_paths = set()
+        for row in self.db.get_backups_by_kind('auto'):
+            backup_id, _, file_path, _, created_at = row[:5]
+            known_paths.add(str(Path(file_path)))
+            created = _as_utc(created_at)
+            if created is None:
+                continue
+            entries.append((f"db:{backup_id}", created, backup_id, file_path))
+
+        # ملفات يتيمة في المجلد بدون سجل في قاعدة البيانات
+        if self.backups_dir.exists():
+            for path in self.backups_dir.glob(f"{AUTO_BACKUP_PREFIX}*.zip"):
+                if str(path) in known_paths:
+                    continue
+                created = datetime.fromtimestamp(path.stat().st_mtime, tz=timezone.utc)
+                entries.append((f"file:{path}", created, None, str(path)))
+
+        removed = 0
+        for _, _, backup_id, file_path in select_backups_to_prune(entries, keep_daily, keep_weekly):
+            try:
+                Path(file_path).unlink(missing_ok=True)
+            except OSError as e:
+                logger.warning(f"⚠️ تعذّر حذف النسخة {file_path}: {e}")
+                continue
+            if backup_id is not None:
+                self.db.delete_backup(backup_id)
+            removed += 1
+
+        if removed:
+            logger.info(f"🧹 تم حذف {removed} نسخة احتياطية قديمة وفق سياسة الاحتفاظ")
+        return removed
@@ -4,7 +4,7 @@
 """
 نظام نسخ احتياطي كامل يشمل:
 - تحميل نسخة احتياطية (كل ملفات البوتات + قاعدة البيانات)
-- رفع واستعادة نسخة
+- رفع واستعادة نسخة (كاملة، قاعدة البيانات فقط، أو بوت واحد)
 - تشفير بكلمة مرور
 - نسخ احتياطي تلقائي يومي
 """
@@ -15,10 +15,14 @@ import zipfile
 import logging
 import asyncio
 import json
+import shutil
+import sqlite3
 from pathlib import Path
 from datetime import datetime, timezone
 from typing import Optional
 
+from metrics import backup_seconds
+
 logger = logging.getLogger(__name__)
 
 
@@ -50,8 +54,9 @@ class BackupSystem:
             # ملاحظة: zipfile الأساسي لا يدعم AES - نستخدم pyzipper إذا متاح
             try:
                 import pyzipper
-                with pyzipper.AESZipFile(buf, 'w', compression=pyzipper.ZIP_DEFLATED,
-                                          encryption=pyzipper.WZ_AES) as zf:
+                with backup_seconds.time(kind="encrypted"), \
+                        pyzipper.AESZipFile(buf, 'w', compression=pyzipper.ZIP_DEFLATED,
+                                            encryption=pyzipper.WZ_AES) as zf:
                     zf.setpassword(password.encode('utf-8'))
                     BackupSystem._add_files_to_zip(zf, bots_dir, db_file, timestamp)
                 buf.seek(0)
@@ -59,12 +64,37 @@ class BackupSystem:
             except ImportError:
                 logger.warning("pyzipper غير متاح - سيتم إنشاء نسخة بدون تشفير")
 
-        with zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED) as zf:
+        with backup_seconds.time(kind="memory"), zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED) as zf:
             BackupSystem._add_files_to_zip(zf, bots_dir, db_file, timestamp)
 
         buf.seek(0)
         return buf
 
+    @staticmethod
+    def create_full_backup_file(target_path: str, bots_dir: str, db_file: str) -> int:
+        """
+        إنشاء نسخة احتياطية كاملة مباشرة على القرص (بدون تحميلها في الذاكرة)
+
+        يُكتب الأرشيف إلى ملف مؤقت ثم يُعاد تسميته، فلا يظهر ملف ناقص أبداً.
+
+        Returns:
+            حجم الملف الناتج بالبايت
+        """
+        target = Path(target_path)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = target.with_name(target.name + ".part")
+        timestamp = datetime.now(timezone.utc).strftime("%Y%m%d_%H%M%S")
+
+        try:
+            with backup_seconds.time(kind="file"), zipfile.ZipFile(tmp_path, 'w', zipfile.ZIP_DEFLATED) as zf:
+                BackupSystem._add_files_to_zip(zf, bots_dir, db_file, timestamp)
+            os.replace(tmp_path, target)
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
+
+        return target.stat().st_size
+
     @staticmethod
     def _add_files_to_zip(zf, bots_dir: str, db_file: str, timestamp: str):
         """إضافة الملفات إلى ZIP"""
@@ -109,39 +139,173 @@ class BackupSystem:
     # ═══════════════════════════════════════════════════════════════════════
 
     @staticmethod
-    def restore_backup(zip_content: bytes, bots_dir: str, db_file: str,
-                        password: Optional[str] = None) -> tuple[bool, str]:
+    def _open_archive(zip_path: str, password: Optional[str] = None):
+        """فتح الأرشيف من القرص (قراءة متدفقة) مع دعم كلمة المرور"""
+        if password:
+            try:
+                import pyzipper
+                zf = pyzipper.AESZipFile(zip_path, 'r')
+                zf.setpassword(password.encode('utf-8'))
+                return zf
+            except ImportError:
+                pass
+        zf = zipfile.ZipFile(zip_path, 'r')
+        if password:
+            zf.setpassword(password.encode('utf-8'))
+        return zf
+
+    @staticmethod
+    def _classify_member(name: str, bots_dir: str) -> tuple:
+        """تصنيف عنصر الأرشيف إلى (نوع، مجلد البوت، المسار النسبي)
+
+        يدعم تخطيط النسخة الكاملة (bots/<folder>/...) وتخطيط نسخة البوت
+        الفردية (<folder>/...).
         """
-        استعادة نسخة احتياطية
+        parts = [p for p in name.replace("\\", "/").split("/") if p not in ("", ".")]
+        if not parts or ".." in parts or name.endswith("/"):
+            return None, None, None
+        if parts == ["backup_meta.json"]:
+            return "meta", None, None
+        if parts[0] == "database" and len(parts) == 2:
+            return "db", None, parts[1]
+        if parts[0] == Path(bots_dir).name:
+            if len(parts) <= 2:
+                return None, None, None
+            parts = parts[1:]
+        if len(parts) < 2:
+            return None, None, None
+        return "bot", parts[0], "/".join(parts[1:])
+
+    @staticmethod
+    def inspect_backup(zip_path: str, bots_dir: str, password: Optional[str] = None) -> dict:
+        """قراءة محتوى النسخة بدون استخراج: مجلدات البوتات ووجود قاعدة البيانات"""
+        folders = set()
+        has_db = False
+        meta = {}
+        with BackupSystem._open_archive(zip_path, password) as zf:
+            for name in zf.namelist():
+                kind, folder, _ = BackupSystem._classify_member(name, bots_dir)
+                if kind == "bot":
+                    folders.add(folder)
+                elif kind == "db":
+                    has_db = True
+                elif kind == "meta":
+                    meta = json.loads(zf.read(name))
+        return {'folders': sorted(folders), 'has_db': has_db, 'meta': meta}
+
+    @staticmethod
+    def stage_restore(zip_path: str, bots_dir: str, db_file: str, password: Optional[str] = None,
+                      scope: str = "all", bot_folder: Optional[str] = None) -> dict:
+        """
+        استخراج النسخة إلى مجلد مرحلي مجاور (بدون لمس الملفات الحية)
+
+        Args:
+            scope: "all" أو "db" أو "bot"
+            bot_folder: مجلد البوت المطلوب عند scope="bot"
 
         Returns:
-            (نجاح, رسالة)
+            خطة الاستعادة: {'staging', 'folders', 'db'} لتمريرها إلى commit_restore
         """
+        bots_path = Path(bots_dir)
+        staging = bots_path.parent / f".restore_{datetime.now(timezone.utc).strftime('%Y%m%d_%H%M%S_%f')}"
+        staging.mkdir(parents=True)
+        plan = {'staging': str(staging), 'folders': [], 'db': None}
+
         try:
-            buf = io.BytesIO(zip_content)
+            with BackupSystem._open_archive(zip_path, password) as zf:
+                for info in zf.infolist():
+                    kind, folder, rel = BackupSystem._classify_member(info.filename, bots_dir)
+                    if kind == "bot" and scope in ("all", "bot"):
+                        if scope == "bot" and folder != bot_folder:
+                            continue
+                        dest = staging / "bots" / folder / rel
+                        if folder not in plan['folders']:
+                            plan['folders'].append(folder)
+                    elif kind == "db" and scope in ("all", "db"):
+                        if rel != Path(db_file).name:
+                            continue
+                        dest = staging / "database" / rel
+                        plan['db'] = str(dest)
+                    else:
+                        continue
+
+                    dest.parent.mkdir(parents=True, exist_ok=True)
+                    with zf.open(info) as src, open(dest, 'wb') as out:
+                        shutil.copyfileobj(src, out, 1024 * 1024)
 
-            # محاولة الفتح مع كلمة المرور إن وجدت
-            if password:
+            if plan['db']:
+                conn = sqlite3.connect(plan['db'])
                 try:
-                    import pyzipper
-                    with pyzipper.AESZipFile(buf, 'r') as zf:
-                        zf.setpassword(password.encode('utf-8'))
-                        zf.extractall(path=".")
-                    return True, "✅ تمت الاستعادة بنجاح"
-                except ImportError:
-                    pass
+                    result = conn.execute("PRAGMA integrity_check").fetchone()
+                finally:
+                    conn.close()
+                if not result or result[0] != "ok":
+                    raise ValueError("قاعدة البيانات في النسخة تالفة")
+        except Exception:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
 
-            with zipfile.ZipFile(buf, 'r') as zf:
-                # التحقق من meta
-                if 'backup_meta.json' in zf.namelist():
-                    meta = json.loads(zf.read('backup_meta.json'))
-                    logger.info(f"استعادة نسخة من: {meta.get('timestamp', 'غير معروف')}")
+        return plan
 
-                # استخراج الملفات
-                zf.extractall(path=".")
+    @staticmethod
+    def commit_restore(plan: dict, bots_dir: str, db_file: str) -> int:
+        """تبديل الملفات المرحلية مكان الحية بعمليات rename ذرية
 
-            return True, "✅ تمت الاستعادة بنجاح - أعد تشغيل البوت"
+        Returns:
+            عدد العناصر المستبدلة
+        """
+        staging = Path(plan['staging'])
+        trash = staging / "old"
+        trash.mkdir(exist_ok=True)
+        swapped = 0
+
+        try:
+            for folder in plan['folders']:
+                live = Path(bots_dir) / folder
+                staged = staging / "bots" / folder
+                live.parent.mkdir(parents=True, exist_ok=True)
+                if live.exists():
+                    os.rename(live, trash / folder)
+                try:
+                    os.rename(staged, live)
+                except OSError:
+                    if (trash / folder).exists():
+                        os.rename(trash / folder, live)
+                    raise
+                swapped += 1
+
+            if plan['db']:
+                os.replace(plan['db'], db_file)
+                swapped += 1
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
 
+        return swapped
+
+    @staticmethod
+    def discard_restore(plan: dict):
+        """حذف مجلد الاستعادة المرحلي"""
+        shutil.rmtree(plan['staging'], ignore_errors=True)
+
+    @staticmethod
+    async def restore_from_file(zip_path: str, bots_dir: str, db_file: str,
+                                password: Optional[str] = None, scope: str = "all",
+                                bot_folder: Optional[str] = None,
+                                pm=None, application=None) -> tuple[bool, str]:
+        """
+        استعادة نسخة من ملف على القرص
+
+        الاستخراج يتم في خيط منفصل إلى مجلد مرحلي والبوتات تعمل. بعدها فقط
+        تُوقف البوتات المتأثرة، تُبدّل المجلدات، ثم يُعاد تشغيلها. البوتات
+        غير الموجودة في النسخة لا تُلمس.
+
+        Returns:
+            (نجاح, رسالة)
+        """
+        try:
+            plan = await asyncio.to_thread(
+                BackupSystem.stage_restore, zip_path, bots_dir, db_file, password, scope, bot_folder
+            )
         except zipfile.BadZipFile:
             return False, "❌ ملف ZIP تالف أو غير صحيح"
         except RuntimeError as e:
@@ -151,33 +315,96 @@ class BackupSystem:
         except Exception as e:
             return False, f"❌ خطأ غير متوقع: {str(e)[:100]}"
 
+        if not plan['folders'] and not plan['db']:
+            BackupSystem.discard_restore(plan)
+            return False, "❌ لا توجد ملفات مطابقة في النسخة"
+
+        # البوتات العاملة التي ستتأثر بالتبديل
+        affected = []
+        if pm is not None and plan['folders']:
+            folders = set(plan['folders'])
+            for bot in pm.db.get_all_bots():
+                if bot[5] in folders and pm.is_bot_running(bot[0]):
+                    affected.append(bot[0])
+
+        for bot_id in affected:
+            await pm.stop_bot(bot_id)
+
+        try:
+            swapped = await asyncio.to_thread(BackupSystem.commit_restore, plan, bots_dir, db_file)
+        except Exception as e:
+            logger.error(f"❌ فشل تبديل ملفات الاستعادة: {e}")
+            swapped = None
+
+        # بعد استبدال قاعدة البيانات: مزامنة حالة البوتات التي ما زالت تعمل
+        if swapped and plan['db'] and pm is not None:
+            for bot_id in pm.get_all_running_bots():
+                proc = pm.processes[bot_id]['process']
+                pm.db.update_bot_status(bot_id, "running", proc.pid)
+
+        resumed = 0
+        if application is not None:
+            for bot_id in affected:
+                ok, _ = await pm.start_bot(bot_id, application)
+                resumed += 1 if ok else 0
+
+        if swapped is None:
+            return False, "❌ فشل تبديل الملفات - لم تتغير البيانات الحالية"
+
+        logger.info(
+            f"♻️ استعادة ({scope}): {len(plan['folders'])} مجلد"
+            f"{' + قاعدة البيانات' if plan['db'] else ''} | أُعيد تشغيل {resumed}/{len(affected)}"
+        )
+        parts = []
+        if plan['folders']:
+            parts.append(f"📁 مجلدات البوتات: {len(plan['folders'])}")
+        if plan['db']:
+            parts.append("🗄️ قاعدة البيانات")
+        if affected:
+            parts.append(f"🔄 أُعيد تشغيل {resumed}/{len(affected)} بوت")
+        return True, "✅ تمت الاستعادة بنجاح\n" + "\n".join(parts)
+
     # ═══════════════════════════════════════════════════════════════════════
     # النسخ الاحتياطي التلقائي
     # ═══════════════════════════════════════════════════════════════════════
 
     @staticmethod
-    async def send_auto_backup(bot, channel_id: str, bots_dir: str, db_file: str):
-        """إرسال نسخة احتياطية تلقائية إلى القناة"""
+    async def send_auto_backup(bot, channel_id: str, bots_dir: str, db_file: str,
+                               backup_path: Optional[str] = None):
+        """إرسال نسخة احتياطية تلقائية إلى القناة
+
+        إذا مُرّر backup_path يُرسل الملف الجاهز، وإلا تُبنى النسخة في خيط منفصل
+        حتى لا تُوقف حلقة الأحداث.
+        """
         try:
             logger.info(f"🔄 بدء النسخ الاحتياطي التلقائي للقناة {channel_id}")
-            buf = BackupSystem.create_full_backup(bots_dir, db_file)
             timestamp = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M UTC")
-            filename = f"backup_{datetime.now().strftime('%Y%m%d_%H%M')}.zip"
-
-            buf.name = filename
-            await bot.send_document(
-                chat_id=channel_id,
-                document=buf,
-                caption=(
-                    f"════════════════════════════\n"
-                    f"💾 <b>نسخة احتياطية تلقائية</b>\n"
-                    f"════════════════════════════\n\n"
-                    f"⏰ التاريخ: {timestamp}\n"
-                    f"🤖 NeurHostX V9.0\n\n"
-                    f"✅ تم الحفظ التلقائي"
-                ),
-                parse_mode="HTML"
-            )
+
+            if backup_path:
+                filename = Path(backup_path).name
+                document = open(backup_path, 'rb')
+            else:
+                filename = f"backup_{datetime.now().strftime('%Y%m%d_%H%M')}.zip"
+                document = await asyncio.to_thread(BackupSystem.create_full_backup, bots_dir, db_file)
+                document.name = filename
+
+            try:
+                await bot.send_document(
+                    chat_id=channel_id,
+                    document=document,
+                    filename=filename,
+                    caption=(
+                        f"════════════════════════════\n"
+                        f"💾 <b>نسخة احتياطية تلقائية</b>\n"
+                        f"════════════════════════════\n\n"
+                        f"⏰ التاريخ: {timestamp}\n"
+                        f"🤖 NeurHostX V9.0\n\n"
+                        f"✅ تم الحفظ التلقائي"
+                    ),
+                    parse_mode="HTML"
+                )
+            finally:
+                document.close()
             logger.info(f"✅ تم إرسال النسخة الاحتياطية إلى {channel_id}")
             return True
         except Exception as e:
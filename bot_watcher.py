@@ -0,0 +1,424 @@
+# ============================================================================
+# وضع المراقبة وإعادة التحميل التلقائي - NeurHostX V9.2
+# ============================================================================
+"""
+مراقبة ملفات البوت وإعادة تشغيله تلقائياً عند تغيرها:
+- inotify عبر ctypes (لينكس) مع فحص دوري كبديل
+- تجميع التغييرات المتتالية (debounce) في إعادة تحميل واحدة
+- فحص صياغة ملفات .py المعدلة قبل إعادة التشغيل
+"""
+
+import os
+import time
+import errno
+import struct
+import ctypes
+import ctypes.util
+import asyncio
+import logging
+from pathlib import Path
+from typing import Dict, Optional, Set
+
+from config import WATCH_DEBOUNCE_SECONDS, WATCH_POLL_INTERVAL_SECONDS
+from helpers import safe_html_escape
+
+logger = logging.getLogger(__name__)
+
+# ملفات تستدعي إعادة التحميل (ملفات البيانات التي يكتبها البوت لا تُراقب)
+WATCH_SUFFIXES = {'.py', '.ini', '.cfg', '.toml', '.yaml', '.yml'}
+WATCH_NAMES = {'requirements.txt', '.env'}
+
+# مجلدات لا تُراقب
+IGNORED_DIRS = {'__pycache__', 'logs', 'venv', 'env', 'node_modules', 'site-packages'}
+
+# حد المجلدات المراقبة بـ inotify لكل بوت (بعده يُستخدم الفحص الدوري)
+MAX_WATCH_DIRS = 256
+
+# ثوابت inotify من <sys/inotify.h>
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_DELETE_SELF = 0x00000400
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_ISDIR = 0x40000000
+_IN_NONBLOCK = os.O_NONBLOCK
+_IN_CLOEXEC = 0o2000000
+
+_WATCH_MASK = (_IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO |
+               _IN_CREATE | _IN_DELETE | _IN_DELETE_SELF)
+_EVENT_HEADER = struct.Struct('iIII')
+
+
+def is_watched_file(name: str) -> bool:
+    """هل تغيّر هذا الملف يستدعي إعادة التحميل؟"""
+    if name in WATCH_NAMES:
+        return True
+    if name.startswith('.'):
+        return False
+    return os.path.splitext(name)[1] in WATCH_SUFFIXES
+
+
+def is_ignored_dir(name: str) -> bool:
+    """هل يُتجاهل هذا المجلد؟"""
+    return name.startswith('.') or name in IGNORED_DIRS
+
+
+class _Inotify:
+    """ربط بسيط لـ inotify من libc عبر ctypes"""
+
+    _libc = None
+
+    @classmethod
+    def available(cls) -> bool:
+        if cls._libc is None:
+            try:
+                libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+                libc.inotify_init1
+                libc.inotify_add_watch
+                cls._libc = libc
+            except (OSError, AttributeError):
+                cls._libc = False
+        return bool(cls._libc)
+
+    def __init__(self):
+        self.fd = self._libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+
+    def add_watch(self, path: str) -> int:
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), _WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        return wd
+
+    def read_events(self):
+        """قراءة كل الأحداث المتاحة: [(wd، mask، الاسم)]"""
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
+                raise
+            if not data:
+                break
+            offset = 0
+            while offset + _EVENT_HEADER.size <= len(data):
+                wd, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+                offset += _EVENT_HEADER.size
+                name = data[offset:offset + length].rstrip(b'\0')
+                offset += length
+                events.append((wd, mask, os.fsdecode(name)))
+        return events
+
+    def close(self):
+        try:
+            os.close(self.fd)
+        except OSError:
+            pass
+
+
+class _BotWatch:
+    """مراقبة مجلد بوت واحد"""
+
+    def __init__(self, watcher: 'BotWatcher', bot_id: int, root: Path):
+        self.watcher = watcher
+        self.bot_id = bot_id
+        self.root = root
+        self.changes: Set[str] = set()
+        self.backend = None
+        self._inotify: Optional[_Inotify] = None
+        self._dirs: Dict[int, str] = {}
+        self._poll_task = None
+        self._debounce = None
+        self._loop = None
+        self.debounce_seconds = WATCH_DEBOUNCE_SECONDS
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        if _Inotify.available():
+            try:
+                self._inotify = _Inotify()
+                if self._watch_tree(self.root, ""):
+                    self._loop.add_reader(self._inotify.fd, self._on_inotify)
+                    self.backend = "inotify"
+                    return
+                logger.info(f"📁 مجلدات البوت {self.bot_id} كثيرة - استخدام الفحص الدوري")
+            except OSError as e:
+                logger.warning(f"⚠️ تعذّر تشغيل inotify للبوت {self.bot_id}: {e}")
+            if self._inotify:
+                self._inotify.close()
+                self._inotify = None
+                self._dirs.clear()
+
+        self._poll_task = self._loop.create_task(self._poll_loop())
+        self.backend = "polling"
+        # تغييرات دفعة واحدة قد تظهر في فحصين متتاليين فيجب أن يغطيهما الانتظار
+        self.debounce_seconds = max(WATCH_DEBOUNCE_SECONDS, WATCH_POLL_INTERVAL_SECONDS * 1.5)
+
+    def stop(self):
+        if self._debounce:
+            self._debounce.cancel()
+            self._debounce = None
+        if self._inotify:
+            try:
+                self._loop.remove_reader(self._inotify.fd)
+            except Exception:
+                pass
+            self._inotify.close()
+            self._inotify = None
+        if self._poll_task:
+            self._poll_task.cancel()
+            self._poll_task = None
+
+    # ─────────────────────────────────────────────────────────────────────
+    # inotify
+    # ─────────────────────────────────────────────────────────────────────
+
+    def _watch_tree(self, path: Path, rel: str) -> bool:
+        """إضافة مراقبة لمجلد وكل مجلداته الفرعية (False عند تجاوز الحد)"""
+        if len(self._dirs) >= MAX_WATCH_DIRS:
+            return False
+        try:
+            wd = self._inotify.add_watch(str(path))
+        except OSError as e:
+            logger.debug(f"تعذّر مراقبة {path}: {e}")
+            return True
+        self._dirs[wd] = rel
+        try:
+            with os.scandir(path) as it:
+                subdirs = [e.name for e in it if e.is_dir(follow_symlinks=False) and not is_ignored_dir(e.name)]
+        except OSError:
+            return True
+        for name in subdirs:
+            if not self._watch_tree(path / name, f"{rel}/{name}" if rel else name):
+                return False
+        return True
+
+    def _on_inotify(self):
+        try:
+            events = self._inotify.read_events()
+        except OSError as e:
+            logger.warning(f"⚠️ خطأ قراءة inotify للبوت {self.bot_id}: {e}")
+            return
+
+        for wd, mask, name in events:
+            if mask & _IN_Q_OVERFLOW:
+                self._mark("*")
+                continue
+            if mask & _IN_IGNORED:
+                self._dirs.pop(wd, None)
+                continue
+            base = self._dirs.get(wd)
+            if base is None or not name:
+                continue
+            rel = f"{base}/{name}" if base else name
+            if mask & _IN_ISDIR:
+                if mask & (_IN_CREATE | _IN_MOVED_TO) and not is_ignored_dir(name):
+                    self._watch_tree(self.root / rel, rel)
+                continue
+            if mask & _IN_CREATE:
+                # الإنشاء يتبعه CLOSE_WRITE عند اكتمال الكتابة
+                continue
+            if is_watched_file(name):
+                self._mark(rel)
+
+    # ─────────────────────────────────────────────────────────────────────
+    # الفحص الدوري
+    # ─────────────────────────────────────────────────────────────────────
+
+    def _snapshot(self) -> Dict[str, tuple]:
+        """(mtime، الحجم) لكل ملف مراقب في مجلد البوت"""
+        result = {}
+        stack = [(self.root, "")]
+        while stack:
+            path, rel = stack.pop()
+            try:
+                with os.scandir(path) as it:
+                    for entry in it:
+                        child = f"{rel}/{entry.name}" if rel else entry.name
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                if not is_ignored_dir(entry.name):
+                                    stack.append((Path(entry.path), child))
+                            elif is_watched_file(entry.name):
+                                st = entry.stat()
+                                result[child] = (st.st_mtime_ns, st.st_size)
+                        except OSError:
+                            continue
+            except OSError:
+                continue
+        return result
+
+    async def _poll_loop(self):
+        previous = await asyncio.to_thread(self._snapshot)
+        while True:
+            try:
+                await asyncio.sleep(WATCH_POLL_INTERVAL_SECONDS)
+                current = await asyncio.to_thread(self._snapshot)
+                for rel in set(previous) | set(current):
+                    if previous.get(rel) != current.get(rel):
+                        self._mark(rel)
+                previous = current
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.warning(f"⚠️ خطأ في فحص ملفات البوت {self.bot_id}: {e}")
+
+    # ─────────────────────────────────────────────────────────────────────
+    # التجميع
+    # ─────────────────────────────────────────────────────────────────────
+
+    def _mark(self, rel: str):
+        """تسجيل تغيير وإعادة ضبط مؤقت الهدوء"""
+        self.changes.add(rel)
+        if self._debounce:
+            self._debounce.cancel()
+        self._debounce = self._loop.call_later(self.debounce_seconds, self._flush)
+
+    def _flush(self):
+        self._debounce = None
+        if not self.changes:
+            return
+        changes, self.changes = self.changes, set()
+        self.watcher.schedule_reload(self.bot_id, changes)
+
+
+class BotWatcher:
+    """إدارة مراقبة ملفات البوتات التي فعّل أصحابها وضع المراقبة"""
+
+    def __init__(self, process_manager):
+        self.pm = process_manager
+        self.db = process_manager.db
+        self.watches: Dict[int, _BotWatch] = {}
+        self._applications = {}
+        self._reloading: Dict[int, asyncio.Task] = {}
+        self._pending: Dict[int, Set[str]] = {}
+
+    def is_watching(self, bot_id: int) -> bool:
+        return bot_id in self.watches
+
+    def backend(self, bot_id: int) -> Optional[str]:
+        """طريقة المراقبة الحالية (inotify/polling) أو None"""
+        watch = self.watches.get(bot_id)
+        return watch.backend if watch else None
+
+    def start(self, bot_id: int, root: Path, application):
+        """بدء مراقبة مجلد البوت (لا شيء إذا كانت المراقبة تعمل)"""
+        self._applications[bot_id] = application
+        if bot_id in self.watches:
+            return
+        watch = _BotWatch(self, bot_id, Path(root))
+        watch.start()
+        self.watches[bot_id] = watch
+        logger.info(f"👁️ بدء مراقبة ملفات البوت {bot_id} ({watch.backend})")
+
+    def stop(self, bot_id: int):
+        """إيقاف مراقبة البوت"""
+        watch = self.watches.pop(bot_id, None)
+        if watch:
+            watch.stop()
+            logger.info(f"👁️ إيقاف مراقبة ملفات البوت {bot_id}")
+        self._pending.pop(bot_id, None)
+        self._applications.pop(bot_id, None)
+
+    def stop_all(self):
+        for bot_id in list(self.watches):
+            self.stop(bot_id)
+
+    def schedule_reload(self, bot_id: int, changes: Set[str]):
+        """جدولة إعادة تحميل (التغييرات أثناء إعادة تحميل جارية تُجمع للمرة التالية)"""
+        if bot_id not in self.watches:
+            return
+        self._pending.setdefault(bot_id, set()).update(changes)
+        task = self._reloading.get(bot_id)
+        if task and not task.done():
+            return
+        self._reloading[bot_id] = asyncio.get_running_loop().create_task(self._reload_loop(bot_id))
+
+    async def _reload_loop(self, bot_id: int):
+        try:
+            while self._pending.get(bot_id):
+                changes = self._pending.pop(bot_id)
+                await self._reload(bot_id, changes)
+        finally:
+            self._reloading.pop(bot_id, None)
+
+    @staticmethod
+    def _check_syntax(root: Path, changes: Set[str]):
+        """فحص صياغة ملفات .py المعدلة: قائمة الأخطاء"""
+        errors = []
+        for rel in sorted(changes):
+            if not rel.endswith('.py'):
+                continue
+            path = root / rel
+            try:
+                source = path.read_bytes()
+            except FileNotFoundError:
+                continue
+            except OSError as e:
+                errors.append(f"{rel}: {e}")
+                continue
+            try:
+                compile(source, rel, 'exec', dont_inherit=True)
+            except SyntaxError as e:
+                errors.append(f"{rel}:{e.lineno}: {e.msg}")
+            except ValueError as e:
+                errors.append(f"{rel}: {e}")
+        return errors
+
+    async def _reload(self, bot_id: int, changes: Set[str]):
+        """فحص التغييرات ثم إعادة تشغيل البوت"""
+        watch = self.watches.get(bot_id)
+        application = self._applications.get(bot_id)
+        bot = self.db.get_bot(bot_id)
+        if not watch or not bot or application is None:
+            return
+        if self.pm.is_hibernated(bot_id):
+            self.db.add_event_log(bot_id, "INFO", "🧊 تم تجاهل تغيير الملفات - البوت مجمّد")
+            return
+        user_id, name = bot[1], bot[3]
+        shown = ", ".join(sorted(c for c in changes if c != "*")[:5]) or "عدة ملفات"
+
+        errors = await asyncio.to_thread(self._check_syntax, watch.root, changes)
+        if errors:
+            self.db.add_event_log(bot_id, "WARNING", f"⚠️ لم يُعد التحميل - خطأ صياغة: {errors[0][:120]}")
+            await self._notify(application, user_id, (
+                f"⚠️ <b>لم تتم إعادة التحميل</b>\n"
+                f"{'─' * 30}\n\n"
+                f"🤖 البوت: <code>{safe_html_escape(name)}</code>\n"
+                f"❌ خطأ صياغة:\n<code>{safe_html_escape(chr(10).join(errors[:3]))}</code>\n\n"
+                f"💡 البوت ما زال يعمل بالنسخة السابقة"
+            ))
+            return
+
+        started = time.monotonic()
+        success, msg = await self.pm.restart_bot(bot_id, application, kind="watch")
+        elapsed = time.monotonic() - started
+
+        if success:
+            self.db.add_event_log(bot_id, "INFO", f"🔁 إعادة تحميل تلقائية ({shown}) في {elapsed:.1f}s")
+            await self._notify(application, user_id, (
+                f"🔁 <b>إعادة تحميل تلقائية</b>\n"
+                f"🤖 <code>{safe_html_escape(name)}</code> | ⏱️ {elapsed:.1f}s\n"
+                f"📝 {safe_html_escape(shown)}"
+            ))
+        else:
+            self.db.add_event_log(bot_id, "ERROR", f"❌ فشلت إعادة التحميل: {msg}")
+            await self._notify(application, user_id, (
+                f"❌ <b>فشلت إعادة التحميل</b>\n"
+                f"🤖 <code>{safe_html_escape(name)}</code>\n\n{safe_html_escape(msg)}"
+            ))
+
+    @staticmethod
+    async def _notify(application, user_id, text):
+        try:
+            await application.bot.send_message(chat_id=user_id, text=text, parse_mode="HTML")
+        except Exception as e:
+            logger.warning(f"فشل إرسال إشعار إعادة التحميل: {e}")
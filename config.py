@@ -125,12 +125,14 @@ PLANS = {
         'max_power': 30.0,
         'cpu_limit': 50,
         'memory_limit_mb': 256,
+        'pids_limit': 64,
         'max_file_size_mb': 10,
         
         # الوقت والمدة
         'validity_days': 1,           # صالح لـ 24 ساعة
         'validity_seconds': 86400,
         'daily_restart_limit': 5,
+        'max_log_rows': 500,           # حد سجلات الأحداث لكل بوت
         
         # الميزات
         'backup_enabled': False,
@@ -156,12 +158,14 @@ PLANS = {
         'max_power': 60.0,
         'cpu_limit': 80,
         'memory_limit_mb': 512,
+        'pids_limit': 128,
         'max_file_size_mb': 30,
         
         # الوقت والمدة
         'validity_days': 7,            # صالح لـ 7 أيام
         'validity_seconds': 604800,
         'daily_restart_limit': 15,
+        'max_log_rows': 2000,
         
         # الميزات
         'backup_enabled': True,
@@ -190,12 +194,14 @@ PLANS = {
         'max_power': 100.0,
         'cpu_limit': 100,
         'memory_limit_mb': 1024,
+        'pids_limit': 256,
         'max_file_size_mb': 50,
         
         # الوقت والمدة
         'validity_days': 30,           # صالح لـ 30 يوم
         'validity_seconds': 2592000,
         'daily_restart_limit': 50,
+        'max_log_rows': 10000,
         
         # الميزات
         'backup_enabled': True,
@@ -226,12 +232,14 @@ PLANS = {
         'max_power': 150.0,
         'cpu_limit': 100,
         'memory_limit_mb': 2048,
+        'pids_limit': 512,
         'max_file_size_mb': 100,
         
         # الوقت والمدة
         'validity_days': 365,          # صالح لـ سنة
         'validity_seconds': 999999999,
         'daily_restart_limit': -1,     # غير محدود
+        'max_log_rows': 50000,
         
         # الميزات
         'backup_enabled': True,
@@ -272,6 +280,8 @@ CONVERSATION_STATES = {
     'WAIT_MAIN_FILE': 10,          # انتظار الملف الرئيسي
     'WAIT_DESCRIPTION': 11,        # انتظار الوصف
     'WAIT_MUTE_REASON': 12,        # انتظار سبب الكتم
+    'WAIT_FILE_FILTER': 13,        # انتظار نص تصفية الملفات
+    'WAIT_FILE_VIEW_INPUT': 14,    # انتظار رقم سطر أو نص بحث في عارض الملفات
 }
 
 # ═══════════════════════════════════════════════════════════════════════════
@@ -281,17 +291,88 @@ CONVERSATION_STATES = {
 # تأخير وحدود إعادة التشغيل
 PROCESS_RESTART_COOLDOWN_SECONDS = 30      # الانتظار بين إعادة التشغيل
 RESTART_TIME_COST_SECONDS = 300            # تكلفة إعادة التشغيل بالثواني
-MAX_DAILY_RESTARTS = 5                     # الحد الأقصى لإعادة التشغيل يومياً
+MAX_DAILY_RESTARTS = 5                     # الحد الأقصى لإعادة التشغيل يومياً (للخطط غير المعروفة)
+RESTART_BACKOFF_BASE_SECONDS = 5           # أول انتظار بعد العطل
+RESTART_BACKOFF_MAX_SECONDS = 600          # أقصى انتظار بين المحاولات
+RESTART_STABLE_UPTIME_SECONDS = 300        # تشغيل أطول من هذا يعيد ضبط التراجع الأسي
+RESTART_WINDOW_SECONDS = 86400             # نافذة ميزانية الأعطال (منزلقة)
 
 # فترات المراقبة والتحقق
 MONITOR_CHECK_INTERVAL_SECONDS = 10        # فترة فحص المراقبة
 WARNING_COOLDOWN_SECONDS = 300             # الانتظار بين التحذيرات
+LOW_TIME_WARNING_SECONDS = 600             # التحذير قبل انتهاء الوقت بهذه المدة
 DAILY_RECOVERY_TIME_SECONDS = 7200         # وقت الاسترجاع اليومي (ساعتين)
 
 # حدود الأداء والعمليات
 MAX_CONCURRENT_BOTS = 50                   # الحد الأقصى للبوتات المتزامنة
+ADMISSION_MEMORY_RESERVE_MB = 512          # ذاكرة تبقى حرة للمضيف بعد قبول أي بوت
+ADMISSION_CPU_MAX_PERCENT = 90             # لا يُقبل بوت جديد فوق هذا الحمل
+ADMISSION_RECHECK_SECONDS = 10             # إعادة فحص سعة الطابور
+PREEMPTION_ENABLED = True                  # تجميد الأقل أولوية لإفساح المجال للخطط الأعلى
+ADMISSION_MAX_PREEMPTIONS = 3              # أقصى عدد بوتات تُجمّد لطلب تشغيل واحد
+
+# عقد التشغيل (worker_agent.py على أجهزة إضافية)
+# NEURHOST_AGENTS="10.0.0.2:8765,10.0.0.3:8765" و NEURHOST_AGENT_TOKEN=رمز مشترك
+# و NEURHOST_AGENT_CA=شهادة CA (أو شهادة الوكيل الذاتية) للتحقق من TLS العقد
+WORKER_AGENTS = [a.strip() for a in os.getenv("NEURHOST_AGENTS", "").split(",") if a.strip()]
+WORKER_AGENT_TOKEN = os.getenv("NEURHOST_AGENT_TOKEN", "")
+WORKER_AGENT_CA = os.getenv("NEURHOST_AGENT_CA", "")
+WORKER_STATS_INTERVAL_SECONDS = 5          # استطلاع سعة العقد واستخدام بوتاتها
+WORKER_NODE_GRACE_SECONDS = 60             # مهلة عودة العقدة قبل اعتبار بوتاتها متوقفة
+WORKER_MEMORY_RESERVE_MB = 256             # ذاكرة تبقى حرة على العقدة بعد وضع أي بوت
+WORKER_LOCAL_FALLBACK = True               # التشغيل محلياً إذا لم تتسع أي عقدة
 PROCESS_TIMEOUT_SECONDS = 300              # مهلة انتظار العملية
 STARTUP_TIMEOUT_SECONDS = 120              # مهلة بدء التشغيل
+STOP_GRACE_SECONDS = 10                    # مهلة الإيقاف اللطيف (SIGTERM) قبل SIGKILL
+STOP_KILL_TIMEOUT_SECONDS = 5              # مهلة انتظار الحصاد بعد SIGKILL
+
+# معالجة التحديثات بالتوازي (ترتيب صارم داخل المستخدم الواحد)
+UPDATE_MAX_IN_FLIGHT = 32                  # أقصى عدد معالجات تعمل في نفس الوقت
+UPDATE_MAX_PENDING = 1024                  # أقصى تحديثات مقبولة (عاملة + منتظرة دورها)
+HANDLER_TIMEOUT_SECONDS = 60               # مهلة المعالج الافتراضية (0 = بلا مهلة)
+HANDLER_TIMEOUTS = {                       # مهل أطول للمعالجات الثقيلة (اسم الدالة -> ثوانٍ)
+    "handle_bot_file": 900,                # فك ZIP وتثبيت المتطلبات وأول تشغيل
+    "start_bot_action": 600,
+    "restart_bot_action": 600,
+    "recover_bot": 600,
+    "successful_payment_callback": 300,
+    "bot_backup": 300,
+    "download_all": 300,
+    "create_bot_backup": 300,
+    "backup_download_now": 600,
+    "backup_send_to_channel": 600,
+    "backup_receive_file": 300,
+    "backup_restore_execute": 900,
+    "bulk_start_all_bots": 900,
+    "bulk_restart_all_bots": 900,
+    "bulk_stop_all_bots": 300,
+    "quick_restart_all": 900,
+    "broadcast_command": 0,
+    "delete_account_final": 300,
+}
+LOOP_STALL_WARN_SECONDS = 0.25             # تأخر حلقة الأحداث الذي يُسجَّل كمعالج حاجب
+
+# وضع المراقبة (إعادة التحميل التلقائي عند تغير الملفات)
+WATCH_DEBOUNCE_SECONDS = 1.5               # انتظار هدوء التغييرات قبل إعادة التحميل
+WATCH_POLL_INTERVAL_SECONDS = 2            # فترة الفحص عند عدم توفر inotify
+
+# عزل الموارد (cgroup v2 لكل بوت، أو setrlimit عند عدم توفره)
+RESOURCE_LIMITS_ENABLED = True             # تطبيق حدود الخطة على عمليات البوتات
+CGROUP_ROOT = "/sys/fs/cgroup/neurohost"   # مجلد cgroup الأب (يحتاج صلاحية الكتابة)
+CGROUP_CPU_PERIOD_US = 100000              # فترة cpu.max (cpu_limit نسبة من نواة واحدة)
+
+# التجميد عند انتهاء الوقت بدل الإيقاف (الاستئناف فوري دون تشغيل بارد)
+HIBERNATE_ENABLED = True                   # تجميد مجموعة العمليات (cgroup freezer أو SIGSTOP)
+HIBERNATE_MAX_SECONDS = 86400              # بعدها يُوقف البوت المجمّد نهائياً ليحرر ذاكرته
+HIBERNATE_RECLAIM_MEMORY = True            # السماح بنقل ذاكرة البوت المجمّد إلى swap (cgroup فقط)
+
+# المفسّر المُسخَّن مسبقاً (zygote): البوتات تبدأ بـ fork بدل تشغيل مفسّر جديد
+ZYGOTE_ENABLED = False                     # اختياري: يتطلب Linux/Unix
+ZYGOTE_PRELOAD_MODULES = [                 # وحدات تُستورد مرة واحدة في الـ zygote
+    "asyncio", "json", "sqlite3", "logging", "ssl",
+    "httpx", "telegram", "telegram.ext",
+    "aiohttp", "requests",
+]
 
 
 # ═══════════════════════════════════════════════════════════════════════════
@@ -372,6 +453,12 @@ SECURITY_CONFIG = {
     
     # حدود المعدل
     'rate_limit_per_minute': 30,         # عدد الطلبات المسموح بها في الدقيقة
+    'rate_limit_buckets': {              # حدود منفصلة حسب نوع التحديث
+        'command':  {'per_minute': 20, 'burst': 5},
+        'callback': {'per_minute': 60, 'burst': 15},
+        'upload':   {'per_minute': 6,  'burst': 3},
+        'message':  {'per_minute': 30, 'burst': 10},
+    },
     
     # الملفات المحظورة
     'blocked_extensions': [
@@ -2,33 +2,84 @@
 # مدير قاعدة البيانات - NeuroHost V8 Enhanced
 # ============================================================================
 
+import time
 import sqlite3
 import logging
 from datetime import datetime, timedelta, timezone
 from pathlib import Path
 from config import DATABASE_FILE, PLANS
+from metrics import db_query_seconds, timed_methods
+from query_profiler import query_profiler
 
 logger = logging.getLogger(__name__)
 
+# (الاسم، الجدول والأعمدة) - كل فهرس يخدم استعلاماً محدداً في هذا الملف
+INDEXES = [
+    # get_bot_logs: WHERE bot_id = ? ORDER BY timestamp DESC LIMIT ?
+    ('idx_logs_bot_time', 'event_logs(bot_id, timestamp DESC)'),
+    # get_user_bots / count_user_bots: WHERE user_id = ? ORDER BY created_at DESC
+    ('idx_bots_user_created', 'bots(user_id, created_at)'),
+    # get_running_bots: WHERE status = 'running' ORDER BY priority DESC (و COUNT حسب الحالة)
+    ('idx_bots_status_priority', 'bots(status, priority DESC)'),
+    # get_pending_users / get_blocked_users: WHERE status = ? ORDER BY joined_at
+    ('idx_users_status_joined', 'users(status, joined_at)'),
+    # get_system_stats: COUNT(*) WHERE plan = ? من الفهرس وحده (covering)
+    ('idx_users_plan', 'users(plan)'),
+    # get_pending_upgrades: WHERE status = 'pending' ORDER BY created_at
+    ('idx_upgrades_status_created', 'upgrade_requests(status, created_at)'),
+    # سجل ترقيات المستخدم: WHERE user_id = ? ORDER BY created_at DESC
+    ('idx_upgrades_user_created', 'upgrade_requests(user_id, created_at)'),
+    # حذف السجلات المنتهية: WHERE timestamp < ? ORDER BY timestamp LIMIT ?
+    ('idx_logs_time', 'event_logs(timestamp)'),
+    # get_backups_by_kind / get_bot_backups
+    ('idx_backups_kind_created', 'backups(kind, created_at)'),
+    ('idx_backups_bot_created', 'backups(bot_id, created_at)'),
+]
+DROPPED_INDEXES = ['idx_logs_bot', 'idx_bots_user', 'idx_bots_status', 'idx_users_status']
+ANALYZE_ROW_LIMIT = 1000
+
+@timed_methods(db_query_seconds, exclude=('add_change_listener', 'init_db'))
 class Database:
     """مدير قاعدة البيانات المحسن"""
     
     def __init__(self, db_file=DATABASE_FILE):
         self.db_file = db_file
+        self._listeners = []
         self.init_db()
         self._migrate_db()
 
+    def add_change_listener(self, callback):
+        """تسجيل دالة تُستدعى بعد تغيّر وقت بوت أو خطة مستخدم: callback(kind, key)
+
+        kind: 'bot_time' (key = bot_id) أو 'user_plan' (key = user_id)
+        """
+        self._listeners.append(callback)
+
+    def _notify(self, kind, key):
+        for callback in self._listeners:
+            try:
+                callback(kind, key)
+            except Exception as e:
+                logger.warning(f"⚠️ خطأ في مستمع التغييرات ({kind}): {e}")
+
+    def _connect(self, **kwargs):
+        """اتصال جديد (عبر محلل الاستعلامات إذا كان مفعلاً)"""
+        return query_profiler.connect(self.db_file, **kwargs)
+
     def _get_connection(self):
         """الحصول على اتصال قاعدة البيانات"""
-        conn = sqlite3.connect(self.db_file, timeout=30)
+        conn = self._connect(timeout=30)
         conn.row_factory = sqlite3.Row
         return conn
 
     def init_db(self):
         """تهيئة قاعدة البيانات"""
-        conn = sqlite3.connect(self.db_file)
+        conn = self._connect()
         c = conn.cursor()
         
+        # يسري فقط قبل إنشاء أول جدول؛ القواعد القديمة تُحوَّل في db_maintenance
+        c.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        
         # جدول المستخدمين
         c.execute('''
             CREATE TABLE IF NOT EXISTS users (
@@ -83,6 +134,9 @@ class Database:
                 description TEXT DEFAULT '',
                 auto_start INTEGER DEFAULT 0,
                 priority INTEGER DEFAULT 1,
+                watch_mode INTEGER DEFAULT 0,
+                requirements_hash TEXT DEFAULT NULL,
+                node TEXT DEFAULT NULL,
                 FOREIGN KEY(user_id) REFERENCES users(user_id)
             )
         ''')
@@ -147,11 +201,71 @@ class Database:
             )
         ''')
         
+        # جدول ذاكرة نتائج الفحص الأمني (مفتاحها hash المحتوى)
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS scan_cache (
+                content_hash TEXT,
+                variant TEXT,
+                scanner_version INTEGER,
+                safe INTEGER,
+                message TEXT,
+                findings TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (content_hash, variant)
+            )
+        ''')
+        
+        # جدول مراجعات تعديل الملفات (فروقات عكسية مضغوطة للتراجع)
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS file_revisions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                bot_id INTEGER,
+                file_path TEXT,
+                reverse_patch BLOB,
+                etag_after TEXT,
+                summary TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        # جدول أعطال البوتات (نافذة ميزانية إعادة التشغيل وملخص الأسباب)
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS bot_crashes (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                bot_id INTEGER,
+                crashed_at INTEGER,
+                exit_code INTEGER,
+                uptime_seconds INTEGER,
+                reason TEXT
+            )
+        ''')
+        
+        # دفتر وقت الاستضافة (إلحاق فقط: + رصيد مضاف، - وقت مستهلك)
+        # bots.remaining_seconds هو الرصيد المتراكم لهذا الدفتر
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS time_ledger (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                bot_id INTEGER,
+                delta INTEGER,
+                kind TEXT,
+                note TEXT DEFAULT '',
+                created_at INTEGER
+            )
+        ''')
+        
         # إنشاء الفهارس
-        c.execute('CREATE INDEX IF NOT EXISTS idx_bots_user ON bots(user_id)')
-        c.execute('CREATE INDEX IF NOT EXISTS idx_bots_status ON bots(status)')
-        c.execute('CREATE INDEX IF NOT EXISTS idx_logs_bot ON event_logs(bot_id)')
-        c.execute('CREATE INDEX IF NOT EXISTS idx_users_status ON users(status)')
+        # فهارس الاستعلامات الساخنة تُنشأ في _migrate_db (بعد إضافة أعمدتها)
+        c.execute('CREATE INDEX IF NOT EXISTS idx_revisions_file ON file_revisions(bot_id, file_path, id)')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_crashes_bot ON bot_crashes(bot_id, crashed_at)')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_ledger_bot ON time_ledger(bot_id, id)')
+        
+        # قيد افتتاحي للبوتات السابقة للدفتر حتى يطابق مجموعه رصيدها
+        c.execute(
+            "INSERT INTO time_ledger (bot_id, delta, kind, note, created_at) "
+            "SELECT id, remaining_seconds, 'opening', '', ? FROM bots "
+            "WHERE id NOT IN (SELECT DISTINCT bot_id FROM time_ledger)",
+            (int(time.time()),)
+        )
         
         conn.commit()
         conn.close()
@@ -159,7 +273,7 @@ class Database:
     def _migrate_db(self):
         """ترحيل قاعدة البيانات للإصدارات الجديدة"""
         try:
-            conn = sqlite3.connect(self.db_file)
+            conn = self._connect()
             c = conn.cursor()
             
             new_columns = [
@@ -168,6 +282,11 @@ class Database:
                 ('bots', 'description', 'TEXT DEFAULT ""'),
                 ('bots', 'auto_start', 'INTEGER DEFAULT 0'),
                 ('bots', 'priority', 'INTEGER DEFAULT 1'),
+                ('bots', 'watch_mode', 'INTEGER DEFAULT 0'),
+                ('bots', 'requirements_hash', 'TEXT DEFAULT NULL'),
+                ('bots', 'node', 'TEXT DEFAULT NULL'),
+                ('backups', 'kind', 'TEXT DEFAULT "manual"'),
+                ('backups', 'duration_ms', 'INTEGER DEFAULT 0'),
             ]
             
             for table, column, definition in new_columns:
@@ -176,18 +295,51 @@ class Database:
                 except sqlite3.OperationalError:
                     pass
             
+            # فهارس مركبة للاستعلامات الساخنة: الترشيح ثم الترتيب من نفس الفهرس
+            # بدل "USE TEMP B-TREE FOR ORDER BY" (راجع /dbprofile advise)
+            created = 0
+            for name, definition in INDEXES:
+                if c.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?", (name,)).fetchone():
+                    continue
+                try:
+                    c.execute(f'CREATE INDEX {name} ON {definition}')
+                    created += 1
+                except sqlite3.OperationalError as e:
+                    logger.warning(f"⚠️ تعذّر إنشاء الفهرس {name}: {e}")
+            
+            # فهارس مفردة أصبحت بادئة لفهرس مركب (تكلفة كتابة بلا فائدة)
+            for name in DROPPED_INDEXES:
+                c.execute(f'DROP INDEX IF EXISTS {name}')
+            
             conn.commit()
             conn.close()
+            
+            # إحصائيات المخطط للفهارس الجديدة فوراً (ثم دورياً عبر db_maintenance)
+            if created:
+                self.analyze()
         except Exception as e:
             logger.warning(f"خطأ في الترحيل: {e}")
 
+    def analyze(self):
+        """تحديث إحصائيات sqlite_stat1 التي يختار بها المخطط الفهارس
+
+        analysis_limit يجعل ANALYZE تقريبياً وسريعاً على الجداول الكبيرة.
+        """
+        conn = self._connect()
+        try:
+            conn.execute(f"PRAGMA analysis_limit = {ANALYZE_ROW_LIMIT}")
+            conn.execute("ANALYZE")
+            conn.commit()
+        finally:
+            conn.close()
+
     # ═══════════════════════════════════════════════════════════════════════
     # إدارة المستخدمين
     # ═══════════════════════════════════════════════════════════════════════
 
     def add_user(self, user_id, username, first_name="", admin_id=0):
         """إضافة مستخدم جديد"""
-        conn = sqlite3.connect(self.db_file)
+        conn = self._connect()
         c = conn.cursor()
         role = 'admin' if user_id == admin_id else 'user'
         status = 'approved' if user_id == admin_id else 'pending'
@@ -208,7 +360,7 @@ class Database:
 
     def get_user(self, user_id):
         """الحصول على بيانات المستخدم"""
-        conn = sqlite3.connect(self.db_file)
+        conn = self._connect()
         c = conn.cursor()
         c.execute("SELECT * FROM users WHERE user_id = ?", (user_id,))
         row = c.fetchone()
@@ -217,7 +369,7 @@ class Database:
 
     def get_all_users(self):
         """الحصول على جميع المستخدمين"""
-        conn = sqlite3.connect(self.db_file)
+        conn = self._connect()
         c = conn.cursor()
         c.execute("SELECT * FROM users ORDER BY joined_at DESC")
         rows = c.fetchall()
@@ -226,7 +378,7 @@ class Database:
 
     def get_pending_users(self):
         """الحصول على المستخدمين المعلقين"""
-        conn = sqlite3.connect(self.db_file)
+        conn = self._connect()
         c = conn.cursor()
         c.execute("SELECT * FROM users WHERE status = 'pending' ORDER BY joined_at ASC")
         rows = c.fetchall()
@@ -235,7 +387,7 @@ class Database:
 
     def get_blocked_users(self):
         """الحصول على المستخدمين المحظورين"""
-        conn = sqlite3.connect(self.db_file)
+        conn = self._connect()
         c = conn.cursor()
         c.execute("SELECT * FROM users WHERE status = 'blocked' ORDER BY joined_at DESC")
         rows = c.fetchall()
@@ -244,7 +396,7 @@ class Database:
 
     def update_user_status(self, user_id, status):
         """تحديث حالة المستخدم"""
-        conn = sqlite3.connect(self.db_file)
+        conn = self._connect()
         c = conn.cursor()
         c.execute("UPDATE users SET status = ? WHERE user_id = ?", (status, user_id))
         conn.commit()
@@ -254,7 +406,7 @@ class Database:
         """تعيين خطة المستخدم"""
         from helpers import get_current_time
         
-        conn = sqlite3.connect(self.db_file)
+        conn = self._connect()
         c = conn.cursor()
         start_date = get_current_time()
         end_date = None
@@ -266,6 +418,7 @@ class Database:
         )
         conn.commit()
         conn.close()
+        self._notify('user_plan', user_id)
 
     def get_user_role(self, user_id, admin_id=0):
         """الحصول على دور المستخدم"""
@@ -278,7 +431,7 @@ class Database:
 
     def set_user_role(self, user_id, role):
         """تعيين دور المستخدم"""
-        conn = sqlite3.connect(self.db_file)
+        conn = self._connect()
         c = conn.cursor()
         c.execute("UPDATE users SET role = ? WHERE user_id = ?", (role, user_id))
         conn.commit()
@@ -286,7 +439,7 @@ class Database:
 
     def toggle_notifications(self, user_id):
         """تبديل الإشعارات"""
-        conn = sqlite3.connect(self.db_file)
+        conn = self._connect()
         c = conn.cursor()
         c.execute("SELECT notifications_enabled FROM users WHERE user_id = ?", (user_id,))
         result = c.fetchone()
@@ -298,7 +451,7 @@ class Database:
 
     def delete_user(self, user_id):
         """حذف حساب المستخدم"""
-        conn = sqlite3.connect(self.db_file)
+        conn = self._connect()
         c = conn.cursor()
         # حذف بوتات المستخدم أولاً
         c.execute("SELECT id FROM bots WHERE user_id = ?", (user_id,))
@@ -322,7 +475,7 @@ class Database:
         plan = self.get_user_plan(user_id)
         plan_config = PLANS.get(plan, PLANS['free'])
         
-        conn = sqlite3.connect(self.db_file)
+        conn = self._connect()
         c = conn.cursor()
         try:
             c.execute('''
@@ -337,6 +490,10 @@ class Database:
                 plan_config['power'], plan_config['power']
             ))
             bot_id = c.lastrowid
+            c.execute(
+                "INSERT INTO time_ledger (bot_id, delta, kind, note, created_at) VALUES (?, ?, 'initial', '', ?)",
+                (bot_id, plan_config['time'], int(time.time()))
+            )
             conn.commit()
             conn.close()
             return bot_id
@@ -350,7 +507,7 @@ class Database:
 
     def get_user_bots(self, user_id):
         """الحصول على بوتات المستخدم"""
-        conn = sqlite3.connect(self.db_file)
+        conn = self._connect()
         c = conn.cursor()
         c.execute(
             "SELECT id, name, status, pid, remaining_seconds, power_remaining, sleep_mode FROM bots WHERE user_id = ? ORDER BY created_at DESC",
@@ -362,7 +519,7 @@ class Database:
 
     def count_user_bots(self, user_id):
         """عد بوتات المستخدم"""
-        conn = sqlite3.connect(self.db_file)
+        conn = self._connect()
         c = conn.cursor()
         c.execute("SELECT COUNT(*) FROM bots WHERE user_id = ?", (user_id,))
         count = c.fetchone()[0]
@@ -371,7 +528,7 @@ class Database:
 
     def get_bot(self, bot_id):
         """الحصول على بيانات البوت"""
-        conn = sqlite3.connect(self.db_file)
+        conn = self._connect()
         c = conn.cursor()
         c.execute("SELECT * FROM bots WHERE id = ?", (bot_id,))
         row = c.fetchone()
@@ -380,7 +537,7 @@ class Database:
 
     def get_bot_by_token(self, token):
         """الحصول على البوت من خلال التوكن"""
-        conn = sqlite3.connect(self.db_file)
+        conn = self._connect()
         c = conn.cursor()
         c.execute("SELECT * FROM bots WHERE token = ?", (token,))
         row = c.fetchone()
@@ -389,7 +546,7 @@ class Database:
 
     def get_all_bots(self):
         """الحصول على جميع البوتات"""
-        conn = sqlite3.connect(self.db_file)
+        conn = self._connect()
         c = conn.cursor()
         c.execute("SELECT * FROM bots ORDER BY created_at DESC")
         rows = c.fetchall()
@@ -398,7 +555,7 @@ class Database:
 
     def get_running_bots(self):
         """الحصول على البوتات العاملة"""
-        conn = sqlite3.connect(self.db_file)
+        conn = self._connect()
         c = conn.cursor()
         c.execute("SELECT * FROM bots WHERE status = 'running' ORDER BY priority DESC")
         rows = c.fetchall()
@@ -409,7 +566,7 @@ class Database:
         """تحديث حالة البوت"""
         from helpers import get_current_time
         
-        conn = sqlite3.connect(self.db_file)
+        conn = self._connect()
         c = conn.cursor()
         if pid is not None:
             c.execute(
@@ -428,7 +585,7 @@ class Database:
         """تحديث موارد البوت"""
         from helpers import get_current_time
         
-        conn = sqlite3.connect(self.db_file)
+        conn = self._connect()
         c = conn.cursor()
         
         updates = []
@@ -451,7 +608,7 @@ class Database:
 
     def update_bot_name(self, bot_id, name):
         """تحديث اسم البوت"""
-        conn = sqlite3.connect(self.db_file)
+        conn = self._connect()
         c = conn.cursor()
         c.execute("UPDATE bots SET name = ? WHERE id = ?", (name, bot_id))
         conn.commit()
@@ -459,17 +616,44 @@ class Database:
 
     def delete_bot(self, bot_id):
         """حذف البوت"""
-        conn = sqlite3.connect(self.db_file)
+        conn = self._connect()
         c = conn.cursor()
         c.execute("DELETE FROM bots WHERE id = ?", (bot_id,))
         c.execute("DELETE FROM event_logs WHERE bot_id = ?", (bot_id,))
         c.execute("DELETE FROM backups WHERE bot_id = ?", (bot_id,))
+        c.execute("DELETE FROM file_revisions WHERE bot_id = ?", (bot_id,))
+        c.execute("DELETE FROM bot_crashes WHERE bot_id = ?", (bot_id,))
+        c.execute("DELETE FROM time_ledger WHERE bot_id = ?", (bot_id,))
+        conn.commit()
+        conn.close()
+
+    def set_watch_mode(self, bot_id, enabled):
+        """تفعيل/تعطيل وضع المراقبة (إعادة التحميل التلقائي عند تغير الملفات)"""
+        conn = self._connect()
+        c = conn.cursor()
+        c.execute("UPDATE bots SET watch_mode = ? WHERE id = ?", (1 if enabled else 0, bot_id))
+        conn.commit()
+        conn.close()
+
+    def set_requirements_hash(self, bot_id, requirements_hash):
+        """حفظ hash ملف requirements.txt بعد تثبيت ناجح"""
+        conn = self._connect()
+        c = conn.cursor()
+        c.execute("UPDATE bots SET requirements_hash = ? WHERE id = ?", (requirements_hash, bot_id))
+        conn.commit()
+        conn.close()
+
+    def set_bot_node(self, bot_id, node):
+        """حفظ عنوان العقدة التي تشغّل البوت (None = المضيف المحلي)"""
+        conn = self._connect()
+        c = conn.cursor()
+        c.execute("UPDATE bots SET node = ? WHERE id = ?", (node, bot_id))
         conn.commit()
         conn.close()
 
     def set_sleep_mode(self, bot_id, sleep_mode, reason=None):
         """تعيين وضع السكون"""
-        conn = sqlite3.connect(self.db_file)
+        conn = self._connect()
         c = conn.cursor()
         c.execute(
             "UPDATE bots SET sleep_mode = ?, last_sleep_reason = ? WHERE id = ?",
@@ -484,7 +668,7 @@ class Database:
 
     def add_event_log(self, bot_id, event_type, message):
         """إضافة سجل حدث"""
-        conn = sqlite3.connect(self.db_file)
+        conn = self._connect()
         c = conn.cursor()
         c.execute(
             "INSERT INTO event_logs (bot_id, event_type, message) VALUES (?, ?, ?)",
@@ -495,7 +679,7 @@ class Database:
 
     def get_bot_logs(self, bot_id, limit=50):
         """الحصول على سجلات البوت"""
-        conn = sqlite3.connect(self.db_file)
+        conn = self._connect()
         c = conn.cursor()
         c.execute(
             "SELECT event_type, message, timestamp FROM event_logs WHERE bot_id = ? ORDER BY timestamp DESC LIMIT ?",
@@ -507,12 +691,103 @@ class Database:
 
     def clear_bot_logs(self, bot_id):
         """مسح سجلات البوت"""
-        conn = sqlite3.connect(self.db_file)
+        conn = self._connect()
         c = conn.cursor()
         c.execute("DELETE FROM event_logs WHERE bot_id = ?", (bot_id,))
         conn.commit()
         conn.close()
 
+    def get_expired_logs(self, cutoff, limit=500):
+        """أقدم سجلات الأحداث قبل cutoff (دفعة للأرشفة ثم الحذف)"""
+        conn = self._connect()
+        c = conn.cursor()
+        c.execute(
+            "SELECT id, bot_id, event_type, message, timestamp FROM event_logs "
+            "WHERE timestamp < ? ORDER BY timestamp LIMIT ?",
+            (cutoff, limit)
+        )
+        rows = c.fetchall()
+        conn.close()
+        return rows
+
+    def get_oldest_bot_logs(self, bot_id, limit=500):
+        """أقدم سجلات بوت واحد (لتطبيق حد الصفوف حسب الخطة)"""
+        conn = self._connect()
+        c = conn.cursor()
+        c.execute(
+            "SELECT id, bot_id, event_type, message, timestamp FROM event_logs "
+            "WHERE bot_id = ? ORDER BY timestamp LIMIT ?",
+            (bot_id, limit)
+        )
+        rows = c.fetchall()
+        conn.close()
+        return rows
+
+    def get_log_counts(self):
+        """(bot_id، عدد السجلات، خطة المالك) لكل بوت له سجلات"""
+        conn = self._connect()
+        c = conn.cursor()
+        c.execute(
+            "SELECT e.bot_id, e.n, COALESCE(u.plan, 'free') FROM "
+            "(SELECT bot_id, COUNT(*) AS n FROM event_logs GROUP BY bot_id) e "
+            "LEFT JOIN bots b ON b.id = e.bot_id LEFT JOIN users u ON u.user_id = b.user_id"
+        )
+        rows = c.fetchall()
+        conn.close()
+        return rows
+
+    def delete_logs(self, log_ids):
+        """حذف سجلات بالمعرّف - معاملة قصيرة لكل دفعة"""
+        if not log_ids:
+            return 0
+        conn = self._connect(timeout=30)
+        c = conn.cursor()
+        c.execute(
+            f"DELETE FROM event_logs WHERE id IN ({', '.join('?' * len(log_ids))})",
+            list(log_ids)
+        )
+        deleted = c.rowcount
+        conn.commit()
+        conn.close()
+        return deleted
+
+    # ═══════════════════════════════════════════════════════════════════════
+    # المساحة الحرة
+    # ═══════════════════════════════════════════════════════════════════════
+
+    def get_auto_vacuum(self):
+        """وضع auto_vacuum: 0 بلا، 1 كامل، 2 تدريجي"""
+        conn = self._connect()
+        try:
+            return conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+        finally:
+            conn.close()
+
+    def enable_incremental_vacuum(self):
+        """تحويل قاعدة قديمة إلى auto_vacuum تدريجي (VACUUM كامل لمرة واحدة)"""
+        conn = self._connect(timeout=60)
+        try:
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("VACUUM")
+        finally:
+            conn.close()
+
+    def incremental_vacuum(self, pages):
+        """إرجاع حتى pages صفحة حرة لنظام الملفات
+
+        Returns:
+            (الصفحات المُرجعة، الصفحات الحرة المتبقية)
+        """
+        conn = self._connect(timeout=30)
+        try:
+            before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            # execute يخطو خطوة واحدة (صفحة واحدة)؛ executescript ينفذها حتى النهاية
+            conn.executescript(f"PRAGMA incremental_vacuum({int(pages)});")
+            after = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        finally:
+            conn.close()
+        return before - after, after
+
     # ═══════════════════════════════════════════════════════════════════════
     # نظام الخطط
     # ═══════════════════════════════════════════════════════════════════════
@@ -522,33 +797,63 @@ class Database:
         if user_id == admin_id:
             return 'supreme'
         
-        conn = sqlite3.connect(self.db_file)
+        # الخطط المنتهية يخفّضها مجدول المواعيد عند موعدها؛ المقارنة هنا احتياط
+        # لما قبل التخفيض (تواريخ ISO بتوقيت UTC تُقارن نصياً بلا تحليل)
+        conn = self._connect()
         c = conn.cursor()
-        c.execute("SELECT plan, plan_end_date FROM users WHERE user_id = ?", (user_id,))
+        c.execute(
+            "SELECT CASE WHEN plan = 'supreme' THEN plan "
+            "WHEN plan_end_date IS NOT NULL AND plan_end_date < ? THEN 'free' "
+            "ELSE plan END FROM users WHERE user_id = ?",
+            (datetime.now(timezone.utc).isoformat(), user_id)
+        )
         result = c.fetchone()
         conn.close()
         
-        if not result:
-            return 'free'
-        
-        plan, end_date = result
-        
-        if plan == 'supreme':
-            return 'supreme'
-        
-        if end_date:
-            try:
-                exp_date = datetime.fromisoformat(end_date)
-                if datetime.now(timezone.utc) > exp_date:
-                    return 'free'
-            except (ValueError, TypeError) as e:
-                logger.warning(f"⚠️ خطأ في تحليل تاريخ انتهاء الخطة: {e}")
-        
-        return plan if plan else 'free'
+        return result[0] if result and result[0] else 'free'
+
+    def get_plan_expiries(self):
+        """الخطط المؤقتة النشطة: [(user_id, plan_end_date)]"""
+        conn = self._connect()
+        c = conn.cursor()
+        c.execute(
+            "SELECT user_id, plan_end_date FROM users "
+            "WHERE plan_end_date IS NOT NULL AND plan NOT IN ('free', 'supreme')"
+        )
+        rows = c.fetchall()
+        conn.close()
+        return rows
+
+    def get_plan_expiry(self, user_id):
+        """تاريخ انتهاء خطة المستخدم (ISO) أو None"""
+        conn = self._connect()
+        c = conn.cursor()
+        c.execute(
+            "SELECT plan_end_date FROM users WHERE user_id = ? AND plan NOT IN ('free', 'supreme')",
+            (user_id,)
+        )
+        row = c.fetchone()
+        conn.close()
+        return row[0] if row else None
+
+    def expire_user_plan(self, user_id):
+        """تخفيض الخطة المنتهية إلى المجانية: هل تم التخفيض"""
+        conn = self._connect()
+        c = conn.cursor()
+        c.execute(
+            "UPDATE users SET plan = 'free', plan_end_date = NULL "
+            "WHERE user_id = ? AND plan NOT IN ('free', 'supreme') "
+            "AND plan_end_date IS NOT NULL AND plan_end_date <= ?",
+            (user_id, datetime.now(timezone.utc).isoformat())
+        )
+        expired = c.rowcount > 0
+        conn.commit()
+        conn.close()
+        return expired
 
     def can_user_recover(self, user_id):
         """التحقق من إمكانية الاسترجاع اليومي"""
-        conn = sqlite3.connect(self.db_file)
+        conn = self._connect()
         c = conn.cursor()
         c.execute("SELECT last_recovery_date FROM users WHERE user_id = ?", (user_id,))
         result = c.fetchone()
@@ -566,7 +871,7 @@ class Database:
 
     def use_user_recovery(self, user_id):
         """استخدام الاسترجاع اليومي"""
-        conn = sqlite3.connect(self.db_file)
+        conn = self._connect()
         c = conn.cursor()
         today = datetime.now(timezone.utc).date().isoformat()
         c.execute("UPDATE users SET last_recovery_date = ? WHERE user_id = ?", (today, user_id))
@@ -579,7 +884,7 @@ class Database:
 
     def add_upgrade_request(self, user_id, current_plan, requested_plan):
         """إضافة طلب ترقية"""
-        conn = sqlite3.connect(self.db_file)
+        conn = self._connect()
         c = conn.cursor()
         c.execute(
             "INSERT INTO upgrade_requests (user_id, current_plan, requested_plan) VALUES (?, ?, ?)",
@@ -592,7 +897,7 @@ class Database:
 
     def get_pending_upgrades(self):
         """الحصول على طلبات الترقية المعلقة"""
-        conn = sqlite3.connect(self.db_file)
+        conn = self._connect()
         c = conn.cursor()
         c.execute("""
             SELECT ur.*, u.username, u.first_name 
@@ -607,7 +912,7 @@ class Database:
 
     def get_upgrade_request(self, request_id):
         """الحصول على طلب ترقية محدد"""
-        conn = sqlite3.connect(self.db_file)
+        conn = self._connect()
         c = conn.cursor()
         c.execute("SELECT * FROM upgrade_requests WHERE id = ?", (request_id,))
         row = c.fetchone()
@@ -618,7 +923,7 @@ class Database:
         """الموافقة على طلب الترقية"""
         from helpers import get_current_time
         
-        conn = sqlite3.connect(self.db_file)
+        conn = self._connect()
         c = conn.cursor()
         
         # جلب بيانات الطلب
@@ -637,12 +942,14 @@ class Database:
         
         conn.commit()
         conn.close()
+        if result:
+            self._notify('user_plan', result[0])
 
     def reject_upgrade(self, request_id):
         """رفض طلب الترقية"""
         from helpers import get_current_time
         
-        conn = sqlite3.connect(self.db_file)
+        conn = self._connect()
         c = conn.cursor()
         c.execute(
             "UPDATE upgrade_requests SET status = 'rejected', reviewed_at = ? WHERE id = ?",
@@ -653,7 +960,7 @@ class Database:
 
     def get_user_upgrade_history(self, user_id):
         """الحصول على سجل ترقيات المستخدم"""
-        conn = sqlite3.connect(self.db_file)
+        conn = self._connect()
         c = conn.cursor()
         c.execute(
             "SELECT * FROM upgrade_requests WHERE user_id = ? ORDER BY created_at DESC",
@@ -667,20 +974,43 @@ class Database:
     # النسخ الاحتياطية
     # ═══════════════════════════════════════════════════════════════════════
 
-    def add_backup(self, bot_id, file_path, size):
+    def add_backup(self, bot_id, file_path, size, kind='manual', duration_ms=0):
         """إضافة سجل نسخة احتياطية"""
-        conn = sqlite3.connect(self.db_file)
+        conn = self._connect()
         c = conn.cursor()
         c.execute(
-            "INSERT INTO backups (bot_id, file_path, size) VALUES (?, ?, ?)",
-            (bot_id, file_path, size)
+            "INSERT INTO backups (bot_id, file_path, size, kind, duration_ms) VALUES (?, ?, ?, ?, ?)",
+            (bot_id, file_path, size, kind, duration_ms)
         )
+        backup_id = c.lastrowid
+        conn.commit()
+        conn.close()
+        return backup_id
+
+    def get_backups_by_kind(self, kind):
+        """الحصول على النسخ الاحتياطية حسب النوع (auto/manual)"""
+        conn = self._connect()
+        c = conn.cursor()
+        c.execute(
+            "SELECT id, bot_id, file_path, size, created_at, kind, duration_ms "
+            "FROM backups WHERE kind = ? ORDER BY created_at DESC",
+            (kind,)
+        )
+        rows = c.fetchall()
+        conn.close()
+        return rows
+
+    def delete_backup(self, backup_id):
+        """حذف سجل نسخة احتياطية"""
+        conn = self._connect()
+        c = conn.cursor()
+        c.execute("DELETE FROM backups WHERE id = ?", (backup_id,))
         conn.commit()
         conn.close()
 
     def get_bot_backups(self, bot_id):
         """الحصول على النسخ الاحتياطية للبوت"""
-        conn = sqlite3.connect(self.db_file)
+        conn = self._connect()
         c = conn.cursor()
         c.execute(
             "SELECT * FROM backups WHERE bot_id = ? ORDER BY created_at DESC",
@@ -690,13 +1020,262 @@ class Database:
         conn.close()
         return rows
 
+    # ═══════════════════════════════════════════════════════════════════════
+    # ذاكرة الفحص الأمني
+    # ═══════════════════════════════════════════════════════════════════════
+
+    def get_scan_results(self, keys):
+        """جلب نتائج فحص مخزنة لقائمة (content_hash, variant)"""
+        results = {}
+        if not keys:
+            return results
+        conn = self._connect()
+        c = conn.cursor()
+        keys = list(keys)
+        for i in range(0, len(keys), 400):
+            chunk = keys[i:i + 400]
+            placeholders = " OR ".join(["(content_hash = ? AND variant = ?)"] * len(chunk))
+            params = [v for key in chunk for v in key]
+            c.execute(
+                "SELECT content_hash, variant, scanner_version, safe, message, findings "
+                f"FROM scan_cache WHERE {placeholders}",
+                params
+            )
+            for row in c.fetchall():
+                results[(row[0], row[1])] = row[2:]
+        conn.close()
+        return results
+
+    def save_scan_results(self, rows):
+        """حفظ نتائج فحص: (content_hash, variant, scanner_version, safe, message, findings)"""
+        if not rows:
+            return
+        conn = self._connect()
+        c = conn.cursor()
+        c.executemany(
+            "INSERT OR REPLACE INTO scan_cache "
+            "(content_hash, variant, scanner_version, safe, message, findings) VALUES (?, ?, ?, ?, ?, ?)",
+            rows
+        )
+        conn.commit()
+        conn.close()
+
+    # ═══════════════════════════════════════════════════════════════════════
+    # دفتر وقت الاستضافة
+    # ═══════════════════════════════════════════════════════════════════════
+
+    def credit_bot_time(self, bot_id, seconds, kind, note=''):
+        """إضافة وقت (قيد + تحديث الرصيد في معاملة واحدة): الرصيد الجديد أو None"""
+        conn = self._connect()
+        c = conn.cursor()
+        c.execute(
+            "INSERT INTO time_ledger (bot_id, delta, kind, note, created_at) "
+            "SELECT id, ?, ?, ?, ? FROM bots WHERE id = ?",
+            (seconds, kind, note, int(time.time()), bot_id)
+        )
+        c.execute(
+            "UPDATE bots SET remaining_seconds = remaining_seconds + ?, total_seconds = total_seconds + ?, "
+            "warned_low = 0 WHERE id = ?",
+            (seconds, seconds, bot_id)
+        )
+        c.execute("SELECT remaining_seconds FROM bots WHERE id = ?", (bot_id,))
+        row = c.fetchone()
+        conn.commit()
+        conn.close()
+        self._notify('bot_time', bot_id)
+        return row[0] if row else None
+
+    def reset_bot_time(self, bot_id, seconds, kind, note=''):
+        """ضبط الرصيد على قيمة (مثل الاسترجاع اليومي): يُقيَّد الفرق فقط"""
+        conn = self._connect()
+        c = conn.cursor()
+        c.execute(
+            "INSERT INTO time_ledger (bot_id, delta, kind, note, created_at) "
+            "SELECT id, ? - remaining_seconds, ?, ?, ? FROM bots WHERE id = ?",
+            (seconds, kind, note, int(time.time()), bot_id)
+        )
+        c.execute(
+            "UPDATE bots SET remaining_seconds = ?, total_seconds = ?, warned_low = 0 WHERE id = ?",
+            (seconds, seconds, bot_id)
+        )
+        conn.commit()
+        conn.close()
+        self._notify('bot_time', bot_id)
+
+    def debit_bot_time_batch(self, debits, kind='usage'):
+        """خصم الوقت المستهلك لعدة بوتات بمعاملة واحدة
+
+        Args:
+            debits: [(bot_id, ثواني)]
+
+        Returns:
+            {bot_id: الرصيد بعد الخصم}
+        """
+        if not debits:
+            return {}
+        now = int(time.time())
+        conn = self._connect()
+        c = conn.cursor()
+        # القيد بالمقدار المخصوم فعلاً حتى يطابق مجموع الدفتر الرصيد (لا ينزل تحت الصفر)
+        c.executemany(
+            "INSERT INTO time_ledger (bot_id, delta, kind, created_at) "
+            "SELECT id, -MIN(?, remaining_seconds), ?, ? FROM bots WHERE id = ? AND remaining_seconds > 0",
+            [(seconds, kind, now, bot_id) for bot_id, seconds in debits]
+        )
+        c.executemany(
+            "UPDATE bots SET remaining_seconds = MAX(0, remaining_seconds - ?) WHERE id = ?",
+            [(seconds, bot_id) for bot_id, seconds in debits]
+        )
+        ids = [bot_id for bot_id, _ in debits]
+        c.execute(
+            f"SELECT id, remaining_seconds FROM bots WHERE id IN ({','.join('?' * len(ids))})",
+            ids
+        )
+        balances = dict(c.fetchall())
+        conn.commit()
+        conn.close()
+        return balances
+
+    def get_time_ledger(self, bot_id, limit=20):
+        """آخر قيود الدفتر: [(delta, kind, note, created_at)]"""
+        conn = self._connect()
+        c = conn.cursor()
+        c.execute(
+            "SELECT delta, kind, note, created_at FROM time_ledger WHERE bot_id = ? ORDER BY id DESC LIMIT ?",
+            (bot_id, limit)
+        )
+        rows = c.fetchall()
+        conn.close()
+        return rows
+
+    def rebuild_time_balance(self, bot_id):
+        """إعادة حساب الرصيد من الدفتر (للتحقق أو الإصلاح): الرصيد"""
+        conn = self._connect()
+        c = conn.cursor()
+        c.execute("SELECT COALESCE(SUM(delta), 0) FROM time_ledger WHERE bot_id = ?", (bot_id,))
+        balance = max(0, c.fetchone()[0])
+        c.execute("UPDATE bots SET remaining_seconds = ? WHERE id = ?", (balance, bot_id))
+        conn.commit()
+        conn.close()
+        return balance
+
+    # ═══════════════════════════════════════════════════════════════════════
+    # أعطال البوتات
+    # ═══════════════════════════════════════════════════════════════════════
+
+    def add_bot_crash(self, bot_id, crashed_at, exit_code, uptime_seconds, reason, keep_seconds=7 * 86400):
+        """تسجيل عطل (مع حذف الأعطال الأقدم من keep_seconds)"""
+        conn = self._connect()
+        c = conn.cursor()
+        c.execute(
+            "INSERT INTO bot_crashes (bot_id, crashed_at, exit_code, uptime_seconds, reason) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (bot_id, crashed_at, exit_code, uptime_seconds, reason)
+        )
+        c.execute(
+            "DELETE FROM bot_crashes WHERE bot_id = ? AND crashed_at < ?",
+            (bot_id, crashed_at - keep_seconds)
+        )
+        conn.commit()
+        conn.close()
+
+    def count_bot_crashes_since(self, bot_id, since):
+        """عدد أعطال البوت منذ وقت (unix)"""
+        conn = self._connect()
+        c = conn.cursor()
+        c.execute(
+            "SELECT COUNT(*) FROM bot_crashes WHERE bot_id = ? AND crashed_at >= ?",
+            (bot_id, since)
+        )
+        count = c.fetchone()[0]
+        conn.close()
+        return count
+
+    def get_bot_crash_reasons(self, bot_id, since, limit=3):
+        """أكثر أسباب الأعطال تكراراً منذ وقت: [(السبب، العدد، آخر وقت)]"""
+        conn = self._connect()
+        c = conn.cursor()
+        c.execute(
+            "SELECT reason, COUNT(*) AS n, MAX(crashed_at) FROM bot_crashes "
+            "WHERE bot_id = ? AND crashed_at >= ? GROUP BY reason ORDER BY n DESC LIMIT ?",
+            (bot_id, since, limit)
+        )
+        rows = c.fetchall()
+        conn.close()
+        return rows
+
+    # ═══════════════════════════════════════════════════════════════════════
+    # مراجعات تعديل الملفات
+    # ═══════════════════════════════════════════════════════════════════════
+
+    def add_file_revision(self, bot_id, file_path, reverse_patch, etag_after, summary, keep=10):
+        """حفظ مراجعة (فرق عكسي) مع الاحتفاظ بآخر keep مراجعة فقط للملف"""
+        conn = self._connect()
+        c = conn.cursor()
+        c.execute(
+            "INSERT INTO file_revisions (bot_id, file_path, reverse_patch, etag_after, summary) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (bot_id, file_path, reverse_patch, etag_after, summary)
+        )
+        c.execute(
+            "DELETE FROM file_revisions WHERE bot_id = ? AND file_path = ? AND id NOT IN ("
+            "SELECT id FROM file_revisions WHERE bot_id = ? AND file_path = ? ORDER BY id DESC LIMIT ?)",
+            (bot_id, file_path, bot_id, file_path, keep)
+        )
+        conn.commit()
+        conn.close()
+
+    def get_latest_file_revision(self, bot_id, file_path):
+        """آخر مراجعة للملف: (id, reverse_patch, etag_after, summary, created_at)"""
+        conn = self._connect()
+        c = conn.cursor()
+        c.execute(
+            "SELECT id, reverse_patch, etag_after, summary, created_at FROM file_revisions "
+            "WHERE bot_id = ? AND file_path = ? ORDER BY id DESC LIMIT 1",
+            (bot_id, file_path)
+        )
+        row = c.fetchone()
+        conn.close()
+        return row
+
+    def count_file_revisions(self, bot_id, file_path):
+        """عدد المراجعات المحفوظة للملف"""
+        conn = self._connect()
+        c = conn.cursor()
+        c.execute(
+            "SELECT COUNT(*) FROM file_revisions WHERE bot_id = ? AND file_path = ?",
+            (bot_id, file_path)
+        )
+        count = c.fetchone()[0]
+        conn.close()
+        return count
+
+    def delete_file_revision(self, revision_id):
+        """حذف مراجعة واحدة (بعد التراجع عنها)"""
+        conn = self._connect()
+        c = conn.cursor()
+        c.execute("DELETE FROM file_revisions WHERE id = ?", (revision_id,))
+        conn.commit()
+        conn.close()
+
+    def delete_file_revisions(self, bot_id, file_path):
+        """حذف كل مراجعات الملف (عند حذف الملف)"""
+        conn = self._connect()
+        c = conn.cursor()
+        c.execute(
+            "DELETE FROM file_revisions WHERE bot_id = ? AND file_path = ?",
+            (bot_id, file_path)
+        )
+        conn.commit()
+        conn.close()
+
     # ═══════════════════════════════════════════════════════════════════════
     # إعدادات النظام
     # ═══════════════════════════════════════════════════════════════════════
 
     def get_setting(self, key, default=None):
         """الحصول على إعداد"""
-        conn = sqlite3.connect(self.db_file)
+        conn = self._connect()
         c = conn.cursor()
         c.execute("SELECT value FROM system_settings WHERE key = ?", (key,))
         result = c.fetchone()
@@ -707,7 +1286,7 @@ class Database:
         """تعيين إعداد"""
         from helpers import get_current_time
         
-        conn = sqlite3.connect(self.db_file)
+        conn = self._connect()
         c = conn.cursor()
         c.execute(
             "INSERT OR REPLACE INTO system_settings (key, value, updated_at) VALUES (?, ?, ?)",
@@ -722,7 +1301,7 @@ class Database:
 
     def get_system_stats(self):
         """الحصول على إحصائيات النظام"""
-        conn = sqlite3.connect(self.db_file)
+        conn = self._connect()
         c = conn.cursor()
         
         stats = {}
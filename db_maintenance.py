@@ -0,0 +1,226 @@
+# ============================================================================
+# صيانة قاعدة البيانات - NeurHostX V9.2
+# ============================================================================
+"""
+مهام صيانة دورية لقاعدة البيانات عبر JobQueue الخاص بالتطبيق:
+- ANALYZE دوري حتى تبقى إحصائيات sqlite_stat1 مطابقة لحجم الجداول
+  فيستمر المخطط في اختيار الفهارس المركبة (INDEXES في database.py)
+- احتفاظ سجلات الأحداث مرة يومياً في ساعات خارج الذروة:
+  * حذف ما هو أقدم من logs_retention_days على دفعات صغيرة (معاملة قصيرة لكل
+    دفعة مع استراحة بينها فلا يُحجز قفل الكتابة طويلاً)
+  * حد صفوف لكل بوت حسب خطة مالكه (max_log_rows في PLANS)
+  * أرشفة كل ما يُحذف قبل حذفه في ملف مضغوط لكل شهر:
+    logs/archive/event_logs_YYYY-MM.jsonl.gz
+  * VACUUM تدريجي لإرجاع الصفحات الحرة
+- التنفيذ في خيط منفصل ودون تداخل بين دورتين
+"""
+
+import gzip
+import json
+import time
+import random
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from config import LOGS_DIRECTORY, PLANS
+from settings_manager import settings_manager
+from helpers import get_current_time
+
+logger = logging.getLogger(__name__)
+
+_MAINTENANCE_DEFAULTS = {
+    "analyze_interval_hours": 24,
+    "retention_hours_utc": [2, 3, 4, 5],   # ساعات خارج الذروة
+    "retention_batch_rows": 500,
+    "retention_batch_pause_ms": 100,
+    "retention_max_minutes": 10,           # ما يتبقى يُستكمل في الساعة التالية من النافذة
+    "archive_logs": True,
+    "vacuum_pages_per_step": 1000,
+}
+
+# فحص نافذة الاحتفاظ (بالثواني) - مجرد مقارنة ساعة وتاريخ
+RETENTION_CHECK_SECONDS = 3600
+ARCHIVE_DIRECTORY = Path(LOGS_DIRECTORY) / "archive"
+
+
+def archive_logs(rows, directory: Path = ARCHIVE_DIRECTORY) -> int:
+    """إلحاق سجلات بملفات الأرشيف الشهرية (gzip متعدد الأجزاء يُقرأ كملف واحد)
+
+    Args:
+        rows: (id, bot_id, event_type, message, timestamp)
+
+    Returns:
+        عدد السجلات المؤرشفة - أي OSError يُرفع فلا تُحذف الدفعة
+    """
+    by_month: Dict[str, List[str]] = {}
+    for log_id, bot_id, event_type, message, timestamp in rows:
+        month = str(timestamp or "")[:7] or "unknown"
+        by_month.setdefault(month, []).append(json.dumps({
+            "id": log_id, "bot_id": bot_id, "type": event_type,
+            "message": message, "timestamp": timestamp,
+        }, ensure_ascii=False))
+    directory.mkdir(parents=True, exist_ok=True)
+    for month, lines in by_month.items():
+        with gzip.open(directory / f"event_logs_{month}.jsonl.gz", "at", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+    return len(rows)
+
+
+class DatabaseMaintenance:
+    """مجدول صيانة قاعدة البيانات"""
+
+    def __init__(self, db):
+        self.db = db
+        self._lock = asyncio.Lock()
+        self.last_analyze_ms: Optional[int] = None
+        self.last_retention: Optional[dict] = None
+
+    @staticmethod
+    def config() -> dict:
+        return {**_MAINTENANCE_DEFAULTS, **settings_manager.get_section("db_maintenance")}
+
+    # ═══════════════════════════════════════════════════════════════════════
+    # التسجيل في JobQueue
+    # ═══════════════════════════════════════════════════════════════════════
+
+    def install(self, application) -> bool:
+        """تسجيل مهمتي ANALYZE والاحتفاظ بالسجلات الدوريتين"""
+        job_queue = application.job_queue
+        if job_queue is None:
+            logger.warning("⚠️ JobQueue غير متاح - لن تُجدول صيانة قاعدة البيانات")
+            return False
+
+        hours = max(1.0, float(self.config()["analyze_interval_hours"]))
+        job_queue.run_repeating(
+            self._analyze_tick,
+            interval=hours * 3600,
+            first=random.uniform(600, 1800),
+            name="db_analyze",
+            job_kwargs={"max_instances": 1, "coalesce": True},
+        )
+        job_queue.run_repeating(
+            self._retention_tick,
+            interval=RETENTION_CHECK_SECONDS,
+            first=random.uniform(60, 300),
+            name="log_retention",
+            job_kwargs={"max_instances": 1, "coalesce": True},
+        )
+        logger.info(f"✅ تم تفعيل صيانة قاعدة البيانات (ANALYZE كل {hours:g} ساعة)")
+        return True
+
+    async def _analyze_tick(self, context):
+        try:
+            await self.run_analyze()
+        except Exception as e:
+            logger.error(f"❌ خطأ في تحديث إحصائيات قاعدة البيانات: {e}")
+
+    def retention_due(self) -> bool:
+        """داخل نافذة خارج الذروة ولم يكتمل احتفاظ اليوم بعد"""
+        now = datetime.now(timezone.utc)
+        if now.hour not in self.config()["retention_hours_utc"]:
+            return False
+        return self.db.get_setting("last_log_retention_date") != now.date().isoformat()
+
+    async def _retention_tick(self, context):
+        try:
+            if self.retention_due():
+                await self.run_retention()
+        except Exception as e:
+            logger.error(f"❌ خطأ في الاحتفاظ بسجلات الأحداث: {e}")
+
+    # ═══════════════════════════════════════════════════════════════════════
+    # التنفيذ
+    # ═══════════════════════════════════════════════════════════════════════
+
+    async def run_analyze(self) -> Optional[int]:
+        """تشغيل ANALYZE مرة واحدة
+
+        Returns:
+            المدة بالمللي ثانية أو None إذا كانت هناك عملية جارية
+        """
+        if self._lock.locked():
+            return None
+        async with self._lock:
+            started = time.monotonic()
+            await asyncio.to_thread(self.db.analyze)
+            self.last_analyze_ms = int((time.monotonic() - started) * 1000)
+            self.db.set_setting("last_db_analyze_at", get_current_time())
+            logger.info(f"📐 تم تحديث إحصائيات قاعدة البيانات ({self.last_analyze_ms} ms)")
+            return self.last_analyze_ms
+
+    async def run_retention(self) -> Optional[dict]:
+        """تشغيل دورة احتفاظ واحدة (بدون تداخل)
+
+        Returns:
+            ملخص الدورة أو None إذا كانت هناك عملية جارية
+        """
+        if self._lock.locked():
+            return None
+        async with self._lock:
+            summary = await asyncio.to_thread(self._retention_pass)
+            if summary["complete"]:
+                self.db.set_setting("last_log_retention_date", datetime.now(timezone.utc).date().isoformat())
+            self.last_retention = summary
+            logger.info(
+                f"🧹 احتفاظ السجلات: {summary['expired']} منتهية | {summary['capped']} فوق حد الخطة | "
+                f"{summary['archived']} مؤرشفة | {summary['vacuumed_pages']} صفحة مُرجعة | "
+                f"{summary['duration_ms']} ms{'' if summary['complete'] else ' (غير مكتمل)'}"
+            )
+            return summary
+
+    def _retention_pass(self) -> dict:
+        cfg = self.config()
+        days = int(settings_manager.get("logs_retention_days", 30))
+        batch = max(1, int(cfg["retention_batch_rows"]))
+        pause = float(cfg["retention_batch_pause_ms"]) / 1000
+        started = time.monotonic()
+        deadline = started + float(cfg["retention_max_minutes"]) * 60
+        summary = {"expired": 0, "capped": 0, "archived": 0, "vacuumed_pages": 0, "complete": True}
+
+        def remove(rows) -> int:
+            if cfg["archive_logs"]:
+                summary["archived"] += archive_logs(rows)
+            deleted = self.db.delete_logs([row[0] for row in rows])
+            time.sleep(pause)
+            return deleted
+
+        # 1) المنتهية (CURRENT_TIMESTAMP بتوقيت UTC ويُقارن نصياً)
+        if days > 0:
+            cutoff = (datetime.now(timezone.utc) - timedelta(days=days)).strftime("%Y-%m-%d %H:%M:%S")
+            while time.monotonic() < deadline:
+                rows = self.db.get_expired_logs(cutoff, batch)
+                if not rows:
+                    break
+                summary["expired"] += remove(rows)
+
+        # 2) حد الصفوف لكل بوت حسب الخطة
+        for bot_id, count, plan in self.db.get_log_counts():
+            cap = PLANS.get(plan, PLANS["free"]).get("max_log_rows", -1)
+            excess = count - cap
+            while cap >= 0 and excess > 0 and time.monotonic() < deadline:
+                rows = self.db.get_oldest_bot_logs(bot_id, min(excess, batch))
+                if not rows:
+                    break
+                deleted = remove(rows)
+                summary["capped"] += deleted
+                excess -= len(rows)
+
+        # 3) إرجاع المساحة الحرة
+        if self.db.get_auto_vacuum() != 2:
+            # قاعدة قديمة: تحويل لمرة واحدة (VACUUM كامل) داخل نافذة خارج الذروة
+            logger.info("🗜 تحويل قاعدة البيانات إلى auto_vacuum تدريجي (VACUUM لمرة واحدة)")
+            self.db.enable_incremental_vacuum()
+        else:
+            while time.monotonic() < deadline:
+                freed, remaining = self.db.incremental_vacuum(cfg["vacuum_pages_per_step"])
+                summary["vacuumed_pages"] += freed
+                if not freed or not remaining:
+                    break
+                time.sleep(pause)
+
+        summary["complete"] = time.monotonic() < deadline
+        summary["duration_ms"] = int((time.monotonic() - started) * 1000)
+        return summary
@@ -0,0 +1,120 @@
+# ============================================================================
+# مجدول المواعيد النهائية - NeurHostX V9.2
+# ============================================================================
+"""
+كومة صغرى من (الموعد، الإجراء، المفتاح) بدل فحص كل بوت كل دورة:
+- تنبيه انخفاض الوقت وانتهاؤه لكل بوت، وانتهاء خطة كل مستخدم
+- مهمة واحدة تنام حتى أقرب موعد، فالعمل يتناسب مع عدد الأحداث فقط
+- إعادة الجدولة تُبطل الموعد القديم دون البحث عنه في الكومة (حذف كسول)
+"""
+
+import time
+import heapq
+import asyncio
+import logging
+import itertools
+from typing import Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class DeadlineScheduler:
+    """تنفيذ معالج كل إجراء عند موعده (الأوقات بتوقيت unix)"""
+
+    def __init__(self):
+        self._heap: List[Tuple[float, int, str, Hashable]] = []
+        self._current: Dict[Tuple[str, Hashable], Tuple[float, int]] = {}
+        self._handlers: Dict[str, Callable[[Hashable], Awaitable[None]]] = {}
+        self._seq = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self.fired = 0
+
+    def register(self, action: str, handler: Callable[[Hashable], Awaitable[None]]):
+        """ربط إجراء بمعالج async يستقبل المفتاح"""
+        self._handlers[action] = handler
+
+    def __len__(self):
+        return len(self._current)
+
+    # ═══════════════════════════════════════════════════════════════════════
+    # الجدولة
+    # ═══════════════════════════════════════════════════════════════════════
+
+    def schedule(self, action: str, key: Hashable, deadline: float):
+        """جدولة (أو إعادة جدولة) الإجراء للمفتاح"""
+        seq = next(self._seq)
+        self._current[(action, key)] = (deadline, seq)
+        heapq.heappush(self._heap, (deadline, seq, action, key))
+        self._compact()
+        self._kick(deadline)
+
+    def cancel(self, action: str, key: Hashable):
+        self._current.pop((action, key), None)
+
+    def deadline(self, action: str, key: Hashable) -> Optional[float]:
+        entry = self._current.get((action, key))
+        return entry[0] if entry else None
+
+    def _compact(self):
+        """إعادة بناء الكومة إذا تراكمت فيها مواعيد ملغاة"""
+        if len(self._heap) > 2 * len(self._current) + 64:
+            self._heap = [(d, s, a, k) for (a, k), (d, s) in self._current.items()]
+            heapq.heapify(self._heap)
+
+    def _kick(self, deadline: float):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = loop.create_task(self._run())
+        elif self._heap and self._heap[0][0] >= deadline:
+            # الموعد الجديد صار الأقرب: إيقاظ المهمة لتعيد حساب مدة النوم
+            self._wakeup.set()
+
+    # ═══════════════════════════════════════════════════════════════════════
+    # التنفيذ
+    # ═══════════════════════════════════════════════════════════════════════
+
+    def _pop_due(self, now: float) -> List[Tuple[str, Hashable]]:
+        due = []
+        while self._heap:
+            deadline, seq, action, key = self._heap[0]
+            current = self._current.get((action, key))
+            if current is None or current[1] != seq:
+                heapq.heappop(self._heap)
+                continue
+            if deadline > now:
+                break
+            heapq.heappop(self._heap)
+            del self._current[(action, key)]
+            due.append((action, key))
+        return due
+
+    async def _run(self):
+        while True:
+            for action, key in self._pop_due(time.time()):
+                handler = self._handlers.get(action)
+                if handler is None:
+                    continue
+                self.fired += 1
+                asyncio.get_running_loop().create_task(self._fire(handler, action, key))
+
+            if not self._heap:
+                # لا مواعيد: تنتهي المهمة وتبدأ من جديد مع أول جدولة
+                return
+            timeout = self._heap[0][0] - time.time()
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=max(0.0, timeout))
+            except asyncio.TimeoutError:
+                pass
+
+    @staticmethod
+    async def _fire(handler, action, key):
+        try:
+            await handler(key)
+        except Exception as e:
+            logger.exception(f"خطأ في تنفيذ الموعد {action} لـ {key}: {e}")
@@ -0,0 +1,255 @@
+# ============================================================================
+# خادم Bot API وهمي للاختبار دون اتصال - NeurHostX V9.2
+# ============================================================================
+"""
+يحاكي الجزء الذي يستخدمه البوت من Telegram Bot API لاختبار وضعي polling و webhook محلياً:
+- getMe / setWebhook / deleteWebhook / getWebhookInfo / getUpdates / sendMessage
+  (وبقية الطرق ترجع ok)
+- يرسل رسائل /start مصطنعة ويقيس الزمن حتى أول رد sendMessage للمحادثة نفسها
+- في وضع webhook يتحقق أيضاً من رفض الطلبات ذات secret_token الخاطئ
+
+الاستخدام:
+    1) في settings.json:  "bot_api_base_url": "http://127.0.0.1:8081"
+       (ولوضع webhook: webhook.enabled=true و webhook.url=http://127.0.0.1:8443)
+    2) python fake_bot_api.py --port 8081 --updates 50
+    3) python main.py
+"""
+
+import json
+import time
+import queue
+import random
+import argparse
+import threading
+import statistics
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+BOT_USER = {"id": 100000001, "is_bot": True, "first_name": "NeurHostX", "username": "neurhost_test_bot"}
+
+
+class FakeBotAPI:
+    """حالة الخادم الوهمي: الـ webhook المسجل وطابور getUpdates والردود"""
+
+    def __init__(self):
+        self.webhook: Dict[str, object] = {}
+        self.updates: "queue.Queue[dict]" = queue.Queue()
+        self.next_update_id = 1
+        self.next_message_id = 1
+        self.sent_at: Dict[int, float] = {}      # chat_id -> وقت الإرسال للبوت
+        self.latencies: List[float] = []
+        self.lock = threading.Lock()
+        self.webhook_set = threading.Event()
+
+    # ═══════════════════════════════════════════════════════════════════════
+    # طرق Bot API
+    # ═══════════════════════════════════════════════════════════════════════
+
+    def call(self, method: str, params: dict):
+        handler = getattr(self, f"m_{method}", None)
+        return handler(params) if handler else True
+
+    def m_getMe(self, params):
+        return BOT_USER
+
+    def m_setWebhook(self, params):
+        self.webhook = {
+            "url": params.get("url", ""),
+            "secret_token": params.get("secret_token"),
+            "max_connections": int(params.get("max_connections") or 40),
+        }
+        if self.webhook["url"]:
+            self.webhook_set.set()
+        else:
+            self.webhook_set.clear()
+        return True
+
+    def m_deleteWebhook(self, params):
+        self.webhook = {}
+        self.webhook_set.clear()
+        return True
+
+    def m_getWebhookInfo(self, params):
+        return {
+            "url": self.webhook.get("url", ""),
+            "has_custom_certificate": False,
+            "pending_update_count": self.updates.qsize(),
+            "max_connections": self.webhook.get("max_connections", 40),
+        }
+
+    def m_getUpdates(self, params):
+        timeout = float(params.get("timeout") or 0)
+        result = []
+        try:
+            result.append(self.updates.get(timeout=timeout) if timeout else self.updates.get_nowait())
+            while True:
+                result.append(self.updates.get_nowait())
+        except queue.Empty:
+            pass
+        return result
+
+    def m_sendMessage(self, params):
+        chat_id = int(params.get("chat_id"))
+        with self.lock:
+            sent = self.sent_at.pop(chat_id, None)
+            if sent is not None:
+                self.latencies.append(time.perf_counter() - sent)
+            message_id = self.next_message_id
+            self.next_message_id += 1
+        return {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": BOT_USER,
+            "text": params.get("text", ""),
+        }
+
+    # ═══════════════════════════════════════════════════════════════════════
+    # التحديثات المصطنعة
+    # ═══════════════════════════════════════════════════════════════════════
+
+    def make_update(self, chat_id: int, text: str = "/start") -> dict:
+        with self.lock:
+            update_id = self.next_update_id
+            self.next_update_id += 1
+        user = {"id": chat_id, "is_bot": False, "first_name": f"user{chat_id}", "language_code": "ar"}
+        return {
+            "update_id": update_id,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private", "first_name": user["first_name"]},
+                "from": user,
+                "text": text,
+                "entities": [{"type": "bot_command", "offset": 0, "length": len(text)}] if text.startswith("/") else [],
+            },
+        }
+
+    def deliver(self, update: dict, secret: Optional[str] = None) -> int:
+        """تسليم تحديث: POST للـ webhook إن كان مسجلاً، وإلا طابور getUpdates
+
+        Returns:
+            رمز HTTP من البوت (200 لطابور getUpdates)
+        """
+        chat_id = update["message"]["chat"]["id"]
+        with self.lock:
+            self.sent_at[chat_id] = time.perf_counter()
+        if not self.webhook.get("url"):
+            self.updates.put(update)
+            return 200
+
+        headers = {"Content-Type": "application/json"}
+        token = self.webhook.get("secret_token") if secret is None else secret
+        if token:
+            headers["X-Telegram-Bot-Api-Secret-Token"] = token
+        request = urllib.request.Request(
+            self.webhook["url"], data=json.dumps(update).encode(), headers=headers, method="POST"
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=10) as response:
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+
+def make_handler(api: FakeBotAPI):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            self.do_POST()
+
+        def do_POST(self):
+            # /bot<token>/<method>
+            parts = self.path.split("?")[0].strip("/").split("/")
+            method = parts[-1] if len(parts) >= 2 and parts[0].startswith("bot") else None
+            params = {}
+            length = int(self.headers.get("Content-Length") or 0)
+            if length:
+                body = self.rfile.read(length)
+                if "json" in (self.headers.get("Content-Type") or ""):
+                    params = json.loads(body or b"{}")
+                else:
+                    from urllib.parse import parse_qsl
+                    params = dict(parse_qsl(body.decode()))
+            if method is None:
+                payload, status = {"ok": False, "error_code": 404, "description": "Not Found"}, 404
+            else:
+                payload, status = {"ok": True, "result": api.call(method, params)}, 200
+            data = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    return Handler
+
+
+def run_benchmark(api: FakeBotAPI, count: int, concurrency: int, wait_seconds: float):
+    """إرسال count رسالة /start من محادثات مختلفة وطباعة زمن الرد"""
+    mode = "webhook" if api.webhook_set.wait(timeout=wait_seconds) else "polling"
+    time.sleep(1)
+    print(f"📡 الوضع: {mode}")
+
+    if mode == "webhook":
+        status = api.deliver(api.make_update(1), secret="wrong-secret")
+        print(f"🔐 طلب بسر خاطئ: HTTP {status} ({'مرفوض ✅' if status == 403 else 'غير مرفوض ❌'})")
+        with api.lock:
+            api.sent_at.clear()
+
+    chats = [random.randint(10_000_000, 99_999_999) for _ in range(count)]
+    started = time.perf_counter()
+    for i in range(0, count, concurrency):
+        batch = [threading.Thread(target=api.deliver, args=(api.make_update(chat),)) for chat in chats[i:i + concurrency]]
+        for t in batch:
+            t.start()
+        for t in batch:
+            t.join()
+    deadline = time.perf_counter() + 30
+    while len(api.latencies) < count and time.perf_counter() < deadline:
+        time.sleep(0.05)
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(api.latencies)
+    if not latencies:
+        print("❌ لم يصل أي رد - هل البوت يعمل ويشير إلى هذا الخادم؟")
+        return
+    p95 = latencies[max(0, int(len(latencies) * 0.95) - 1)]
+    print(
+        f"✅ ردود: {len(latencies)}/{count} خلال {elapsed:.2f}s\n"
+        f"   الوسيط: {statistics.median(latencies) * 1000:.1f}ms | "
+        f"p95: {p95 * 1000:.1f}ms | الأقصى: {latencies[-1] * 1000:.1f}ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Telegram Bot API for offline tests")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--updates", type=int, default=50, help="عدد رسائل /start المصطنعة (0 = خادم فقط)")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--wait", type=float, default=30, help="انتظار تسجيل الـ webhook قبل اعتبار الوضع polling")
+    args = parser.parse_args()
+
+    api = FakeBotAPI()
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(api))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"🧪 Bot API وهمي على http://{args.host}:{args.port}")
+
+    try:
+        if args.updates:
+            run_benchmark(api, args.updates, args.concurrency, args.wait)
+        else:
+            threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
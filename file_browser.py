@@ -0,0 +1,372 @@
+# ============================================================================
+# بنية دعم مدير الملفات - NeurHostX V9.2
+# ============================================================================
+"""
+هياكل مساعدة لمدير الملفات:
+- ذاكرة قوائم المجلدات (لكل مجلد: العناصر مع الحجم ووقت التعديل + الحجم الكلي)
+- جدول مقابض قصيرة للمسارات (لتبقى callback_data أقل من 64 بايت)
+- فهرس إزاحات السطور لعارض الملفات (قفز مباشر لأي سطر أو صفحة + بحث)
+"""
+
+import os
+import re
+import mmap
+import time
+import bisect
+import threading
+import logging
+from pathlib import Path
+from collections import OrderedDict
+from array import array
+from typing import List, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class ListingEntry(NamedTuple):
+    """عنصر واحد في قائمة المجلد"""
+    name: str
+    is_dir: bool
+    size: int
+    mtime: float
+
+
+class DirectoryListing(NamedTuple):
+    """قائمة مجلد جاهزة للعرض"""
+    dirs: List[ListingEntry]
+    files: List[ListingEntry]
+    total_size: int
+    dir_mtime_ns: int
+    loaded_at: float
+
+
+class DirectoryListingCache:
+    """ذاكرة قوائم المجلدات لمدير الملفات
+
+    - خلال revalidate_seconds تُعاد القائمة بدون أي استدعاء نظام
+    - بعدها يُتحقق من mtime المجلد (stat واحد) ويُعاد المسح عند تغيره
+    - بعد max_age_seconds يُعاد المسح دائماً (أحجام الملفات التي يكتبها البوت نفسه)
+    - معالجات الرفع والتعديل والحذف تستدعي invalidate مباشرة
+    """
+
+    def __init__(self, max_dirs: int = 256, revalidate_seconds: float = 5,
+                 max_age_seconds: float = 60):
+        self.max_dirs = max_dirs
+        self.revalidate_seconds = revalidate_seconds
+        self.max_age_seconds = max_age_seconds
+        self._entries = OrderedDict()
+        self._checked_at = {}
+        self._lock = threading.Lock()
+
+    def get(self, dir_path: Path) -> DirectoryListing:
+        """قائمة المجلد (من الذاكرة إن كانت صالحة)"""
+        key = str(dir_path)
+        now = time.monotonic()
+
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None:
+                self._entries.move_to_end(key)
+                if now - self._checked_at.get(key, 0) < self.revalidate_seconds:
+                    return cached
+
+        if cached is not None and now - cached.loaded_at < self.max_age_seconds:
+            try:
+                if os.stat(key).st_mtime_ns == cached.dir_mtime_ns:
+                    with self._lock:
+                        self._checked_at[key] = now
+                    return cached
+            except OSError:
+                pass
+
+        listing = self._scan(dir_path, now)
+        with self._lock:
+            self._entries[key] = listing
+            self._entries.move_to_end(key)
+            self._checked_at[key] = now
+            while len(self._entries) > self.max_dirs:
+                old_key, _ = self._entries.popitem(last=False)
+                self._checked_at.pop(old_key, None)
+        return listing
+
+    @staticmethod
+    def _scan(dir_path: Path, now: float) -> DirectoryListing:
+        """مسح المجلد مرة واحدة بـ scandir"""
+        dirs = []
+        files = []
+        total_size = 0
+        dir_mtime_ns = os.stat(dir_path).st_mtime_ns
+
+        with os.scandir(dir_path) as it:
+            for entry in it:
+                if entry.name.startswith('.') or entry.name == '__pycache__':
+                    continue
+                try:
+                    if entry.is_dir():
+                        st = entry.stat()
+                        dirs.append(ListingEntry(entry.name, True, 0, st.st_mtime))
+                    else:
+                        st = entry.stat()
+                        total_size += st.st_size
+                        files.append(ListingEntry(entry.name, False, st.st_size, st.st_mtime))
+                except OSError:
+                    continue
+
+        dirs.sort(key=lambda e: e.name)
+        files.sort(key=lambda e: e.name)
+        return DirectoryListing(dirs, files, total_size, dir_mtime_ns, now)
+
+    def invalidate(self, path: Path):
+        """إبطال قائمة المجلد الذي يحتوي المسار (أو المجلد نفسه)"""
+        path = Path(path).resolve()
+        with self._lock:
+            for key in (str(path), str(path.parent)):
+                self._entries.pop(key, None)
+                self._checked_at.pop(key, None)
+
+    def invalidate_tree(self, root: Path):
+        """إبطال كل القوائم داخل مجلد (بعد نشر أو استعادة أو حذف بوت)"""
+        root_str = str(Path(root).resolve())
+        with self._lock:
+            for key in [k for k in self._entries if k == root_str or k.startswith(root_str + os.sep)]:
+                self._entries.pop(key, None)
+                self._checked_at.pop(key, None)
+
+
+class PathHandleTable:
+    """جدول مقابض رقمية قصيرة ← (بوت، مسار نسبي)
+
+    LRU مع مدة صلاحية. كل مقبض مرتبط بالمستخدم الذي صدر له، فلا يمكن
+    استخدامه من جلسة مستخدم آخر.
+    """
+
+    def __init__(self, max_entries: int = 20000, ttl_seconds: float = 3600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._by_handle = OrderedDict()
+        self._by_path = {}
+        self._next = 1
+        self._lock = threading.Lock()
+
+    def issue(self, user_id: int, bot_id: int, rel_path: str) -> int:
+        """إصدار مقبض للمسار (أو إعادة المقبض الموجود)"""
+        key = (user_id, bot_id, rel_path)
+        expires = time.monotonic() + self.ttl_seconds
+        with self._lock:
+            handle = self._by_path.get(key)
+            if handle is None:
+                handle = self._next
+                self._next += 1
+                self._by_path[key] = handle
+            self._by_handle[handle] = (key, expires)
+            self._by_handle.move_to_end(handle)
+            while len(self._by_handle) > self.max_entries:
+                _, (old_key, _) = self._by_handle.popitem(last=False)
+                self._by_path.pop(old_key, None)
+        return handle
+
+    def resolve(self, user_id: int, handle: int) -> Optional[Tuple[int, str]]:
+        """المقبض ← (bot_id، المسار النسبي) أو None إذا انتهى أو لا يخص المستخدم"""
+        now = time.monotonic()
+        with self._lock:
+            item = self._by_handle.get(handle)
+            if item is None:
+                return None
+            key, expires = item
+            if expires < now:
+                del self._by_handle[handle]
+                self._by_path.pop(key, None)
+                return None
+            if key[0] != user_id:
+                return None
+            self._by_handle[handle] = (key, now + self.ttl_seconds)
+            self._by_handle.move_to_end(handle)
+        return key[1], key[2]
+
+
+class LineIndex:
+    """فهرس متناثر لإزاحات السطور في ملف
+
+    تُحفظ إزاحة بداية كل سطر رقم STRIDE (0، 64، 128...) فقط، فالوصول
+    لأي سطر = قفز إلى أقرب نقطة + قراءة أقل من STRIDE سطر، مهما كان
+    موقع السطر في الملف. الذاكرة ≈ 8 بايت لكل 64 سطر.
+
+    الملفات التي تنمو بالإلحاق (السجلات) يُمدَّد فهرسها من آخر موضع
+    مفهرس بدل إعادة البناء.
+    """
+
+    STRIDE = 64
+    MAX_LINE_BYTES = 400
+
+    def __init__(self, path: str):
+        self.path = path
+        self.inode = None
+        self.size = 0
+        self.mtime_ns = 0
+        self.line_count = 0
+        self._checkpoints = array('Q', [0])
+        self._complete_lines = 0
+        self._scanned_to = 0
+        self._tail = b''
+
+    def _read_tail(self, f, end: int) -> bytes:
+        """آخر 64 بايت قبل الموضع (بصمة للتأكد أن الملف لم يُعد كتابته)"""
+        start = max(0, end - 64)
+        f.seek(start)
+        return f.read(end - start)
+
+    def matches(self, st: os.stat_result) -> bool:
+        """هل الفهرس مطابق لحالة الملف الحالية؟"""
+        return (st.st_ino, st.st_size, st.st_mtime_ns) == (self.inode, self.size, self.mtime_ns)
+
+    def can_extend(self, st: os.stat_result) -> bool:
+        """هل الملف نفسه نما فقط (إلحاق) فيمكن تمديد الفهرس؟"""
+        if st.st_ino != self.inode or st.st_size < self._scanned_to or self._scanned_to == 0:
+            return False
+        try:
+            with open(self.path, 'rb') as f:
+                return self._read_tail(f, self._scanned_to) == self._tail
+        except OSError:
+            return False
+
+    def update(self, st: os.stat_result):
+        """فهرسة الجزء غير المفهرس من الملف (أو كله)"""
+        stride = self.STRIDE
+        checkpoints = self._checkpoints
+        count = self._complete_lines
+        pos = self._scanned_to
+        size = st.st_size
+
+        if size > pos:
+            with open(self.path, 'rb') as f, \
+                    mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                size = len(mm)
+                find = mm.find
+                while True:
+                    nl = find(b'\n', pos)
+                    if nl < 0:
+                        break
+                    pos = nl + 1
+                    count += 1
+                    if count % stride == 0:
+                        checkpoints.append(pos)
+                self._tail = mm[max(0, pos - 64):pos]
+
+        self._complete_lines = count
+        self._scanned_to = pos
+        self.line_count = count + (1 if size > pos else 0)
+        self.inode, self.size, self.mtime_ns = st.st_ino, size, st.st_mtime_ns
+
+    def _offset_of(self, f, line_no: int) -> int:
+        """إزاحة بداية السطر (0-based) باستخدام أقرب نقطة فهرسة"""
+        idx = min(line_no // self.STRIDE, len(self._checkpoints) - 1)
+        f.seek(self._checkpoints[idx])
+        for _ in range(line_no - idx * self.STRIDE):
+            if not self._skip_line(f):
+                break
+        return f.tell()
+
+    @staticmethod
+    def _skip_line(f) -> bool:
+        """تخطي سطر واحد دون تحميل السطور الطويلة جداً في الذاكرة"""
+        while True:
+            chunk = f.readline(65536)
+            if not chunk:
+                return False
+            if chunk.endswith(b'\n'):
+                return True
+
+    def read_lines(self, start: int, count: int) -> List[Tuple[int, str, bool]]:
+        """قراءة count سطر بدءاً من السطر start (0-based)
+
+        Returns:
+            قائمة (رقم السطر، النص، هل قُص السطر)
+        """
+        lines = []
+        if start >= self.line_count:
+            return lines
+        with open(self.path, 'rb') as f:
+            self._offset_of(f, start)
+            for line_no in range(start, min(start + count, self.line_count)):
+                raw = f.readline(self.MAX_LINE_BYTES + 1)
+                if not raw:
+                    break
+                truncated = False
+                if not raw.endswith(b'\n') and len(raw) > self.MAX_LINE_BYTES:
+                    truncated = True
+                    raw = raw[:self.MAX_LINE_BYTES]
+                    self._skip_line(f)
+                text = raw.rstrip(b'\r\n').decode('utf-8', errors='replace')
+                lines.append((line_no, text, truncated))
+        return lines
+
+    def line_of_offset(self, offset: int, mm) -> int:
+        """رقم السطر (0-based) الذي يحتوي الإزاحة"""
+        idx = bisect.bisect_right(self._checkpoints, offset) - 1
+        start = self._checkpoints[idx]
+        return idx * self.STRIDE + mm[start:offset].count(b'\n')
+
+    def search(self, needle: str, from_line: int = 0) -> Optional[int]:
+        """البحث عن نص (بدون حساسية لحالة الأحرف) بدءاً من سطر، مع الالتفاف للبداية
+
+        Returns:
+            رقم أول سطر مطابق (0-based) أو None
+        """
+        if not needle or self.size == 0:
+            return None
+        pattern = re.compile(re.escape(needle.encode('utf-8')), re.IGNORECASE)
+        with open(self.path, 'rb') as f:
+            start_offset = self._offset_of(f, from_line) if from_line < self.line_count else self.size
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                match = pattern.search(mm, start_offset)
+                if match is None and start_offset > 0:
+                    match = pattern.search(mm, 0, start_offset)
+                if match is None:
+                    return None
+                return self.line_of_offset(match.start(), mm)
+
+
+class LineIndexCache:
+    """ذاكرة فهارس السطور لكل (مسار، inode، حجم، mtime)"""
+
+    def __init__(self, max_files: int = 32):
+        self.max_files = max_files
+        self._indexes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path: Path) -> LineIndex:
+        """فهرس الملف (يُبنى أو يُمدَّد عند الحاجة) - يُستدعى من خيط منفصل"""
+        key = str(Path(path).resolve())
+        st = os.stat(key)
+        with self._lock:
+            index = self._indexes.get(key)
+            if index is not None:
+                self._indexes.move_to_end(key)
+                if index.matches(st):
+                    return index
+
+        if index is None or not index.can_extend(st):
+            index = LineIndex(key)
+        else:
+            # نسخة جديدة حتى لا نعدّل فهرساً قد يقرأه طلب آخر
+            fresh = LineIndex(key)
+            fresh._checkpoints = array('Q', index._checkpoints)
+            fresh._complete_lines = index._complete_lines
+            fresh._scanned_to = index._scanned_to
+            fresh._tail = index._tail
+            fresh.inode = index.inode
+            index = fresh
+        index.update(st)
+
+        with self._lock:
+            self._indexes[key] = index
+            self._indexes.move_to_end(key)
+            while len(self._indexes) > self.max_files:
+                self._indexes.popitem(last=False)
+        return index
+
+
+# مثيلات عامة مشتركة بين المعالجات
+listing_cache = DirectoryListingCache()
+path_handles = PathHandleTable()
+line_indexes = LineIndexCache()
@@ -0,0 +1,335 @@
+# ============================================================================
+# محرر الملفات بالتصحيحات - NeurHostX V9.2
+# ============================================================================
+"""
+تعديل ملفات البوتات بدون استبدال الملف كاملاً:
+- فرق موحّد (unified diff) أو استبدال نطاق سطور بصيغة sed مثل 12,18
+- كتابة ذرية عبر ملف مؤقت + rename مع شرط etag لاكتشاف التعارض
+- حفظ آخر N مراجعة كفروقات عكسية مضغوطة للتراجع الفوري
+"""
+
+import os
+import re
+import json
+import zlib
+import difflib
+import tempfile
+import threading
+import logging
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from settings_manager import settings_manager
+
+logger = logging.getLogger(__name__)
+
+# رأس مقطع الفرق الموحّد: @@ -start,count +start,count @@
+_HUNK_HEADER = re.compile(r'^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@')
+
+# السطر الأول لتعديل نطاق: 12,18 أو 12 أو 12,$d أو 0a
+_RANGE_HEADER = re.compile(r'^\s*(\d+|\$)(?:\s*,\s*(\d+|\$))?\s*([acd]?)\s*$')
+
+
+def file_etag(path) -> str:
+    """معرّف نسخة الملف من mtime والحجم (يتغير مع أي كتابة)"""
+    st = os.stat(path)
+    return f"{st.st_mtime_ns:x}-{st.st_size:x}"
+
+
+def _newline_of(lines: List[str]) -> str:
+    """نمط نهاية السطر المستخدم في الملف"""
+    for line in lines:
+        if line.endswith('\r\n'):
+            return '\r\n'
+        if line.endswith('\n'):
+            return '\n'
+    return '\n'
+
+
+def _to_lines(text: str, newline: str) -> List[str]:
+    """تقسيم نص المستخدم إلى سطور بنهاية سطر الملف"""
+    return [line + newline for line in text.splitlines()]
+
+
+def is_unified_diff(text: str) -> bool:
+    """هل النص فرق موحّد؟"""
+    return any(_HUNK_HEADER.match(line) for line in text.splitlines()[:200])
+
+
+# ═══════════════════════════════════════════════════════════════════════════
+# تطبيق التعديلات على قائمة السطور
+# ═══════════════════════════════════════════════════════════════════════════
+
+def apply_unified_diff(lines: List[str], diff_text: str) -> List[str]:
+    """تطبيق فرق موحّد على سطور الملف
+
+    يُتحقق من سطور السياق والحذف. إذا انزاح موضع المقطع (تعديلات سابقة)
+    يُبحث عنه في أقرب موضع مطابق.
+
+    Raises:
+        ValueError: إذا كان الفرق غير صالح أو لا يطابق الملف
+    """
+    newline = _newline_of(lines)
+    hunks = []
+    current = None
+    for raw in diff_text.splitlines():
+        match = _HUNK_HEADER.match(raw)
+        if match:
+            current = {'start': int(match.group(1)), 'old': [], 'new': []}
+            hunks.append(current)
+            continue
+        if current is None:
+            continue
+        if raw.startswith(('--- ', '+++ ', 'diff ')) and not current['old'] and not current['new']:
+            continue
+        if raw.startswith('\\'):
+            # "\ No newline at end of file" ينطبق على آخر سطر أُضيف
+            for key in ('new', 'old'):
+                if current[key] and current[key][-1].endswith(newline):
+                    current[key][-1] = current[key][-1][:-len(newline)]
+                    break
+            continue
+        tag, body = raw[:1], raw[1:] + newline
+        if tag == ' ' or raw == '':
+            current['old'].append(body if raw else newline)
+            current['new'].append(body if raw else newline)
+        elif tag == '-':
+            current['old'].append(body)
+        elif tag == '+':
+            current['new'].append(body)
+        else:
+            raise ValueError(f"سطر غير متوقع في الفرق: {raw[:40]}")
+
+    if not hunks:
+        raise ValueError("لا توجد مقاطع @@ في الفرق")
+
+    result = list(lines)
+    offset = 0
+    for number, hunk in enumerate(hunks, 1):
+        old = [line.rstrip('\r\n') for line in hunk['old']]
+        expected = hunk['start'] - 1 + offset if old else hunk['start'] + offset
+        position = _find_block(result, old, max(0, expected))
+        if position is None:
+            raise ValueError(f"المقطع {number} لا يطابق محتوى الملف الحالي")
+        result[position:position + len(old)] = hunk['new']
+        offset = position - (hunk['start'] - 1 if old else hunk['start']) + len(hunk['new']) - len(old)
+    return result
+
+
+def _find_block(lines: List[str], block: List[str], expected: int) -> Optional[int]:
+    """أقرب موضع يطابق فيه block السطور (بتجاهل نهايات الأسطر)"""
+    if not block:
+        return min(expected, len(lines))
+    limit = len(lines) - len(block)
+    for distance in range(0, max(limit, 0) + 1):
+        for position in (expected - distance, expected + distance):
+            if 0 <= position <= limit and all(
+                lines[position + i].rstrip('\r\n') == block[i] for i in range(len(block))
+            ):
+                return position
+        if expected - distance < 0 and expected + distance > limit:
+            break
+    return None
+
+
+def parse_line_range(text: str) -> Optional[Tuple[str, str, str, str]]:
+    """تحليل تعديل نطاق سطور: السطر الأول N[,M][a|c|d] والباقي هو النص الجديد
+
+    Returns:
+        (البداية، النهاية، الأمر، النص) أو None إذا لم يكن النص بهذه الصيغة
+    """
+    first, _, body = text.partition('\n')
+    match = _RANGE_HEADER.match(first)
+    if not match:
+        return None
+    start, end, command = match.group(1), match.group(2) or match.group(1), match.group(3) or 'c'
+    return start, end, command, body
+
+
+def apply_line_range(lines: List[str], spec: Tuple[str, str, str, str]) -> List[str]:
+    """تطبيق تعديل نطاق سطور (الترقيم يبدأ من 1، و$ تعني آخر سطر)
+
+    - N,M أو N,Mc: استبدال السطور N..M بالنص
+    - N,Md: حذف السطور N..M
+    - Na: إدراج النص بعد السطر N (0a للإدراج في البداية)
+
+    Raises:
+        ValueError: إذا كان النطاق خارج الملف
+    """
+    start_s, end_s, command, body = spec
+    total = len(lines)
+    start = total if start_s == '$' else int(start_s)
+    end = total if end_s == '$' else int(end_s)
+    new_lines = _to_lines(body, _newline_of(lines)) if command != 'd' else []
+
+    result = list(lines)
+    if command == 'a':
+        if not 0 <= start <= total:
+            raise ValueError(f"السطر {start} خارج الملف ({total} سطر)")
+        if start == total and result and not result[-1].endswith('\n'):
+            result[-1] += _newline_of(lines)
+        result[start:start] = new_lines
+        return result
+
+    if start < 1 or end < start or end > total:
+        raise ValueError(f"النطاق {start},{end} خارج الملف ({total} سطر)")
+    result[start - 1:end] = new_lines
+    return result
+
+
+# ═══════════════════════════════════════════════════════════════════════════
+# الفروقات العكسية
+# ═══════════════════════════════════════════════════════════════════════════
+
+def make_reverse_patch(old_lines: List[str], new_lines: List[str]) -> Tuple[bytes, int, int]:
+    """فرق عكسي مضغوط يعيد new_lines إلى old_lines
+
+    يُحفظ فقط الجزء المتغير: [(i1, i2, السطور القديمة)] على إحداثيات الملف الجديد.
+
+    Returns:
+        (الفرق المضغوط، عدد السطور المضافة، عدد السطور المحذوفة)
+    """
+    ops = []
+    added = removed = 0
+    matcher = difflib.SequenceMatcher(None, new_lines, old_lines)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag != 'equal':
+            ops.append((i1, i2, old_lines[j1:j2]))
+            added += i2 - i1
+            removed += j2 - j1
+    return zlib.compress(json.dumps(ops, ensure_ascii=False).encode('utf-8')), added, removed
+
+
+def apply_reverse_patch(lines: List[str], blob: bytes) -> List[str]:
+    """تطبيق فرق عكسي (من الآخر للأول حتى لا تنزاح الإحداثيات)"""
+    result = list(lines)
+    for i1, i2, old in reversed(json.loads(zlib.decompress(blob).decode('utf-8'))):
+        result[i1:i2] = old
+    return result
+
+
+# ═══════════════════════════════════════════════════════════════════════════
+# المحرر
+# ═══════════════════════════════════════════════════════════════════════════
+
+class FileEditor:
+    """تطبيق التعديلات ذرياً مع اكتشاف التعارض وسجل تراجع"""
+
+    def __init__(self):
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+
+    def _lock_for(self, path: str) -> threading.Lock:
+        """قفل لكل ملف حتى لا يتداخل تعديلان داخل العملية نفسها"""
+        with self._locks_guard:
+            lock = self._locks.get(path)
+            if lock is None:
+                lock = self._locks[path] = threading.Lock()
+            return lock
+
+    @staticmethod
+    def history_limit() -> int:
+        """عدد المراجعات المحفوظة لكل ملف"""
+        return max(0, int(settings_manager.get("file_edit_history", 10)))
+
+    @staticmethod
+    def _read_lines(path: str) -> List[str]:
+        with open(path, 'r', encoding='utf-8', newline='') as f:
+            return f.read().splitlines(keepends=True)
+
+    @staticmethod
+    def _atomic_write(path: str, lines: List[str], expected_etag: Optional[str]) -> str:
+        """كتابة عبر ملف مؤقت في نفس المجلد ثم os.replace
+
+        Returns:
+            etag الجديد، أو None إذا تغير الملف بعد expected_etag
+        """
+        target = Path(path)
+        fd, tmp_path = tempfile.mkstemp(prefix=f".{target.name}.", suffix=".tmp", dir=target.parent)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8', newline='') as f:
+                f.writelines(lines)
+                f.flush()
+                os.fsync(f.fileno())
+            os.chmod(tmp_path, os.stat(path).st_mode & 0o7777)
+            # فحص أخير قبل الاستبدال لتضييق نافذة التعارض مع كاتب خارجي
+            if expected_etag is not None and file_etag(path) != expected_etag:
+                os.unlink(tmp_path)
+                return None
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        return file_etag(path)
+
+    def apply(self, db, bot_id: int, rel_path: str, file_path: str, text: str,
+              expected_etag: Optional[str] = None, force_full: bool = False):
+        """تطبيق تعديل من المستخدم (فرق موحّد، نطاق سطور، أو محتوى كامل)
+
+        Returns:
+            (نجاح، رسالة، etag الجديد)
+        """
+        with self._lock_for(file_path):
+            if expected_etag is not None and file_etag(file_path) != expected_etag:
+                return False, "⚠️ تم تعديل الملف من مصدر آخر منذ فتحه. افتحه مجدداً ثم أعد التعديل.", None
+
+            try:
+                old_lines = self._read_lines(file_path)
+            except UnicodeDecodeError:
+                return False, "❌ الملف ليس نصاً بترميز UTF-8", None
+
+            try:
+                if not force_full and is_unified_diff(text):
+                    new_lines = apply_unified_diff(old_lines, text)
+                    kind = "فرق موحّد"
+                elif not force_full and (spec := parse_line_range(text)):
+                    new_lines = apply_line_range(old_lines, spec)
+                    kind = f"السطور {spec[0]},{spec[1]}{spec[2]}"
+                else:
+                    new_lines = text.splitlines(keepends=True)
+                    kind = "المحتوى كاملاً"
+            except ValueError as e:
+                return False, f"❌ {e}", None
+
+            if new_lines == old_lines:
+                return False, "ℹ️ لا يوجد تغيير في المحتوى", None
+
+            new_etag = self._atomic_write(file_path, new_lines, expected_etag)
+            if new_etag is None:
+                return False, "⚠️ تم تعديل الملف من مصدر آخر أثناء الحفظ. لم يُكتب شيء.", None
+
+            patch, added, removed = make_reverse_patch(old_lines, new_lines)
+            keep = self.history_limit()
+            if keep:
+                db.add_file_revision(bot_id, rel_path, patch, new_etag, kind, keep=keep)
+
+            return True, f"✅ {kind} | +{added} / -{removed} سطر", new_etag
+
+    def undo(self, db, bot_id: int, rel_path: str, file_path: str):
+        """التراجع عن آخر تعديل محفوظ
+
+        Returns:
+            (نجاح، رسالة، etag الجديد)
+        """
+        with self._lock_for(file_path):
+            revision = db.get_latest_file_revision(bot_id, rel_path)
+            if not revision:
+                return False, "ℹ️ لا توجد تعديلات للتراجع عنها", None
+
+            revision_id, blob, etag_after, summary, created_at = revision
+            current_etag = file_etag(file_path)
+            if current_etag != etag_after:
+                return False, "⚠️ تغير الملف بعد آخر تعديل مسجل، لا يمكن التراجع بأمان.", None
+
+            lines = apply_reverse_patch(self._read_lines(file_path), blob)
+            new_etag = self._atomic_write(file_path, lines, current_etag)
+            if new_etag is None:
+                return False, "⚠️ تم تعديل الملف أثناء التراجع. لم يُكتب شيء.", None
+
+            db.delete_file_revision(revision_id)
+            return True, f"↩️ تم التراجع عن: {summary} ({created_at})", new_etag
+
+
+# مثيل عام
+file_editor = FileEditor()
@@ -255,9 +255,9 @@ async def manage_bot(update: Update, context: ContextTypes.DEFAULT_TYPE, db: Dat
         )
         return
     
-    await _show_manage_bot(query, bot, db)
+    await _show_manage_bot(query, bot, db, context.bot_data.get('pm'))
 
-async def _show_manage_bot(query, bot, db):
+async def _show_manage_bot(query, bot, db, pm=None):
     """عرض واجهة إدارة البوت"""
     bot_id = bot[0]
     name = bot[3]
@@ -295,6 +295,18 @@ async def _show_manage_bot(query, bot, db):
             f"   • إعادة التشغيل: {restart_count}x\n\n"
         )
     
+    if status == "cooldown":
+        wait = pm.restart_policy.cooldown_remaining(bot_id) if pm else None
+        if wait is not None:
+            text += f"⏳ <b>إعادة تشغيل تلقائية بعد:</b> {seconds_to_human(int(wait))}\n"
+        text += f"   • الأعطال خلال 24 ساعة: {restart_count}x\n\n"
+    
+    if status == "queued":
+        position = pm.admission.position(bot_id) if pm else None
+        if position is not None:
+            text += f"📋 <b>الموقع في الطابور:</b> {position}\n"
+        text += "   يعمل تلقائياً عند توفر السعة على المضيف\n\n"
+    
     if sleep_mode:
         text += "⚠️ <b>البوت في وضع السكون</b>\n   استخدم الاسترجاع لإيقاظه\n\n"
     
@@ -311,6 +323,13 @@ async def _show_manage_bot(query, bot, db):
             InlineKeyboardButton("⏹️ إيقاف", callback_data=f"stop_{bot_id}"),
             InlineKeyboardButton("🔄 إعادة تشغيل", callback_data=f"restart_{bot_id}")
         ])
+    elif status == "queued":
+        keyboard.append([InlineKeyboardButton("⏹️ إلغاء الانتظار", callback_data=f"stop_{bot_id}")])
+    elif status == "cooldown":
+        keyboard.append([
+            InlineKeyboardButton("▶️ تشغيل الآن", callback_data=f"start_{bot_id}"),
+            InlineKeyboardButton("⏹️ إيقاف", callback_data=f"stop_{bot_id}")
+        ])
     
     if sleep_mode:
         keyboard.append([InlineKeyboardButton("✨ إيقاظ (استرجاع مجاني)", callback_data=f"recover_{bot_id}")])
@@ -376,7 +395,7 @@ async def start_bot_action(update: Update, context: ContextTypes.DEFAULT_TYPE, d
         
         bot = db.get_bot(bot_id)
         if bot and success:
-            await _show_manage_bot(query, bot, db)
+            await _show_manage_bot(query, bot, db, pm)
     except Exception as e:
         logger.error(f"خطأ في بدء البوت: {e}")
         await query.message.reply_text(
@@ -400,13 +419,19 @@ async def stop_bot_action(update: Update, context: ContextTypes.DEFAULT_TYPE, db
         
         bot = db.get_bot(bot_id)
         bot_name = bot[3] if bot else f"البوت #{bot_id}"
-        pm.stop_bot(bot_id)
+        result = await pm.stop_bot(bot_id)
+        
+        stop_note = ""
+        if result['exit_code'] is not None:
+            stop_note = f"\n⏱️ زمن الإيقاف: {result['latency']:.2f}s"
+            if result['forced']:
+                stop_note += " (إيقاف قسري)"
         
         await query.message.reply_text(
             f"════════════════════════════\n"
             f"⏹️ <b>تم إيقاف البوت</b>\n"
             f"════════════════════════════\n\n"
-            f"🤖 {safe_html_escape(bot_name)}",
+            f"🤖 {safe_html_escape(bot_name)}{stop_note}",
             parse_mode="HTML",
             reply_markup=InlineKeyboardMarkup([
                 [InlineKeyboardButton("▶️ تشغيل مجدداً", callback_data=f"start_{bot_id}")],
@@ -415,7 +440,7 @@ async def stop_bot_action(update: Update, context: ContextTypes.DEFAULT_TYPE, db
         )
         
         if bot:
-            await _show_manage_bot(query, bot, db)
+            await _show_manage_bot(query, bot, db, pm)
     except Exception as e:
         logger.error(f"خطأ في إيقاف البوت: {e}")
         await query.message.reply_text(f"❌ حدث خطأ: {str(e)[:50]}")
@@ -452,7 +477,7 @@ async def restart_bot_action(update: Update, context: ContextTypes.DEFAULT_TYPE,
         )
         
         if bot:
-            await _show_manage_bot(query, bot, db)
+            await _show_manage_bot(query, bot, db, pm)
     except Exception as e:
         logger.error(f"خطأ في إعادة تشغيل البوت: {e}")
         await query.message.reply_text(f"❌ حدث خطأ: {str(e)[:50]}")
@@ -559,7 +584,6 @@ async def add_time_action(update: Update, context: ContextTypes.DEFAULT_TYPE, db
         plan_config = PLANS.get(plan, PLANS['free'])
         
         current_total = bot[10]
-        current_remaining = bot[11]
         
         # حساب الوقت المضاف
         if time_value == "max":
@@ -574,14 +598,7 @@ async def add_time_action(update: Update, context: ContextTypes.DEFAULT_TYPE, db
             await query.answer("⚠️ سيتجاوز هذا حد الخطة", show_alert=True)
             return
         
-        new_remaining = current_remaining + seconds
-        
-        db.update_bot_resources(
-            bot_id,
-            total_seconds=new_total,
-            remaining_seconds=new_remaining,
-            warned_low=0
-        )
+        new_remaining = db.credit_bot_time(bot_id, seconds, 'manual')
         
         await query.message.reply_text(
             f"════════════════════════════\n"
@@ -630,11 +647,7 @@ async def recover_bot(update: Update, context: ContextTypes.DEFAULT_TYPE, db: Da
         
         # إضافة ساعتين
         recovery_time = 7200
-        db.update_bot_resources(
-            bot_id,
-            remaining_seconds=recovery_time,
-            total_seconds=recovery_time
-        )
+        db.reset_bot_time(bot_id, recovery_time, 'recovery')
         
         # إيقاظ البوت من السكون
         db.set_sleep_mode(bot_id, False)
@@ -663,7 +676,7 @@ async def recover_bot(update: Update, context: ContextTypes.DEFAULT_TYPE, db: Da
         # إعادة عرض واجهة إدارة البوت
         bot = db.get_bot(bot_id)
         if bot:
-            await _show_manage_bot(query, bot, db)
+            await _show_manage_bot(query, bot, db, pm)
         
     except Exception as e:
         logger.error(f"خطأ في استرجاع البوت: {e}")
@@ -1217,7 +1230,7 @@ async def delete_account_final(update: Update, context: ContextTypes.DEFAULT_TYP
     # إيقاف جميع بوتات المستخدم
     bots = db.get_user_bots(user_id)
     for bot in bots:
-        pm.stop_bot(bot[0])
+        await pm.stop_bot(bot[0])
     
     # حذف الحساب
     db.delete_user(user_id)
@@ -2,6 +2,7 @@
 # معالجات متقدمة - NeuroHost V8 Enhanced (البوتات والأدمن والترقيات)
 # ============================================================================
 
+import os
 import re
 import sys
 import time
@@ -11,6 +12,7 @@ import asyncio
 import zipfile
 import io
 from pathlib import Path
+from typing import Tuple
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputFile
 from telegram.ext import ContextTypes, ConversationHandler
 from config import (
@@ -22,6 +24,8 @@ from helpers import (
     get_current_time, render_bar, extract_token_from_code,
     validate_token, get_bot_id_from_callback, generate_unique_folder
 )
+from file_browser import listing_cache
+from zygote import without_agent_secrets
 
 logger = logging.getLogger(__name__)
 
@@ -110,6 +114,21 @@ async def deploy_zip_start(update: Update, context: ContextTypes.DEFAULT_TYPE, d
     context.user_data['bot_action'] = 'deploy_zip'
     return CONVERSATION_STATES['WAIT_FILE']
 
+async def _security_check(update: Update, context: ContextTypes.DEFAULT_TYPE, folder) -> Tuple[bool, str]:
+    """فحص أمان مجلد البوت بعد الرفع (BotSecurityManager المسجل في bot_data)
+
+    Returns:
+        (مسموح؟، تقرير HTML أو سبب الرفض)
+    """
+    security = context.bot_data.get('security')
+    if security is None:
+        return True, ""
+    allowed, warnings = await security.validate_bot_upload(update.effective_user.id, str(folder))
+    warnings = [safe_html_escape(w) for w in warnings]
+    if not allowed:
+        return False, "\n".join(warnings)
+    return True, security.format_security_report(warnings) if warnings else ""
+
 async def handle_bot_file(update: Update, context: ContextTypes.DEFAULT_TYPE, db, pm):
     """معالجة ملف البوت"""
     doc = update.message.document
@@ -174,6 +193,12 @@ async def handle_bot_py(update: Update, context: ContextTypes.DEFAULT_TYPE, doc,
         file_path = bot_path / doc.file_name
         await file.download_to_drive(str(file_path))
         
+        allowed, report = await _security_check(update, context, bot_path)
+        if not allowed:
+            await update.message.reply_text(f"🛡 <b>تم رفض الملف</b>\n\n{report}", parse_mode="HTML")
+            await asyncio.to_thread(shutil.rmtree, bot_path, True)
+            return ConversationHandler.END
+        
         # البحث عن التوكن
         token = None
         try:
@@ -207,7 +232,8 @@ async def handle_bot_py(update: Update, context: ContextTypes.DEFAULT_TYPE, doc,
                     f"🆔 المعرّف: <code>{bot_id}</code>\n"
                     f"📝 الاسم: <code>{safe_html_escape(doc.file_name)}</code>\n"
                     f"🔑 التوكن: <code>{token[:25]}...</code>\n\n"
-                    "💡 يمكنك الآن تشغيل البوت من قائمة 'بوتاتي'",
+                    "💡 يمكنك الآن تشغيل البوت من قائمة 'بوتاتي'"
+                    + (f"\n\n{report}" if report else ""),
                     parse_mode="HTML"
                 )
                 return ConversationHandler.END
@@ -229,7 +255,8 @@ async def handle_bot_py(update: Update, context: ContextTypes.DEFAULT_TYPE, doc,
                 "📎 أرسل توكن البوت:\n"
                 "<code>123456789:ABCDefGHIjkLmnoPQRsTuvWXYz</code>\n\n"
                 "💡 احصل على التوكن من @BotFather\n\n"
-                "❌ للإلغاء أرسل /cancel",
+                "❌ للإلغاء أرسل /cancel"
+                + (f"\n\n{report}" if report else ""),
                 parse_mode="HTML"
             )
             return CONVERSATION_STATES['WAIT_TOKEN']
@@ -257,11 +284,19 @@ async def handle_bot_zip(update: Update, context: ContextTypes.DEFAULT_TYPE, db,
         file = await context.bot.get_file(doc.file_id)
         file_bytes = await file.download_as_bytearray()
         
-        dest_path.mkdir(parents=True, exist_ok=True)
+        def _extract():
+            dest_path.mkdir(parents=True, exist_ok=True)
+            with zipfile.ZipFile(io.BytesIO(file_bytes), 'r') as zip_ref:
+                zip_ref.extractall(str(dest_path))
+
+        # فك الضغط في خيط منفصل حتى لا يحجب تحديثات المستخدمين الآخرين
+        await asyncio.to_thread(_extract)
         
-        zip_buffer = io.BytesIO(file_bytes)
-        with zipfile.ZipFile(zip_buffer, 'r') as zip_ref:
-            zip_ref.extractall(str(dest_path))
+        allowed, report = await _security_check(update, context, dest_path)
+        if not allowed:
+            await msg.edit_text(f"🛡 <b>تم رفض الأرشيف</b>\n\n{report}", parse_mode="HTML")
+            await asyncio.to_thread(shutil.rmtree, dest_path, True)
+            return ConversationHandler.END
         
         await msg.edit_text(
             "⏳ <b>جاري معالجة الملف...</b>\n\n"
@@ -315,6 +350,7 @@ async def handle_bot_zip(update: Update, context: ContextTypes.DEFAULT_TYPE, db,
                 process = await asyncio.create_subprocess_exec(
                     sys.executable, "-m", "pip", "install", "-q", "-r", str(req_file),
                     cwd=str(dest_path),
+                    env=without_agent_secrets(os.environ),
                     stdout=asyncio.subprocess.PIPE,
                     stderr=asyncio.subprocess.PIPE
                 )
@@ -349,6 +385,8 @@ async def handle_bot_zip(update: Update, context: ContextTypes.DEFAULT_TYPE, db,
                 result_text += f"📦 المتطلبات: {'✅ مثبّتة' if requirements_installed else '⚠️ فشل التثبيت'}\n"
 
             result_text += "\n🎉 البوت جاهز للتشغيل!"
+            if report:
+                result_text += f"\n\n{report}"
 
             await msg.edit_text(
                 result_text,
@@ -366,7 +404,7 @@ async def handle_bot_zip(update: Update, context: ContextTypes.DEFAULT_TYPE, db,
         else:
             await msg.edit_text("❌ فشل إضافة البوت. قد يكون التوكن مستخدماً.")
             if dest_path.exists():
-                shutil.rmtree(dest_path)
+                await asyncio.to_thread(shutil.rmtree, dest_path)
         
         return ConversationHandler.END
         
@@ -377,7 +415,7 @@ async def handle_bot_zip(update: Update, context: ContextTypes.DEFAULT_TYPE, db,
         logger.exception(f"خطأ في معالجة ZIP: {e}")
         await msg.edit_text(f"❌ خطأ: {str(e)[:50]}")
         if dest_path.exists():
-            shutil.rmtree(dest_path)
+            await asyncio.to_thread(shutil.rmtree, dest_path)
         return ConversationHandler.END
 
 async def handle_token(update: Update, context: ContextTypes.DEFAULT_TYPE, db):
@@ -468,12 +506,22 @@ async def handle_bot_file_upload(update: Update, context: ContextTypes.DEFAULT_T
         # تحميل الملف
         file = await context.bot.get_file(doc.file_id)
         await file.download_to_drive(str(file_path))
+        listing_cache.invalidate(file_path)
+        
+        allowed, report = await _security_check(update, context, bot_path)
+        if not allowed:
+            file_path.unlink(missing_ok=True)
+            listing_cache.invalidate(file_path)
+            await update.message.reply_text(f"🛡 <b>تم رفض الملف</b>\n\n{report}", parse_mode="HTML")
+            context.user_data.pop('upload_bot_id', None)
+            return ConversationHandler.END
         
         await update.message.reply_text(
             f"✅ <b>تم رفع الملف</b>\n"
             f"────────────────────────────\n\n"
             f"📄 الملف: <code>{safe_html_escape(doc.file_name)}</code>\n"
-            f"💾 الحجم: {get_file_size(file_path)}",
+            f"💾 الحجم: {get_file_size(file_path)}"
+            + (f"\n\n{report}" if report else ""),
             parse_mode="HTML"
         )
         
@@ -501,13 +549,30 @@ async def handle_bot_file_replace(update: Update, context: ContextTypes.DEFAULT_
         new_file_path = bot_path / doc.file_name
         
         # إنشاء نسخة احتياطية
+        backup_path = bot_path / f"{old_main_file}.backup"
         if old_file_path.exists():
-            backup_path = bot_path / f"{old_main_file}.backup"
             shutil.copy2(old_file_path, backup_path)
         
+        # نسخة من الملف الذي سيُكتب فوقه (إن كان غير الرئيسي) لاسترجاعه عند الرفض
+        overwritten = new_file_path.read_bytes() if new_file_path.exists() and new_file_path != old_file_path else None
+        
         # تحميل الملف الجديد
         file = await context.bot.get_file(doc.file_id)
         await file.download_to_drive(str(new_file_path))
+        listing_cache.invalidate(new_file_path)
+        
+        allowed, report = await _security_check(update, context, bot_path)
+        if not allowed:
+            if new_file_path == old_file_path and backup_path.exists():
+                shutil.copy2(backup_path, old_file_path)
+            elif overwritten is not None:
+                new_file_path.write_bytes(overwritten)
+            else:
+                new_file_path.unlink(missing_ok=True)
+            listing_cache.invalidate(new_file_path)
+            await update.message.reply_text(f"🛡 <b>تم رفض الملف</b>\n\n{report}", parse_mode="HTML")
+            context.user_data.pop('replace_bot_id', None)
+            return ConversationHandler.END
         
         # تحديث قاعدة البيانات
         db.update_bot_status(bot_id, "stopped", None)
@@ -525,7 +590,8 @@ async def handle_bot_file_replace(update: Update, context: ContextTypes.DEFAULT_
             f"📄 الملف الجديد: <code>{safe_html_escape(doc.file_name)}</code>\n"
             f"📄 الملف القديم: <code>{safe_html_escape(old_main_file)}</code>\n"
             f"💾 نسخة احتياطية: <code>{old_main_file}.backup</code>\n\n"
-            f"⚠️ تم إيقاف البوت - ابدأه مرة أخرى",
+            f"⚠️ تم إيقاف البوت - ابدأه مرة أخرى"
+            + (f"\n\n{report}" if report else ""),
             parse_mode="HTML"
         )
         
@@ -611,13 +677,14 @@ async def delete_bot_action(update: Update, context: ContextTypes.DEFAULT_TYPE,
         bot_name = bot[3]
         
         # إيقاف البوت إذا كان يعمل
-        pm.stop_bot(bot_id)
+        await pm.stop_bot(bot_id)
         
         # حذف ملفات البوت
         bot_path = Path(BOTS_DIRECTORY) / bot[5]
         try:
             if bot_path.exists():
-                shutil.rmtree(bot_path)
+                await asyncio.to_thread(shutil.rmtree, bot_path)
+            listing_cache.invalidate_tree(bot_path)
         except Exception as e:
             logger.warning(f"فشل حذف مجلد البوت: {e}")
         
@@ -966,7 +1033,7 @@ async def sys_status(update: Update, context: ContextTypes.DEFAULT_TYPE, db):
         
         try:
             import psutil
-            cpu = psutil.cpu_percent(interval=0.5)
+            cpu = await asyncio.to_thread(psutil.cpu_percent, 0.5)
             mem = psutil.virtual_memory().percent
             disk = psutil.disk_usage('/').percent
             mem_total = psutil.virtual_memory().total / (1024**3)
@@ -1029,6 +1096,114 @@ async def sys_status(update: Update, context: ContextTypes.DEFAULT_TYPE, db):
         logger.error(f"خطأ في عرض حالة النظام: {e}")
         await query.answer("❌ حدث خطأ", show_alert=True)
 
+def _fmt_seconds(value):
+    """زمن مقروء من قيمة بالثواني (أو — إذا لا توجد قياسات)"""
+    if value is None:
+        return "—"
+    return f"{value * 1000:.0f}ms" if value < 1 else f"{value:.1f}s"
+
+
+def _histogram_rows(histogram, order_by, limit=5):
+    """[(التسمية، العدد، p50، p95، المجموع)] مرتبة تنازلياً حسب order_by ('p95' أو 'total')"""
+    rows = []
+    for key, (_, total, count) in histogram.series().items():
+        rows.append((
+            "/".join(key) or "—", count,
+            histogram.quantile(0.5, key), histogram.quantile(0.95, key), total
+        ))
+    index = 3 if order_by == 'p95' else 4
+    return sorted(rows, key=lambda row: row[index] or 0, reverse=True)[:limit]
+
+
+async def admin_metrics(update: Update, context: ContextTypes.DEFAULT_TYPE, db):
+    """ملخص المقاييس الحية (نفس بيانات /metrics)"""
+    query = update.callback_query
+    await query.answer()
+
+    if update.effective_user.id != ADMIN_ID:
+        await query.answer("⛔ صلاحيات الأدمن مطلوبة", show_alert=True)
+        return
+
+    from metrics import (
+        handler_seconds, handler_timeouts_total, loop_stalls_total,
+        updates_in_flight, updates_waiting, db_query_seconds, monitor_tick_seconds,
+        bots, bot_crashes_total, bot_restarts_total, pip_install_seconds, backup_seconds,
+        telegram_api_seconds, telegram_api_errors_total, telegram_api_rate_limited_total
+    )
+
+    try:
+        bot_counts = {key[0]: value for key, value in bots.items()}
+        restarts = {key[0]: int(value) for key, value in bot_restarts_total.items()}
+        in_flight = sum(value for _, value in updates_in_flight.items())
+        waiting = sum(value for _, value in updates_waiting.items())
+
+        text = (
+            f"════════════════════════════\n"
+            f"📈 <b>مقاييس الأداء</b>\n"
+            f"════════════════════════════\n\n"
+            f"📨 <b>التحديثات:</b> قيد المعالجة {in_flight:.0f} | بالانتظار {waiting:.0f}\n"
+            f"   ⏱ تجاوز المهلة: {handler_timeouts_total.total():.0f} | 🐢 توقف الحلقة: {loop_stalls_total.total():.0f}\n\n"
+            f"🤖 <b>البوتات:</b> 🟢 {bot_counts.get('running', 0)} | 😴 {bot_counts.get('hibernated', 0)} | "
+            f"🌐 {bot_counts.get('remote', 0)} | 📋 {bot_counts.get('queued', 0)}\n"
+            f"   💥 أعطال: {bot_crashes_total.total():.0f} | ♻️ إعادة تشغيل: "
+            f"{restarts.get('auto', 0)} تلقائي، {restarts.get('manual', 0)} يدوي، {restarts.get('watch', 0)} مراقبة\n\n"
+        )
+
+        rows = _histogram_rows(handler_seconds, 'p95')
+        if rows:
+            text += "⚡ <b>أبطأ المعالجات (p50 / p95):</b>\n"
+            for label, count, p50, p95, _ in rows:
+                text += f"   <code>{safe_html_escape(label)}</code> ×{count}: {_fmt_seconds(p50)} / {_fmt_seconds(p95)}\n"
+            text += "\n"
+
+        rows = _histogram_rows(db_query_seconds, 'total')
+        if rows:
+            text += "🗄 <b>قاعدة البيانات (الأكثر وقتاً):</b>\n"
+            for label, count, _, p95, total in rows:
+                text += f"   <code>{safe_html_escape(label)}</code> ×{count}: {_fmt_seconds(total)} (p95 {_fmt_seconds(p95)})\n"
+            text += "\n"
+
+        text += "🔁 <b>دورات المراقبة (p95):</b> "
+        text += " | ".join(
+            f"{label} {_fmt_seconds(p95)}" for label, _, _, p95, _ in _histogram_rows(monitor_tick_seconds, 'p95')
+        ) or "—"
+        text += "\n"
+
+        for title, histogram in (("📦 pip", pip_install_seconds), ("💾 النسخ", backup_seconds)):
+            rows = _histogram_rows(histogram, 'total')
+            text += f"{title}: " + (" | ".join(
+                f"{label} ×{count} (p50 {_fmt_seconds(p50)})" for label, count, p50, _, _ in rows
+            ) or "—") + "\n"
+
+        api_calls = sum(count for _, (_, _, count) in telegram_api_seconds.series().items())
+        text += (
+            f"\n📡 <b>Telegram API:</b> {api_calls} طلب | ❌ أخطاء {telegram_api_errors_total.total():.0f} | "
+            f"🚦 429: {telegram_api_rate_limited_total.total():.0f}\n"
+        )
+        rows = _histogram_rows(telegram_api_seconds, 'p95', limit=3)
+        for label, count, _, p95, _ in rows:
+            text += f"   <code>{safe_html_escape(label)}</code> ×{count}: p95 {_fmt_seconds(p95)}\n"
+
+        text += f"\n🕐 آخر تحديث: {get_current_time()[:19]}"
+
+        keyboard = [
+            [
+                InlineKeyboardButton("🔄 تحديث", callback_data="admin_metrics"),
+                InlineKeyboardButton("📊 حالة النظام", callback_data="sys_status")
+            ],
+            [InlineKeyboardButton("🔙 رجوع", callback_data="admin_panel")]
+        ]
+
+        await query.edit_message_text(
+            text,
+            reply_markup=InlineKeyboardMarkup(keyboard),
+            parse_mode="HTML"
+        )
+
+    except Exception as e:
+        logger.error(f"خطأ في عرض المقاييس: {e}")
+        await query.answer("❌ حدث خطأ", show_alert=True)
+
 async def admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE, db):
     """لوحة تحكم الأدمن المحسّنة"""
     query = update.callback_query
@@ -1078,7 +1253,10 @@ async def admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE, db):
             InlineKeyboardButton(f"⏳ المعلقون{notif_pending}", callback_data="admin_pending"),
             InlineKeyboardButton("🚫 المحظورون", callback_data="admin_blocked")
         ],
-        [InlineKeyboardButton("🛡️ الإشراف والإدارة", callback_data="admin_moderation_panel")],
+        [
+            InlineKeyboardButton("📈 المقاييس", callback_data="admin_metrics"),
+            InlineKeyboardButton("🛡️ الإشراف والإدارة", callback_data="admin_moderation_panel")
+        ],
         [InlineKeyboardButton("⚙️ الإعدادات المتقدمة", callback_data="admin_settings_panel")],
         [
             InlineKeyboardButton("🎮 عمليات جماعية", callback_data="bulk_bot_operations"),
@@ -1350,14 +1528,17 @@ async def bot_backup(update: Update, context: ContextTypes.DEFAULT_TYPE, db):
             return
         
         # إنشاء ملف ZIP
-        zip_buffer = io.BytesIO()
-        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-            for file_path in bot_path.rglob('*'):
-                if file_path.is_file() and not file_path.name.startswith('.'):
-                    arcname = file_path.relative_to(bot_path)
-                    zip_file.write(file_path, arcname)
-        
-        zip_buffer.seek(0)
+        def _build_zip():
+            zip_buffer = io.BytesIO()
+            with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+                for file_path in bot_path.rglob('*'):
+                    if file_path.is_file() and not file_path.name.startswith('.'):
+                        arcname = file_path.relative_to(bot_path)
+                        zip_file.write(file_path, arcname)
+            zip_buffer.seek(0)
+            return zip_buffer
+
+        zip_buffer = await asyncio.to_thread(_build_zip)
         
         # إرسال الملف
         zip_name = f"{bot[3]}_backup_{int(time.time())}.zip"
@@ -1399,6 +1580,7 @@ async def bot_settings(update: Update, context: ContextTypes.DEFAULT_TYPE, db):
         auto_start = bot[28] if len(bot) > 28 else 0
         priority = bot[29] if len(bot) > 29 else 1
         description = bot[27] if len(bot) > 27 else ''
+        watch_mode = bot[30] if len(bot) > 30 else 0
         priority_text = {1: "🔵 عادي", 2: "🟡 متوسط", 3: "🔴 عالي"}.get(priority, "🔵 عادي")
         
         text = (
@@ -1409,6 +1591,7 @@ async def bot_settings(update: Update, context: ContextTypes.DEFAULT_TYPE, db):
             f"📄 الملف الرئيسي: <code>{bot[6]}</code>\n"
             f"{'─'*28}\n"
             f"🔄 الاسترجاع التلقائي: {'✅ مفعّل' if auto_start else '❌ معطّل'}\n"
+            f"👁️ وضع المراقبة: {'✅ مفعّل' if watch_mode else '❌ معطّل'}\n"
             f"⚡ الأولوية: {priority_text}\n"
             f"📝 الوصف: {safe_html_escape(description[:40]) if description else '<i>لا يوجد</i>'}\n"
         )
@@ -1420,6 +1603,10 @@ async def bot_settings(update: Update, context: ContextTypes.DEFAULT_TYPE, db):
                 f"{'✅' if auto_start else '❌'} الاسترجاع التلقائي",
                 callback_data=f"toggle_auto_recovery_{bot_id}"
             )],
+            [InlineKeyboardButton(
+                f"{'✅' if watch_mode else '❌'} وضع المراقبة (إعادة تحميل تلقائي)",
+                callback_data=f"toggle_watch_{bot_id}"
+            )],
             [InlineKeyboardButton("⚡ الأولوية", callback_data=f"set_priority_{bot_id}"),
              InlineKeyboardButton("📝 الوصف", callback_data=f"edit_description_{bot_id}")],
             [InlineKeyboardButton("⚙️ إعدادات متقدمة", callback_data=f"bot_settings_advanced_{bot_id}")],
@@ -1778,7 +1965,7 @@ async def restore_from_backup(update: Update, context: ContextTypes.DEFAULT_TYPE
 
     latest = backups[0]
     from pathlib import Path
-    import zipfile
+    from backup_system import BackupSystem
 
     file_path = Path(latest[2]) if latest[2] else None
     if not file_path or not file_path.exists():
@@ -1789,10 +1976,15 @@ async def restore_from_backup(update: Update, context: ContextTypes.DEFAULT_TYPE
         bot = db.get_bot(bot_id)
         if not bot:
             return
-        bot_path = Path(BOTS_DIRECTORY) / bot[5]
 
-        with zipfile.ZipFile(str(file_path), 'r') as zf:
-            zf.extractall(str(bot_path.parent))
+        # استعادة مجلد هذا البوت فقط (استخراج مرحلي ثم تبديل ذري)
+        ok, result_msg = await BackupSystem.restore_from_file(
+            str(file_path), BOTS_DIRECTORY, DATABASE_FILE,
+            scope="bot", bot_folder=bot[5],
+            pm=context.bot_data.get('pm'), application=context.application
+        )
+        if not ok:
+            raise RuntimeError(result_msg)
 
         db.add_event_log(bot_id, "INFO", f"↩️ تم استرجاع نسخة احتياطية")
         await query.edit_message_text(
@@ -1800,7 +1992,7 @@ async def restore_from_backup(update: Update, context: ContextTypes.DEFAULT_TYPE
             f"✅ <b>تم الاسترجاع بنجاح!</b>\n"
             f"════════════════════════════\n\n"
             f"📅 تم استرجاع نسخة: {str(latest[4])[:16]}\n\n"
-            f"⚠️ أعد تشغيل البوت لتطبيق التغييرات",
+            f"{result_msg}",
             parse_mode="HTML",
             reply_markup=InlineKeyboardMarkup([
                 [InlineKeyboardButton("▶️ تشغيل البوت", callback_data=f"start_{bot_id}")],
@@ -3,17 +3,20 @@
 # ============================================================================
 
 import io
+import asyncio
 import zipfile
-import shutil
+import fnmatch
 import logging
 from pathlib import Path
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputFile
 from telegram.ext import ContextTypes, ConversationHandler
 from config import BOTS_DIRECTORY, MAX_FILE_UPLOAD_SIZE_MB, MAX_EDIT_FILE_SIZE_MB, CONVERSATION_STATES
 from helpers import (
-    safe_html_escape, get_file_size, get_file_icon, 
+    safe_html_escape, get_file_size, get_file_icon, format_size,
     is_safe_path, get_bot_id_from_callback
 )
+from file_browser import listing_cache, path_handles, line_indexes
+from file_editor import file_editor, file_etag
 
 logger = logging.getLogger(__name__)
 
@@ -21,17 +24,219 @@ logger = logging.getLogger(__name__)
 # مدير الملفات الرئيسي
 # ============================================================================
 
+# عدد العناصر في كل صفحة
+FILES_PAGE_SIZE = 10
+
+# مفاتيح الترتيب: الاسم، الحجم، وقت التعديل
+SORT_KEYS = {
+    'n': ('🔤 الاسم', lambda e: e.name.lower()),
+    's': ('📏 الحجم', lambda e: e.size),
+    'm': ('🕐 التعديل', lambda e: e.mtime),
+}
+
+
+def _dir_callback(user_id, bot_id, sub_path, page=0):
+    """callback لفتح مجلد (بمقبض قصير بدل المسار الكامل)"""
+    handle = path_handles.issue(user_id, bot_id, sub_path)
+    return f"fm_{handle}_{page}"
+
+
+def _file_callback(prefix, user_id, bot_id, rel_path):
+    """callback لإجراء على ملف: {prefix}_{bot_id}_#{handle}"""
+    return f"{prefix}_{bot_id}_#{path_handles.issue(user_id, bot_id, rel_path)}"
+
+
+def _resolve_file_arg(user_id, bot_id, arg):
+    """تحويل وسيط الملف في callback (#مقبض أو مسار قديم بـ |) إلى مسار نسبي"""
+    if arg.startswith('#'):
+        try:
+            entry = path_handles.resolve(user_id, int(arg[1:]))
+        except ValueError:
+            return None
+        if not entry or entry[0] != bot_id:
+            return None
+        return entry[1]
+    return arg.replace("|", "/")
+
+
+def _parent_callback(user_id, bot_id, rel_path):
+    """callback للعودة إلى المجلد الذي يحتوي الملف"""
+    parent = "/".join(rel_path.split("/")[:-1])
+    return _dir_callback(user_id, bot_id, parent) if parent else f"files_{bot_id}"
+
+
+def _build_file_manager(context, user_id, bot, sub_path, page=0):
+    """بناء نص ولوحة مدير الملفات لمجلد وصفحة محددين
+
+    Returns:
+        (النص، لوحة الأزرار) أو (None, None) إذا كان المجلد غير موجود
+    """
+    bot_id = bot[0]
+    bot_path = Path(BOTS_DIRECTORY) / bot[5]
+    if not bot_path.exists():
+        return None, None
+
+    bot_root = bot_path.resolve()
+    current_path = (bot_root / sub_path).resolve() if sub_path else bot_root
+
+    # التحقق الأمني: لا نخرج من مجلد البوت
+    if not str(current_path).startswith(str(bot_root)):
+        current_path = bot_root
+        sub_path = ""
+
+    # جمع الملفات والمجلدات (من ذاكرة القوائم)
+    try:
+        listing = listing_cache.get(current_path)
+        dirs, files, total_size = listing.dirs, listing.files, listing.total_size
+    except Exception as e:
+        logger.error(f"خطأ قراءة مجلد: {e}")
+        dirs, files, total_size = [], [], 0
+    dir_count, file_count = len(dirs), len(files)
+
+    # التصفية حسب الاسم (خاصة بهذا المجلد)
+    name_filter = ""
+    fm_filter = context.user_data.get('fm_filter')
+    if fm_filter and fm_filter.get('bot_id') == bot_id and fm_filter.get('path') == sub_path:
+        name_filter = fm_filter.get('text', "")
+    if name_filter:
+        needle = name_filter.lower()
+        if any(ch in needle for ch in "*?["):
+            dirs = [e for e in dirs if fnmatch.fnmatch(e.name.lower(), needle)]
+            files = [e for e in files if fnmatch.fnmatch(e.name.lower(), needle)]
+        else:
+            dirs = [e for e in dirs if needle in e.name.lower()]
+            files = [e for e in files if needle in e.name.lower()]
+
+    # الترتيب (المجلدات دائماً بالاسم وقبل الملفات)
+    sort_key, sort_desc = context.user_data.get('fm_sort', ('n', False))
+    if sort_key != 'n' or sort_desc:
+        files = sorted(files, key=SORT_KEYS[sort_key][1], reverse=sort_desc)
+
+    entries = list(dirs) + list(files)
+    total_pages = max(1, (len(entries) + FILES_PAGE_SIZE - 1) // FILES_PAGE_SIZE)
+    page = min(max(page, 0), total_pages - 1)
+    page_entries = entries[page * FILES_PAGE_SIZE:(page + 1) * FILES_PAGE_SIZE]
+
+    dir_handle = path_handles.issue(user_id, bot_id, sub_path)
+    display_path = f"/{sub_path}" if sub_path else "/"
+
+    text = (
+        f"════════════════════════════\n"
+        f"📁 <b>مدير الملفات</b>\n"
+        f"════════════════════════════\n\n"
+        f"🤖 <b>{safe_html_escape(bot[3])}</b>\n"
+        f"📂 المسار: <code>{safe_html_escape(display_path)}</code>\n"
+        f"📊 {file_count} ملف | {dir_count} مجلد | {format_size(total_size)}\n"
+    )
+    if name_filter:
+        text += f"🔍 التصفية: <code>{safe_html_escape(name_filter)}</code> ({len(entries)} نتيجة)\n"
+    text += f"{'─'*28}\n\n"
+
+    keyboard = []
+
+    # زر العودة للمجلد الأعلى
+    if sub_path:
+        keyboard.append([InlineKeyboardButton(
+            "⬆️ رجوع للمجلد الأعلى", callback_data=_parent_callback(user_id, bot_id, sub_path)
+        )])
+
+    for entry in page_entries:
+        rel = f"{sub_path}/{entry.name}" if sub_path else entry.name
+        if entry.is_dir:
+            text += f"📁 <b>{safe_html_escape(entry.name)}/</b>\n"
+            keyboard.append([InlineKeyboardButton(
+                f"📂 {entry.name}", callback_data=_dir_callback(user_id, bot_id, rel)
+            )])
+        else:
+            icon = get_file_icon(entry.name)
+            text += f"{icon} <code>{safe_html_escape(entry.name)}</code>  <i>{format_size(entry.size)}</i>\n"
+            short = entry.name[:10] + "…" if len(entry.name) > 12 else entry.name
+            keyboard.append([
+                InlineKeyboardButton(f"👁️ {short}", callback_data=_file_callback("viewfile", user_id, bot_id, rel)),
+                InlineKeyboardButton("✏️", callback_data=_file_callback("editfile", user_id, bot_id, rel)),
+                InlineKeyboardButton("📥", callback_data=_file_callback("downloadfile", user_id, bot_id, rel)),
+                InlineKeyboardButton("🗑️", callback_data=_file_callback("deletefile", user_id, bot_id, rel)),
+            ])
+
+    if not entries:
+        text += "🔍 <i>لا توجد نتائج</i>" if name_filter else "📭 <i>المجلد فارغ</i>"
+
+    # التنقل بين الصفحات
+    if total_pages > 1:
+        nav = []
+        if page > 0:
+            nav.append(InlineKeyboardButton("◀️", callback_data=f"fm_{dir_handle}_{page - 1}"))
+        nav.append(InlineKeyboardButton(f"📄 {page + 1}/{total_pages}", callback_data=f"fm_{dir_handle}_{page}"))
+        if page < total_pages - 1:
+            nav.append(InlineKeyboardButton("▶️", callback_data=f"fm_{dir_handle}_{page + 1}"))
+        keyboard.append(nav)
+
+    # الترتيب والتصفية
+    sort_row = []
+    for key, (label, _) in SORT_KEYS.items():
+        if key == sort_key:
+            label = f"{'⬇️' if sort_desc else '⬆️'} {label.split(' ', 1)[1]}"
+        sort_row.append(InlineKeyboardButton(label, callback_data=f"fmsort_{dir_handle}_{key}"))
+    keyboard.append(sort_row)
+    if name_filter:
+        keyboard.append([InlineKeyboardButton("❌ إلغاء التصفية", callback_data=f"fmclr_{dir_handle}")])
+    else:
+        keyboard.append([InlineKeyboardButton("🔍 تصفية بالاسم", callback_data=f"fmfind_{dir_handle}")])
+
+    # أزرار التحكم
+    keyboard.append([
+        InlineKeyboardButton("📤 رفع ملف", callback_data=f"upload_file_{bot_id}"),
+        InlineKeyboardButton("📥 تحميل الكل", callback_data=f"download_all_{bot_id}")
+    ])
+    keyboard.append([
+        InlineKeyboardButton("🔄 تحديث", callback_data=f"fm_{dir_handle}_{page}"),
+        InlineKeyboardButton("🔙 رجوع", callback_data=f"manage_{bot_id}")
+    ])
+
+    return text, InlineKeyboardMarkup(keyboard)
+
+
+async def _show_file_manager(update, context, bot, sub_path, page=0):
+    """عرض مدير الملفات بتعديل الرسالة الحالية"""
+    query = update.callback_query
+    text, markup = _build_file_manager(context, update.effective_user.id, bot, sub_path, page)
+    if text is None:
+        await query.edit_message_text(
+            "════════════════════════════\n❌ <b>مجلد البوت غير موجود</b>\n════════════════════════════",
+            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 رجوع", callback_data=f"manage_{bot[0]}")]]),
+            parse_mode="HTML"
+        )
+        return
+    await query.edit_message_text(text, reply_markup=markup, parse_mode="HTML")
+
+
+def _resolve_dir_handle(update, handle_str):
+    """مقبض مجلد من callback ← (bot_id، المسار النسبي) أو None"""
+    try:
+        return path_handles.resolve(update.effective_user.id, int(handle_str))
+    except ValueError:
+        return None
+
+
 async def file_manager(update: Update, context: ContextTypes.DEFAULT_TYPE, db):
-    """مدير الملفات المحسّن مع دعم التنقل بين المجلدات"""
+    """مدير الملفات مع صفحات وترتيب وتصفية ومقابض قصيرة للمسارات"""
     query = update.callback_query
     await query.answer()
     
     try:
-        # دعم التنقل: files_ID أو browse_ID_subpath
+        # files_ID | fm_HANDLE_PAGE | browse_ID_subpath (الصيغة القديمة)
         data = query.data
         sub_path = ""
-        if data.startswith("browse_"):
-            # format: browse_{bot_id}_{encoded_subpath}
+        page = 0
+        if data.startswith("fm_"):
+            _, handle_str, page_str = data.split("_", 2)
+            entry = _resolve_dir_handle(update, handle_str)
+            if not entry:
+                await query.answer("⌛ انتهت صلاحية الجلسة، افتح مدير الملفات مجدداً", show_alert=True)
+                return
+            bot_id, sub_path = entry
+            page = int(page_str)
+        elif data.startswith("browse_"):
             parts = data.split("_", 2)
             bot_id = int(parts[1])
             sub_path = parts[2].replace("|", "/") if len(parts) > 2 else ""
@@ -50,125 +255,262 @@ async def file_manager(update: Update, context: ContextTypes.DEFAULT_TYPE, db):
             )
             return
         
-        bot_path = Path(BOTS_DIRECTORY) / bot[5]
-        current_path = (bot_path / sub_path).resolve() if sub_path else bot_path.resolve()
-        
-        # التحقق الأمني: لا نخرج من مجلد البوت
-        if not str(current_path).startswith(str(bot_path.resolve())):
-            current_path = bot_path.resolve()
-            sub_path = ""
-        
-        if not bot_path.exists():
-            await query.edit_message_text(
-                "════════════════════════════\n❌ <b>مجلد البوت غير موجود</b>\n════════════════════════════",
-                reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 رجوع", callback_data=f"manage_{bot_id}")]]),
-                parse_mode="HTML"
-            )
-            return
-        
-        # جمع الملفات والمجلدات
-        dirs = []
-        files = []
-        total_size = 0
-        
-        try:
-            for item in sorted(current_path.iterdir()):
-                if item.name.startswith('.') or item.name == '__pycache__':
-                    continue
-                if item.is_dir():
-                    dirs.append(item.name)
-                else:
-                    size_bytes = item.stat().st_size
-                    total_size += size_bytes
-                    files.append((item.name, get_file_size(item), size_bytes))
-        except Exception as e:
-            logger.error(f"خطأ قراءة مجلد: {e}")
-        
-        # تحديد مسار العرض
-        display_path = f"/{sub_path}" if sub_path else "/"
-        
-        if total_size < 1024:
-            size_str = f"{total_size} B"
-        elif total_size < 1024*1024:
-            size_str = f"{total_size/1024:.1f} KB"
-        else:
-            size_str = f"{total_size/(1024*1024):.1f} MB"
-        
-        text = (
-            f"════════════════════════════\n"
-            f"════════════════════════════\n"
-        f"📁 <b>مدير الملفات</b>\n"
-        f"════════════════════════════\n\n"
-            f"🤖 <b>{safe_html_escape(bot[3])}</b>\n"
-            f"📂 المسار: <code>{display_path}</code>\n"
-            f"📊 {len(files)} ملف | {len(dirs)} مجلد | {size_str}\n"
-            f"{'─'*28}\n\n"
-        )
-        
-        keyboard = []
-        
-        # زر العودة للمجلد الأعلى
-        if sub_path:
-            parent = "/".join(sub_path.split("/")[:-1])
-            if parent:
-                parent_cb = f"browse_{bot_id}_{parent.replace('/', '|')}"
-            else:
-                parent_cb = f"files_{bot_id}"
-            keyboard.append([InlineKeyboardButton("⬆️ رجوع للمجلد الأعلى", callback_data=parent_cb)])
-        
-        # عرض المجلدات أولاً
-        for dname in dirs[:8]:
-            enc = (sub_path + "/" + dname if sub_path else dname).replace("/", "|")
-            text += f"📁 <b>{safe_html_escape(dname)}/</b>\n"
-            keyboard.append([InlineKeyboardButton(f"📂 {dname}", callback_data=f"browse_{bot_id}_{enc}")])
-        
-        # عرض الملفات
-        for fname, fsize, _ in files[:12]:
-            icon = get_file_icon(fname)
-            text += f"{icon} <code>{safe_html_escape(fname)}</code>  <i>{fsize}</i>\n"
-            # ترميز اسم الملف مع المسار الفرعي
-            full_rel = (sub_path + "/" + fname if sub_path else fname)
-            encoded = full_rel.replace("/", "|")
-            short = fname[:10] + "…" if len(fname) > 12 else fname
-            keyboard.append([
-                InlineKeyboardButton(f"👁️ {short}", callback_data=f"viewfile_{bot_id}_{encoded}"),
-                InlineKeyboardButton("✏️", callback_data=f"editfile_{bot_id}_{encoded}"),
-                InlineKeyboardButton("📥", callback_data=f"downloadfile_{bot_id}_{encoded}"),
-                InlineKeyboardButton("🗑️", callback_data=f"deletefile_{bot_id}_{encoded}"),
-            ])
-        
-        extra = (len(dirs) - 8) + (len(files) - 12)
-        if extra > 0:
-            text += f"\n<i>... و {extra} عنصر إضافي</i>"
-        
-        if not dirs and not files:
-            text += "📭 <i>المجلد فارغ</i>"
-        
-        # أزرار التحكم
-        keyboard.append([
-            InlineKeyboardButton("📤 رفع ملف", callback_data=f"upload_file_{bot_id}"),
-            InlineKeyboardButton("📥 تحميل الكل", callback_data=f"download_all_{bot_id}")
-        ])
-        keyboard.append([
-            InlineKeyboardButton("🔄 تحديث", callback_data=f"files_{bot_id}"),
-            InlineKeyboardButton("🔙 رجوع", callback_data=f"manage_{bot_id}")
-        ])
-        
-        await query.edit_message_text(
-            text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode="HTML"
-        )
+        await _show_file_manager(update, context, bot, sub_path, page)
         
     except Exception as e:
         logger.error(f"خطأ في مدير الملفات: {e}")
         await query.answer("❌ حدث خطأ", show_alert=True)
 
+
+async def file_manager_sort(update: Update, context: ContextTypes.DEFAULT_TYPE, db):
+    """تغيير ترتيب الملفات (الضغط على نفس المفتاح يعكس الاتجاه)"""
+    query = update.callback_query
+    await query.answer()
+
+    _, handle_str, key = query.data.split("_", 2)
+    entry = _resolve_dir_handle(update, handle_str)
+    if not entry or key not in SORT_KEYS:
+        await query.answer("⌛ انتهت صلاحية الجلسة، افتح مدير الملفات مجدداً", show_alert=True)
+        return
+
+    current_key, current_desc = context.user_data.get('fm_sort', ('n', False))
+    desc = (not current_desc) if key == current_key else (key != 'n')
+    context.user_data['fm_sort'] = (key, desc)
+
+    bot = db.get_bot(entry[0])
+    if bot:
+        await _show_file_manager(update, context, bot, entry[1])
+
+
+async def file_manager_clear_filter(update: Update, context: ContextTypes.DEFAULT_TYPE, db):
+    """إلغاء تصفية الملفات"""
+    query = update.callback_query
+    await query.answer()
+
+    entry = _resolve_dir_handle(update, query.data.replace("fmclr_", ""))
+    context.user_data.pop('fm_filter', None)
+    if not entry:
+        await query.answer("⌛ انتهت صلاحية الجلسة، افتح مدير الملفات مجدداً", show_alert=True)
+        return
+
+    bot = db.get_bot(entry[0])
+    if bot:
+        await _show_file_manager(update, context, bot, entry[1])
+
+
+async def file_manager_filter_start(update: Update, context: ContextTypes.DEFAULT_TYPE, db):
+    """طلب نص التصفية"""
+    query = update.callback_query
+    await query.answer()
+
+    entry = _resolve_dir_handle(update, query.data.replace("fmfind_", ""))
+    if not entry:
+        await query.answer("⌛ انتهت صلاحية الجلسة، افتح مدير الملفات مجدداً", show_alert=True)
+        return ConversationHandler.END
+
+    context.user_data['fm_filter_target'] = entry
+    await query.message.reply_text(
+        "🔍 <b>تصفية الملفات</b>\n"
+        "────────────────────────────\n\n"
+        "أرسل جزءاً من اسم الملف أو نمطاً مثل <code>*.py</code>\n\n"
+        "❌ للإلغاء أرسل /cancel",
+        parse_mode="HTML"
+    )
+    return CONVERSATION_STATES['WAIT_FILE_FILTER']
+
+
+async def file_manager_filter_apply(update: Update, context: ContextTypes.DEFAULT_TYPE, db):
+    """تطبيق التصفية وعرض النتائج في رسالة جديدة"""
+    entry = context.user_data.pop('fm_filter_target', None)
+    if not entry:
+        return ConversationHandler.END
+
+    bot_id, sub_path = entry
+    bot = db.get_bot(bot_id)
+    if not bot:
+        await update.message.reply_text("❌ البوت غير موجود")
+        return ConversationHandler.END
+
+    context.user_data['fm_filter'] = {
+        'bot_id': bot_id, 'path': sub_path, 'text': update.message.text.strip()[:50]
+    }
+    text, markup = _build_file_manager(context, update.effective_user.id, bot, sub_path)
+    if text is None:
+        await update.message.reply_text("❌ مجلد البوت غير موجود")
+    else:
+        await update.message.reply_text(text, reply_markup=markup, parse_mode="HTML")
+    return ConversationHandler.END
+
 # ============================================================================
 # عرض الملفات
 # ============================================================================
 
 
+# عدد السطور في كل صفحة من عارض الملفات
+VIEW_PAGE_LINES = 40
+
+# أقصى عدد أحرف لمحتوى الصفحة (حد رسالة تيليجرام 4096)
+VIEW_PAGE_CHARS = 3200
+
+
+def _is_binary_file(file_path):
+    """فحص سريع: وجود بايت صفري في أول 8KB يعني ملفاً ثنائياً"""
+    with open(file_path, 'rb') as f:
+        return b'\0' in f.read(8192)
+
+
+def _load_file_page(file_path, start, highlight=None):
+    """قراءة صفحة من الملف عبر فهرس السطور (تُنفّذ في خيط منفصل)
+
+    Args:
+        start: رقم أول سطر (0-based) أو -1 لنهاية الملف
+
+    Returns:
+        (الفهرس، السطور المعروضة، رقم أول سطر)
+    """
+    index = line_indexes.get(file_path)
+    if start < 0:
+        start = max(0, index.line_count - VIEW_PAGE_LINES)
+    elif highlight is not None:
+        # إظهار سطرين من السياق قبل السطر المطابق
+        start = max(0, highlight - 2)
+    start = min(start, max(0, index.line_count - 1))
+    return index, index.read_lines(start, VIEW_PAGE_LINES), start
+
+
+async def _build_file_view(context, user_id, bot, filename, start=0, highlight=None, revisions=0):
+    """بناء نص ولوحة عارض الملفات لصفحة محددة
+
+    Returns:
+        (النص، لوحة الأزرار) أو (رسالة الخطأ، لوحة الرجوع)
+    """
+    bot_id = bot[0]
+    bot_path = Path(BOTS_DIRECTORY) / bot[5]
+    file_path = bot_path / filename
+    back_cb = _parent_callback(user_id, bot_id, filename)
+    back_markup = InlineKeyboardMarkup([[InlineKeyboardButton("🔙 رجوع", callback_data=back_cb)]])
+    download_cb = _file_callback("downloadfile", user_id, bot_id, filename)
+
+    if not is_safe_path(bot_path, file_path):
+        return "⛔ الوصول مرفوض", back_markup
+
+    if not file_path.exists() or file_path.is_dir():
+        return "❌ الملف غير موجود", back_markup
+
+    try:
+        if await asyncio.to_thread(_is_binary_file, file_path):
+            return (
+                f"📦 <b>{safe_html_escape(filename)}</b>\n\n"
+                f"هذا ملف ثنائي ولا يمكن عرضه كنص.\n"
+                f"💾 الحجم: {get_file_size(file_path)}",
+                InlineKeyboardMarkup([
+                    [InlineKeyboardButton("📥 تحميل", callback_data=download_cb)],
+                    [InlineKeyboardButton("🔙 رجوع", callback_data=back_cb)]
+                ])
+            )
+        index, lines, start = await asyncio.to_thread(_load_file_page, file_path, start, highlight)
+    except Exception as e:
+        logger.error(f"خطأ قراءة ملف للعرض: {e}")
+        return (
+            "❌ لا يمكن قراءة الملف\n\nيمكنك تحميله بدلاً من ذلك.",
+            InlineKeyboardMarkup([
+                [InlineKeyboardButton("📥 تحميل", callback_data=download_cb)],
+                [InlineKeyboardButton("🔙 رجوع", callback_data=back_cb)]
+            ])
+        )
+
+    # تجميع السطور ضمن حد الرسالة
+    width = len(str(index.line_count or 1))
+    body = []
+    used = 0
+    for line_no, line_text, truncated in lines:
+        marker = "▶" if line_no == highlight else " "
+        rendered = f"{line_no + 1:>{width}}{marker}│ {line_text.expandtabs(4)}"
+        if truncated:
+            rendered += " …"
+        rendered = safe_html_escape(rendered)
+        if body and used + len(rendered) + 1 > VIEW_PAGE_CHARS:
+            break
+        body.append(rendered)
+        used += len(rendered) + 1
+    shown = len(body)
+    end = start + shown
+    next_start = end if end < index.line_count else None
+    prev_start = max(0, start - VIEW_PAGE_LINES) if start > 0 else None
+
+    total_pages = max(1, (index.line_count + VIEW_PAGE_LINES - 1) // VIEW_PAGE_LINES)
+    current_page = min(total_pages, start // VIEW_PAGE_LINES + 1)
+
+    icon = get_file_icon(filename)
+    text = (
+        f"{icon} <b>{safe_html_escape(filename)}</b>\n"
+        f"────────────────────────────\n"
+        f"💾 الحجم: {format_size(index.size)} | 📏 {index.line_count:,} سطر\n"
+        f"📍 السطور {start + 1 if shown else 0}–{end} | 📄 {current_page}/{total_pages}\n"
+    )
+    search = context.user_data.get('fv_search')
+    handle = path_handles.issue(user_id, bot_id, filename)
+    if search and search.get('handle') == handle:
+        text += f"🔍 البحث: <code>{safe_html_escape(search['text'])}</code>\n"
+    text += "────────────────────────────\n\n"
+    text += f"<code>{chr(10).join(body)}</code>" if body else "📭 <i>الملف فارغ</i>"
+
+    keyboard = []
+    nav = []
+    if prev_start is not None:
+        nav.append(InlineKeyboardButton("⏮️", callback_data=f"fv_{handle}_0"))
+        nav.append(InlineKeyboardButton("◀️", callback_data=f"fv_{handle}_{prev_start}"))
+    if next_start is not None:
+        nav.append(InlineKeyboardButton("▶️", callback_data=f"fv_{handle}_{next_start}"))
+        nav.append(InlineKeyboardButton("⏭️", callback_data=f"fv_{handle}_e"))
+    if nav:
+        keyboard.append(nav)
+
+    tools = [
+        InlineKeyboardButton("🔢 انتقال", callback_data=f"fvgo_{handle}"),
+        InlineKeyboardButton("🔍 بحث", callback_data=f"fvfind_{handle}"),
+    ]
+    if search and search.get('handle') == handle:
+        after = highlight if highlight is not None else start
+        tools.append(InlineKeyboardButton("⏬ التالي", callback_data=f"fvn_{handle}_{after}"))
+    keyboard.append(tools)
+
+    keyboard.append([
+        InlineKeyboardButton("✏️ تعديل", callback_data=_file_callback("editfile", user_id, bot_id, filename)),
+        InlineKeyboardButton("📥 تحميل", callback_data=download_cb)
+    ])
+    keyboard.append([
+        InlineKeyboardButton("🗑️ حذف", callback_data=_file_callback("deletefile", user_id, bot_id, filename)),
+        InlineKeyboardButton("🔄 تحديث", callback_data=f"fv_{handle}_{start}")
+    ])
+    if revisions:
+        keyboard.append([InlineKeyboardButton(
+            f"↩️ تراجع عن آخر تعديل ({revisions})",
+            callback_data=_file_callback("fileundo", user_id, bot_id, filename)
+        )])
+    keyboard.append([InlineKeyboardButton("🔙 رجوع", callback_data=back_cb)])
+
+    return text, InlineKeyboardMarkup(keyboard)
+
+
+async def _show_file_view(update, context, bot_id, filename, db, start=0, highlight=None):
+    """عرض صفحة من الملف (تعديل الرسالة أو رسالة جديدة بعد إدخال نصي)"""
+    user_id = update.effective_user.id
+    bot = db.get_bot(bot_id)
+    if not bot:
+        text, markup = "❌ البوت غير موجود", None
+    else:
+        revisions = db.count_file_revisions(bot_id, filename)
+        text, markup = await _build_file_view(context, user_id, bot, filename, start, highlight, revisions)
+
+    if update.callback_query:
+        await update.callback_query.edit_message_text(text, reply_markup=markup, parse_mode="HTML")
+    else:
+        await update.message.reply_text(text, reply_markup=markup, parse_mode="HTML")
+
+
 async def view_file(update: Update, context: ContextTypes.DEFAULT_TYPE, db):
-    """عرض محتوى الملف"""
+    """عرض محتوى الملف (الصفحة الأولى)"""
     query = update.callback_query
     await query.answer()
     
@@ -180,101 +522,142 @@ async def view_file(update: Update, context: ContextTypes.DEFAULT_TYPE, db):
             return
         
         bot_id = int(parts[1])
-        filename = parts[2]
-        
-        bot = db.get_bot(bot_id)
-        if not bot:
-            await query.edit_message_text("❌ البوت غير موجود")
-            return
-        
-        bot_path = Path(BOTS_DIRECTORY) / bot[5]
-        file_path = bot_path / filename
-        
-        # التحقق من الأمان
-        if not is_safe_path(bot_path, file_path):
-            await query.answer("⛔ الوصول مرفوض", show_alert=True)
-            return
-        
-        if not file_path.exists() or file_path.is_dir():
-            await query.edit_message_text(
-                "❌ الملف غير موجود",
-                reply_markup=InlineKeyboardMarkup([[
-                    InlineKeyboardButton("🔙 رجوع", callback_data=f"files_{bot_id}")
-                ]])
-            )
+        filename = _resolve_file_arg(update.effective_user.id, bot_id, parts[2])
+        if filename is None:
+            await query.answer("⌛ انتهت صلاحية الجلسة، افتح مدير الملفات مجدداً", show_alert=True)
             return
         
-        file_size_bytes = file_path.stat().st_size
-        file_size_mb = file_size_bytes / (1024 * 1024)
+        await _show_file_view(update, context, bot_id, filename, db)
         
-        # التحقق من حجم الملف
-        if file_size_mb > MAX_EDIT_FILE_SIZE_MB:
-            await query.edit_message_text(
-                f"❌ <b>الملف كبير جداً للعرض</b>\n\n"
-                f"📄 الملف: <code>{safe_html_escape(filename)}</code>\n"
-                f"💾 الحجم: {file_size_mb:.2f} MB\n"
-                f"📏 الحد الأقصى: {MAX_EDIT_FILE_SIZE_MB} MB\n\n"
-                f"💡 يمكنك تحميل الملف بدلاً من ذلك",
-                reply_markup=InlineKeyboardMarkup([
-                    [InlineKeyboardButton("📥 تحميل", callback_data=f"downloadfile_{bot_id}_{filename}")],
-                    [InlineKeyboardButton("🔙 رجوع", callback_data=f"files_{bot_id}")]
-                ]),
-                parse_mode="HTML"
-            )
+    except Exception as e:
+        logger.error(f"خطأ في عرض الملف: {e}")
+        await query.answer("❌ حدث خطأ", show_alert=True)
+
+
+async def view_file_page(update: Update, context: ContextTypes.DEFAULT_TYPE, db):
+    """التنقل في الملف: fv_HANDLE_LINE أو fv_HANDLE_e (النهاية)"""
+    query = update.callback_query
+    await query.answer()
+
+    try:
+        _, handle_str, where = query.data.split("_", 2)
+        entry = _resolve_dir_handle(update, handle_str)
+        if not entry:
+            await query.answer("⌛ انتهت صلاحية الجلسة، افتح مدير الملفات مجدداً", show_alert=True)
             return
-        
-        # قراءة الملف
-        try:
-            with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
-                content = f.read(3000)
-        except Exception as e:
-            await query.edit_message_text(
-                f"❌ لا يمكن قراءة الملف\n\n"
-                f"قد يكون ملفاً ثنائياً.\n"
-                f"يمكنك تحميله بدلاً من ذلك.",
-                reply_markup=InlineKeyboardMarkup([
-                    [InlineKeyboardButton("📥 تحميل", callback_data=f"downloadfile_{bot_id}_{filename}")],
-                    [InlineKeyboardButton("🔙 رجوع", callback_data=f"files_{bot_id}")]
-                ])
+
+        start = -1 if where == "e" else int(where)
+        await _show_file_view(update, context, entry[0], entry[1], db, start=start)
+
+    except Exception as e:
+        logger.error(f"خطأ في التنقل في الملف: {e}")
+        await query.answer("❌ حدث خطأ", show_alert=True)
+
+
+async def view_file_search_next(update: Update, context: ContextTypes.DEFAULT_TYPE, db):
+    """الانتقال إلى المطابقة التالية: fvn_HANDLE_LINE"""
+    query = update.callback_query
+
+    _, handle_str, line_str = query.data.split("_", 2)
+    entry = _resolve_dir_handle(update, handle_str)
+    search = context.user_data.get('fv_search')
+    if not entry or not search or search.get('handle') != int(handle_str):
+        await query.answer("⌛ انتهت صلاحية البحث", show_alert=True)
+        return
+
+    await _search_and_show(update, context, entry, search['text'], int(line_str) + 1, db)
+
+
+async def _search_and_show(update, context, entry, needle, from_line, db):
+    """البحث في الملف وعرض الصفحة التي تحتوي المطابقة"""
+    bot_id, filename = entry
+    bot = db.get_bot(bot_id)
+    if not bot:
+        return
+    file_path = Path(BOTS_DIRECTORY) / bot[5] / filename
+    if not is_safe_path(Path(BOTS_DIRECTORY) / bot[5], file_path) or not file_path.is_file():
+        return
+
+    def _search():
+        return line_indexes.get(file_path).search(needle, from_line)
+
+    try:
+        found = await asyncio.to_thread(_search)
+    except Exception as e:
+        logger.error(f"خطأ في البحث داخل الملف: {e}")
+        found = None
+
+    if update.callback_query:
+        await update.callback_query.answer(
+            f"🔍 السطر {found + 1}" if found is not None else "🔍 لا توجد نتائج"
+        )
+    if found is None:
+        if update.message:
+            await update.message.reply_text(
+                f"🔍 لا توجد نتائج لـ <code>{safe_html_escape(needle)}</code>", parse_mode="HTML"
             )
-            return
-        
-        icon = get_file_icon(filename)
-        
-        # تقصير المحتوى إذا كان طويلاً
-        display_content = content[:2000]
-        if len(content) > 2000:
-            display_content += "\n\n... (تم قص المحتوى)"
-        
-        text = (
-            f"{icon} <b>{safe_html_escape(filename)}</b>\n"
-            f"────────────────────────────\n"
-            f"💾 الحجم: {get_file_size(file_path)}\n"
-            f"────────────────────────────\n\n"
-            f"<code>{safe_html_escape(display_content)}</code>"
+        return
+    await _show_file_view(update, context, bot_id, filename, db, highlight=found)
+
+
+async def view_file_input_start(update: Update, context: ContextTypes.DEFAULT_TYPE, db):
+    """طلب رقم سطر/صفحة (fvgo_) أو نص بحث (fvfind_)"""
+    query = update.callback_query
+    await query.answer()
+
+    mode, handle_str = query.data.split("_", 1)
+    entry = _resolve_dir_handle(update, handle_str)
+    if not entry:
+        await query.answer("⌛ انتهت صلاحية الجلسة، افتح مدير الملفات مجدداً", show_alert=True)
+        return ConversationHandler.END
+
+    context.user_data['fv_input'] = (mode, int(handle_str), entry)
+    if mode == "fvgo":
+        prompt = (
+            "🔢 <b>انتقال داخل الملف</b>\n"
+            "────────────────────────────\n\n"
+            "أرسل رقم السطر (مثل <code>50000</code>)\n"
+            "أو رقم الصفحة مسبوقاً بـ p (مثل <code>p12</code>)\n\n"
+            "❌ للإلغاء أرسل /cancel"
         )
-        
-        keyboard = [
-            [
-                InlineKeyboardButton("✏️ تعديل", callback_data=f"editfile_{bot_id}_{filename}"),
-                InlineKeyboardButton("📥 تحميل", callback_data=f"downloadfile_{bot_id}_{filename}")
-            ],
-            [
-                InlineKeyboardButton("🗑️ حذف", callback_data=f"deletefile_{bot_id}_{filename}"),
-                InlineKeyboardButton("🔄 تحديث", callback_data=f"viewfile_{bot_id}_{filename}")
-            ],
-            [InlineKeyboardButton("🔙 رجوع", callback_data=f"files_{bot_id}")]
-        ]
-        
-        await query.edit_message_text(
-            text,
-            reply_markup=InlineKeyboardMarkup(keyboard),
-            parse_mode="HTML"
+    else:
+        prompt = (
+            "🔍 <b>بحث داخل الملف</b>\n"
+            "────────────────────────────\n\n"
+            "أرسل النص المطلوب (بدون حساسية لحالة الأحرف)\n\n"
+            "❌ للإلغاء أرسل /cancel"
         )
-        
-    except Exception as e:
-        logger.error(f"خطأ في عرض الملف: {e}")
-        await query.answer("❌ حدث خطأ", show_alert=True)
+    await query.message.reply_text(prompt, parse_mode="HTML")
+    return CONVERSATION_STATES['WAIT_FILE_VIEW_INPUT']
+
+
+async def view_file_input_apply(update: Update, context: ContextTypes.DEFAULT_TYPE, db):
+    """تنفيذ الانتقال أو البحث وعرض النتيجة في رسالة جديدة"""
+    pending = context.user_data.pop('fv_input', None)
+    if not pending:
+        return ConversationHandler.END
+
+    mode, handle, entry = pending
+    text = update.message.text.strip()
+
+    if mode == "fvfind":
+        needle = text[:100]
+        context.user_data['fv_search'] = {'handle': handle, 'text': needle}
+        await _search_and_show(update, context, entry, needle, 0, db)
+        return ConversationHandler.END
+
+    try:
+        if text[:1].lower() in ("p", "ص"):
+            start = (max(1, int(text[1:].strip())) - 1) * VIEW_PAGE_LINES
+        else:
+            start = max(1, int(text.replace(",", ""))) - 1
+    except ValueError:
+        await update.message.reply_text("❌ أرسل رقماً صحيحاً مثل 120 أو p3")
+        context.user_data['fv_input'] = pending
+        return CONVERSATION_STATES['WAIT_FILE_VIEW_INPUT']
+
+    await _show_file_view(update, context, entry[0], entry[1], db, start=start)
+    return ConversationHandler.END
 
 # ============================================================================
 # تحميل الملفات
@@ -292,9 +675,11 @@ async def download_file(update: Update, context: ContextTypes.DEFAULT_TYPE, db):
             return
         
         bot_id = int(parts[1])
-        # دعم المسارات المشفرة بـ |
-        encoded_name = parts[2]
-        filename = encoded_name.replace("|", "/")
+        # مقبض قصير (#N) أو مسار مشفر بـ |
+        filename = _resolve_file_arg(update.effective_user.id, bot_id, parts[2])
+        if filename is None:
+            await query.answer("⌛ انتهت صلاحية الجلسة، افتح مدير الملفات مجدداً", show_alert=True)
+            return
         display_name = filename.split("/")[-1]  # اسم الملف للعرض
         
         bot = db.get_bot(bot_id)
@@ -357,14 +742,17 @@ async def download_all(update: Update, context: ContextTypes.DEFAULT_TYPE, db):
             return
         
         # إنشاء ملف ZIP
-        zip_buffer = io.BytesIO()
-        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-            for file_path in bot_path.rglob('*'):
-                if file_path.is_file() and not file_path.name.startswith('.'):
-                    arcname = file_path.relative_to(bot_path)
-                    zip_file.write(file_path, arcname)
-        
-        zip_buffer.seek(0)
+        def _build_zip():
+            zip_buffer = io.BytesIO()
+            with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+                for file_path in bot_path.rglob('*'):
+                    if file_path.is_file() and not file_path.name.startswith('.'):
+                        arcname = file_path.relative_to(bot_path)
+                        zip_file.write(file_path, arcname)
+            zip_buffer.seek(0)
+            return zip_buffer
+
+        zip_buffer = await asyncio.to_thread(_build_zip)
         
         # إرسال الملف
         zip_name = f"{bot[3]}_files.zip"
@@ -475,7 +863,11 @@ async def edit_file_start(update: Update, context: ContextTypes.DEFAULT_TYPE, db
             return ConversationHandler.END
         
         bot_id = int(parts[1])
-        filename = parts[2]
+        user_id = update.effective_user.id
+        filename = _resolve_file_arg(user_id, bot_id, parts[2])
+        if filename is None:
+            await query.answer("⌛ انتهت صلاحية الجلسة، افتح مدير الملفات مجدداً", show_alert=True)
+            return ConversationHandler.END
         
         bot = db.get_bot(bot_id)
         if not bot:
@@ -501,26 +893,29 @@ async def edit_file_start(update: Update, context: ContextTypes.DEFAULT_TYPE, db
                 f"💾 الحجم: {file_size_mb:.2f} MB\n"
                 f"📏 الحد الأقصى: {MAX_EDIT_FILE_SIZE_MB} MB",
                 reply_markup=InlineKeyboardMarkup([[
-                    InlineKeyboardButton("🔙 رجوع", callback_data=f"viewfile_{bot_id}_{filename}")
+                    InlineKeyboardButton("🔙 رجوع", callback_data=_file_callback("viewfile", user_id, bot_id, filename))
                 ]]),
                 parse_mode="HTML"
             )
             return ConversationHandler.END
         
-        # حفظ بيانات التعديل
+        # حفظ بيانات التعديل مع etag لاكتشاف التعارض عند الحفظ
         context.user_data['edit_file'] = {
             'bot_id': bot_id,
             'filename': filename,
-            'file_path': str(file_path)
+            'file_path': str(file_path),
+            'etag': file_etag(file_path),
         }
         
         await query.message.reply_text(
             f"✏️ <b>تعديل الملف</b>\n"
             f"────────────────────────────\n\n"
             f"📄 الملف: <code>{safe_html_escape(filename)}</code>\n\n"
-            "📝 أرسل المحتوى الجديد:\n"
-            "• نص عادي للمحتوى الجديد\n"
-            "• أو ملف بالمحتوى الجديد\n\n"
+            "📝 أرسل التعديل بإحدى الصيغ:\n"
+            "• <b>نطاق سطور</b>: السطر الأول <code>12,18</code> ثم النص الجديد\n"
+            "  (<code>12,18d</code> للحذف، <code>12a</code> للإدراج بعد السطر 12)\n"
+            "• <b>فرق موحّد</b> (unified diff) نصاً أو ملف .diff/.patch\n"
+            "• أو المحتوى الكامل الجديد نصاً أو ملفاً\n\n"
             "❌ للإلغاء أرسل /cancel",
             parse_mode="HTML"
         )
@@ -533,50 +928,127 @@ async def edit_file_start(update: Update, context: ContextTypes.DEFAULT_TYPE, db
         return ConversationHandler.END
 
 async def handle_file_edit(update: Update, context: ContextTypes.DEFAULT_TYPE, db):
-    """معالجة تعديل الملف"""
+    """معالجة تعديل الملف (تصحيح أو نطاق سطور أو محتوى كامل)"""
     edit_file_data = context.user_data.get('edit_file')
     if not edit_file_data:
         await update.message.reply_text("❌ خطأ. حاول مرة أخرى.")
         return ConversationHandler.END
     
     try:
-        # الحصول على المحتوى الجديد
+        # الحصول على التعديل
+        force_full = False
         if update.message.document:
-            file = await context.bot.get_file(update.message.document.file_id)
+            document = update.message.document
+            file = await context.bot.get_file(document.file_id)
             file_bytes = await file.download_as_bytearray()
             content = file_bytes.decode('utf-8')
+            # الملف المرفوع يستبدل المحتوى إلا إذا كان ملف تصحيح
+            force_full = not (document.file_name or "").endswith(('.diff', '.patch'))
         else:
             content = update.message.text
         
+        bot_id = edit_file_data['bot_id']
+        filename = edit_file_data['filename']
         file_path = edit_file_data['file_path']
+        user_id = update.effective_user.id
         
-        # إنشاء نسخة احتياطية
-        backup_path = f"{file_path}.bak"
-        shutil.copy2(file_path, backup_path)
+        ok, message, _ = await asyncio.to_thread(
+            file_editor.apply, db, bot_id, filename, file_path, content,
+            edit_file_data.get('etag'), force_full
+        )
         
-        # كتابة المحتوى الجديد
-        with open(file_path, 'w', encoding='utf-8') as f:
-            f.write(content)
+        if not ok:
+            await update.message.reply_text(
+                f"{message}\n\n📝 أرسل تعديلاً آخر أو /cancel للإلغاء"
+            )
+            if edit_file_data.get('etag') != file_etag(file_path):
+                # تعارض: يجب إعادة فتح الملف لرؤية آخر نسخة
+                context.user_data.pop('edit_file', None)
+                return ConversationHandler.END
+            return CONVERSATION_STATES['WAIT_FILE_EDIT']
         
-        bot_id = edit_file_data['bot_id']
-        db.add_event_log(bot_id, "INFO", f"✏️ تم تعديل الملف: {edit_file_data['filename']}")
+        listing_cache.invalidate(Path(file_path))
+        db.add_event_log(bot_id, "INFO", f"✏️ تم تعديل الملف: {filename}")
         
         await update.message.reply_text(
             f"✅ <b>تم تحديث الملف</b>\n"
             f"────────────────────────────\n\n"
-            f"📄 الملف: <code>{safe_html_escape(edit_file_data['filename'])}</code>\n"
-            f"💾 نسخة احتياطية: <code>{edit_file_data['filename']}.bak</code>",
+            f"📄 الملف: <code>{safe_html_escape(filename)}</code>\n"
+            f"{safe_html_escape(message)}",
+            reply_markup=InlineKeyboardMarkup([
+                [
+                    InlineKeyboardButton("👁️ عرض", callback_data=_file_callback("viewfile", user_id, bot_id, filename)),
+                    InlineKeyboardButton("↩️ تراجع", callback_data=_file_callback("fileundo", user_id, bot_id, filename))
+                ],
+                [InlineKeyboardButton("✏️ تعديل آخر", callback_data=_file_callback("editfile", user_id, bot_id, filename))]
+            ]),
             parse_mode="HTML"
         )
         
         context.user_data.pop('edit_file', None)
         return ConversationHandler.END
         
+    except UnicodeDecodeError:
+        await update.message.reply_text("❌ الملف المرسل ليس نصاً بترميز UTF-8")
+        return CONVERSATION_STATES['WAIT_FILE_EDIT']
     except Exception as e:
         logger.error(f"خطأ في تعديل الملف: {e}")
         await update.message.reply_text(f"❌ خطأ: {str(e)[:50]}")
         return CONVERSATION_STATES['WAIT_FILE_EDIT']
 
+
+async def undo_file_edit(update: Update, context: ContextTypes.DEFAULT_TYPE, db):
+    """التراجع عن آخر تعديل للملف من سجل الفروقات العكسية"""
+    query = update.callback_query
+    
+    try:
+        parts = query.data.split("_", 2)
+        bot_id = int(parts[1])
+        user_id = update.effective_user.id
+        filename = _resolve_file_arg(user_id, bot_id, parts[2])
+        if filename is None:
+            await query.answer("⌛ انتهت صلاحية الجلسة، افتح مدير الملفات مجدداً", show_alert=True)
+            return
+        
+        bot = db.get_bot(bot_id)
+        if not bot:
+            await query.answer("❌ البوت غير موجود", show_alert=True)
+            return
+        
+        bot_path = Path(BOTS_DIRECTORY) / bot[5]
+        file_path = bot_path / filename
+        if not is_safe_path(bot_path, file_path) or not file_path.is_file():
+            await query.answer("❌ الملف غير موجود", show_alert=True)
+            return
+        
+        ok, message, _ = await asyncio.to_thread(file_editor.undo, db, bot_id, filename, str(file_path))
+        await query.answer(message, show_alert=not ok)
+        if not ok:
+            return
+        
+        listing_cache.invalidate(file_path)
+        db.add_event_log(bot_id, "INFO", f"↩️ تراجع عن تعديل الملف: {filename}")
+        remaining = db.count_file_revisions(bot_id, filename)
+        
+        keyboard = [[InlineKeyboardButton("👁️ عرض", callback_data=_file_callback("viewfile", user_id, bot_id, filename))]]
+        if remaining:
+            keyboard[0].append(InlineKeyboardButton(
+                f"↩️ تراجع ({remaining})", callback_data=_file_callback("fileundo", user_id, bot_id, filename)
+            ))
+        await query.edit_message_text(
+            f"↩️ <b>تم التراجع</b>\n"
+            f"────────────────────────────\n\n"
+            f"📄 الملف: <code>{safe_html_escape(filename)}</code>\n"
+            f"{safe_html_escape(message)}\n"
+            f"🗂️ مراجعات متبقية: {remaining}",
+            reply_markup=InlineKeyboardMarkup(keyboard),
+            parse_mode="HTML"
+        )
+        
+    except Exception as e:
+        logger.error(f"خطأ في التراجع عن التعديل: {e}")
+        await query.answer("❌ حدث خطأ", show_alert=True)
+
 # ============================================================================
 # حذف الملفات
 # ============================================================================
@@ -593,7 +1065,11 @@ async def delete_file(update: Update, context: ContextTypes.DEFAULT_TYPE, db):
             return
         
         bot_id = int(parts[1])
-        filename = parts[2]
+        user_id = update.effective_user.id
+        filename = _resolve_file_arg(user_id, bot_id, parts[2])
+        if filename is None:
+            await query.answer("⌛ انتهت صلاحية الجلسة، افتح مدير الملفات مجدداً", show_alert=True)
+            return
         
         bot = db.get_bot(bot_id)
         if not bot:
@@ -622,8 +1098,8 @@ async def delete_file(update: Update, context: ContextTypes.DEFAULT_TYPE, db):
         
         keyboard = [
             [
-                InlineKeyboardButton("✅ حذف", callback_data=f"confirmdelfile_{bot_id}_{filename}"),
-                InlineKeyboardButton("❌ إلغاء", callback_data=f"files_{bot_id}")
+                InlineKeyboardButton("✅ حذف", callback_data=_file_callback("confirmdelfile", user_id, bot_id, filename)),
+                InlineKeyboardButton("❌ إلغاء", callback_data=_parent_callback(user_id, bot_id, filename))
             ]
         ]
         
@@ -649,7 +1125,10 @@ async def confirm_delete_file(update: Update, context: ContextTypes.DEFAULT_TYPE
             return
         
         bot_id = int(parts[1])
-        filename = parts[2]
+        filename = _resolve_file_arg(update.effective_user.id, bot_id, parts[2])
+        if filename is None:
+            await query.answer("⌛ انتهت صلاحية الجلسة، افتح مدير الملفات مجدداً", show_alert=True)
+            return
         
         bot = db.get_bot(bot_id)
         if not bot:
@@ -659,15 +1138,23 @@ async def confirm_delete_file(update: Update, context: ContextTypes.DEFAULT_TYPE
         bot_path = Path(BOTS_DIRECTORY) / bot[5]
         file_path = bot_path / filename
         
+        # التحقق من الأمان
+        if not is_safe_path(bot_path, file_path) or filename == bot[6]:
+            await query.answer("⛔ الوصول مرفوض", show_alert=True)
+            return
+        
         if file_path.exists():
             file_path.unlink()
+            listing_cache.invalidate(file_path)
+            db.delete_file_revisions(bot_id, filename)
         
         db.add_event_log(bot_id, "INFO", f"🗑️ تم حذف الملف: {filename}")
         
         await query.answer("✅ تم حذف الملف", show_alert=True)
         
-        # العودة لمدير الملفات
-        await file_manager(update, context, db)
+        # العودة لمدير الملفات (نفس المجلد)
+        parent = "/".join(filename.split("/")[:-1])
+        await _show_file_manager(update, context, bot, parent)
         
     except Exception as e:
         logger.error(f"خطأ في حذف الملف: {e}")
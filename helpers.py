@@ -290,12 +290,18 @@ def is_safe_path(base_path: Path, check_path: Path) -> bool:
 
 def format_bot_status(status: str, sleep_mode: bool = False) -> tuple:
     """تنسيق حالة البوت"""
-    if sleep_mode:
+    if status == "hibernated":
+        return "🧊", "مجمّد (يستأنف فوراً عند الاسترجاع)"
+    elif sleep_mode:
         return "😴", "وضع السكون"
     elif status == "running":
         return "🟢", "يعمل"
     elif status == "stopped":
         return "🔴", "متوقف"
+    elif status == "cooldown":
+        return "⏳", "بانتظار إعادة التشغيل"
+    elif status == "queued":
+        return "📋", "في طابور الانتظار"
     elif status == "error":
         return "❌", "خطأ"
     else:
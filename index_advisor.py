@@ -0,0 +1,165 @@
+# ============================================================================
+# مستشار الفهارس - NeurHostX V9.2
+# ============================================================================
+"""
+يمر على جرد الاستعلامات ويقترح الفهارس الناقصة:
+- الجرد: العبارات التي سجلها محلل الاستعلامات (الحمل الحقيقي) مع نصوص SQL
+  الثابتة في database.py (تُستخرج بـ ast)
+- لكل عبارة EXPLAIN QUERY PLAN بمعاملات NULL؛ المشكلة: SCAN لجدول مع شرط
+  أو ترتيب، أو USE TEMP B-TREE FOR ORDER BY
+- الاقتراح: أعمدة المساواة في WHERE، ثم عمود نطاق واحد أو أعمدة ORDER BY
+  باتجاهها، ما لم يكن فهرس موجود يبدأ بنفس الأعمدة
+
+النتائج توجّه قائمة INDEXES في database.py (الترحيل) ولا تُطبَّق تلقائياً.
+"""
+
+import re
+import ast
+import sqlite3
+import logging
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+_QUERY_PREFIXES = ("SELECT", "UPDATE", "DELETE", "WITH")
+_TABLE_RE = re.compile(r"\b(?:FROM|UPDATE)\s+(\w+)(?:\s+(?:AS\s+)?(?!WHERE|ORDER|GROUP|LIMIT|JOIN|SET)(\w+))?", re.I)
+_WHERE_RE = re.compile(r"\bWHERE\s+(.*?)(?=\bGROUP\s+BY\b|\bORDER\s+BY\b|\bLIMIT\b|$)", re.I | re.S)
+_ORDER_RE = re.compile(r"\bORDER\s+BY\s+(.*?)(?=\bLIMIT\b|$)", re.I | re.S)
+_EQ_RE = re.compile(r"(?:(\w+)\.)?(\w+)\s*(?:=|\bIS\b|\bIN\b)\s*(?:\?|'[^']*'|\d+|\()", re.I)
+_RANGE_RE = re.compile(r"(?:(\w+)\.)?(\w+)\s*(?:>=|<=|>|<)", re.I)
+_ORDER_COL_RE = re.compile(r"^(?:(\w+)\.)?(\w+)(?:\s+(ASC|DESC))?$", re.I)
+
+
+def query_inventory(source: Optional[str] = None) -> List[str]:
+    """نصوص SQL الثابتة الممررة إلى execute/executemany في database.py"""
+    path = Path(source or Path(__file__).with_name("database.py"))
+    tree = ast.parse(path.read_text(encoding="utf-8"))
+    statements = []
+    for node in ast.walk(tree):
+        if not (isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute)
+                and node.func.attr in ("execute", "executemany") and node.args):
+            continue
+        arg = node.args[0]
+        if isinstance(arg, ast.Constant) and isinstance(arg.value, str):
+            sql = " ".join(arg.value.split())
+            if sql.upper().startswith(_QUERY_PREFIXES) and sql not in statements:
+                statements.append(sql)
+    return statements
+
+
+class IndexAdvisor:
+    """تحليل خطط الاستعلامات على قاعدة بيانات فعلية"""
+
+    def __init__(self, db_file: str):
+        self.db_file = db_file
+        self._columns: Dict[str, List[str]] = {}
+        self._indexes: Dict[str, List[Tuple[str, List[str]]]] = {}
+
+    # ═══════════════════════════════════════════════════════════════════════
+    # المخطط
+    # ═══════════════════════════════════════════════════════════════════════
+
+    def _load_schema(self, conn):
+        tables = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+        for table in tables:
+            self._columns[table] = [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+            indexes = []
+            for row in conn.execute(f"PRAGMA index_list({table})"):
+                columns = [info[2] for info in conn.execute(f"PRAGMA index_info({row[1]})")]
+                indexes.append((row[1], columns))
+            self._indexes[table] = indexes
+
+    def _covered(self, table: str, columns: List[str]) -> Optional[str]:
+        """اسم فهرس موجود يبدأ بنفس الأعمدة (أو None)"""
+        for name, index_columns in self._indexes.get(table, []):
+            if index_columns[:len(columns)] == columns:
+                return name
+        return None
+
+    # ═══════════════════════════════════════════════════════════════════════
+    # اشتقاق الفهرس من نص العبارة
+    # ═══════════════════════════════════════════════════════════════════════
+
+    def candidate(self, sql: str) -> Optional[Tuple[str, List[str]]]:
+        """(الجدول، [الأعمدة مع الاتجاه]) للجدول الأول في العبارة"""
+        match = _TABLE_RE.search(sql)
+        if not match:
+            return None
+        table, alias = match.group(1), match.group(2)
+        known = self._columns.get(table, [])
+        prefixes = {None, table, alias}
+
+        def own(prefix, column):
+            return prefix in prefixes and column in known
+
+        equality, ranges, order = [], [], []
+        where = _WHERE_RE.search(sql)
+        if where:
+            clause = where.group(1)
+            if re.search(r"\bOR\b", clause, re.I):
+                return None
+            for prefix, column in _EQ_RE.findall(clause):
+                if own(prefix or None, column) and column not in equality:
+                    equality.append(column)
+            for prefix, column in _RANGE_RE.findall(clause):
+                if own(prefix or None, column) and column not in equality + ranges:
+                    ranges.append(column)
+        ordered = _ORDER_RE.search(sql)
+        if ordered:
+            for part in ordered.group(1).split(","):
+                col_match = _ORDER_COL_RE.match(part.strip())
+                if not col_match or not own(col_match.group(1), col_match.group(2)):
+                    order = []
+                    break
+                direction = " DESC" if (col_match.group(3) or "").upper() == "DESC" else ""
+                if col_match.group(2) not in equality:
+                    order.append(col_match.group(2) + direction)
+
+        # عمود نطاق يقطع الترتيب: إما النطاق أو الترتيب بعد أعمدة المساواة
+        columns = equality + (ranges[:1] if ranges else order)
+        return (table, columns) if columns else None
+
+    # ═══════════════════════════════════════════════════════════════════════
+    # التحليل
+    # ═══════════════════════════════════════════════════════════════════════
+
+    def advise(self, statements: List[str]) -> List[dict]:
+        """[{sql, plan, problems, suggestion}] للعبارات التي لا تستخدم فهرساً مناسباً"""
+        conn = sqlite3.connect(self.db_file, timeout=5)
+        try:
+            self._load_schema(conn)
+            results = []
+            for sql in statements:
+                try:
+                    plan = [row[-1] for row in conn.execute(
+                        f"EXPLAIN QUERY PLAN {sql}", [None] * sql.count("?")
+                    )]
+                except sqlite3.Error as e:
+                    logger.debug(f"تخطي عبارة لا يمكن شرحها: {e}")
+                    continue
+
+                problems = []
+                filtered = bool(_WHERE_RE.search(sql) or _ORDER_RE.search(sql))
+                for line in plan:
+                    if line.startswith("SCAN sqlite_"):
+                        continue        # جداول SQLite الداخلية
+                    if line.startswith("SCAN ") and " USING " not in line and filtered:
+                        problems.append(line)
+                    elif line.startswith("USE TEMP B-TREE FOR ORDER BY"):
+                        problems.append(line)
+                if not problems:
+                    continue
+
+                suggestion = None
+                candidate = self.candidate(sql)
+                if candidate:
+                    table, columns = candidate
+                    bare = [column.split()[0] for column in columns]
+                    if not self._covered(table, bare):
+                        name = f"idx_{table}_{'_'.join(bare)}"
+                        suggestion = f"CREATE INDEX {name} ON {table}({', '.join(columns)})"
+                results.append({"sql": sql, "plan": plan, "problems": problems, "suggestion": suggestion})
+            return results
+        finally:
+            conn.close()
@@ -3,18 +3,25 @@
 # ============================================================================
 
 import sys
+import asyncio
 import logging
 from telegram.ext import (
     CommandHandler, MessageHandler, CallbackQueryHandler,
-    ConversationHandler, PreCheckoutQueryHandler, filters,
+    ConversationHandler, PreCheckoutQueryHandler, TypeHandler,
+    ApplicationHandlerStop, filters,
 )
 from telegram import Update
 from telegram.ext import ContextTypes
 
-from app_setup import setup_logging, check_requirements, create_app, print_startup_banner
-from config import ADMIN_ID, CONVERSATION_STATES, DATABASE_FILE
+from app_setup import setup_logging, check_requirements, create_app, print_startup_banner, run_app
+from config import ADMIN_ID, CONVERSATION_STATES, DATABASE_FILE, SECURITY_CONFIG
 from database import Database
 from process_manager import ProcessManager
+from security_system import RateLimiter, BotSecurityManager, start_scan_pool
+from update_scheduler import update_scheduler
+from metrics import metrics_server
+from query_profiler import query_profiler
+from zygote import make_non_dumpable
 
 # ── المعالجات الأساسية ──
 from handlers import (
@@ -27,12 +34,15 @@ from handlers import (
 )
 from handlers_files import (
     file_manager, view_file, upload_file, download_file, download_all,
-    edit_file_start, handle_file_edit, replace_file, delete_file, confirm_delete_file
+    edit_file_start, handle_file_edit, replace_file, delete_file, confirm_delete_file,
+    file_manager_sort, file_manager_clear_filter, file_manager_filter_start,
+    file_manager_filter_apply, view_file_page, view_file_search_next,
+    view_file_input_start, view_file_input_apply, undo_file_edit,
 )
 from handlers_advanced import (
     add_bot_start, deploy_zip_start, handle_bot_file, handle_token,
     confirm_delete, delete_bot_action, request_upgrade, select_upgrade,
-    approve_upgrade, reject_upgrade, approve_user, reject_user, sys_status,
+    approve_upgrade, reject_upgrade, approve_user, reject_user, sys_status, admin_metrics,
     admin_panel, admin_users, admin_pending, admin_upgrades, admin_bots,
     bot_backup, bot_settings, clear_logs, admin_blocked,
     bulk_bot_operations, bulk_start_all_bots,
@@ -56,13 +66,16 @@ from backup_handlers import (
     backup_panel, backup_download_now, backup_download_encrypted,
     backup_restore_upload, backup_receive_file, backup_restore_execute,
     backup_toggle_auto, backup_set_channel, backup_receive_channel,
-    backup_send_to_channel, backup_receive_password,
+    backup_send_to_channel, backup_receive_password, backup_restore_scope,
     WAIT_BACKUP_PASSWORD, WAIT_RESTORE_FILE, WAIT_RESTORE_PASS, WAIT_CHANNEL_ID,
+    WAIT_RESTORE_SCOPE,
 )
+from backup_scheduler import BackupScheduler
+from db_maintenance import DatabaseMaintenance
 from missing_handlers import (
     rename_bot_start, rename_bot_execute,
     change_main_file_start, set_main_file,
-    toggle_auto_recovery, set_priority_menu, set_priority_execute,
+    toggle_auto_recovery, toggle_watch_mode, set_priority_menu, set_priority_execute,
     edit_description_start, edit_description_execute,
     bulk_stop_all_bots, bulk_restart_all_bots, bulk_stats_all_bots,
     mute_duration_handler, promote_role_handler,
@@ -126,6 +139,69 @@ async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE):
         pass
 
 
+def build_rate_limit_guard():
+    """إنشاء وسيط تحديد المعدل العام (يعمل قبل أي معالج أو عمل على قاعدة البيانات)"""
+    buckets = SECURITY_CONFIG.get('rate_limit_buckets', {})
+    default_rate = SECURITY_CONFIG.get('rate_limit_per_minute', 30)
+    limiters = {
+        kind: RateLimiter(
+            max_requests=buckets.get(kind, {}).get('per_minute', default_rate),
+            window_seconds=60,
+            burst=buckets.get(kind, {}).get('burst'),
+        )
+        for kind in ('command', 'callback', 'upload', 'message')
+    }
+    # آخر تنبيه لكل مستخدم حتى لا نرد على كل طلب مرفوض
+    warned = RateLimiter(max_requests=1, window_seconds=30)
+
+    async def rate_limit_guard(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        user = update.effective_user
+        if not user or user.id == ADMIN_ID:
+            return
+
+        # المدفوعات لا تُحدّ أبداً: رفض successful_payment يعني خصماً بلا إضافة رصيد،
+        # و pre_checkout_query يجب الرد عليه خلال 10 ثوانٍ وإلا فشل الدفع
+        if update.pre_checkout_query or (update.message and update.message.successful_payment):
+            return
+
+        if update.callback_query:
+            kind = 'callback'
+        elif update.message:
+            msg = update.message
+            if msg.document or msg.photo or msg.video or msg.audio:
+                kind = 'upload'
+            elif msg.text and msg.text.startswith('/'):
+                kind = 'command'
+            else:
+                kind = 'message'
+        else:
+            return
+
+        limiter = limiters[kind]
+        allowed, _ = limiter.is_allowed(user.id)
+        if allowed:
+            return
+
+        wait = limiter.get_remaining_time(user.id)
+        if warned.is_allowed(user.id)[0]:
+            text = f"⏳ طلبات كثيرة، انتظر {wait} ثانية"
+            try:
+                if update.callback_query:
+                    await update.callback_query.answer(text, show_alert=True)
+                else:
+                    await update.message.reply_text(text)
+            except Exception:
+                pass
+        elif update.callback_query:
+            try:
+                await update.callback_query.answer()
+            except Exception:
+                pass
+        raise ApplicationHandlerStop
+
+    return rate_limit_guard
+
+
 async def cancel_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """إلغاء أي عملية جارية"""
     context.user_data.clear()
@@ -219,6 +295,130 @@ async def broadcast_command(update: Update, context: ContextTypes.DEFAULT_TYPE,
     )
 
 
+def fit_entries(text: str, entries, limit: int = 4000) -> str:
+    """إلحاق مدخلات HTML كاملة بالنص حتى حد الرسالة دون قطع وسم أو كيان"""
+    for i, entry in enumerate(entries):
+        more = len(entries) - i
+        if len(text) + len(entry) + 40 > limit:
+            return text + f"… و{more} أخرى"
+        text += entry
+    return text
+
+
+async def dbprofile_command(update: Update, context: ContextTypes.DEFAULT_TYPE, db):
+    """أمر /dbprofile - محلل استعلامات قاعدة البيانات
+
+    /dbprofile on [ms] | off | reset | slow | advise | analyze | retention | top [N] [total|avg|p99|count|rows]
+    """
+    if update.effective_user.id != ADMIN_ID:
+        return
+    from helpers import safe_html_escape as escape
+
+    args = [a.lower() for a in context.args or []]
+    action = args[0] if args else "top"
+
+    if action == "on":
+        threshold = float(args[1]) if len(args) > 1 and args[1].replace('.', '', 1).isdigit() else None
+        query_profiler.enable(threshold)
+        await update.message.reply_text(
+            f"🔬 تم تفعيل محلل الاستعلامات (بطيء ≥ {query_profiler.slow_seconds * 1000:.0f}ms)"
+        )
+        return
+    if action == "off":
+        query_profiler.disable()
+        await update.message.reply_text("⏹ تم إيقاف محلل الاستعلامات (الإحصائيات محفوظة حتى reset)")
+        return
+    if action == "reset":
+        query_profiler.reset()
+        await update.message.reply_text("🧹 تم تصفير إحصائيات الاستعلامات")
+        return
+    if action == "analyze":
+        maintenance = context.bot_data.get('db_maintenance')
+        elapsed = await maintenance.run_analyze() if maintenance else None
+        await update.message.reply_text(
+            f"📐 تم تحديث إحصائيات الفهارس ({elapsed} ms)" if elapsed is not None
+            else "⏳ هناك عملية صيانة جارية"
+        )
+        return
+    if action == "retention":
+        maintenance = context.bot_data.get('db_maintenance')
+        result = await maintenance.run_retention() if maintenance else None
+        if result is None:
+            await update.message.reply_text("⏳ هناك عملية صيانة جارية")
+            return
+        await update.message.reply_text(
+            f"🧹 احتفاظ السجلات{'' if result['complete'] else ' (غير مكتمل - يُستكمل لاحقاً)'}\n"
+            f"🗓 منتهية: {result['expired']} | 📏 فوق حد الخطة: {result['capped']}\n"
+            f"🗄 مؤرشفة: {result['archived']} | 🗜 صفحات مُرجعة: {result['vacuumed_pages']}\n"
+            f"⏱ {result['duration_ms']} ms"
+        )
+        return
+    if action == "advise":
+        from index_advisor import IndexAdvisor, query_inventory
+        statements = [row['sql'] for row in query_profiler.report(1000)]
+        statements += [sql for sql in query_inventory() if sql not in statements]
+        results = await asyncio.to_thread(IndexAdvisor(db.db_file).advise, statements)
+        text = f"🧭 <b>مستشار الفهارس</b> - {len(statements)} عبارة، {len(results)} بلا فهرس مناسب\n\n"
+        entries = []
+        for result in results:
+            item = (
+                f"<code>{escape(result['sql'][:140])}</code>\n"
+                f"<i>{escape(' | '.join(result['problems'])[:120])}</i>\n"
+            )
+            if result['suggestion']:
+                item += f"💡 <code>{escape(result['suggestion'])}</code>\n"
+            entries.append(item + "\n")
+        text = fit_entries(text, entries)
+        if not results:
+            text += "✅ كل الاستعلامات تستخدم فهارس مناسبة"
+        await update.message.reply_text(text, parse_mode="HTML")
+        return
+
+    summary = query_profiler.summary()
+    text = (
+        f"════════════════════════════\n"
+        f"🔬 <b>محلل الاستعلامات</b> ({'🟢 مفعّل' if summary['enabled'] else '🔴 متوقف'})\n"
+        f"════════════════════════════\n"
+        f"📊 {summary['queries']} استعلام | {summary['statements']} عبارة | "
+        f"{summary['total_ms']:.0f}ms خلال {summary['window_seconds'] / 60:.0f} دقيقة\n"
+        f"🐌 بطيئة (≥ {summary['slow_query_ms']:.0f}ms): {summary['slow']}\n\n"
+    )
+
+    if action == "slow":
+        entries = []
+        for entry in list(query_profiler.slow_log)[-10:][::-1]:
+            item = (
+                f"• <b>{entry['ms']:.1f}ms</b> {escape(entry['caller'])} ({entry['rows']} صف)\n"
+                f"<code>{escape(entry['sql'][:160])}</code>\n"
+            )
+            if entry['plan']:
+                item += "<i>" + escape(" | ".join(entry['plan'])[:200]) + "</i>\n"
+            entries.append(item)
+        text = fit_entries(text, entries)
+        if not query_profiler.slow_log:
+            text += "لا توجد استعلامات بطيئة."
+    else:
+        top = 10
+        order_by = "total"
+        for arg in args[1:]:
+            if arg.isdigit():
+                top = max(1, min(25, int(arg)))
+            else:
+                order_by = arg
+        rows = query_profiler.report(top, order_by)
+        if not rows:
+            text += "لا توجد قياسات بعد - فعّله بـ <code>/dbprofile on</code>"
+        text = fit_entries(text, [
+            f"{i}. <b>{row['total_ms']:.1f}ms</b> ×{row['count']} | avg {row['avg_ms']:.2f} | "
+            f"p99 {row['p99_ms']:.2f} | {row['rows']} صف\n"
+            f"   {escape(', '.join(row['callers'])[:80])}\n"
+            f"<code>{escape(row['sql'][:160])}</code>\n"
+            for i, row in enumerate(rows, 1)
+        ])
+
+    await update.message.reply_text(text, parse_mode="HTML")
+
+
 # ════════════════════════════════════════════════════════════════════════
 # تسجيل جميع المعالجات
 # ════════════════════════════════════════════════════════════════════════
@@ -228,16 +428,22 @@ def setup_handlers(app, db, pm):
 
     app.bot_data['pm'] = pm
     app.bot_data['db'] = db
+    # فحص أمان الرفع (handlers_advanced._security_check) - ذاكرة الأحكام في جدول scan_cache
+    app.bot_data['security'] = BotSecurityManager(db)
+
+    # ════ تحديد المعدل (قبل كل المعالجات) ════
+    app.add_handler(TypeHandler(Update, build_rate_limit_guard()), group=-1)
 
     # ── Wrapper functions ──
+    # كل معالج يعمل بمهلته من HANDLER_TIMEOUTS (update_scheduler)
     def _d(fn):
         """Wrapper للدوال التي تحتاج db فقط"""
-        async def w(u, c): return await fn(u, c, db)
+        async def w(u, c): return await update_scheduler.run_handler(fn.__name__, fn(u, c, db), u)
         return w
 
     def _dp(fn):
         """Wrapper للدوال التي تحتاج db و pm"""
-        async def w(u, c): return await fn(u, c, db, pm)
+        async def w(u, c): return await update_scheduler.run_handler(fn.__name__, fn(u, c, db, pm), u)
         return w
 
     # ════ أوامر ════
@@ -250,6 +456,7 @@ def setup_handlers(app, db, pm):
     app.add_handler(CommandHandler("ping",      ping_command))
     app.add_handler(CommandHandler("status",    _d(status_command)))
     app.add_handler(CommandHandler("bots",      _d(my_bots_command)))
+    app.add_handler(CommandHandler("dbprofile", _d(dbprofile_command)))
 
     # ════ تنقل أساسي ════
     app.add_handler(CallbackQueryHandler(_d(main_menu),              pattern="^main_menu$"))
@@ -283,7 +490,13 @@ def setup_handlers(app, db, pm):
     # ════ مدير الملفات ════
     app.add_handler(CallbackQueryHandler(_d(file_manager),           pattern=r"^files_\d+$"))
     app.add_handler(CallbackQueryHandler(_d(file_manager),           pattern=r"^browse_\d+_.+$"))
+    app.add_handler(CallbackQueryHandler(_d(file_manager),           pattern=r"^fm_\d+_\d+$"))
+    app.add_handler(CallbackQueryHandler(_d(file_manager_sort),      pattern=r"^fmsort_\d+_[nsm]$"))
+    app.add_handler(CallbackQueryHandler(_d(file_manager_clear_filter), pattern=r"^fmclr_\d+$"))
     app.add_handler(CallbackQueryHandler(_d(view_file),              pattern=r"^viewfile_\d+_.+$"))
+    app.add_handler(CallbackQueryHandler(_d(view_file_page),         pattern=r"^fv_\d+_(\d+|e)$"))
+    app.add_handler(CallbackQueryHandler(_d(view_file_search_next),  pattern=r"^fvn_\d+_\d+$"))
+    app.add_handler(CallbackQueryHandler(_d(undo_file_edit),         pattern=r"^fileundo_\d+_.+$"))
     app.add_handler(CallbackQueryHandler(_d(download_file),          pattern=r"^downloadfile_\d+_.+$"))
     app.add_handler(CallbackQueryHandler(_d(download_all),           pattern=r"^download_all_\d+$"))
     app.add_handler(CallbackQueryHandler(_d(delete_file),            pattern=r"^deletefile_\d+_.+$"))
@@ -296,6 +509,7 @@ def setup_handlers(app, db, pm):
     app.add_handler(CallbackQueryHandler(_d(change_main_file_start), pattern=r"^change_main_file_\d+$"))
     app.add_handler(CallbackQueryHandler(_d(set_main_file),          pattern=r"^set_main_file_\d+_.+$"))
     app.add_handler(CallbackQueryHandler(_d(toggle_auto_recovery),   pattern=r"^toggle_auto_recovery_\d+$"))
+    app.add_handler(CallbackQueryHandler(_dp(toggle_watch_mode),     pattern=r"^toggle_watch_\d+$"))
     app.add_handler(CallbackQueryHandler(_d(set_priority_menu),      pattern=r"^set_priority_\d+$"))
     app.add_handler(CallbackQueryHandler(_d(set_priority_execute),   pattern=r"^set_prio_[123]_\d+$"))
     app.add_handler(CallbackQueryHandler(_d(edit_description_start), pattern=r"^edit_description_\d+$"))
@@ -311,6 +525,7 @@ def setup_handlers(app, db, pm):
 
     # ════ لوحة الأدمن ════
     app.add_handler(CallbackQueryHandler(_d(sys_status),             pattern="^sys_status$"))
+    app.add_handler(CallbackQueryHandler(_d(admin_metrics),          pattern="^admin_metrics$"))
     app.add_handler(CallbackQueryHandler(_d(admin_panel),            pattern="^admin_panel$"))
     app.add_handler(CallbackQueryHandler(_d(admin_users),            pattern="^admin_users$"))
     app.add_handler(CallbackQueryHandler(_d(admin_pending),          pattern="^admin_pending$"))
@@ -460,6 +675,32 @@ def setup_handlers(app, db, pm):
         per_user=True, per_chat=True, allow_reentry=True,
     )
 
+    # ─ تصفية ملفات مدير الملفات ─
+    file_filter_conv = ConversationHandler(
+        entry_points=[CallbackQueryHandler(_d(file_manager_filter_start), pattern=r"^fmfind_\d+$")],
+        states={
+            CONVERSATION_STATES['WAIT_FILE_FILTER']: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, _d(file_manager_filter_apply)),
+                CommandHandler("cancel", cancel_handler)
+            ],
+        },
+        fallbacks=[CommandHandler("cancel", cancel_handler)],
+        per_user=True, per_chat=True, allow_reentry=True,
+    )
+
+    # ─ الانتقال والبحث في عارض الملفات ─
+    file_view_conv = ConversationHandler(
+        entry_points=[CallbackQueryHandler(_d(view_file_input_start), pattern=r"^fv(go|find)_\d+$")],
+        states={
+            CONVERSATION_STATES['WAIT_FILE_VIEW_INPUT']: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, _d(view_file_input_apply)),
+                CommandHandler("cancel", cancel_handler)
+            ],
+        },
+        fallbacks=[CommandHandler("cancel", cancel_handler)],
+        per_user=True, per_chat=True, allow_reentry=True,
+    )
+
     # ─ تغيير اسم البوت ─
     rename_conv = ConversationHandler(
         entry_points=[CallbackQueryHandler(_d(rename_bot_start), pattern=r"^rename_bot_\d+$")],
@@ -511,6 +752,10 @@ def setup_handlers(app, db, pm):
                 MessageHandler(filters.TEXT & ~filters.COMMAND, _d(backup_restore_execute)),
                 CommandHandler("cancel", cancel_handler)
             ],
+            WAIT_RESTORE_SCOPE: [
+                CallbackQueryHandler(_dp(backup_restore_scope), pattern=r"^backup_restore_scope_"),
+                CommandHandler("cancel", cancel_handler)
+            ],
         },
         fallbacks=[CommandHandler("cancel", cancel_handler)],
         per_user=True, per_chat=True, allow_reentry=True,
@@ -532,7 +777,7 @@ def setup_handlers(app, db, pm):
     # إضافة جميع ConversationHandlers
     for conv in [
         add_bot_conv, deploy_zip_conv, upload_file_conv, replace_file_conv,
-        edit_file_conv, rename_conv, desc_conv,
+        edit_file_conv, file_filter_conv, file_view_conv, rename_conv, desc_conv,
         backup_enc_conv, backup_restore_conv, backup_channel_conv,
     ]:
         app.add_handler(conv)
@@ -551,8 +796,14 @@ def setup_handlers(app, db, pm):
 def main():
     """نقطة الدخول الرئيسية"""
     try:
+        # البوتات المحلية بنفس المستخدم: /proc/<pid>/environ للمضيف يحمل الأسرار
+        if not make_non_dumpable():
+            logger.warning("⚠️ تعذّر PR_SET_DUMPABLE - بيئة المضيف مقروءة لعمليات البوتات")
         check_requirements()
         print_startup_banner()
+        # مجمّع عمليات فحص الرفع قبل أن تبدأ خيوط التطبيق
+        start_scan_pool()
+        query_profiler.configure()
 
         # تهيئة قاعدة البيانات
         db = Database(DATABASE_FILE)
@@ -569,15 +820,30 @@ def main():
         # تسجيل المعالجات
         total = setup_handlers(app, db, pm)
 
+        # جدولة النسخ الاحتياطي التلقائي
+        app.bot_data['backup_scheduler'] = BackupScheduler(db)
+        app.bot_data['backup_scheduler'].install(app)
+
+        # صيانة قاعدة البيانات (ANALYZE دوري)
+        app.bot_data['db_maintenance'] = DatabaseMaintenance(db)
+        app.bot_data['db_maintenance'].install(app)
+
+        # مواعيد انتهاء الخطط والوقت
+        pm.install_deadlines(app)
+
+        # الاتصال بعقد التشغيل الإضافية (إن وُجدت)
+        pm.nodes.install(app)
+
+        # مقاييس Prometheus على /metrics
+        ok, where = metrics_server.start()
+        logger.info(f"📈 المقاييس: {where}" if ok else f"📈 خادم المقاييس غير مفعّل: {where}")
+
         print("\n" + "=" * 58)
         print(f"🚀 NeurHostX V9.2 يعمل | {total} معالج مسجّل")
         print("   اضغط Ctrl+C للإيقاف")
         print("=" * 58 + "\n")
 
-        app.run_polling(
-            drop_pending_updates=True,
-            allowed_updates=Update.ALL_TYPES,
-        )
+        run_app(app, allowed_updates=Update.ALL_TYPES)
 
     except KeyboardInterrupt:
         print("\n🛑 تم إيقاف البوت بنجاح")
@@ -0,0 +1,350 @@
+# ============================================================================
+# سجل المقاييس - NeurHostX V9.2
+# ============================================================================
+"""
+سجل مقاييس داخل العملية بصيغة Prometheus النصية:
+- Counter / Gauge / Histogram (حاويات ثابتة) مع تسميات (labels)
+- آمن للاستخدام من الخيوط (استعلامات قاعدة البيانات تعمل أحياناً في asyncio.to_thread)
+- خادم HTTP محلي يعرض /metrics (قسم metrics في settings.json)
+- ملخص للوحة الأدمن: النسب المئوية تُقدَّر من الحاويات
+"""
+
+import time
+import inspect
+import logging
+import threading
+import functools
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from settings_manager import settings_manager
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)
+SLOW_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 900)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> Tuple[str, ...]:
+        if set(labels) != set(self.labels):
+            raise ValueError(f"{self.name}: التسميات المتوقعة {self.labels} وليس {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def _label_text(self, key: Tuple[str, ...], extra: str = "") -> str:
+        parts = [f'{name}="{_escape(value)}"' for name, value in zip(self.labels, key)]
+        if extra:
+            parts.append(extra)
+        return "{" + ",".join(parts) + "}" if parts else ""
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    """عدّاد تراكمي لا ينقص"""
+
+    kind = "counter"
+
+    def __init__(self, name, help_text, labels=()):
+        super().__init__(name, help_text, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def items(self) -> List[Tuple[Tuple[str, ...], float]]:
+        with self._lock:
+            return list(self._values.items())
+
+    def total(self) -> float:
+        return sum(value for _, value in self.items())
+
+    def render(self) -> List[str]:
+        return [f"{self.name}{self._label_text(key)} {_format_value(value)}" for key, value in sorted(self.items())]
+
+
+class Gauge(Counter):
+    """قيمة لحظية: تُضبط يدوياً أو تُحسب عند القراءة عبر set_function"""
+
+    kind = "gauge"
+
+    def __init__(self, name, help_text, labels=()):
+        super().__init__(name, help_text, labels)
+        self._function: Optional[Callable] = None
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, function: Callable):
+        """function() ترجع رقماً (بلا تسميات) أو {قيم التسميات (tuple): رقم}"""
+        self._function = function
+
+    def items(self):
+        if self._function is None:
+            return super().items()
+        try:
+            result = self._function()
+        except Exception as e:
+            logger.warning(f"⚠️ تعذّر حساب المقياس {self.name}: {e}")
+            return []
+        if isinstance(result, dict):
+            return [(tuple(str(v) for v in key), value) for key, value in result.items()]
+        return [((), result)]
+
+
+class Histogram(_Metric):
+    """توزيع القيم على حاويات ثابتة مع المجموع والعدد"""
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # key -> [عدد كل حاوية (غير تراكمي)، المجموع، العدد]
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = next(i for i, bound in enumerate(self.buckets) if value <= bound)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """قياس مدة كتلة with (يعمل أيضاً حول await)"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def series(self) -> Dict[Tuple[str, ...], Tuple[List[int], float, int]]:
+        with self._lock:
+            return {key: (list(counts), total, count) for key, (counts, total, count) in self._series.items()}
+
+    def quantile(self, q: float, key: Tuple[str, ...] = ()) -> Optional[float]:
+        """تقدير النسبة المئوية بالاستيفاء الخطي داخل الحاوية (كما يفعل histogram_quantile)"""
+        data = self.series().get(key)
+        if not data or not data[2]:
+            return None
+        counts, _, count = data
+        rank = q * count
+        seen = 0
+        lower = 0.0
+        for bound, bucket_count in zip(self.buckets, counts):
+            if seen + bucket_count >= rank and bucket_count:
+                if bound == float("inf"):
+                    return lower
+                return lower + (bound - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+            lower = bound if bound != float("inf") else lower
+        return lower
+
+    def render(self) -> List[str]:
+        lines = []
+        for key, (counts, total, count) in sorted(self.series().items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{self._label_text(key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{self._label_text(key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{self._label_text(key)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """كل المقاييس بالاسم (التسجيل المتكرر لنفس الاسم يرجع المقياس نفسه)"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name, help_text, labels, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help_text, labels, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"المقياس {name} مسجل بنوع {metric.kind}")
+            return metric
+
+    def counter(self, name, help_text, labels=()) -> Counter:
+        return self._register(Counter, name, help_text, labels)
+
+    def gauge(self, name, help_text, labels=()) -> Gauge:
+        return self._register(Gauge, name, help_text, labels)
+
+    def histogram(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram, name, help_text, labels, buckets=buckets)
+
+    def get(self, name) -> Optional[_Metric]:
+        return self._metrics.get(name)
+
+    def render(self) -> str:
+        """كل المقاييس بصيغة Prometheus النصية (text/plain; version=0.0.4)"""
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.header())
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+# ═══════════════════════════════════════════════════════════════════════════
+# مقاييس المضيف
+# ═══════════════════════════════════════════════════════════════════════════
+
+handler_seconds = metrics.histogram(
+    "neurhost_handler_seconds", "Handler latency by callback prefix or command", ("route",))
+handler_timeouts_total = metrics.counter(
+    "neurhost_handler_timeouts_total", "Handlers cancelled after exceeding their timeout", ("route",))
+loop_stalls_total = metrics.counter(
+    "neurhost_loop_stalls_total", "Event loop stalls attributed to running handlers", ("handler",))
+updates_in_flight = metrics.gauge(
+    "neurhost_updates_in_flight", "Updates being handled right now")
+updates_waiting = metrics.gauge(
+    "neurhost_updates_waiting", "Accepted updates waiting for their user's turn or a slot")
+
+db_query_seconds = metrics.histogram(
+    "neurhost_db_query_seconds", "Database call time per Database method", ("method",), buckets=QUERY_BUCKETS)
+
+monitor_tick_seconds = metrics.histogram(
+    "neurhost_monitor_tick_seconds", "Duration of one monitor/accounting tick", ("loop",), buckets=QUERY_BUCKETS)
+bots = metrics.gauge(
+    "neurhost_bots", "Hosted bots by state", ("state",))
+bot_crashes_total = metrics.counter(
+    "neurhost_bot_crashes_total", "Unexpected bot exits")
+bot_restarts_total = metrics.counter(
+    "neurhost_bot_restarts_total", "Bot restarts", ("kind",))
+pip_install_seconds = metrics.histogram(
+    "neurhost_pip_install_seconds", "pip install -r requirements.txt duration", ("result",), buckets=SLOW_BUCKETS)
+backup_seconds = metrics.histogram(
+    "neurhost_backup_seconds", "Full backup creation time", ("kind",), buckets=SLOW_BUCKETS)
+
+telegram_api_seconds = metrics.histogram(
+    "neurhost_telegram_api_seconds", "Bot API request latency", ("method",))
+telegram_api_errors_total = metrics.counter(
+    "neurhost_telegram_api_errors_total", "Bot API requests that failed (HTTP code or network)", ("method", "code"))
+telegram_api_rate_limited_total = metrics.counter(
+    "neurhost_telegram_api_rate_limited_total", "Bot API 429 Too Many Requests responses", ("method",))
+
+
+def timed_methods(histogram: Histogram, exclude: Iterable[str] = ()):
+    """مزخرف صنف: قياس زمن كل دالة عامة في histogram بتسمية method=اسم الدالة"""
+    excluded = set(exclude)
+
+    def wrap(name, function):
+        @functools.wraps(function)
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - started, method=name)
+        return timed
+
+    def decorate(cls):
+        for name, function in list(vars(cls).items()):
+            if name.startswith("_") or name in excluded or not inspect.isfunction(function):
+                continue
+            setattr(cls, name, wrap(name, function))
+        return cls
+
+    return decorate
+
+
+# ═══════════════════════════════════════════════════════════════════════════
+# خادم /metrics
+# ═══════════════════════════════════════════════════════════════════════════
+
+_METRICS_DEFAULTS = {
+    "enabled": True,
+    "listen": "127.0.0.1",     # محلي فقط: المقاييس تكشف أسماء الأوامر وحجم الحمل
+    "port": 9108,
+}
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry: MetricsRegistry = metrics
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        data = self.registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class MetricsServer:
+    """خادم HTTP في خيط خلفي لا يمر عبر حلقة الأحداث (يبقى متاحاً حتى لو توقفت)"""
+
+    def __init__(self, registry: MetricsRegistry = metrics):
+        self.registry = registry
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    def start(self) -> Tuple[bool, str]:
+        cfg = {**_METRICS_DEFAULTS, **settings_manager.get_section("metrics")}
+        if not cfg["enabled"]:
+            return False, "معطل في الإعدادات"
+        handler = type("MetricsHandler", (_MetricsHandler,), {"registry": self.registry})
+        try:
+            self._server = ThreadingHTTPServer((cfg["listen"], int(cfg["port"])), handler)
+        except OSError as e:
+            return False, f"تعذّر فتح {cfg['listen']}:{cfg['port']}: {e}"
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="metrics-http", daemon=True).start()
+        return True, f"http://{cfg['listen']}:{cfg['port']}/metrics"
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+metrics_server = MetricsServer()
@@ -3,13 +3,14 @@
 # ============================================================================
 """
 هذا الملف يحتوي على جميع المعالجات التي كانت مفقودة:
-- rename_bot, change_main_file, toggle_auto_recovery, set_priority, edit_description
+- rename_bot, change_main_file, toggle_auto_recovery, toggle_watch_mode, set_priority, edit_description
 - create_backup, delete_backup_menu, restore_backup_menu
 - bulk_stop_all, bulk_restart_all, bulk_stats_all
 - mute_duration_*, promote_role_*
 - admin_settings_system, _resources, _time, _files, _security, _save
 """
 
+import asyncio
 import logging
 import sqlite3
 from pathlib import Path
@@ -180,6 +181,28 @@ async def toggle_auto_recovery(update: Update, context: ContextTypes.DEFAULT_TYP
     await manage_bot_settings_show(query, bot_id, db)
 
 
+async def toggle_watch_mode(update: Update, context: ContextTypes.DEFAULT_TYPE, db, pm):
+    """تبديل وضع المراقبة (إعادة التحميل التلقائي عند تغير الملفات)"""
+    query = update.callback_query
+    bot_id = int(query.data.replace("toggle_watch_", ""))
+    bot = db.get_bot(bot_id)
+    if not bot or bot[1] != update.effective_user.id:
+        await query.answer("❌ غير مصرح", show_alert=True)
+        return
+
+    enabled = not (bot[30] if len(bot) > 30 else 0)
+    pm.set_watch_mode(bot_id, enabled, context.application)
+
+    if enabled:
+        backend = pm.watcher.backend(bot_id)
+        note = f" ({backend})" if backend else " - يبدأ عند تشغيل البوت"
+        await query.answer(f"👁️ وضع المراقبة: ✅ مفعّل{note}", show_alert=True)
+    else:
+        await query.answer("👁️ وضع المراقبة: ❌ معطّل", show_alert=True)
+
+    await manage_bot_settings_show(query, bot_id, db)
+
+
 async def manage_bot_settings_show(query, bot_id, db):
     """عرض إعدادات البوت"""
     bot = db.get_bot(bot_id)
@@ -189,6 +212,7 @@ async def manage_bot_settings_show(query, bot_id, db):
     auto_recovery = bot[28] if len(bot) > 28 else 0
     priority = bot[29] if len(bot) > 29 else 1
     description = bot[27] if len(bot) > 27 else ''
+    watch_mode = bot[30] if len(bot) > 30 else 0
 
     priority_text = {1: "🔵 عادي", 2: "🟡 متوسط", 3: "🔴 عالي"}.get(priority, "🔵 عادي")
 
@@ -198,6 +222,7 @@ async def manage_bot_settings_show(query, bot_id, db):
         f"{SUBDIV}\n"
         f"📄 الملف الرئيسي: <code>{bot[6]}</code>\n"
         f"🔄 استرجاع تلقائي: {'✅ مفعّل' if auto_recovery else '❌ معطّل'}\n"
+        f"👁️ وضع المراقبة: {'✅ مفعّل' if watch_mode else '❌ معطّل'}\n"
         f"⚡ الأولوية: {priority_text}\n"
         f"📝 الوصف: {safe_html_escape(description[:50]) if description else 'لا يوجد'}\n",
         parse_mode="HTML",
@@ -208,6 +233,10 @@ async def manage_bot_settings_show(query, bot_id, db):
                 f"{'🔄' if auto_recovery else '⏸️'} تبديل الاسترجاع التلقائي",
                 callback_data=f"toggle_auto_recovery_{bot_id}"
             )],
+            [InlineKeyboardButton(
+                f"{'✅' if watch_mode else '❌'} وضع المراقبة (إعادة تحميل تلقائي)",
+                callback_data=f"toggle_watch_{bot_id}"
+            )],
             [InlineKeyboardButton("⚡ تعيين الأولوية", callback_data=f"set_priority_{bot_id}")],
             [InlineKeyboardButton("📝 تعديل الوصف", callback_data=f"edit_description_{bot_id}")],
             [InlineKeyboardButton("🔙 رجوع", callback_data=f"manage_{bot_id}")]
@@ -331,7 +360,7 @@ async def bulk_stop_all_bots(update: Update, context: ContextTypes.DEFAULT_TYPE,
         if bot[2] == 'running':
             try:
                 if pm:
-                    pm.stop_bot(bot_id)
+                    await pm.stop_bot(bot_id)
                 stopped += 1
             except Exception as e:
                 logger.error(f"خطأ إيقاف {bot_id}: {e}")
@@ -359,22 +388,21 @@ async def bulk_restart_all_bots(update: Update, context: ContextTypes.DEFAULT_TY
     )
 
     pm = context.bot_data.get('pm')
-    success = 0
-    failed = 0
 
-    for bot in bots:
-        bot_id = bot[0]
-        if bot[2] == 'running':
-            try:
-                if pm:
-                    ok, _ = await pm.restart_bot(bot_id, context.application)
-                    if ok:
-                        success += 1
-                    else:
-                        failed += 1
-            except Exception as e:
-                logger.error(f"خطأ إعادة تشغيل {bot_id}: {e}")
-                failed += 1
+    async def _restart(bot_id):
+        try:
+            ok, _ = await pm.restart_bot(bot_id, context.application)
+            return ok
+        except Exception as e:
+            logger.error(f"خطأ إعادة تشغيل {bot_id}: {e}")
+            return False
+
+    # إعادة التشغيل بالتوازي: زمن العملية الجماعية = زمن أبطأ بوت
+    results = []
+    if pm:
+        results = await asyncio.gather(*(_restart(bot[0]) for bot in bots if bot[2] == 'running'))
+    success = sum(1 for ok in results if ok)
+    failed = len(results) - success
 
     await query.edit_message_text(
         f"{DIVIDER}\n✅ <b>اكتملت إعادة التشغيل الجماعية</b>\n{DIVIDER}\n\n"
@@ -625,13 +653,17 @@ async def admin_settings_security(update: Update, context: ContextTypes.DEFAULT_
         return
 
     from config import SECURITY_CONFIG
-    rate_limit = SECURITY_CONFIG.get('rate_limit', {})
+    buckets = SECURITY_CONFIG.get('rate_limit_buckets', {})
+    bucket_names = {'command': 'الأوامر', 'callback': 'الأزرار', 'upload': 'الرفع', 'message': 'الرسائل'}
+    bucket_lines = "".join(
+        f"   {bucket_names.get(kind, kind)}: {cfg.get('per_minute', 30)}/دقيقة (دفعة {cfg.get('burst', '-')})\n"
+        for kind, cfg in buckets.items()
+    )
 
     await query.edit_message_text(
         f"{DIVIDER}\n🔐 <b>إعدادات الأمان</b>\n{DIVIDER}\n\n"
         f"🚫 حد معدل الطلبات:\n"
-        f"   الحد: {rate_limit.get('max_requests', 30)} طلب\n"
-        f"   الفترة: {rate_limit.get('window', 60)} ثانية\n\n"
+        f"{bucket_lines}\n"
         f"🛡️ حظر IP التلقائي: {'✅' if SECURITY_CONFIG.get('auto_ban_enabled') else '❌'}\n"
         f"🔒 التحقق من التوكن: ✅ مفعّل\n\n"
         f"<i>للتعديل: افتح ملف config.py</i>",
@@ -684,13 +716,16 @@ async def create_bot_backup(update: Update, context: ContextTypes.DEFAULT_TYPE,
         return
 
     try:
-        buf = BytesIO()
-        with zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED) as zf:
-            for f in bot_path.rglob('*'):
-                if f.is_file() and not f.name.startswith('.') and f.suffix != '.pyc':
-                    zf.write(str(f), str(f.relative_to(bot_path.parent)))
-
-        buf.seek(0)
+        def _build_zip():
+            buf = BytesIO()
+            with zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED) as zf:
+                for f in bot_path.rglob('*'):
+                    if f.is_file() and not f.name.startswith('.') and f.suffix != '.pyc':
+                        zf.write(str(f), str(f.relative_to(bot_path.parent)))
+            buf.seek(0)
+            return buf
+
+        buf = await asyncio.to_thread(_build_zip)
         ts = datetime.now().strftime("%Y%m%d_%H%M")
         filename = f"backup_{bot[3]}_{ts}.zip"
         buf.name = filename
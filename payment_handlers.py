@@ -220,16 +220,15 @@ async def successful_payment_callback(update: Update, context: ContextTypes.DEFA
 
             bot = db.get_bot(bot_id)
             if bot:
-                current_total = bot[10] or 0
-                current_remaining = bot[11] or 0
-                db.update_bot_resources(
-                    bot_id,
-                    total_seconds=current_total + seconds_to_add,
-                    remaining_seconds=current_remaining + seconds_to_add,
-                    warned_low=0
-                )
+                db.credit_bot_time(bot_id, seconds_to_add, 'payment', period)
                 db.add_event_log(bot_id, "INFO", f"✅ تمت إضافة {days} يوم عبر الدفع")
                 bot_name = bot[3]
+
+                # البوت المجمّد بعد انتهاء وقته يستأنف فوراً (عبر الطابور إذا امتلأ المضيف)
+                pm = context.bot_data.get('pm')
+                if pm and pm.is_hibernated(bot_id) and bot[15]:
+                    db.set_sleep_mode(bot_id, False)
+                    await pm.start_bot(bot_id, context.application)
             else:
                 bot_name = f"البوت #{bot_id}"
 
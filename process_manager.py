@@ -7,13 +7,31 @@ import sys
 import time
 import signal
 import asyncio
+import hashlib
 import logging
 from pathlib import Path
+from datetime import datetime
 from config import (
     BOTS_DIRECTORY, PROCESS_RESTART_COOLDOWN_SECONDS, RESTART_TIME_COST_SECONDS, 
-    MAX_DAILY_RESTARTS, MONITOR_CHECK_INTERVAL_SECONDS, WARNING_COOLDOWN_SECONDS
+    MAX_DAILY_RESTARTS, MONITOR_CHECK_INTERVAL_SECONDS, LOW_TIME_WARNING_SECONDS,
+    STOP_GRACE_SECONDS, STOP_KILL_TIMEOUT_SECONDS,
+    ZYGOTE_ENABLED, ZYGOTE_PRELOAD_MODULES,
+    HIBERNATE_ENABLED, HIBERNATE_MAX_SECONDS, HIBERNATE_RECLAIM_MEMORY,
+    WORKER_LOCAL_FALLBACK
 )
 from helpers import seconds_to_human, get_current_time, safe_html_escape
+from bot_watcher import BotWatcher
+from restart_policy import RestartPolicy
+from resource_limits import ResourceLimiter
+from zygote import ZygotePool, without_agent_secrets
+from time_ledger import TimeLedger
+from deadline_scheduler import DeadlineScheduler
+from admission import AdmissionController
+from worker_nodes import NodePool
+from metrics import (
+    monitor_tick_seconds, bots as bots_gauge, bot_crashes_total,
+    bot_restarts_total, pip_install_seconds
+)
 
 try:
     import psutil
@@ -32,6 +50,40 @@ class ProcessManager:
         self.restart_cooldown = PROCESS_RESTART_COOLDOWN_SECONDS
         self.restart_time_cost = RESTART_TIME_COST_SECONDS
         self.max_restarts = MAX_DAILY_RESTARTS
+        self.watcher = BotWatcher(self)
+        self.restart_policy = RestartPolicy(db)
+        self.ledger = TimeLedger(db)
+        self._accounting_task = None
+        self.application = None
+        
+        # مواعيد التحذير والسكون وانتهاء الخطط
+        self.deadlines = DeadlineScheduler()
+        self.deadlines.register('time_warning', self._on_time_warning)
+        self.deadlines.register('time_expired', self._on_time_expired)
+        self.deadlines.register('hibernate_timeout', self._on_hibernate_timeout)
+        self.deadlines.register('plan_expired', self._on_plan_expired)
+        db.add_change_listener(self._on_db_change)
+        
+        # عقد التشغيل الإضافية (WORKER_AGENTS)
+        self.nodes = NodePool()
+        
+        # سعة المضيف وطابور التشغيل
+        self.admission = AdmissionController(self)
+        self.limiter = ResourceLimiter(db)
+        self.zygote = ZygotePool(ZYGOTE_PRELOAD_MODULES) if ZYGOTE_ENABLED and os.name != 'nt' else None
+        bots_gauge.set_function(self._bot_counts)
+
+    def _bot_counts(self):
+        """أعداد البوتات حسب الحالة لمقياس neurhost_bots (تُحسب عند القراءة)"""
+        counts = {('running',): 0, ('hibernated',): 0, ('remote',): 0, ('queued',): len(self.admission)}
+        for data in list(self.processes.values()):
+            if data.get('frozen_at'):
+                counts[('hibernated',)] += 1
+            elif getattr(data['process'], 'remote', False):
+                counts[('remote',)] += 1
+            else:
+                counts[('running',)] += 1
+        return counts
 
     async def start_bot(self, bot_id, application):
         """بدء البوت مع معالجة أخطاء محسّنة"""
@@ -39,27 +91,52 @@ class ProcessManager:
         if not bot:
             return False, "❌ البوت غير موجود"
         
-        # استخراج البيانات من الـ tuple
-        user_id = bot[1]
-        token = bot[2]
-        name = bot[3]
-        status = bot[4]
-        folder = bot[5]
-        main_file = bot[6]
-        pid = bot[7]
-        total_seconds = bot[10]
+        # التشغيل (يدوياً أو من المؤقت) يلغي أي إعادة تشغيل مجدولة
+        self.restart_policy.cancel(bot_id)
+        self.application = application
+        
         remaining_seconds = bot[11]
         sleep_mode = bot[15]
         
         # التحقق من الحالات
         if sleep_mode:
+            self.admission.discard(bot_id)
             self.db.add_event_log(bot_id, "WARNING", "⚠️ البوت في وضع السكون")
             return False, "⚠️ البوت في وضع السكون. استخدم الاسترجاع اليومي لإيقاظه."
         
         if remaining_seconds <= 0:
+            self.admission.discard(bot_id)
             self.db.add_event_log(bot_id, "WARNING", "⚠️ انتهت فترة الاستضافة")
             return False, "⚠️ انتهت فترة الاستضافة. أضف وقتاً جديداً."
         
+        # سعة المضيف: قبول فوري أو انتظار في الطابور حسب الأولوية
+        admitted, position = await self.admission.admit(bot)
+        if not admitted:
+            if not self.is_hibernated(bot_id):
+                self.db.update_bot_status(bot_id, "queued", None)
+            self.db.add_event_log(bot_id, "INFO", f"📋 المضيف ممتلئ - في الطابور (الموقع {position})")
+            return False, (
+                f"📋 المضيف ممتلئ حالياً - البوت في طابور الانتظار (الموقع {position}).\n"
+                f"سيعمل تلقائياً عند توفر السعة."
+            )
+        
+        try:
+            # البوت مجمّد: استئناف العملية نفسها بدل تشغيل بارد
+            if self.is_hibernated(bot_id):
+                return self.resume_bot(bot_id)
+            return await self._launch_bot(bot, application)
+        finally:
+            self.admission.release(bot_id)
+    
+    async def _launch_bot(self, bot, application):
+        """تشغيل عملية البوت بعد قبولها"""
+        bot_id = bot[0]
+        user_id = bot[1]
+        token = bot[2]
+        folder = bot[5]
+        main_file = bot[6]
+        pid = bot[7]
+        
         # التحقق من مسار البوت
         bot_path = Path(BOTS_DIRECTORY) / folder
         if not bot_path.exists():
@@ -71,8 +148,11 @@ class ProcessManager:
             self.db.add_event_log(bot_id, "ERROR", f"❌ الملف {main_file} غير موجود")
             return False, f"❌ الملف الرئيسي ({main_file}) غير موجود"
         
-        # قتل العملية القديمة إذا كانت موجودة
-        if pid:
+        # قتل العملية القديمة إذا كانت موجودة (على العقدة التي كانت تشغّله أو محلياً)
+        old_node = bot[32] if len(bot) > 32 else None
+        if old_node:
+            await self.nodes.stop_bot(old_node, bot_id)
+        elif pid:
             try:
                 if os.name != 'nt':
                     os.killpg(os.getpgid(pid), signal.SIGKILL)
@@ -82,49 +162,66 @@ class ProcessManager:
             except Exception as e:
                 logger.warning(f"فشل قتل العملية القديمة: {e}")
         
-        # تثبيت المتطلبات إذا وجدت
         req_file = bot_path / "requirements.txt"
-        if req_file.exists():
+        
+        # عقدة تشغيل بسعة كافية إن وُجدت عقد (المزامنة والمتطلبات تتم عليها)
+        process = None
+        node = self.nodes.place(self.limiter.limits_for(user_id)['memory_limit_mb']) if self.nodes else None
+        if node is not None:
             try:
-                logger.info(f"🔧 جاري تثبيت متطلبات البوت {bot_id}...")
-                process = await asyncio.create_subprocess_exec(
-                    sys.executable, "-m", "pip", "install", "-q", "-r", str(req_file),
-                    cwd=str(bot_path),
-                    stdout=asyncio.subprocess.PIPE,
-                    stderr=asyncio.subprocess.PIPE
+                process = await self.nodes.start_bot(
+                    node, bot_id, bot_path, main_file,
+                    env={"BOT_TOKEN": token} if token else {},
+                    setup=self.limiter.remote_setup(user_id),
+                    requirements_hash=hashlib.sha256(req_file.read_bytes()).hexdigest() if req_file.exists() else None
                 )
-                await asyncio.wait_for(process.wait(), timeout=120)
-                self.db.add_event_log(bot_id, "INFO", "✅ تم تثبيت المتطلبات بنجاح")
-                logger.info(f"✅ تم تثبيت المتطلبات للبوت {bot_id}")
-            except asyncio.TimeoutError:
-                logger.warning(f"انتهت مهلة تثبيت المتطلبات: {bot_id}")
-                self.db.add_event_log(bot_id, "WARNING", "⚠️ انتهت مهلة تثبيت المتطلبات")
             except Exception as e:
-                logger.warning(f"فشل تثبيت المتطلبات: {e}")
-                self.db.add_event_log(bot_id, "WARNING", f"⚠️ فشل تثبيت المتطلبات")
+                logger.warning(f"فشل التشغيل على العقدة {node.address} للبوت {bot_id}: {e}")
+        
+        if process is None and self.nodes and not WORKER_LOCAL_FALLBACK:
+            self.db.add_event_log(bot_id, "ERROR", "❌ لا توجد عقدة تشغيل متاحة")
+            return False, "❌ لا توجد عقدة تشغيل متاحة حالياً"
+        
+        # تثبيت المتطلبات إذا وجدت (فقط عند تغير requirements.txt)
+        if process is None and req_file.exists():
+            await self._install_requirements(bot_id, bot_path, req_file, bot[31] if len(bot) > 31 else None)
         
         # إنشاء مجلد السجلات
         logs_dir = bot_path / "logs"
         logs_dir.mkdir(exist_ok=True)
         
-        # تحضير البيئة
-        env = os.environ.copy()
+        # تحضير البيئة (بدون أسرار عقد التشغيل)
+        env = without_agent_secrets(os.environ)
         if token:
             env["BOT_TOKEN"] = token
         
         # بدء البوت
         try:
-            stdout_file = open(logs_dir / "stdout.log", "a", encoding="utf-8")
-            stderr_file = open(logs_dir / "stderr.log", "a", encoding="utf-8")
+            stdout_file = stderr_file = None
+            if process is None and self.zygote:
+                try:
+                    process = await self.zygote.spawn(
+                        cwd=str(bot_path),
+                        main=main_file,
+                        env=env,
+                        stdout=str(logs_dir / "stdout.log"),
+                        stderr=str(logs_dir / "stderr.log"),
+                        setup=self.limiter.child_setup(bot_id, user_id)
+                    )
+                except Exception as e:
+                    logger.warning(f"فشل التشغيل عبر zygote للبوت {bot_id}: {e} - تشغيل مفسّر جديد")
             
-            process = await asyncio.create_subprocess_exec(
-                sys.executable, main_file,
-                cwd=str(bot_path),
-                env=env,
-                stdout=stdout_file,
-                stderr=stderr_file,
-                preexec_fn=os.setsid if os.name != 'nt' else None
-            )
+            if process is None:
+                stdout_file = open(logs_dir / "stdout.log", "a", encoding="utf-8")
+                stderr_file = open(logs_dir / "stderr.log", "a", encoding="utf-8")
+                process = await asyncio.create_subprocess_exec(
+                    sys.executable, main_file,
+                    cwd=str(bot_path),
+                    env=env,
+                    stdout=stdout_file,
+                    stderr=stderr_file,
+                    preexec_fn=self.limiter.prepare(bot_id, user_id) if os.name != 'nt' else None
+                )
             
             self.processes[bot_id] = {
                 'process': process,
@@ -132,82 +229,454 @@ class ProcessManager:
                 'stderr': stderr_file,
                 'started_at': time.time()
             }
+            self._start_accounting(bot_id)
             
             # تحديث قاعدة البيانات
             now_timestamp = int(time.time())
+            remote = getattr(process, 'remote', False)
             self.db.update_bot_status(bot_id, "running", process.pid)
+            self.db.set_bot_node(bot_id, process.node.address if remote else None)
             self.db.update_bot_resources(
                 bot_id,
                 start_time=get_current_time(),
-                restart_count=0,
                 started_at_timestamp=now_timestamp,
                 uptime_seconds=0
             )
             
             # بدء المراقبة
-            if bot_id in self.monitor_tasks:
-                self.monitor_tasks[bot_id].cancel()
-            
+            self._cancel_monitor(bot_id)
             self.monitor_tasks[bot_id] = application.create_task(
                 self._monitor_bot(bot_id, user_id, application)
             )
             
-            self.db.add_event_log(bot_id, "INFO", "✅ تم بدء البوت بنجاح")
-            logger.info(f"✅ تم بدء البوت {bot_id} بنجاح مع PID {process.pid}")
-            return True, f"✅ تم بدء البوت بنجاح\n🆔 PID: {process.pid}"
+            # وضع المراقبة: إعادة التحميل التلقائي عند تغير الملفات
+            if len(bot) > 30 and bot[30]:
+                self.watcher.start(bot_id, bot_path, application)
+            
+            where = f" على العقدة {process.node.name}" if remote else ""
+            self.db.add_event_log(bot_id, "INFO", f"✅ تم بدء البوت بنجاح{where}")
+            logger.info(f"✅ تم بدء البوت {bot_id} بنجاح مع PID {process.pid}{where}")
+            return True, f"✅ تم بدء البوت بنجاح{where}\n🆔 PID: {process.pid}"
             
         except Exception as e:
             logger.exception(f"فشل بدء البوت {bot_id}: {e}")
             self.db.add_event_log(bot_id, "CRITICAL", f"❌ فشل البدء: {str(e)[:80]}")
             return False, f"❌ فشل بدء البوت: {str(e)[:50]}"
 
-    def stop_bot(self, bot_id):
-        """إيقاف البوت"""
-        if bot_id in self.processes:
-            proc_data = self.processes[bot_id]
-            process = proc_data['process']
-            
+    async def _install_requirements(self, bot_id, bot_path, req_file, installed_hash):
+        """تثبيت المتطلبات عبر pip إلا إذا لم يتغير الملف منذ آخر تثبيت ناجح"""
+        req_hash = hashlib.sha256(req_file.read_bytes()).hexdigest()
+        if req_hash == installed_hash:
+            logger.info(f"⏭️ المتطلبات لم تتغير للبوت {bot_id} - تخطي pip")
+            return
+        
+        started = time.perf_counter()
+        result = "failed"
+        try:
+            logger.info(f"🔧 جاري تثبيت متطلبات البوت {bot_id}...")
+            process = await asyncio.create_subprocess_exec(
+                sys.executable, "-m", "pip", "install", "-q", "-r", str(req_file),
+                cwd=str(bot_path),
+                env=without_agent_secrets(os.environ),
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE
+            )
+            _, stderr = await asyncio.wait_for(process.communicate(), timeout=120)
+            if process.returncode == 0:
+                result = "ok"
+                self.db.set_requirements_hash(bot_id, req_hash)
+                # المكتبات المحمّلة مسبقاً قد تكون تغيّرت
+                if self.zygote:
+                    self.zygote.refresh()
+                self.db.add_event_log(bot_id, "INFO", "✅ تم تثبيت المتطلبات بنجاح")
+                logger.info(f"✅ تم تثبيت المتطلبات للبوت {bot_id}")
+            else:
+                error = stderr.decode('utf-8', errors='replace').strip().splitlines()
+                self.db.add_event_log(
+                    bot_id, "WARNING", f"⚠️ فشل تثبيت المتطلبات: {error[-1][:100] if error else process.returncode}"
+                )
+        except asyncio.TimeoutError:
+            result = "timeout"
             try:
-                if os.name != 'nt':
-                    os.killpg(os.getpgid(process.pid), signal.SIGTERM)
-                else:
-                    process.terminate()
-                
-                # إغلاق ملفات السجل
+                process.kill()
+            except ProcessLookupError:
+                pass
+            logger.warning(f"انتهت مهلة تثبيت المتطلبات: {bot_id}")
+            self.db.add_event_log(bot_id, "WARNING", "⚠️ انتهت مهلة تثبيت المتطلبات")
+        except Exception as e:
+            logger.warning(f"فشل تثبيت المتطلبات: {e}")
+            self.db.add_event_log(bot_id, "WARNING", f"⚠️ فشل تثبيت المتطلبات")
+        finally:
+            pip_install_seconds.observe(time.perf_counter() - started, result=result)
+
+    def set_watch_mode(self, bot_id, enabled, application=None):
+        """تفعيل/تعطيل وضع المراقبة (يبدأ فوراً إذا كان البوت يعمل)"""
+        self.db.set_watch_mode(bot_id, enabled)
+        if not enabled:
+            self.watcher.stop(bot_id)
+            return
+        bot = self.db.get_bot(bot_id)
+        if bot and application is not None and self.is_bot_running(bot_id):
+            self.watcher.start(bot_id, Path(BOTS_DIRECTORY) / bot[5], application)
+
+    @staticmethod
+    def _signal_group(process, sig):
+        """إرسال إشارة لمجموعة عمليات البوت (البوت يبدأ بـ setsid فمعرف المجموعة = PID)"""
+        try:
+            if getattr(process, 'remote', False):
+                # العقدة ترسل الإشارة للمجموعة هناك
+                process.send_signal(sig)
+            elif os.name != 'nt':
+                os.killpg(process.pid, sig)
+            elif sig == signal.SIGTERM:
+                process.terminate()
+            else:
+                process.kill()
+            return True
+        except (ProcessLookupError, PermissionError):
+            return False
+
+    @staticmethod
+    def _close_logs(proc_data):
+        """إغلاق ملفات السجل بعد انتهاء العملية"""
+        for key in ('stdout', 'stderr'):
+            try:
+                proc_data[key].close()
+            except Exception:
+                pass
+
+    @staticmethod
+    def _append_log(path, text):
+        path.parent.mkdir(exist_ok=True)
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(f"\n--- {get_current_time()} (worker node) ---\n{text}")
+
+    def _cancel_monitor(self, bot_id):
+        """إلغاء مهمة المراقبة (إلا إذا كان الإيقاف صادراً منها)"""
+        task = self.monitor_tasks.pop(bot_id, None)
+        if task is not None and task is not asyncio.current_task():
+            task.cancel()
+
+    async def _terminate(self, bot_id, proc_data, grace):
+        """SIGTERM ← انتظار غير حاجز حتى grace ← SIGKILL للمجموعة ← حصاد
+
+        Returns:
+            (زمن الإيقاف بالثواني، هل احتاج SIGKILL، رمز الخروج)
+        """
+        process = proc_data['process']
+        started = time.monotonic()
+        forced = False
+
+        # العملية المجمّدة لا تعالج SIGTERM حتى تُذاب
+        if proc_data.get('frozen_at'):
+            self._set_frozen(bot_id, proc_data, False)
+
+        if process.returncode is None and self._signal_group(process, signal.SIGTERM):
+            try:
+                await asyncio.wait_for(process.wait(), timeout=grace)
+            except asyncio.TimeoutError:
+                forced = True
+                logger.warning(f"⏱️ البوت {bot_id} لم يتوقف خلال {grace}s - إرسال SIGKILL")
+                self._signal_group(process, signal.SIGKILL)
                 try:
-                    proc_data['stdout'].close()
-                    proc_data['stderr'].close()
-                except:
-                    pass
-                
+                    await asyncio.wait_for(process.wait(), timeout=STOP_KILL_TIMEOUT_SECONDS)
+                except asyncio.TimeoutError:
+                    logger.error(f"❌ تعذّر حصاد عملية البوت {bot_id} (PID {process.pid})")
+
+        # عمليات فرعية بقيت في المجموعة بعد خروج العملية الرئيسية
+        if process.returncode is not None and os.name != 'nt':
+            self._signal_group(process, signal.SIGKILL)
+
+        self._close_logs(proc_data)
+        await asyncio.to_thread(self.limiter.release, bot_id)
+        return time.monotonic() - started, forced, process.returncode
+
+    async def stop_bot(self, bot_id, keep_watch=False, grace=None):
+        """إيقاف البوت بلطف مع التصعيد (keep_watch: إبقاء مراقبة الملفات عند إعادة التشغيل)
+
+        Returns:
+            {'latency': ثواني الإيقاف، 'forced': هل احتاج SIGKILL، 'exit_code': رمز الخروج}
+        """
+        if not keep_watch:
+            self.watcher.stop(bot_id)
+        
+        # الإيقاف اليدوي يلغي أي إعادة تشغيل مجدولة بعد عطل
+        if self.restart_policy.cancel(bot_id):
+            self.restart_policy.reset(bot_id)
+        
+        # إزالة العملية أولاً حتى تتوقف حلقة المراقبة ولا تعتبره توقفاً مفاجئاً
+        proc_data = self.processes.pop(bot_id, None)
+        self._stop_accounting(bot_id)
+        self.deadlines.cancel('hibernate_timeout', bot_id)
+        self.admission.discard(bot_id)
+        self._cancel_monitor(bot_id)
+        
+        result = {'latency': 0.0, 'forced': False, 'exit_code': None}
+        if proc_data:
+            try:
+                latency, forced, exit_code = await self._terminate(
+                    bot_id, proc_data, STOP_GRACE_SECONDS if grace is None else grace
+                )
+                result = {'latency': latency, 'forced': forced, 'exit_code': exit_code}
             except Exception as e:
                 logger.warning(f"خطأ في إيقاف البوت {bot_id}: {e}")
-            
-            del self.processes[bot_id]
-        
-        # إلغاء مهمة المراقبة
-        if bot_id in self.monitor_tasks:
-            self.monitor_tasks[bot_id].cancel()
-            del self.monitor_tasks[bot_id]
+                self._close_logs(proc_data)
         
         # تحديث قاعدة البيانات
         self.db.update_bot_status(bot_id, "stopped", None)
-        self.db.add_event_log(bot_id, "INFO", "⏹ تم إيقاف البوت")
+        self.admission.wake()
+        if proc_data:
+            how = "قسرياً (SIGKILL)" if result['forced'] else "بلطف"
+            self.db.add_event_log(bot_id, "INFO", f"⏹ تم إيقاف البوت {how} خلال {result['latency']:.2f}s")
+            logger.info(f"⏹ البوت {bot_id} توقف {how} خلال {result['latency']:.2f}s")
+        else:
+            self.db.add_event_log(bot_id, "INFO", "⏹ تم إيقاف البوت")
+        return result
+
+    # ═══════════════════════════════════════════════════════════════════════
+    # التجميد (Hibernation)
+    # ═══════════════════════════════════════════════════════════════════════
+
+    def is_hibernated(self, bot_id):
+        """هل البوت مجمّد (العملية حية بذاكرتها لكن لا تستهلك المعالج)"""
+        proc_data = self.processes.get(bot_id)
+        return bool(proc_data and proc_data.get('frozen_at'))
+
+    def _set_frozen(self, bot_id, proc_data, frozen):
+        """تجميد/إذابة المجموعة بـ cgroup freezer وإلا بـ SIGSTOP/SIGCONT: الطريقة المستخدمة"""
+        if self.limiter.freeze(bot_id, frozen):
+            method = "cgroup"
+        else:
+            self._signal_group(proc_data['process'], signal.SIGSTOP if frozen else signal.SIGCONT)
+            method = "signal"
+        proc_data['frozen_at'] = time.time() if frozen else None
+        return method
+
+    async def hibernate_bot(self, bot_id):
+        """تجميد البوت بدل إيقافه (False إذا تعذّر: يجب إيقافه عندها)"""
+        proc_data = self.processes.get(bot_id)
+        if os.name == 'nt' or not proc_data or proc_data['process'].returncode is not None:
+            return False
+        if proc_data.get('frozen_at'):
+            return True
+        
+        method = self._set_frozen(bot_id, proc_data, True)
+        self._stop_accounting(bot_id)
+        self.deadlines.schedule('hibernate_timeout', bot_id, proc_data['frozen_at'] + HIBERNATE_MAX_SECONDS)
+        self.db.update_bot_status(bot_id, "hibernated", proc_data['process'].pid)
+        
+        note = ""
+        if HIBERNATE_RECLAIM_MEMORY and method == "cgroup":
+            freed = await asyncio.to_thread(self.limiter.reclaim, bot_id)
+            if freed:
+                note = f" - حُرر {freed / (1024 * 1024):.0f} MB"
+        self.db.add_event_log(bot_id, "INFO", f"🧊 تم تجميد البوت ({method}){note}")
+        logger.info(f"🧊 البوت {bot_id} مجمّد ({method}){note}")
         return True
 
-    async def restart_bot(self, bot_id, application):
-        """إعادة تشغيل البوت"""
-        self.stop_bot(bot_id)
-        await asyncio.sleep(2)
+    def resume_bot(self, bot_id):
+        """استئناف البوت المجمّد: إذابة فقط، دون تشغيل مفسّر أو إعادة تحميل"""
+        proc_data = self.processes.get(bot_id)
+        if not proc_data or not proc_data.get('frozen_at'):
+            return False, "❌ البوت غير مجمّد"
+        
+        started = time.perf_counter()
+        frozen_for = time.time() - proc_data['frozen_at']
+        self._set_frozen(bot_id, proc_data, False)
+        latency_ms = (time.perf_counter() - started) * 1000
+        self.deadlines.cancel('hibernate_timeout', bot_id)
+        self._start_accounting(bot_id)
+        
+        # الوقت المستهلك يُحسب من لحظة الاستئناف كما في التشغيل العادي
+        self.db.update_bot_status(bot_id, "running", proc_data['process'].pid)
+        self.db.update_bot_resources(
+            bot_id,
+            start_time=get_current_time(),
+            started_at_timestamp=int(time.time()),
+            uptime_seconds=0
+        )
+        self.db.add_event_log(
+            bot_id, "INFO",
+            f"☀️ استئناف من التجميد خلال {latency_ms:.2f}ms (كان مجمّداً {seconds_to_human(max(1, int(frozen_for)))})"
+        )
+        return True, f"✅ تم استئناف البوت خلال {latency_ms:.2f}ms"
+
+    # ═══════════════════════════════════════════════════════════════════════
+    # محاسبة وقت الاستضافة
+    # ═══════════════════════════════════════════════════════════════════════
+
+    def _start_accounting(self, bot_id):
+        """بدء خصم وقت البوت (وتشغيل حلقة المحاسبة إن لم تكن تعمل)"""
+        self.ledger.start(bot_id)
+        if self._accounting_task is None or self._accounting_task.done():
+            self._accounting_task = asyncio.get_running_loop().create_task(self._accounting_loop())
+        self._schedule_time_deadlines(bot_id)
+
+    def _stop_accounting(self, bot_id):
+        """إيقاف خصم وقت البوت وإلغاء مواعيده"""
+        self.ledger.stop(bot_id)
+        self.deadlines.cancel('time_warning', bot_id)
+        self.deadlines.cancel('time_expired', bot_id)
+
+    async def _accounting_loop(self):
+        """دورة واحدة لكل البوتات: قيد خصم مجمّع بدل كتابة لكل بوت"""
+        while self.ledger.active:
+            await asyncio.sleep(MONITOR_CHECK_INTERVAL_SECONDS)
+            try:
+                with monitor_tick_seconds.time(loop="accounting"):
+                    self.ledger.tick()
+            except Exception as e:
+                logger.exception(f"خطأ في محاسبة وقت الاستضافة: {e}")
+
+    # ═══════════════════════════════════════════════════════════════════════
+    # مواعيد الوقت والخطط
+    # ═══════════════════════════════════════════════════════════════════════
+
+    def _schedule_time_deadlines(self, bot_id):
+        """حساب موعدي التحذير والسكون من الرصيد (يُعاد عند كل تشغيل أو إضافة وقت)"""
+        bot = self.db.get_bot(bot_id)
+        if not bot or self.is_hibernated(bot_id) or bot_id not in self.processes:
+            return
+        remaining = bot[11] - self.ledger.unbilled(bot_id)
+        expires_at = time.time() + max(0.0, remaining)
+        self.deadlines.schedule('time_expired', bot_id, expires_at)
+        if bot[20]:  # warned_low: تم التحذير لهذا الرصيد
+            self.deadlines.cancel('time_warning', bot_id)
+        else:
+            self.deadlines.schedule('time_warning', bot_id, expires_at - LOW_TIME_WARNING_SECONDS)
+
+    def schedule_plan_expiry(self, user_id):
+        """جدولة تخفيض الخطة عند انتهائها (أو إلغاؤه إذا لم تعد مؤقتة)"""
+        end_date = self.db.get_plan_expiry(user_id)
+        if not end_date:
+            self.deadlines.cancel('plan_expired', user_id)
+            return
+        try:
+            deadline = datetime.fromisoformat(end_date).timestamp()
+        except (ValueError, TypeError):
+            logger.warning(f"⚠️ تاريخ انتهاء خطة غير صالح للمستخدم {user_id}: {end_date}")
+            return
+        self.deadlines.schedule('plan_expired', user_id, deadline)
+
+    def install_deadlines(self, application) -> bool:
+        """بناء المواعيد بعد بدء حلقة التطبيق (المجدول يحتاج حلقة تعمل)"""
+        self.application = application
+        if application.job_queue is None:
+            logger.warning("⚠️ JobQueue غير متاح - مواعيد انتهاء الخطط تُبنى عند أول تغيير")
+            return False
+        application.job_queue.run_once(self._rebuild_deadlines_job, when=1, name="rebuild_deadlines")
+        return True
+
+    async def _rebuild_deadlines_job(self, context):
+        self.rebuild_deadlines()
+
+    def rebuild_deadlines(self):
+        """إعادة بناء المواعيد من قاعدة البيانات (عند بدء التشغيل)"""
+        for user_id, _ in self.db.get_plan_expiries():
+            self.schedule_plan_expiry(user_id)
+        for bot_id in list(self.processes):
+            self._schedule_time_deadlines(bot_id)
+        logger.info(f"⏰ تم بناء {len(self.deadlines)} موعد")
+
+    def _on_db_change(self, kind, key):
+        """تحديث المواعيد فور تغيّر الرصيد أو الخطة"""
+        if kind == 'bot_time' and self.ledger.active and key in self.processes:
+            self._schedule_time_deadlines(key)
+        elif kind == 'user_plan':
+            self.schedule_plan_expiry(key)
+
+    async def _send_owner(self, user_id, text):
+        if self.application is None:
+            return
+        try:
+            await self.application.bot.send_message(chat_id=user_id, text=text, parse_mode="HTML")
+        except Exception as e:
+            logger.warning(f"فشل إرسال الإشعار: {e}")
+
+    async def _on_time_warning(self, bot_id):
+        bot = self.db.get_bot(bot_id)
+        if not bot or bot[20] or bot_id not in self.processes:
+            return
+        remaining = max(0, int(bot[11] - self.ledger.unbilled(bot_id)))
+        self.db.update_bot_resources(bot_id, warned_low=1)
+        await self._send_owner(bot[1], (
+            f"⚠️ <b>تحذير الوقت</b>\n"
+            f"{'─' * 30}\n\n"
+            f"🤖 البوت: <code>{safe_html_escape(bot[3])}</code>\n"
+            f"⏰ الوقت المتبقي: <b>{seconds_to_human(remaining)}</b>\n\n"
+            f"💡 أضف وقتاً إضافياً لتجنب دخول وضع السكون"
+        ))
+
+    async def _on_time_expired(self, bot_id):
+        """انتهاء الرصيد: تجميد البوت (أو إيقافه) وإدخاله وضع السكون"""
+        proc_data = self.processes.get(bot_id)
+        bot = self.db.get_bot(bot_id)
+        if not bot or not proc_data or proc_data.get('frozen_at'):
+            return
+        
+        # رصيد أُضيف دون إشعار (مثلاً من عملية أخرى): إعادة الجدولة بدل السكون
+        if bot[11] - self.ledger.unbilled(bot_id) >= 1:
+            self._schedule_time_deadlines(bot_id)
+            return
+        
+        self.db.set_sleep_mode(bot_id, True, "انتهت فترة الاستضافة")
+        hibernated = HIBERNATE_ENABLED and await self.hibernate_bot(bot_id)
+        if not hibernated:
+            await self.stop_bot(bot_id)
+        self.admission.wake()
+        self.db.add_event_log(bot_id, "INFO", "😴 دخل وضع السكون")
+        
+        state_note = (
+            "🧊 تم تجميد البوت مع الحفاظ على حالته، ويستأنف فوراً عند إضافة وقت.\n\n"
+            if hibernated else ""
+        )
+        await self._send_owner(bot[1], (
+            f"😴 <b>وضع السكون</b>\n"
+            f"{'─' * 30}\n\n"
+            f"🤖 البوت: <code>{safe_html_escape(bot[3])}</code>\n\n"
+            f"انتهى وقت الاستضافة ودخل البوت وضع السكون.\n"
+            f"{state_note}\n"
+            f"✨ استخدم <b>الاسترجاع اليومي</b> للحصول على ساعتين مجاناً!"
+        ))
+
+    async def _on_hibernate_timeout(self, bot_id):
+        """إيقاف البوت المجمّد نهائياً بعد HIBERNATE_MAX_SECONDS لتحرير ذاكرته"""
+        if self.is_hibernated(bot_id):
+            # المجمّد لإفساح المجال يبقى في موقعه بالطابور ويعمل لاحقاً تشغيلاً بارداً
+            queued = self.admission.detach(bot_id)
+            await self.stop_bot(bot_id)
+            if queued:
+                self.admission.restore(bot_id, queued)
+                self.db.update_bot_status(bot_id, "queued", None)
+            self.db.add_event_log(bot_id, "INFO", "⏹ إيقاف البوت بعد طول التجميد")
+
+    async def _on_plan_expired(self, user_id):
+        """تخفيض الخطة المنتهية إلى المجانية"""
+        if not self.db.expire_user_plan(user_id):
+            # تم التجديد أو لم يحن الموعد (تغيير الساعة): إعادة الجدولة من القيمة الحالية
+            self.schedule_plan_expiry(user_id)
+            return
+        logger.info(f"📉 انتهت خطة المستخدم {user_id} - تخفيض إلى المجانية")
+        await self._send_owner(user_id, (
+            f"📉 <b>انتهت خطتك</b>\n"
+            f"{'─' * 30}\n\n"
+            f"تم تحويل حسابك إلى الخطة المجانية.\n"
+            f"💎 يمكنك التجديد في أي وقت من قائمة الخطط."
+        ))
+
+    async def restart_bot(self, bot_id, application, kind="manual"):
+        """إعادة تشغيل البوت (يبدأ فور خروج العملية القديمة)"""
+        bot_restarts_total.inc(kind=kind)
+        await self.stop_bot(bot_id, keep_watch=True)
         return await self.start_bot(bot_id, application)
 
     async def _monitor_bot(self, bot_id, user_id, application):
         """مراقبة البوت بشكل مستمر"""
-        last_warning_time = 0
-        
         while bot_id in self.processes:
+            tick_started = None
             try:
                 await asyncio.sleep(MONITOR_CHECK_INTERVAL_SECONDS)
+                tick_started = time.perf_counter()
                 
                 bot = self.db.get_bot(bot_id)
                 if not bot:
@@ -219,20 +688,34 @@ class ProcessManager:
                 
                 process = proc_data['process']
                 
-                # التحقق من توقف العملية
+                # التحقق من توقف العملية (تم حصادها بالفعل)
                 if process.returncode is not None:
+                    self.processes.pop(bot_id, None)
+                    self._stop_accounting(bot_id)
+                    self.admission.wake()
+                    self._close_logs(proc_data)
+                    if os.name != 'nt':
+                        self._signal_group(process, signal.SIGKILL)
                     self.db.add_event_log(
                         bot_id,
                         "WARNING",
                         f"⚠️ توقف البوت برمز: {process.returncode}"
                     )
-                    await self._handle_unexpected_stop(bot_id, user_id, application)
+                    if self.limiter.oom_kills(bot_id):
+                        self.db.add_event_log(bot_id, "WARNING", "🧠 تم قتل البوت لتجاوزه حد الذاكرة في خطته")
+                    await asyncio.to_thread(self.limiter.release, bot_id)
+                    await self._handle_unexpected_stop(bot_id, user_id, application, proc_data)
                     break
                 
+                # المجمّد لا يستهلك وقت الاستضافة ولا موارد
+                if proc_data.get('frozen_at'):
+                    continue
+                
                 # الحصول على استخدام الموارد
                 cpu, mem = self.get_bot_usage(bot_id)
                 
-                # حساب وقت التشغيل الدقيق
+                # وقت التشغيل للعرض فقط؛ الاستهلاك تخصمه حلقة المحاسبة ومواعيد
+                # التحذير والسكون يتولاها مجدول المواعيد
                 started_at = bot[26]  # started_at_timestamp
                 if started_at:
                     now_timestamp = int(time.time())
@@ -240,76 +723,59 @@ class ProcessManager:
                 else:
                     actual_uptime = 0
                 
-                # حساب الوقت المتبقي
-                initial_time = bot[10]  # total_seconds
-                remaining = max(0, initial_time - actual_uptime)
-                
                 self.db.update_bot_resources(
                     bot_id,
-                    remaining_seconds=remaining,
                     cpu_usage=cpu,
                     mem_usage=mem,
                     uptime_seconds=actual_uptime
                 )
                 
-                # تحذير الوقت المنخفض
-                current_time = time.time()
-                if remaining > 0 and remaining <= 600 and (current_time - last_warning_time) > WARNING_COOLDOWN_SECONDS:
-                    try:
-                        await application.bot.send_message(
-                            chat_id=user_id,
-                            text=(
-                                f"⚠️ <b>تحذير الوقت</b>\n"
-                                f"{'─' * 30}\n\n"
-                                f"🤖 البوت: <code>{safe_html_escape(bot[3])}</code>\n"
-                                f"⏰ الوقت المتبقي: <b>{seconds_to_human(remaining)}</b>\n\n"
-                                f"💡 أضف وقتاً إضافياً لتجنب دخول وضع السكون"
-                            ),
-                            parse_mode="HTML"
-                        )
-                        last_warning_time = current_time
-                    except Exception as e:
-                        logger.warning(f"فشل إرسال التحذير: {e}")
-                
-                # وضع السكون عند انتهاء الوقت
-                if remaining <= 0:
-                    self.db.set_sleep_mode(bot_id, True, "انتهت فترة الاستضافة")
-                    self.stop_bot(bot_id)
-                    self.db.add_event_log(bot_id, "INFO", "😴 دخل وضع السكون")
-                    
-                    try:
-                        await application.bot.send_message(
-                            chat_id=user_id,
-                            text=(
-                                f"😴 <b>وضع السكون</b>\n"
-                                f"{'─' * 30}\n\n"
-                                f"🤖 البوت: <code>{safe_html_escape(bot[3])}</code>\n\n"
-                                f"انتهى وقت الاستضافة ودخل البوت وضع السكون.\n\n"
-                                f"✨ استخدم <b>الاسترجاع اليومي</b> للحصول على ساعتين مجاناً!"
-                            ),
-                            parse_mode="HTML"
-                        )
-                    except Exception:
-                        pass
-                    
-                    break
-                
             except asyncio.CancelledError:
                 break
             except Exception as e:
                 logger.exception(f"خطأ في حلقة المراقبة للبوت {bot_id}: {e}")
+            finally:
+                if tick_started is not None:
+                    monitor_tick_seconds.observe(time.perf_counter() - tick_started, loop="bot")
+
+    async def _handle_unexpected_stop(self, bot_id, user_id, application, proc_data):
+        """معالجة التوقف المفاجئ: تسجيل العطل ثم انتظار بتراجع أسي أو تعليق البوت
 
-    async def _handle_unexpected_stop(self, bot_id, user_id, application):
-        """معالجة التوقف المفاجئ"""
+        الانتظار يتم بمؤقت في الحلقة (حالة cooldown)، فتنتهي مهمة المراقبة فوراً.
+        """
         bot = self.db.get_bot(bot_id)
         if not bot:
             return
         
-        restart_count = bot[17]  # restart_count
+        process = proc_data['process']
+        uptime = time.time() - proc_data['started_at']
+        stderr_path = Path(BOTS_DIRECTORY) / bot[5] / "logs" / "stderr.log"
+        if getattr(process, 'remote', False) and process.stderr_tail:
+            # سجل العقدة يُنسخ محلياً ليظهر في السجلات ويُستخرج منه سبب العطل
+            await asyncio.to_thread(self._append_log, stderr_path, process.stderr_tail)
+        bot_crashes_total.inc()
+        decision = await asyncio.to_thread(
+            self.restart_policy.record_crash, bot_id, process.returncode, uptime, stderr_path
+        )
+        used, limit = decision['used'], decision['limit']
+        limit_text = "∞" if limit < 0 else str(limit)
         
-        # إذا تجاوز الحد الأقصى لإعادة التشغيل
-        if restart_count >= self.max_restarts:
+        self.db.update_bot_resources(
+            bot_id,
+            restart_count=used,
+            total_restarts=(bot[23] or 0) + 1,
+            last_error=decision['reason'][:200]
+        )
+        self.db.add_event_log(bot_id, "ERROR", f"💥 عطل ({used}/{limit_text} خلال 24 ساعة): {decision['reason'][:150]}")
+        
+        # تجاوز ميزانية الأعطال: تعليق البوت مع ملخص الأسباب
+        if decision['action'] == 'suspend':
             self.db.set_sleep_mode(bot_id, True, "تجاوز عدد إعادة التشغيل")
+            self.db.update_bot_status(bot_id, "stopped", None)
+            summary = self.restart_policy.crash_summary(bot_id)
+            summary_text = "\n".join(
+                f"• {count}× <code>{safe_html_escape(reason[:80])}</code>" for reason, count, _ in summary
+            )
             try:
                 await application.bot.send_message(
                     chat_id=user_id,
@@ -317,8 +783,8 @@ class ProcessManager:
                         f"⚠️ <b>توقف البوت نهائياً</b>\n"
                         f"{'─' * 30}\n\n"
                         f"🤖 البوت: <code>{safe_html_escape(bot[3])}</code>\n\n"
-                        f"توقف البوت بشكل متكرر وتم إدخاله في وضع السكون.\n"
-                        f"تحقق من الأخطاء في السجلات."
+                        f"توقف البوت {used} مرة خلال 24 ساعة (الحد {limit_text}) وتم إدخاله في وضع السكون.\n\n"
+                        f"🔎 <b>أكثر الأسباب تكراراً:</b>\n{summary_text}"
                     ),
                     parse_mode="HTML"
                 )
@@ -328,52 +794,74 @@ class ProcessManager:
             return
         
         # خصم وقت من إعادة التشغيل
-        new_time = max(0, bot[11] - self.restart_time_cost)
+        self.db.debit_bot_time_batch([(bot_id, self.restart_time_cost)], kind='restart')
+        self.db.update_bot_resources(bot_id, last_restart_at=get_current_time())
         
-        self.db.update_bot_resources(
-            bot_id,
-            remaining_seconds=new_time,
-            restart_count=restart_count + 1,
-            last_restart_at=get_current_time()
+        delay = decision['delay']
+        self.db.update_bot_status(bot_id, "cooldown", None)
+        self.restart_policy.schedule(
+            bot_id, delay,
+            lambda: self._restart_after_cooldown(bot_id, user_id, application, decision)
         )
+        logger.info(f"⏳ البوت {bot_id} في انتظار إعادة التشغيل بعد {delay:.1f}s (عطل متتالٍ #{decision['consecutive']})")
+
+    async def _restart_after_cooldown(self, bot_id, user_id, application, decision):
+        """إعادة التشغيل عند انتهاء فترة الانتظار"""
+        bot = self.db.get_bot(bot_id)
+        if not bot or bot[4] != "cooldown" or bot[15]:
+            return
         
-        # انتظار قبل إعادة التشغيل
-        await asyncio.sleep(5)
-        
-        # إعادة التشغيل التلقائي
         success, msg = await self.start_bot(bot_id, application)
+        limit_text = "∞" if decision['limit'] < 0 else str(decision['limit'])
+        if success:
+            bot_restarts_total.inc(kind="auto")
         
         if success:
-            try:
-                await application.bot.send_message(
-                    chat_id=user_id,
-                    text=(
-                        f"♻️ <b>إعادة تشغيل تلقائية</b>\n"
-                        f"{'─' * 30}\n\n"
-                        f"🤖 البوت: <code>{safe_html_escape(bot[3])}</code>\n\n"
-                        f"تم اكتشاف توقف غير متوقع وإعادة تشغيل البوت تلقائياً.\n"
-                        f"📊 عدد إعادات التشغيل: {restart_count + 1}/{self.max_restarts}"
-                    ),
-                    parse_mode="HTML"
-                )
-            except Exception:
-                pass
-            self.db.add_event_log(bot_id, "INFO", f"✅ إعادة تشغيل تلقائية #{restart_count + 1}")
+            # إشعار في العطل 1 و2 و4 و8... حتى لا تُغرق حلقة الأعطال المحادثة
+            consecutive = decision['consecutive']
+            if consecutive & (consecutive - 1) == 0:
+                try:
+                    await application.bot.send_message(
+                        chat_id=user_id,
+                        text=(
+                            f"♻️ <b>إعادة تشغيل تلقائية</b>\n"
+                            f"{'─' * 30}\n\n"
+                            f"🤖 البوت: <code>{safe_html_escape(bot[3])}</code>\n"
+                            f"💥 السبب: <code>{safe_html_escape(decision['reason'][:120])}</code>\n"
+                            f"⏳ بعد انتظار: {decision['delay']:.0f}s\n"
+                            f"📊 الأعطال خلال 24 ساعة: {decision['used']}/{limit_text}"
+                        ),
+                        parse_mode="HTML"
+                    )
+                except Exception:
+                    pass
+            self.db.add_event_log(bot_id, "INFO", f"✅ إعادة تشغيل تلقائية #{decision['used']}")
         else:
+            self.db.update_bot_status(bot_id, "stopped", None)
             self.db.add_event_log(bot_id, "ERROR", f"❌ فشل إعادة التشغيل التلقائية: {msg}")
 
     def get_bot_usage(self, bot_id):
-        """الحصول على استخدام الموارد"""
-        if not psutil:
-            return 0.0, 0.0
-        
+        """الحصول على استخدام الموارد (من cgroup للبوت كاملاً، أو psutil للعملية الرئيسية)"""
         proc_data = self.processes.get(bot_id)
         if not proc_data:
             return 0.0, 0.0
         
+        if getattr(proc_data['process'], 'remote', False):
+            return proc_data['process'].usage
+        
+        usage = self.limiter.usage(bot_id)
+        if usage is not None:
+            return usage
+        
+        if not psutil:
+            return 0.0, 0.0
+        
         try:
-            process = psutil.Process(proc_data['process'].pid)
-            cpu = process.cpu_percent(interval=0.1)
+            # نفس كائن psutil بين الفحوص: cpu_percent يقيس منذ الاستدعاء السابق دون حجز الحلقة
+            process = proc_data.get('psutil')
+            if process is None:
+                process = proc_data['psutil'] = psutil.Process(proc_data['process'].pid)
+            cpu = process.cpu_percent(interval=None)
             mem = process.memory_info().rss / (1024 * 1024)
             return cpu, mem
         except:
@@ -396,7 +884,10 @@ class ProcessManager:
 
     async def stop_all_bots(self):
         """إيقاف جميع البوتات"""
+        self.admission.close()
         bot_ids = list(self.processes.keys())
-        for bot_id in bot_ids:
-            self.stop_bot(bot_id)
+        await asyncio.gather(*(self.stop_bot(bot_id) for bot_id in bot_ids))
+        if self.zygote:
+            await self.zygote.close()
+        await self.nodes.close()
         logger.info(f"تم إيقاف {len(bot_ids)} بوت")
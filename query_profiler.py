@@ -0,0 +1,315 @@
+# ============================================================================
+# محلل استعلامات قاعدة البيانات - NeurHostX V9.2
+# ============================================================================
+"""
+قياس كل عبارة SQL تنفذها طبقة Database:
+- لكل عبارة (بعد توحيد الثوابت): العدد، الزمن الكلي/المتوسط/p99، الصفوف المُرجعة،
+  والدوال التي تنفذها
+- الزمن يشمل execute وجلب الصفوف (fetch*) لأن SQLite ينفذ الاستعلام أثناء الجلب
+- العبارات الأبطأ من slow_query_ms تُسجَّل مع EXPLAIN QUERY PLAN في logs/slow_queries.log
+- يُفعَّل ويُعطَّل أثناء التشغيل (/dbprofile)؛ عند التعطيل تُفتح الاتصالات بالصنف
+  الافتراضي لـ sqlite3 فلا توجد أي كلفة إضافية
+"""
+
+import re
+import sys
+import time
+import sqlite3
+import logging
+import threading
+from collections import deque
+from logging.handlers import RotatingFileHandler
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from config import LOGS_DIRECTORY
+from settings_manager import settings_manager
+
+logger = logging.getLogger(__name__)
+
+_PROFILER_DEFAULTS = {
+    "enabled": False,
+    "slow_query_ms": 100,
+    "explain_interval_seconds": 60,   # أقصى خطة واحدة لكل عبارة خلال هذه المدة
+}
+_SAMPLES_PER_STATEMENT = 512
+_EXPLAINABLE = ("SELECT", "UPDATE", "DELETE", "INSERT", "REPLACE", "WITH")
+
+_WS_RE = re.compile(r"\s+")
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r"\b\d+(?:\.\d+)?\b")
+_IN_LIST_RE = re.compile(r"\bIN\s*\(\s*\?(?:\s*,\s*\?)+\s*\)", re.IGNORECASE)
+
+
+def normalize_sql(sql: str) -> str:
+    """شكل موحد للعبارة: مسافات مضغوطة، الثوابت ← ?، وقوائم IN (?, ?, ...) ← IN (?...)"""
+    sql = _WS_RE.sub(" ", sql).strip()
+    sql = _STRING_RE.sub("?", sql)
+    sql = _NUMBER_RE.sub("?", sql)
+    return _IN_LIST_RE.sub("IN (?...)", sql)
+
+
+class _StatementStats:
+    __slots__ = ("sql", "count", "total", "max", "rows", "callers", "samples")
+
+    def __init__(self, sql: str):
+        self.sql = sql
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.rows = 0
+        self.callers = set()
+        self.samples = deque(maxlen=_SAMPLES_PER_STATEMENT)
+
+    def p99(self) -> float:
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]
+
+
+class ProfilingCursor(sqlite3.Cursor):
+    """مؤشر يقيس execute والجلب ويُسلّم القياس عند العبارة التالية أو الإغلاق"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._pending = None    # [العبارة، المعاملات، الزمن، الصفوف، الدالة]
+
+    def _finish(self):
+        pending, self._pending = self._pending, None
+        if pending is not None:
+            query_profiler.record(self.connection, *pending)
+
+    def _timed_execute(self, method, sql, params, caller):
+        self._finish()
+        started = time.perf_counter()
+        try:
+            method(sql, params)
+        finally:
+            self._pending = [sql, params, time.perf_counter() - started, 0, caller]
+        return self
+
+    def execute(self, sql, params=()):
+        return self._execute(sql, params, sys._getframe(1).f_code.co_name)
+
+    def executemany(self, sql, seq_of_params):
+        return self._executemany(sql, seq_of_params, sys._getframe(1).f_code.co_name)
+
+    def _execute(self, sql, params, caller):
+        return self._timed_execute(super().execute, sql, params, caller)
+
+    def _executemany(self, sql, seq_of_params, caller):
+        self._timed_execute(super().executemany, sql, seq_of_params, caller)
+        self._pending[1] = None     # لا تُستخدم في EXPLAIN (مولّد مُستهلك)
+        self._pending[3] = max(self.rowcount, 0)
+        return self
+
+    def _timed_fetch(self, method, *args):
+        started = time.perf_counter()
+        result = method(*args)
+        if self._pending is not None:
+            self._pending[2] += time.perf_counter() - started
+            if isinstance(result, list):
+                self._pending[3] += len(result)
+            elif result is not None:
+                self._pending[3] += 1
+        return result
+
+    def fetchone(self):
+        return self._timed_fetch(super().fetchone)
+
+    def fetchmany(self, size=None):
+        return self._timed_fetch(super().fetchmany, size if size is not None else self.arraysize)
+
+    def fetchall(self):
+        return self._timed_fetch(super().fetchall)
+
+    def __next__(self):
+        return self._timed_fetch(super().__next__)
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        try:
+            self._finish()
+        except Exception:
+            pass
+
+
+class ProfilingConnection(sqlite3.Connection):
+    """اتصال ينشئ ProfilingCursor دائماً
+
+    Connection.execute المدمجة تنفذ عبر C مباشرة متجاوزة ProfilingCursor.execute،
+    لذا تمر الاختصارات هنا عبر self.cursor() صراحة (executescript لا يُقاس)
+    """
+
+    def __init__(self, database, *args, **kwargs):
+        super().__init__(database, *args, **kwargs)
+        self.database_path = str(database)
+
+    def cursor(self, factory=ProfilingCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, params=()):
+        return self.cursor()._execute(sql, params, sys._getframe(1).f_code.co_name)
+
+    def executemany(self, sql, seq_of_params):
+        return self.cursor()._executemany(sql, seq_of_params, sys._getframe(1).f_code.co_name)
+
+
+class QueryProfiler:
+    """إحصائيات العبارات وسجل الاستعلامات البطيئة"""
+
+    def __init__(self):
+        self.enabled = False
+        self.slow_seconds = _PROFILER_DEFAULTS["slow_query_ms"] / 1000
+        self.explain_interval = _PROFILER_DEFAULTS["explain_interval_seconds"]
+        self.started_at: Optional[float] = None
+        self._stats: Dict[str, _StatementStats] = {}
+        self._explained: Dict[str, float] = {}
+        self.slow_log: deque = deque(maxlen=50)
+        self._lock = threading.Lock()
+        self._slow_logger: Optional[logging.Logger] = None
+
+    # ═══════════════════════════════════════════════════════════════════════
+    # التحكم
+    # ═══════════════════════════════════════════════════════════════════════
+
+    def configure(self):
+        """تطبيق قسم db_profiler من settings.json (عند بدء التشغيل)"""
+        cfg = {**_PROFILER_DEFAULTS, **settings_manager.get_section("db_profiler")}
+        self.slow_seconds = float(cfg["slow_query_ms"]) / 1000
+        self.explain_interval = float(cfg["explain_interval_seconds"])
+        if cfg["enabled"]:
+            self.enable()
+
+    def enable(self, slow_query_ms: Optional[float] = None):
+        if slow_query_ms is not None:
+            self.slow_seconds = slow_query_ms / 1000
+        if not self.enabled:
+            self.started_at = time.monotonic()
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+            self._explained.clear()
+            self.slow_log.clear()
+        self.started_at = time.monotonic() if self.enabled else None
+
+    def connect(self, db_file, **kwargs) -> sqlite3.Connection:
+        """sqlite3.connect مع القياس إذا كان مفعلاً (الاتصالات المفتوحة لا تتأثر بالتبديل)"""
+        if self.enabled:
+            kwargs["factory"] = ProfilingConnection
+        return sqlite3.connect(db_file, **kwargs)
+
+    # ═══════════════════════════════════════════════════════════════════════
+    # التسجيل
+    # ═══════════════════════════════════════════════════════════════════════
+
+    def record(self, connection, sql: str, params, elapsed: float, rows: int, caller: str):
+        key = normalize_sql(sql)
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = _StatementStats(key)
+            stats.count += 1
+            stats.total += elapsed
+            stats.max = max(stats.max, elapsed)
+            stats.rows += rows
+            stats.callers.add(caller)
+            stats.samples.append(elapsed)
+            explain = False
+            if elapsed >= self.slow_seconds:
+                now = time.monotonic()
+                if now - self._explained.get(key, -self.explain_interval) >= self.explain_interval:
+                    self._explained[key] = now
+                    explain = True
+        if elapsed >= self.slow_seconds:
+            self._log_slow(connection, key, sql, params, elapsed, rows, caller, explain)
+
+    def _explain(self, connection, sql: str, params) -> List[str]:
+        """EXPLAIN QUERY PLAN على اتصال جديد (الأصلي قد يكون أُغلق)"""
+        if not sql.lstrip().upper().startswith(_EXPLAINABLE) or params is None:
+            return []
+        path = getattr(connection, "database_path", None)
+        if not path:
+            return []
+        conn = sqlite3.connect(path, timeout=5)
+        try:
+            rows = conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+        except sqlite3.Error as e:
+            return [f"(تعذّر EXPLAIN: {e})"]
+        finally:
+            conn.close()
+        return [row[-1] for row in rows]
+
+    def _log_slow(self, connection, key, sql, params, elapsed, rows, caller, explain):
+        plan = self._explain(connection, sql, params) if explain else []
+        self.slow_log.append({
+            "sql": key, "ms": elapsed * 1000, "rows": rows, "caller": caller,
+            "plan": plan, "at": time.time(),
+        })
+        text = f"🐌 {elapsed * 1000:.1f}ms | {caller} | {rows} صف | {key}"
+        if plan:
+            text += "\n    " + "\n    ".join(plan)
+        self._get_slow_logger().warning(text)
+
+    def _get_slow_logger(self) -> logging.Logger:
+        if self._slow_logger is None:
+            slow_logger = logging.getLogger("neurhost.slow_queries")
+            try:
+                Path(LOGS_DIRECTORY).mkdir(exist_ok=True)
+                handler = RotatingFileHandler(
+                    Path(LOGS_DIRECTORY) / "slow_queries.log",
+                    maxBytes=2 * 1024 * 1024, backupCount=3, encoding="utf-8"
+                )
+                handler.setFormatter(logging.Formatter("%(asctime)s - %(message)s"))
+                slow_logger.addHandler(handler)
+            except OSError as e:
+                logger.warning(f"⚠️ تعذّر فتح سجل الاستعلامات البطيئة: {e}")
+            self._slow_logger = slow_logger
+        return self._slow_logger
+
+    # ═══════════════════════════════════════════════════════════════════════
+    # التقرير
+    # ═══════════════════════════════════════════════════════════════════════
+
+    def report(self, top: int = 10, order_by: str = "total") -> List[dict]:
+        """أعلى العبارات حسب total أو avg أو p99 أو count أو rows"""
+        with self._lock:
+            rows = [
+                {
+                    "sql": s.sql, "count": s.count, "total_ms": s.total * 1000,
+                    "avg_ms": s.total * 1000 / s.count, "p99_ms": s.p99() * 1000,
+                    "max_ms": s.max * 1000, "rows": s.rows, "callers": sorted(s.callers),
+                }
+                for s in self._stats.values() if s.count
+            ]
+        key = {"total": "total_ms", "avg": "avg_ms", "p99": "p99_ms"}.get(order_by, order_by)
+        if rows and key not in rows[0]:
+            key = "total_ms"
+        return sorted(rows, key=lambda r: r[key], reverse=True)[:top]
+
+    def summary(self) -> dict:
+        with self._lock:
+            count = sum(s.count for s in self._stats.values())
+            total = sum(s.total for s in self._stats.values())
+            statements = len(self._stats)
+        return {
+            "enabled": self.enabled,
+            "statements": statements,
+            "queries": count,
+            "total_ms": total * 1000,
+            "slow": len(self.slow_log),
+            "slow_query_ms": self.slow_seconds * 1000,
+            "window_seconds": time.monotonic() - self.started_at if self.started_at else 0,
+        }
+
+
+query_profiler = QueryProfiler()
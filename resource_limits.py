@@ -0,0 +1,273 @@
+# ============================================================================
+# عزل موارد البوتات - NeurHostX V9.2
+# ============================================================================
+"""
+تطبيق حدود الخطة (cpu_limit / memory_limit_mb / pids_limit) على عمليات البوتات:
+- cgroup v2: مجموعة مستقلة لكل بوت (cpu.max و memory.max و pids.max)
+  والإحصائيات تُقرأ مباشرة من cpu.stat و memory.current
+- بديل عند عدم توفر cgroup v2: setrlimit و nice في العملية الجديدة قبل تشغيل كودها
+"""
+
+import os
+import time
+import signal
+import logging
+import functools
+from pathlib import Path
+from typing import Callable, Dict, Optional, Tuple
+
+from config import (
+    ADMIN_ID, PLANS, RESOURCE_LIMITS_ENABLED,
+    CGROUP_ROOT, CGROUP_CPU_PERIOD_US
+)
+from zygote import apply_child_setup
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+_REQUIRED_CONTROLLERS = ("cpu", "memory", "pids")
+
+# حدود احتياطية إذا لم تُعرف خطة المستخدم
+_DEFAULT_LIMITS = {'cpu_limit': 50, 'memory_limit_mb': 256, 'pids_limit': 64}
+
+
+def _write(path: Path, value: str):
+    with open(path, 'w') as f:
+        f.write(value)
+
+
+def _read(path: Path) -> str:
+    with open(path) as f:
+        return f.read()
+
+
+class ResourceLimiter:
+    """حدود موارد البوتات حسب الخطة"""
+
+    def __init__(self, db, root: str = CGROUP_ROOT):
+        self.db = db
+        self.root = Path(root)
+        self._samples: Dict[int, Tuple[float, int]] = {}
+        self.backend = self._detect() if RESOURCE_LIMITS_ENABLED else "none"
+        logger.info(f"🧱 عزل الموارد: {self.backend}")
+
+    # ═══════════════════════════════════════════════════════════════════════
+    # الاكتشاف والتهيئة
+    # ═══════════════════════════════════════════════════════════════════════
+
+    def _detect(self) -> str:
+        if os.name == 'nt':
+            return "none"
+        try:
+            self._init_cgroup_root()
+            return "cgroup2"
+        except OSError as e:
+            logger.info(f"cgroup v2 غير متاح ({e}) - استخدام setrlimit")
+        return "rlimit" if resource else "none"
+
+    def _init_cgroup_root(self):
+        """إنشاء المجلد الأب وتفعيل المتحكمات له ولأبنائه"""
+        parent = self.root.parent
+        available = _read(parent / "cgroup.controllers").split()
+        missing = [c for c in _REQUIRED_CONTROLLERS if c not in available]
+        if missing:
+            raise OSError(f"متحكمات غير متاحة: {', '.join(missing)}")
+
+        controllers = " ".join(f"+{c}" for c in _REQUIRED_CONTROLLERS)
+        enabled = _read(parent / "cgroup.subtree_control").split()
+        if any(c not in enabled for c in _REQUIRED_CONTROLLERS):
+            _write(parent / "cgroup.subtree_control", controllers)
+        self.root.mkdir(exist_ok=True)
+        _write(self.root / "cgroup.subtree_control", controllers)
+
+    def _cgroup(self, bot_id: int) -> Path:
+        return self.root / f"bot-{bot_id}"
+
+    # ═══════════════════════════════════════════════════════════════════════
+    # الحدود
+    # ═══════════════════════════════════════════════════════════════════════
+
+    def limits_for(self, user_id: int) -> dict:
+        """حدود الخطة الحالية للمستخدم"""
+        plan = PLANS.get(self.db.get_user_plan(user_id, ADMIN_ID), {})
+        return {key: plan.get(key, default) for key, default in _DEFAULT_LIMITS.items()}
+
+    def child_setup(self, bot_id: int, user_id: int) -> dict:
+        """تجهيز الحدود قبل التشغيل ووصف ما تطبّقه العملية الجديدة على نفسها
+
+        الوصف قابل للتسلسل (JSON) ليُرسل إلى الـ zygote أيضاً، وتطبّقه
+        apply_child_setup قبل تنفيذ كود البوت، فلا تفلت أي عملية فرعية من الحدود.
+        """
+        limits = self.limits_for(user_id)
+
+        if self.backend == "cgroup2":
+            try:
+                return {'cgroup_procs': str(self._setup_cgroup(bot_id, limits) / "cgroup.procs")}
+            except OSError as e:
+                logger.warning(f"فشل إنشاء cgroup للبوت {bot_id}: {e} - استخدام setrlimit")
+
+        if self.backend in ("cgroup2", "rlimit") and resource:
+            return self._rlimit_setup(limits)
+        return {}
+
+    def remote_setup(self, user_id: int) -> dict:
+        """وصف الحدود لبوت يعمل على عقدة أخرى (setrlimit و nice تطبّقهما العقدة)"""
+        if resource is None or not RESOURCE_LIMITS_ENABLED:
+            return {}
+        return self._rlimit_setup(self.limits_for(user_id))
+
+    def prepare(self, bot_id: int, user_id: int) -> Callable[[], None]:
+        """preexec_fn للعملية الجديدة: جلسة جديدة (setsid) ثم حدود الخطة"""
+        return functools.partial(apply_child_setup, self.child_setup(bot_id, user_id))
+
+    def _setup_cgroup(self, bot_id: int, limits: dict) -> Path:
+        cgroup = self._cgroup(bot_id)
+        if cgroup.exists():
+            self._kill_cgroup(cgroup)
+        cgroup.mkdir(exist_ok=True)
+
+        quota = int(CGROUP_CPU_PERIOD_US * limits['cpu_limit'] / 100)
+        _write(cgroup / "cpu.max", f"{quota} {CGROUP_CPU_PERIOD_US}")
+        memory = limits['memory_limit_mb'] * 1024 * 1024
+        _write(cgroup / "memory.max", str(memory))
+        # بدون swap لا يتجاوز البوت حده بالتبديل على حساب بقية المضيف
+        if (cgroup / "memory.swap.max").exists():
+            _write(cgroup / "memory.swap.max", "0")
+        _write(cgroup / "pids.max", str(limits['pids_limit']))
+
+        self._samples.pop(bot_id, None)
+        return cgroup
+
+    @staticmethod
+    def _rlimit_setup(limits: dict) -> dict:
+        """بديل setrlimit: الذاكرة بـ RLIMIT_DATA (أقرب إلى الاستخدام الفعلي من RLIMIT_AS)
+        والمعالج بأولوية nice، لأن rlimit لا يعرف نسبة المعالج ولا عدّاد عمليات لكل بوت.
+        """
+        memory = limits['memory_limit_mb'] * 1024 * 1024
+        memory_limit = 'RLIMIT_DATA' if hasattr(resource, 'RLIMIT_DATA') else 'RLIMIT_AS'
+        return {
+            'rlimits': [(memory_limit, memory), ('RLIMIT_CORE', 0)],
+            'nice': max(0, round((100 - limits['cpu_limit']) / 10)),
+        }
+
+    # ═══════════════════════════════════════════════════════════════════════
+    # الإحصائيات
+    # ═══════════════════════════════════════════════════════════════════════
+
+    def usage(self, bot_id: int) -> Optional[Tuple[float, float]]:
+        """(نسبة المعالج منذ القراءة السابقة، الذاكرة بالميجابايت) أو None بدون cgroup"""
+        if self.backend != "cgroup2":
+            return None
+        cgroup = self._cgroup(bot_id)
+        try:
+            usage_usec = 0
+            for line in _read(cgroup / "cpu.stat").splitlines():
+                key, _, value = line.partition(' ')
+                if key == "usage_usec":
+                    usage_usec = int(value)
+                    break
+            memory = int(_read(cgroup / "memory.current"))
+        except (OSError, ValueError):
+            return None
+
+        now = time.monotonic()
+        previous = self._samples.get(bot_id)
+        self._samples[bot_id] = (now, usage_usec)
+        cpu = 0.0
+        if previous and now > previous[0]:
+            cpu = (usage_usec - previous[1]) / ((now - previous[0]) * 1e6) * 100
+        return max(cpu, 0.0), memory / (1024 * 1024)
+
+    def oom_kills(self, bot_id: int) -> int:
+        """عدد مرات قتل عمليات البوت لتجاوز memory.max"""
+        if self.backend != "cgroup2":
+            return 0
+        try:
+            for line in _read(self._cgroup(bot_id) / "memory.events").splitlines():
+                key, _, value = line.partition(' ')
+                if key == "oom_kill":
+                    return int(value)
+        except (OSError, ValueError):
+            pass
+        return 0
+
+    # ═══════════════════════════════════════════════════════════════════════
+    # التجميد
+    # ═══════════════════════════════════════════════════════════════════════
+
+    def freeze(self, bot_id: int, frozen: bool) -> bool:
+        """تجميد/إذابة مجموعة البوت عبر cgroup.freeze (False: غير متاح، استخدم SIGSTOP/SIGCONT)"""
+        if self.backend != "cgroup2":
+            return False
+        cgroup = self._cgroup(bot_id)
+        try:
+            _write(cgroup / "cgroup.freeze", "1" if frozen else "0")
+        except OSError:
+            return False
+        if not frozen:
+            # إعادة منع swap (الصفحات المنقولة تعود عند الحاجة إليها)
+            try:
+                _write(cgroup / "memory.swap.max", "0")
+            except OSError:
+                pass
+        return True
+
+    def reclaim(self, bot_id: int) -> int:
+        """نقل ذاكرة البوت المجمّد إلى swap/التخلص من ذاكرة التخزين: البايتات المحررة"""
+        if self.backend != "cgroup2":
+            return 0
+        cgroup = self._cgroup(bot_id)
+        try:
+            before = int(_read(cgroup / "memory.current"))
+            if (cgroup / "memory.swap.max").exists():
+                _write(cgroup / "memory.swap.max", "max")
+            # memory.reclaim (Linux 5.19+) قد يحرر أقل من المطلوب فيرجع EAGAIN
+            try:
+                _write(cgroup / "memory.reclaim", str(before))
+            except OSError:
+                pass
+            return max(0, before - int(_read(cgroup / "memory.current")))
+        except (OSError, ValueError):
+            return 0
+
+    # ═══════════════════════════════════════════════════════════════════════
+    # التنظيف
+    # ═══════════════════════════════════════════════════════════════════════
+
+    def _kill_cgroup(self, cgroup: Path):
+        """قتل كل عمليات المجموعة (بما فيها ما خرج من مجموعة العمليات) وحذفها"""
+        kill_file = cgroup / "cgroup.kill"
+        try:
+            if kill_file.exists():
+                _write(kill_file, "1")
+            else:
+                for pid in _read(cgroup / "cgroup.procs").split():
+                    try:
+                        os.kill(int(pid), signal.SIGKILL)
+                    except ProcessLookupError:
+                        pass
+        except OSError:
+            pass
+
+        for _ in range(20):
+            try:
+                cgroup.rmdir()
+                return
+            except FileNotFoundError:
+                return
+            except OSError:
+                # العمليات المقتولة لم تخرج بعد من المجموعة
+                time.sleep(0.01)
+        logger.warning(f"تعذّر حذف {cgroup}")
+
+    def release(self, bot_id: int):
+        """تحرير موارد البوت بعد خروج عمليته"""
+        self._samples.pop(bot_id, None)
+        if self.backend == "cgroup2":
+            cgroup = self._cgroup(bot_id)
+            if cgroup.exists():
+                self._kill_cgroup(cgroup)
@@ -0,0 +1,200 @@
+# ============================================================================
+# سياسة إعادة التشغيل بعد الأعطال - NeurHostX V9.2
+# ============================================================================
+"""
+التحكم في حلقات الأعطال:
+- تراجع أسي مع تذبذب عشوائي بين محاولات إعادة التشغيل
+- ميزانية أعطال في نافذة منزلقة (24 ساعة) حسب daily_restart_limit للخطة
+- حالة انتظار (cooldown) بمؤقت في الحلقة بدل مهمة مراقبة نائمة
+- استخراج سبب العطل من نهاية stderr لتلخيص الأسباب المتكررة
+"""
+
+import re
+import time
+import signal
+import random
+import asyncio
+import logging
+from pathlib import Path
+from typing import Callable, Dict, Optional
+
+from config import (
+    ADMIN_ID, PLANS, MAX_DAILY_RESTARTS,
+    RESTART_BACKOFF_BASE_SECONDS, RESTART_BACKOFF_MAX_SECONDS,
+    RESTART_STABLE_UPTIME_SECONDS, RESTART_WINDOW_SECONDS
+)
+
+logger = logging.getLogger(__name__)
+
+# حجم الجزء المقروء من نهاية stderr.log
+STDERR_TAIL_BYTES = 16 * 1024
+
+_TRACEBACK_HEADER = "Traceback (most recent call last):"
+_FILE_LINE = re.compile(r'^\s*File "([^"]+)", line (\d+)')
+
+
+def read_stderr_tail(path: Path, max_bytes: int = STDERR_TAIL_BYTES) -> str:
+    """قراءة آخر max_bytes من ملف stderr"""
+    try:
+        with open(path, 'rb') as f:
+            f.seek(0, 2)
+            size = f.tell()
+            f.seek(max(0, size - max_bytes))
+            return f.read().decode('utf-8', errors='replace')
+    except OSError:
+        return ""
+
+
+def parse_crash_reason(stderr_tail: str, exit_code: Optional[int]) -> str:
+    """استخراج سبب مختصر للعطل من نهاية stderr ورمز الخروج
+
+    الأولوية: آخر traceback (نوع الاستثناء + رسالته + موضعه)، ثم الإشارة
+    التي أنهت العملية، ثم آخر سطر غير فارغ.
+    """
+    lines = [line.rstrip() for line in stderr_tail.splitlines() if line.strip()]
+
+    start = None
+    for i in range(len(lines) - 1, -1, -1):
+        if lines[i].startswith(_TRACEBACK_HEADER):
+            start = i
+            break
+
+    if start is not None:
+        location = ""
+        exception = None
+        for line in lines[start + 1:]:
+            match = _FILE_LINE.match(line)
+            if match:
+                location = f"{Path(match.group(1)).name}:{match.group(2)}"
+            elif not line.startswith((' ', '\t')):
+                exception = line.strip()
+                break
+        if exception:
+            return f"{exception[:150]} @ {location}" if location else exception[:150]
+
+    if exit_code is not None and exit_code < 0:
+        try:
+            name = signal.Signals(-exit_code).name
+        except ValueError:
+            name = f"signal {-exit_code}"
+        if -exit_code == signal.SIGKILL:
+            return f"{name} (قد يكون تجاوز حد الذاكرة)"
+        return name
+
+    if lines:
+        return lines[-1][:150]
+    return f"exit code {exit_code}"
+
+
+def normalize_reason(reason: str) -> str:
+    """توحيد السبب للتجميع (الأرقام والعناوين المتغيرة في الرسالة لا تفرّق بين الأعطال)"""
+    message, sep, location = reason.partition(' @ ')
+    message = re.sub(r'0x[0-9a-fA-F]+', '0x…', message)
+    message = re.sub(r'\b\d+\b', 'N', message)
+    return (message + sep + location)[:200]
+
+
+class RestartPolicy:
+    """محرك قرارات إعادة التشغيل بعد الأعطال"""
+
+    def __init__(self, db):
+        self.db = db
+        self._consecutive: Dict[int, int] = {}
+        self._cooldowns: Dict[int, asyncio.TimerHandle] = {}
+        self._resume_at: Dict[int, float] = {}
+
+    # ═══════════════════════════════════════════════════════════════════════
+    # الميزانية والتراجع
+    # ═══════════════════════════════════════════════════════════════════════
+
+    def crash_limit(self, user_id: int) -> int:
+        """عدد الأعطال المسموح بها في النافذة (-1 = غير محدود)"""
+        plan = self.db.get_user_plan(user_id, ADMIN_ID)
+        return PLANS.get(plan, {}).get('daily_restart_limit', MAX_DAILY_RESTARTS)
+
+    def crashes_in_window(self, bot_id: int) -> int:
+        return self.db.count_bot_crashes_since(bot_id, int(time.time()) - RESTART_WINDOW_SECONDS)
+
+    @staticmethod
+    def backoff_delay(consecutive: int) -> float:
+        """تراجع أسي مع تذبذب: نصف المدة ثابت والنصف الآخر عشوائي"""
+        exponent = min(max(consecutive - 1, 0), 16)
+        ceiling = min(RESTART_BACKOFF_MAX_SECONDS, RESTART_BACKOFF_BASE_SECONDS * (2 ** exponent))
+        return ceiling / 2 + random.uniform(0, ceiling / 2)
+
+    def record_crash(self, bot_id: int, exit_code: Optional[int], uptime: float,
+                     stderr_path: Path) -> dict:
+        """تسجيل عطل واتخاذ القرار
+
+        Returns:
+            {'action': 'restart'|'suspend', 'delay', 'reason', 'used', 'limit', 'consecutive'}
+        """
+        reason = normalize_reason(parse_crash_reason(read_stderr_tail(stderr_path), exit_code))
+        self.db.add_bot_crash(bot_id, int(time.time()), exit_code, int(uptime), reason)
+
+        # تشغيل مستقر لفترة كافية يعني أن هذا عطل جديد وليس استمراراً للحلقة
+        if uptime >= RESTART_STABLE_UPTIME_SECONDS:
+            consecutive = 1
+        else:
+            consecutive = self._consecutive.get(bot_id, 0) + 1
+        self._consecutive[bot_id] = consecutive
+
+        bot = self.db.get_bot(bot_id)
+        limit = self.crash_limit(bot[1]) if bot else MAX_DAILY_RESTARTS
+        used = self.crashes_in_window(bot_id)
+
+        decision = {
+            'reason': reason,
+            'used': used,
+            'limit': limit,
+            'consecutive': consecutive,
+            'delay': 0.0,
+        }
+        if limit >= 0 and used > limit:
+            decision['action'] = 'suspend'
+            self.reset(bot_id)
+        else:
+            decision['action'] = 'restart'
+            decision['delay'] = self.backoff_delay(consecutive)
+        return decision
+
+    def crash_summary(self, bot_id: int, limit: int = 3):
+        """أكثر أسباب الأعطال تكراراً في النافذة"""
+        return self.db.get_bot_crash_reasons(bot_id, int(time.time()) - RESTART_WINDOW_SECONDS, limit)
+
+    # ═══════════════════════════════════════════════════════════════════════
+    # حالة الانتظار
+    # ═══════════════════════════════════════════════════════════════════════
+
+    def schedule(self, bot_id: int, delay: float, callback: Callable):
+        """جدولة إعادة التشغيل بمؤقت (لا تبقى أي مهمة نائمة أثناء الانتظار)"""
+        self.cancel(bot_id)
+        loop = asyncio.get_running_loop()
+
+        def _fire():
+            self._cooldowns.pop(bot_id, None)
+            self._resume_at.pop(bot_id, None)
+            loop.create_task(callback())
+
+        self._cooldowns[bot_id] = loop.call_later(delay, _fire)
+        self._resume_at[bot_id] = time.time() + delay
+
+    def cancel(self, bot_id: int) -> bool:
+        """إلغاء إعادة تشغيل مجدولة (عند التشغيل أو الإيقاف اليدوي)"""
+        handle = self._cooldowns.pop(bot_id, None)
+        self._resume_at.pop(bot_id, None)
+        if handle is None:
+            return False
+        handle.cancel()
+        return True
+
+    def reset(self, bot_id: int):
+        """نسيان سلسلة الأعطال المتتالية (بعد التعليق أو الإيقاف اليدوي)"""
+        self._consecutive.pop(bot_id, None)
+
+    def cooldown_remaining(self, bot_id: int) -> Optional[float]:
+        """الثواني المتبقية لإعادة التشغيل أو None"""
+        resume_at = self._resume_at.get(bot_id)
+        if resume_at is None:
+            return None
+        return max(0.0, resume_at - time.time())
@@ -6,9 +6,20 @@
 """
 
 import os
+import re
+import ast
 import json
+import math
+import time
+import asyncio
 import hashlib
 import logging
+import threading
+import multiprocessing
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from typing import Tuple, List, Dict, Optional
 from pathlib import Path
 from datetime import datetime, timedelta
@@ -47,6 +58,15 @@ class SecurityScanner:
         'setup.py', 'README.md', 'LICENSE'
     }
 
+    # الملحقات النصية التي يُفحص محتواها
+    TEXT_EXTENSIONS = {'.py', '.txt', '.json', '.yml', '.yaml', '.conf', '.cfg'}
+
+    # الحد الأدنى لعدد الملفات لاستخدام مجمّع العمليات بدل الفحص التسلسلي
+    PARALLEL_THRESHOLD = 32
+
+    # إصدار محرك الفحص - تغييره يُبطل النتائج المخزنة في ذاكرة الفحص
+    SCANNER_VERSION = 2
+
     @staticmethod
     def scan_file(file_path: str) -> Tuple[bool, str]:
         """فحص ملف واحد
@@ -57,28 +77,8 @@ class SecurityScanner:
         Returns:
             (آمن؟، الرسالة)
         """
-        file_name = os.path.basename(file_path)
-
-        # التحقق من الامتداد
-        file_ext = os.path.splitext(file_name)[1].lower()
-        if file_ext in SecurityScanner.DANGEROUS_EXTENSIONS:
-            return False, f"❌ امتداد خطر: {file_ext}"
-
-        # التحقق من حجم الملف
-        try:
-            file_size_mb = os.path.getsize(file_path) / (1024 * 1024)
-            if file_size_mb > SecurityScanner.MAX_SAFE_FILE_SIZE:
-                return False, f"❌ حجم الملف كبير جداً: {file_size_mb:.1f}MB"
-        except:
-            return False, "❌ لا يمكن الوصول للملف"
-
-        # فحص محتوى الملفات النصية فقط
-        if file_ext in ['.py', '.txt', '.json', '.yml', '.yaml', '.conf', '.cfg']:
-            is_safe, message = SecurityScanner._scan_file_content(file_path)
-            if not is_safe:
-                return False, message
-
-        return True, "✅ آمن"
+        result = scan_file_detailed(file_path)
+        return result['safe'], result['message']
 
     @staticmethod
     def _scan_file_content(file_path: str) -> Tuple[bool, str]:
@@ -86,56 +86,107 @@ class SecurityScanner:
         try:
             with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
                 content = f.read()
-
-            # البحث عن كلمات مفتاحية خطرة
-            for keyword in SecurityScanner.DANGEROUS_KEYWORDS:
-                if keyword in content:
-                    logger.warning(f"⚠️ كلمة مفتاحية خطرة: {keyword} في {file_path}")
-                    # نوفر تحذير لكن لا نحظر (قد تكون شرعية)
-
-            # البحث عن أنماط خطرة
-            if 'eval(' in content or 'exec(' in content:
-                return False, "❌ كود خطر: eval/exec مكتشف"
-
-            if '__import__(' in content and 'import' not in file_path:
-                return False, "❌ كود خطر: __import__ مكتشف"
-
-            return True, "✅ محتوى آمن"
-
         except Exception as e:
             return False, f"❌ خطأ في الفحص: {str(e)}"
 
+        safe, message, _ = _analyze_content(content, file_path)
+        return safe, message
+
     @staticmethod
-    def scan_directory(dir_path: str) -> Tuple[bool, List[str], List[str]]:
+    def scan_directory(dir_path: str, cache: Optional['ScanCache'] = None) -> Tuple[bool, List[str], List[str]]:
         """فحص مجلد كامل
 
+        المجلدات الكبيرة تُوزّع على مجمّع عمليات (ProcessPoolExecutor)
+        بدل الفحص التسلسلي، والملفات غير المتغيرة تُقرأ نتيجتها من cache.
+
         Args:
             dir_path: مسار المجلد
+            cache: ذاكرة نتائج الفحص (اختياري)
 
         Returns:
             (آمن؟، الملفات الآمنة، الملفات غير الآمنة)
         """
+        paths = SecurityScanner.list_files(dir_path)
+        results = SecurityScanner.scan_paths(paths, cache)
+
         safe_files = []
         unsafe_files = []
+        for path, result in zip(paths, results):
+            file = os.path.basename(path)
+            if result['safe']:
+                safe_files.append(file)
+            else:
+                unsafe_files.append(f"{file}: {result['message']}")
 
-        # فحص جميع الملفات في المجلد
+        all_safe = len(unsafe_files) == 0
+        return all_safe, safe_files, unsafe_files
+
+    @staticmethod
+    def list_files(dir_path: str) -> List[str]:
+        """قائمة ملفات المجلد مع تخطي المجلدات المشبوهة"""
+        paths = []
         for root, dirs, files in os.walk(dir_path):
+            dirs[:] = [d for d in dirs if d not in ('__pycache__', '.git')]
             for file in files:
-                file_path = os.path.join(root, file)
-
-                # تخطي المجلدات المشبوهة
-                if '__pycache__' in file_path or '.git' in file_path:
-                    continue
+                paths.append(os.path.join(root, file))
+        return paths
 
-                is_safe, message = SecurityScanner.scan_file(file_path)
+    @staticmethod
+    def scan_paths(paths: List[str], cache: Optional['ScanCache'] = None) -> List[Dict]:
+        """فحص قائمة ملفات وإرجاع نتيجة مفصلة لكل ملف (بنفس الترتيب)
 
-                if is_safe:
-                    safe_files.append(file)
+        الفحوصات الرخيصة (الامتداد والحجم) تتم مباشرة، ثم يُحسب hash
+        المحتوى للملفات النصية ويُبحث عنه في cache، ولا يُحلَّل إلا الباقي.
+        """
+        results = [None] * len(paths)
+        keys = {}
+        pending = []
+
+        for i, path in enumerate(paths):
+            pre = _precheck_file(path)
+            if pre is not None:
+                results[i] = pre
+                continue
+            if cache is not None:
+                content_hash = SecurityScanner.get_file_hash(path)
+                if content_hash:
+                    keys[i] = (content_hash, _cache_variant(path))
+                    continue
+            pending.append(i)
+
+        # الملفات المتطابقة في نفس الرفع تُحلَّل مرة واحدة
+        duplicates = {}
+        if keys:
+            found = cache.get_many(set(keys.values()))
+            for i, key in keys.items():
+                if key in found:
+                    results[i] = dict(found[key])
+                elif key in duplicates:
+                    duplicates[key].append(i)
                 else:
-                    unsafe_files.append(f"{file}: {message}")
-
-        all_safe = len(unsafe_files) == 0
-        return all_safe, safe_files, unsafe_files
+                    duplicates[key] = []
+                    pending.append(i)
+
+        pending_paths = [paths[i] for i in pending]
+        if len(pending_paths) >= SecurityScanner.PARALLEL_THRESHOLD:
+            scanned = _scan_in_pool(pending_paths)
+        else:
+            scanned = [_scan_file_content_detailed(p) for p in pending_paths]
+
+        new_entries = []
+        for i, result in zip(pending, scanned):
+            results[i] = result
+            if i in keys:
+                new_entries.append((keys[i], result))
+                for j in duplicates[keys[i]]:
+                    results[j] = dict(result)
+        if new_entries:
+            cache.put_many(new_entries)
+
+        for i, key in keys.items():
+            results[i]['sha256'] = key[0]
+
+        return results
 
     @staticmethod
     def get_file_hash(file_path: str) -> str:
@@ -171,18 +222,306 @@ class SecurityScanner:
         return actual_hash == expected_hash
 
 
+# ═══════════════════════════════════════════════════════════════════════════
+# محرك الفحص (دوال على مستوى الوحدة لتعمل داخل مجمّع العمليات)
+# ═══════════════════════════════════════════════════════════════════════════
+
+# تعبير واحد مُجمّع لكل الكلمات المفتاحية (مسح واحد للنص بدل بحث لكل كلمة)
+_KEYWORD_PATTERN = re.compile("|".join(
+    re.escape(k) for k in sorted(SecurityScanner.DANGEROUS_KEYWORDS, key=len, reverse=True)
+))
+
+# استدعاءات تُحظر إذا ظهرت ككود فعلي (وليس داخل تعليق أو نص)
+_BLOCKED_CALLS = {'eval', 'exec', '__import__'}
+
+_scan_pool = None
+_scan_pool_lock = threading.Lock()
+
+
+def start_scan_pool() -> ProcessPoolExecutor:
+    """إنشاء مجمّع عمليات الفحص (عند بدء التشغيل، أو لاستبدال مجمّع معطوب)
+
+    العمليات تُنشأ بـ spawn لا fork: المجمّع يبدأ عماله عند أول فحص من خيط
+    asyncio.to_thread، و fork من عملية متعددة الخيوط قد يرث أقفالاً محجوزة.
+    """
+    global _scan_pool
+    with _scan_pool_lock:
+        if _scan_pool is None:
+            _scan_pool = ProcessPoolExecutor(
+                max_workers=os.cpu_count() or 1,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _scan_pool
+
+
+def _get_scan_pool() -> ProcessPoolExecutor:
+    """مجمّع عمليات الفحص المشترك"""
+    return _scan_pool if _scan_pool is not None else start_scan_pool()
+
+
+def _reset_scan_pool(broken: ProcessPoolExecutor):
+    """إسقاط مجمّع معطوب (مات أحد عماله) ليُنشأ بديل عند الفحص التالي"""
+    global _scan_pool
+    with _scan_pool_lock:
+        if _scan_pool is broken:
+            _scan_pool = None
+    broken.shutdown(wait=False, cancel_futures=True)
+
+
+def _scan_in_pool(paths: List[str]) -> List[Dict]:
+    """فحص الملفات في مجمّع العمليات مع إعادة بنائه مرة واحدة إذا تعطل"""
+    chunksize = max(1, len(paths) // ((os.cpu_count() or 1) * 4))
+    for attempt in range(2):
+        pool = _get_scan_pool()
+        try:
+            return list(pool.map(_scan_file_content_detailed, paths, chunksize=chunksize))
+        except BrokenProcessPool as e:
+            logger.warning(f"⚠️ تعطل مجمّع عمليات الفحص - إعادة إنشائه: {e}")
+            _reset_scan_pool(pool)
+    # تعطل مرتين متتاليتين: فحص تسلسلي بدل رفض الرفع
+    return [_scan_file_content_detailed(p) for p in paths]
+
+
+class _DangerousCodeVisitor(ast.NodeVisitor):
+    """كشف الاستدعاءات الخطرة من شجرة AST"""
+
+    def __init__(self):
+        self.calls = []
+        self.subprocess = []
+
+    def visit_Call(self, node):
+        func = node.func
+        if isinstance(func, ast.Name) and func.id in _BLOCKED_CALLS:
+            self.calls.append((func.id, node.lineno))
+        elif isinstance(func, ast.Attribute):
+            if func.attr in _BLOCKED_CALLS and isinstance(func.value, ast.Name) \
+                    and func.value.id in ('builtins', '__builtins__'):
+                self.calls.append((func.attr, node.lineno))
+            elif isinstance(func.value, ast.Name) and func.value.id == 'subprocess':
+                self.subprocess.append((f"subprocess.{func.attr}", node.lineno))
+        self.generic_visit(node)
+
+    def visit_Import(self, node):
+        for alias in node.names:
+            if alias.name.split('.')[0] == 'subprocess':
+                self.subprocess.append(("import subprocess", node.lineno))
+        self.generic_visit(node)
+
+    def visit_ImportFrom(self, node):
+        if node.module and node.module.split('.')[0] == 'subprocess':
+            self.subprocess.append(("from subprocess import", node.lineno))
+        self.generic_visit(node)
+
+
+def _analyze_content(content: str, file_path: str) -> Tuple[bool, str, List[str]]:
+    """تحليل محتوى نصي: كلمات مفتاحية + تحليل AST لملفات بايثون
+
+    Returns:
+        (آمن؟، الرسالة، الملاحظات)
+    """
+    findings = sorted(set(_KEYWORD_PATTERN.findall(content)))
+    for keyword in findings:
+        # نوفر تحذير لكن لا نحظر (قد تكون شرعية)
+        logger.warning(f"⚠️ كلمة مفتاحية خطرة: {keyword} في {file_path}")
+
+    if not file_path.endswith('.py'):
+        return True, "✅ محتوى آمن", findings
+
+    try:
+        tree = ast.parse(content, filename=file_path)
+    except (SyntaxError, ValueError):
+        # لا يمكن تحليل الملف - نرجع للفحص النصي المحافظ
+        if 'eval(' in content or 'exec(' in content:
+            return False, "❌ كود خطر: eval/exec مكتشف", findings
+        return True, "✅ محتوى آمن", findings
+
+    visitor = _DangerousCodeVisitor()
+    visitor.visit(tree)
+    findings.extend(f"{name} (سطر {line})" for name, line in visitor.subprocess)
+
+    for name, line in visitor.calls:
+        if name == '__import__':
+            if 'import' in file_path:
+                continue
+            return False, f"❌ كود خطر: __import__ مكتشف (سطر {line})", findings
+        return False, f"❌ كود خطر: eval/exec مكتشف (سطر {line})", findings
+
+    return True, "✅ محتوى آمن", findings
+
+
+def _precheck_file(file_path: str) -> Optional[Dict]:
+    """الفحوصات الرخيصة (الامتداد والحجم)
+
+    Returns:
+        نتيجة نهائية، أو None إذا كان الملف يحتاج فحص المحتوى
+    """
+    file_name = os.path.basename(file_path)
+
+    # التحقق من الامتداد
+    file_ext = os.path.splitext(file_name)[1].lower()
+    if file_ext in SecurityScanner.DANGEROUS_EXTENSIONS:
+        return {'safe': False, 'message': f"❌ امتداد خطر: {file_ext}", 'findings': []}
+
+    # التحقق من حجم الملف
+    try:
+        file_size_mb = os.path.getsize(file_path) / (1024 * 1024)
+        if file_size_mb > SecurityScanner.MAX_SAFE_FILE_SIZE:
+            return {'safe': False, 'message': f"❌ حجم الملف كبير جداً: {file_size_mb:.1f}MB", 'findings': []}
+    except OSError:
+        return {'safe': False, 'message': "❌ لا يمكن الوصول للملف", 'findings': []}
+
+    # فحص محتوى الملفات النصية فقط
+    if file_ext not in SecurityScanner.TEXT_EXTENSIONS:
+        return {'safe': True, 'message': "✅ آمن", 'findings': []}
+
+    return None
+
+
+def _cache_variant(file_path: str) -> str:
+    """الجزء من مفتاح الذاكرة الذي يعتمد على المسار (يؤثر على نتيجة الفحص)"""
+    variant = os.path.splitext(file_path)[1].lower()
+    if 'import' in file_path:
+        variant += "|import"
+    return variant
+
+
+def _scan_file_content_detailed(file_path: str) -> Dict:
+    """فحص محتوى ملف نصي (يعمل داخل مجمّع العمليات)"""
+    try:
+        with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
+            content = f.read()
+    except Exception as e:
+        return {'safe': False, 'message': f"❌ خطأ في الفحص: {str(e)}", 'findings': []}
+
+    safe, message, findings = _analyze_content(content, file_path)
+    if not safe:
+        return {'safe': False, 'message': message, 'findings': findings}
+    return {'safe': True, 'message': "✅ آمن", 'findings': findings}
+
+
+def scan_file_detailed(file_path: str) -> Dict:
+    """فحص ملف واحد مع تفاصيل الملاحظات
+
+    Returns:
+        {'safe': bool, 'message': str, 'findings': list}
+    """
+    pre = _precheck_file(file_path)
+    if pre is not None:
+        return pre
+    return _scan_file_content_detailed(file_path)
+
+
+class ScanCache:
+    """ذاكرة نتائج الفحص: LRU في الذاكرة أمام جدول scan_cache
+
+    المفتاح هو sha256 للمحتوى، لذلك الملفات غير المتغيرة والمكتبات
+    المشتركة بين المستخدمين لا يُعاد فحصها.
+    """
+
+    def __init__(self, db=None, max_entries: int = 10000):
+        self.db = db
+        self.max_entries = max_entries
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, keys) -> Dict:
+        """جلب النتائج المخزنة لمجموعة مفاتيح (content_hash, variant)"""
+        found = {}
+        missing = []
+        with self._lock:
+            for key in keys:
+                if key in self._lru:
+                    self._lru.move_to_end(key)
+                    found[key] = self._lru[key]
+                else:
+                    missing.append(key)
+
+        if missing and self.db is not None:
+            try:
+                rows = self.db.get_scan_results(missing)
+            except Exception as e:
+                logger.warning(f"⚠️ تعذّر قراءة ذاكرة الفحص: {e}")
+                rows = {}
+            for key, (version, safe, message, findings) in rows.items():
+                if version != SecurityScanner.SCANNER_VERSION:
+                    continue
+                result = {'safe': bool(safe), 'message': message, 'findings': json.loads(findings or "[]")}
+                found[key] = result
+                self._remember(key, result)
+
+        with self._lock:
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, entries):
+        """تخزين نتائج جديدة: قائمة ((content_hash, variant), result)"""
+        rows = []
+        for key, result in entries:
+            self._remember(key, result)
+            rows.append((
+                key[0], key[1], SecurityScanner.SCANNER_VERSION,
+                1 if result['safe'] else 0, result['message'],
+                json.dumps(result.get('findings', []), ensure_ascii=False)
+            ))
+        if rows and self.db is not None:
+            try:
+                self.db.save_scan_results(rows)
+            except Exception as e:
+                logger.warning(f"⚠️ تعذّر حفظ ذاكرة الفحص: {e}")
+
+    def _remember(self, key, result):
+        with self._lock:
+            self._lru[key] = {k: v for k, v in result.items() if k != 'sha256'}
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.max_entries:
+                self._lru.popitem(last=False)
+
+    @property
+    def hit_rate(self) -> float:
+        """نسبة الإصابة (0..1)"""
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> Dict:
+        """إحصائيات الذاكرة"""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hit_rate * 100, 1),
+            'memory_entries': len(self._lru),
+        }
+
+
 class RateLimiter:
-    """نظام تحديد معدل الطلبات"""
+    """نظام تحديد معدل الطلبات (GCRA - مكافئ لـ token bucket)
 
-    def __init__(self, max_requests: int = 5, window_seconds: int = 60):
+    لكل مفتاح رقم واحد فقط (وقت الوصول النظري TAT) مخزن في مصفوفة
+    مضغوطة، والمفاتيح الخاملة تُحذف دورياً فلا تنمو الذاكرة بلا حد.
+    """
+
+    def __init__(self, max_requests: int = 5, window_seconds: int = 60,
+                 burst: Optional[int] = None, sweep_seconds: int = 60):
         """
         Args:
             max_requests: الحد الأقصى للطلبات
             window_seconds: فترة الزمني بالثواني
+            burst: أقصى دفعة متتالية (افتراضياً = max_requests)
+            sweep_seconds: الفاصل بين عمليات حذف المفاتيح الخاملة
         """
         self.max_requests = max_requests
         self.window_seconds = window_seconds
-        self.requests = {}
+        self.burst = burst or max_requests
+        self.interval = window_seconds / max_requests
+        self.tolerance = self.interval * (self.burst - 1)
+        self.sweep_seconds = sweep_seconds
+
+        self._slots = {}
+        self._tat = array('d')
+        self._free = []
+        self._last_sweep = time.monotonic()
 
     def is_allowed(self, user_id: int) -> Tuple[bool, int]:
         """التحقق من السماح بطلب جديد
@@ -193,25 +532,25 @@ class RateLimiter:
         Returns:
             (مسموح؟، الطلبات المتبقية)
         """
-        now = datetime.now()
+        now = time.monotonic()
+        if now - self._last_sweep >= self.sweep_seconds:
+            self.evict_idle(now)
 
-        if user_id not in self.requests:
-            self.requests[user_id] = []
-
-        # تنظيف الطلبات القديمة
-        self.requests[user_id] = [
-            req_time for req_time in self.requests[user_id]
-            if (now - req_time).total_seconds() < self.window_seconds
-        ]
+        slot = self._slots.get(user_id)
+        tat = self._tat[slot] if slot is not None else now
+        if tat < now:
+            tat = now
 
         # التحقق من الحد الأقصى
-        if len(self.requests[user_id]) >= self.max_requests:
+        if tat - now > self.tolerance:
             return False, 0
 
-        # إضافة الطلب الجديد
-        self.requests[user_id].append(now)
-        remaining = self.max_requests - len(self.requests[user_id])
+        new_tat = tat + self.interval
+        if slot is None:
+            slot = self._allocate(user_id)
+        self._tat[slot] = new_tat
 
+        remaining = int((self.tolerance + self.interval - (new_tat - now)) / self.interval + 1e-9)
         return True, remaining
 
     def get_remaining_time(self, user_id: int) -> int:
@@ -223,14 +562,38 @@ class RateLimiter:
         Returns:
             الثواني المتبقية
         """
-        if user_id not in self.requests or not self.requests[user_id]:
+        slot = self._slots.get(user_id)
+        if slot is None:
             return 0
 
-        oldest_request = self.requests[user_id][0]
-        elapsed = (datetime.now() - oldest_request).total_seconds()
-        remaining = self.window_seconds - elapsed
+        wait = self._tat[slot] - self.tolerance - time.monotonic()
+        return max(0, math.ceil(wait))
+
+    def evict_idle(self, now: Optional[float] = None) -> int:
+        """حذف المفاتيح التي امتلأ رصيدها بالكامل (لا فرق بينها وبين مفتاح جديد)
 
-        return max(0, int(remaining))
+        Returns:
+            عدد المفاتيح المحذوفة
+        """
+        now = time.monotonic() if now is None else now
+        idle = [key for key, slot in self._slots.items() if self._tat[slot] <= now]
+        for key in idle:
+            self._free.append(self._slots.pop(key))
+        self._last_sweep = now
+        return len(idle)
+
+    def _allocate(self, user_id: int) -> int:
+        """حجز خانة في المصفوفة لمفتاح جديد"""
+        if self._free:
+            slot = self._free.pop()
+        else:
+            slot = len(self._tat)
+            self._tat.append(0.0)
+        self._slots[user_id] = slot
+        return slot
+
+    def __len__(self):
+        return len(self._slots)
 
 
 class FileValidator:
@@ -324,11 +687,14 @@ class FileValidator:
 class BotSecurityManager:
     """مدير أمان البوتات المرفوعة"""
 
-    def __init__(self):
+    # الحد الأقصى لعدد hashes السلامة المحفوظة في الذاكرة
+    MAX_INTEGRITY_HASHES = 5000
+
+    def __init__(self, db=None):
         self.scanner = SecurityScanner()
-        self.rate_limiter = RateLimiter(max_requests=3, window_seconds=60)
         self.validator = FileValidator()
-        self.integrity_hashes = {}
+        self.scan_cache = ScanCache(db)
+        self.integrity_hashes = OrderedDict()
 
     async def validate_bot_upload(self, user_id: int, bot_folder: str) -> Tuple[bool, List[str]]:
         """التحقق من أمان البوت المرفوع
@@ -338,40 +704,55 @@ class BotSecurityManager:
             bot_folder: مسار مجلد البوت
 
         Returns:
-            (آمن؟، التحذيرات)
+            (آمن؟، التحذيرات) - أي ملف خطر يرفض الرفع كاملاً
+            (معدل الرفع يحدده حارس upload العام في main.py قبل التنزيل)
         """
         warnings = []
 
-        # التحقق من معدل الطلبات
-        is_allowed, remaining = self.rate_limiter.is_allowed(user_id)
-        if not is_allowed:
-            waiting_time = self.rate_limiter.get_remaining_time(user_id)
-            return False, [f"⏳ يرجى الانتظار {waiting_time} ثانية قبل المحاولة مجدداً"]
-
         # فحص المجلد
         if not os.path.exists(bot_folder):
             return False, ["❌ مجلد البوت غير موجود"]
 
-        # فحص أمان الملفات
-        is_safe, safe_files, unsafe_files = self.scanner.scan_directory(bot_folder)
+        # فحص أمان الملفات (خارج حلقة الأحداث، مع ذاكرة النتائج)
+        paths = await asyncio.to_thread(self.scanner.list_files, bot_folder)
+        results = await asyncio.to_thread(self.scanner.scan_paths, paths, self.scan_cache)
+
+        safe_files = []
+        unsafe_files = []
+        flagged = []
+        for path, result in zip(paths, results):
+            file = os.path.basename(path)
+            if result['safe']:
+                safe_files.append(file)
+                # كلمات مفتاحية حساسة: تحذير فقط (قد تكون شرعية)
+                if result.get('findings'):
+                    flagged.append(f"{file}: {', '.join(result['findings'][:3])}")
+            else:
+                unsafe_files.append(f"{file}: {result['message']}")
+
+            # تسجيل hashes الملفات (محسوبة أثناء الفحص)
+            if result.get('sha256'):
+                rel = os.path.relpath(path, bot_folder)
+                self.integrity_hashes[f"{user_id}_{rel}"] = result['sha256']
+                self.integrity_hashes.move_to_end(f"{user_id}_{rel}")
+        while len(self.integrity_hashes) > self.MAX_INTEGRITY_HASHES:
+            self.integrity_hashes.popitem(last=False)
 
         if unsafe_files:
             warnings.extend([f"⚠️ {f}" for f in unsafe_files[:5]])
+        warnings.extend([f"🔎 {f}" for f in flagged[:5]])
 
         # تحذير إذا لم يوجد main.py
-        if not any(f.endswith(('main.py', 'bot.py', 'app.py')) for f in safe_files):
+        if not any(p.endswith(('main.py', 'bot.py', 'app.py')) for p in paths):
             warnings.append("⚠️ لم يتم العثور على الملف الرئيسي (main.py/bot.py/app.py)")
 
-        # تسجيل هashes الملفات
-        for file in safe_files[:10]:
-            file_path = os.path.join(bot_folder, file)
-            if os.path.isfile(file_path):
-                file_hash = self.scanner.get_file_hash(file_path)
-                self.integrity_hashes[f"{user_id}_{file}"] = file_hash
-
-        logger.info(f"✅ فحص البوت: المستخدم {user_id}, آمن={is_safe}")
+        stats = self.scan_cache.stats()
+        logger.info(
+            f"✅ فحص البوت: المستخدم {user_id}, آمن={not unsafe_files}, "
+            f"ملفات={len(paths)}, نسبة إصابة الذاكرة={stats['hit_rate']}%"
+        )
 
-        return True, warnings  # نسمح برفع البوت حتى مع التحذيرات
+        return not unsafe_files, warnings
 
     def format_security_report(self, warnings: List[str]) -> str:
         """تنسيق تقرير الأمان"""
@@ -111,14 +111,8 @@ class TelegramStarsPayment:
             if bot[1] != user_id:  # user_id column
                 return False, "❌ أنت لا تملك هذا البوت"
 
-            # إضافة الوقت
-            current_remaining = bot[12]  # remaining_seconds
-            new_remaining = current_remaining + duration_seconds
-
-            db.update_bot_resources(
-                bot_id,
-                remaining_seconds=new_remaining
-            )
+            # إضافة الوقت كقيد في دفتر الوقت
+            db.credit_bot_time(bot_id, duration_seconds, source)
 
             # تسجيل العملية
             db.add_event_log(
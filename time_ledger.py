@@ -0,0 +1,73 @@
+# ============================================================================
+# محاسبة وقت الاستضافة - NeurHostX V9.2
+# ============================================================================
+"""
+حساب الوقت المستهلك بدفتر قيود (time_ledger):
+- الاستهلاك يُقاس بفروق time.monotonic() (لا يتأثر بتغيير ساعة النظام)
+- دفعة خصم واحدة لكل البوتات في كل دورة بدل قراءة-تعديل-كتابة لكل بوت
+- الإضافات (دفع، استرجاع، مسؤول) قيود مستقلة فلا تضيع بين دورتين
+"""
+
+import time
+import logging
+from typing import Dict
+
+logger = logging.getLogger(__name__)
+
+
+class TimeLedger:
+    """عدّاد الاستهلاك للبوتات العاملة
+
+    الرصيد نفسه هو bots.remaining_seconds (يحدّثه كل قيد في نفس المعاملة)،
+    فقراءة صف البوت تعطي الرصيد بعد آخر دورة وآخر إضافة معاً.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self._last: Dict[int, float] = {}
+        self._carry: Dict[int, float] = {}
+
+    def start(self, bot_id: int):
+        """بدء احتساب الاستهلاك (تشغيل أو استئناف)"""
+        self._last[bot_id] = time.monotonic()
+        self._carry.pop(bot_id, None)
+
+    def stop(self, bot_id: int):
+        """إيقاف الاحتساب مع خصم ما تراكم منذ آخر دورة"""
+        last = self._last.pop(bot_id, None)
+        carry = self._carry.pop(bot_id, 0.0)
+        if last is None:
+            return
+        seconds = int(time.monotonic() - last + carry)
+        if seconds > 0:
+            self.db.debit_bot_time_batch([(bot_id, seconds)])
+
+    def unbilled(self, bot_id: int) -> float:
+        """الاستهلاك منذ آخر خصم (لم يُقيَّد بعد)"""
+        last = self._last.get(bot_id)
+        if last is None:
+            return 0.0
+        return time.monotonic() - last + self._carry.get(bot_id, 0.0)
+
+    @property
+    def active(self) -> int:
+        return len(self._last)
+
+    def tick(self) -> Dict[int, int]:
+        """خصم الاستهلاك منذ الدورة السابقة لكل البوتات بدفعة واحدة
+
+        Returns:
+            {bot_id: الرصيد بعد الخصم}
+        """
+        now = time.monotonic()
+        debits = []
+        for bot_id, last in self._last.items():
+            elapsed = now - last + self._carry.get(bot_id, 0.0)
+            seconds = int(elapsed)
+            # كسور الثانية تُرحّل للدورة التالية فلا يضيع شيء بالتقريب
+            self._carry[bot_id] = elapsed - seconds
+            self._last[bot_id] = now
+            if seconds:
+                debits.append((bot_id, seconds))
+
+        return self.db.debit_bot_time_batch(debits)
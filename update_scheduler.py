@@ -0,0 +1,225 @@
+# ============================================================================
+# جدولة التحديثات - NeurHostX V9.2
+# ============================================================================
+"""
+معالجة تحديثات Telegram بالتوازي بين المستخدمين وبالترتيب داخل المستخدم الواحد:
+- لكل مستخدم (أو محادثة) مسار بقفل FIFO فلا تتداخل تحديثاته وتبقى حالة
+  ConversationHandler صحيحة، بينما يعمل المستخدمون الآخرون دون انتظار
+- حد أقصى للمعالجات العاملة معاً (UPDATE_MAX_IN_FLIGHT) يُطبَّق بعد دور المستخدم،
+  فلا يحجز مستخدم يرسل بكثرة الخانات بتحديثات تنتظر دورها
+- مهلة لكل معالج (HANDLER_TIMEOUTS) عبر run_handler
+- مراقب لحلقة الأحداث يسجل المعالجات التي كانت تعمل عند أي توقف طويل
+  (عمل حاجب يجب نقله إلى asyncio.to_thread)
+"""
+
+import re
+import time
+import asyncio
+import logging
+from collections import Counter, deque
+from typing import Awaitable, Dict, Optional
+
+from telegram.ext import BaseUpdateProcessor
+
+from config import (
+    UPDATE_MAX_IN_FLIGHT, UPDATE_MAX_PENDING,
+    HANDLER_TIMEOUT_SECONDS, HANDLER_TIMEOUTS, LOOP_STALL_WARN_SECONDS
+)
+from metrics import (
+    handler_seconds, handler_timeouts_total, loop_stalls_total,
+    updates_in_flight, updates_waiting
+)
+
+logger = logging.getLogger(__name__)
+
+# بادئة callback_data قبل أول معرّف رقمي: manage_12 -> manage و set_prio_2_15 -> set_prio
+_ROUTE_RE = re.compile(r"^([A-Za-z_]+?)(?:_\d.*)?$")
+
+
+def route_of(update, handler_name: str) -> str:
+    """تسمية المعالج في المقاييس: بادئة الزر، أو /الأمر، أو اسم الدالة"""
+    query = getattr(update, "callback_query", None)
+    if query is not None and query.data:
+        match = _ROUTE_RE.match(query.data)
+        return match.group(1)[:40] if match else handler_name
+    message = getattr(update, "effective_message", None)
+    text = getattr(message, "text", None) if message is not None else None
+    if text and text.startswith("/"):
+        return text.split()[0].split("@")[0][:32]
+    return handler_name
+
+
+class _Lane:
+    """مسار مستخدم واحد: قفل FIFO وعدد التحديثات التي تحمله"""
+
+    __slots__ = ("lock", "users")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.users = 0
+
+
+class UpdateScheduler(BaseUpdateProcessor):
+    """معالج تحديثات PTB بترتيب لكل مستخدم وحد للتوازي"""
+
+    def __init__(self, max_in_flight: int = UPDATE_MAX_IN_FLIGHT, max_pending: int = UPDATE_MAX_PENDING):
+        # حد PTB هنا للتحديثات المقبولة؛ الحد الفعلي للتنفيذ هو _running
+        super().__init__(max_concurrent_updates=max(max_pending, max_in_flight))
+        self.max_in_flight = max_in_flight
+        self._running: Optional[asyncio.Semaphore] = None
+        self._lanes: Dict[int, _Lane] = {}
+        # المعالجات العاملة الآن: رقم تسلسلي -> (الاسم، وقت البدء)
+        self._active: Dict[int, tuple] = {}
+        # آخر المعالجات المنتهية: (الاسم، وقت الانتهاء) - المتسبب بالتوقف ينتهي غالباً قبل أن يستيقظ المراقب
+        self._finished: deque = deque(maxlen=64)
+        self._next_call = 0
+        self._watchdog: Optional[asyncio.Task] = None
+        self.in_flight = 0
+        self.pending = 0            # المقبولة: العاملة + المنتظرة دورها
+        self.processed = 0
+        self.timeouts: Counter = Counter()
+        self.stalls: Counter = Counter()
+        updates_in_flight.set_function(lambda: self.in_flight)
+        updates_waiting.set_function(lambda: self.pending - self.in_flight)
+
+    # ═══════════════════════════════════════════════════════════════════════
+    # BaseUpdateProcessor
+    # ═══════════════════════════════════════════════════════════════════════
+
+    async def initialize(self) -> None:
+        self._running = asyncio.Semaphore(self.max_in_flight)
+        if LOOP_STALL_WARN_SECONDS and self._watchdog is None:
+            self._watchdog = asyncio.get_running_loop().create_task(self._watch_loop())
+
+    async def shutdown(self) -> None:
+        if self._watchdog is not None:
+            self._watchdog.cancel()
+            self._watchdog = None
+
+    @staticmethod
+    def lane_key(update) -> Optional[int]:
+        """مفتاح الترتيب: المستخدم، أو المحادثة لتحديثات القنوات، أو None (بلا ترتيب)"""
+        user = getattr(update, "effective_user", None)
+        if user is not None:
+            return user.id
+        chat = getattr(update, "effective_chat", None)
+        return chat.id if chat is not None else None
+
+    async def do_process_update(self, update, coroutine: Awaitable) -> None:
+        key = self.lane_key(update)
+        self.pending += 1
+        if key is None:
+            try:
+                await self._execute(coroutine)
+            finally:
+                self.pending -= 1
+            return
+
+        # الحجز متزامن (قبل أي await) فيأخذ كل تحديث دوره بترتيب وصوله
+        lane = self._lanes.get(key)
+        if lane is None:
+            lane = self._lanes[key] = _Lane()
+        lane.users += 1
+        try:
+            async with lane.lock:
+                await self._execute(coroutine)
+        finally:
+            self.pending -= 1
+            lane.users -= 1
+            if not lane.users:
+                self._lanes.pop(key, None)
+
+    async def _execute(self, coroutine: Awaitable):
+        if self._running is None:
+            self._running = asyncio.Semaphore(self.max_in_flight)
+        async with self._running:
+            self.in_flight += 1
+            try:
+                await coroutine
+            finally:
+                self.in_flight -= 1
+                self.processed += 1
+
+    # ═══════════════════════════════════════════════════════════════════════
+    # مهلة المعالجات
+    # ═══════════════════════════════════════════════════════════════════════
+
+    @staticmethod
+    def timeout_for(name: str) -> float:
+        return HANDLER_TIMEOUTS.get(name, HANDLER_TIMEOUT_SECONDS)
+
+    async def run_handler(self, name: str, coroutine: Awaitable, update=None):
+        """تشغيل معالج بمهلته وتسجيله كعامل لمراقب حلقة الأحداث
+
+        عند تجاوز المهلة يُلغى المعالج ويُرجع None فتبقى حالة المحادثة كما هي.
+        """
+        call = self._next_call
+        self._next_call += 1
+        self._active[call] = (name, time.monotonic())
+        timeout = self.timeout_for(name)
+        route = route_of(update, name)
+        started = time.perf_counter()
+        try:
+            if not timeout:
+                return await coroutine
+            return await asyncio.wait_for(coroutine, timeout=timeout)
+        except asyncio.TimeoutError:
+            self.timeouts[name] += 1
+            handler_timeouts_total.inc(route=route)
+            logger.warning(f"⏱ تجاوز المعالج {name} مهلته ({timeout}s) وتم إلغاؤه")
+            await self._notify_timeout(update)
+            return None
+        finally:
+            handler_seconds.observe(time.perf_counter() - started, route=route)
+            self._active.pop(call, None)
+            self._finished.append((name, time.monotonic()))
+
+    @staticmethod
+    async def _notify_timeout(update):
+        message = getattr(update, "effective_message", None)
+        if message is None:
+            return
+        try:
+            await message.reply_text("⏱ استغرقت العملية وقتاً أطول من المسموح وتم إلغاؤها، حاول مرة أخرى.")
+        except Exception:
+            pass
+
+    # ═══════════════════════════════════════════════════════════════════════
+    # مراقب حلقة الأحداث
+    # ═══════════════════════════════════════════════════════════════════════
+
+    async def _watch_loop(self):
+        """قياس تأخر الاستيقاظ: تأخر كبير يعني أن معالجاً عاملاً حجب الحلقة"""
+        interval = min(0.1, LOOP_STALL_WARN_SECONDS / 2)
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(interval)
+            lag = time.monotonic() - started - interval
+            if lag < LOOP_STALL_WARN_SECONDS:
+                continue
+            # المتسبب ما زال عاملاً أو انتهى بعد موعد استيقاظ المراقب
+            due = started + interval
+            suspects = sorted(
+                {name for name, _ in self._active.values()}
+                | {name for name, ended in self._finished if ended >= due}
+            )
+            for name in suspects:
+                self.stalls[name] += 1
+                loop_stalls_total.inc(handler=name)
+            logger.warning(
+                f"🐢 توقفت حلقة الأحداث {lag * 1000:.0f}ms - "
+                f"معالجات عاملة: {', '.join(suspects) or 'لا شيء (مهمة خلفية)'}"
+            )
+
+    def summary(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "waiting": self.pending - self.in_flight,
+            "lanes": len(self._lanes),
+            "processed": self.processed,
+            "timeouts": sum(self.timeouts.values()),
+            "stalls": dict(self.stalls),
+        }
+
+
+update_scheduler = UpdateScheduler()
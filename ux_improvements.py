@@ -8,6 +8,7 @@
 - health_check للأدمن
 """
 
+import asyncio
 import logging
 import time as time_module
 from datetime import datetime, timezone
@@ -155,7 +156,7 @@ async def health_check(update: Update, context: ContextTypes.DEFAULT_TYPE, db: D
     import psutil
 
     try:
-        cpu = psutil.cpu_percent(interval=0.5)
+        cpu = await asyncio.to_thread(psutil.cpu_percent, 0.5)
         mem = psutil.virtual_memory()
         disk = psutil.disk_usage('/')
         
@@ -0,0 +1,492 @@
+# ============================================================================
+# وكيل تشغيل البوتات (عقدة) - NeurHostX V9.2
+# ============================================================================
+"""
+عملية صغيرة على كل جهاز تشغيل إضافي تنفّذ أوامر المضيف الرئيسي:
+- start / signal / list / stats / manifest / put / delete / tail
+- بروتوكول أسطر JSON فوق TLS، والمصادقة بتحدي HMAC-SHA256 برمز مشترك في
+  الاتجاهين، ثم كل رسالة موقّعة بمفتاح جلسة مشتق من التحديين
+- ملفات البوتات تُزامن بتجزئة المحتوى (manifest): يُرسل فقط ما تغيّر
+- إذا انقطع المضيف أكثر من --orphan-grace تُوقف البوتات (كما تموت بموت main.py محلياً)
+
+لا يعتمد إلا على المكتبة القياسية و zygote.py، فيكفي نسخ الملفين إلى العقدة:
+
+    NEURHOST_AGENT_TOKEN=secret python worker_agent.py --host 0.0.0.0 --port 8765 \
+        --tls-cert agent.crt --tls-key agent.key --root ./agent_bots --slots 20
+
+والمضيف يثق بالشهادة عبر NEURHOST_AGENT_CA (بدون TLS يُسمح بعنوان loopback فقط).
+"""
+
+import os
+import sys
+import json
+import hmac
+import time
+import base64
+import signal
+import asyncio
+import hashlib
+import logging
+import argparse
+import functools
+import socket
+import ssl
+import ipaddress
+from pathlib import Path
+from typing import Dict, Optional
+
+from zygote import apply_child_setup, without_agent_secrets, make_non_dumpable
+
+logger = logging.getLogger("worker_agent")
+
+# أقصى حجم لسطر رسالة واحد (الملفات تُرسل على أجزاء أصغر منه)
+MAX_MESSAGE_BYTES = 4 * 1024 * 1024
+STDERR_TAIL_BYTES = 16 * 1024
+STOP_KILL_TIMEOUT_SECONDS = 5
+PIP_TIMEOUT_SECONDS = 300
+
+# مجلدات لا تدخل في المزامنة (تُنشأ على العقدة نفسها)
+SYNC_EXCLUDE = {"logs", "__pycache__", ".git"}
+REQUIREMENTS_MARKER = ".requirements.sha256"
+
+# متغيرات بيئة الوكيل التي يرثها البوت؛ الباقي يأتي من المضيف (BOT_TOKEN)
+BOT_ENV_KEYS = ("PATH", "HOME", "LANG", "LC_ALL", "LC_CTYPE", "TZ", "TMPDIR")
+
+
+def bot_environment(env: dict) -> Dict[str, str]:
+    """بيئة دنيا لعملية البوت: لا ترث أسرار الوكيل ولا بقية بيئته"""
+    base = {key: os.environ[key] for key in BOT_ENV_KEYS if key in os.environ}
+    base.update(without_agent_secrets(env or {}))
+    return base
+
+
+def sign(token: str, challenge: str) -> str:
+    """رد التحدي: HMAC-SHA256(الرمز، التحدي)"""
+    return hmac.new(token.encode(), challenge.encode(), hashlib.sha256).hexdigest()
+
+
+def session_key(token: str, challenge: str, nonce: str) -> bytes:
+    """مفتاح الجلسة: HMAC-SHA256(الرمز، تحدي الوكيل + تحدي المضيف)"""
+    return hmac.new(token.encode(), f"session:{challenge}:{nonce}".encode(), hashlib.sha256).digest()
+
+
+def is_loopback(host: str) -> bool:
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+class SecureChannel:
+    """تأطير رسائل الجلسة: HMAC لكل رسالة مع رقم تسلسلي لكل اتجاه
+
+    رسالة محقونة أو معدّلة أو مُعادة أو بترتيب مختلف ترفع ValueError فيُقطع الاتصال.
+    """
+
+    def __init__(self, key: bytes, send_label: str, receive_label: str):
+        self._key = key
+        self._send_label = send_label
+        self._receive_label = receive_label
+        self._send_seq = 0
+        self._receive_seq = 0
+
+    def _mac(self, label: str, seq: int, body: str) -> str:
+        return hmac.new(self._key, f"{label}:{seq}:{body}".encode(), hashlib.sha256).hexdigest()
+
+    def encode(self, message: dict) -> bytes:
+        body = json.dumps(message)
+        frame = {"seq": self._send_seq, "body": body, "mac": self._mac(self._send_label, self._send_seq, body)}
+        self._send_seq += 1
+        return (json.dumps(frame) + "\n").encode()
+
+    def decode(self, line: bytes) -> dict:
+        frame = json.loads(line)
+        body = frame.get("body") if isinstance(frame, dict) else None
+        if not isinstance(body, str) or frame.get("seq") != self._receive_seq or not hmac.compare_digest(
+            str(frame.get("mac", "")), self._mac(self._receive_label, self._receive_seq, body)
+        ):
+            raise ValueError("رسالة غير موقّعة أو خارج الترتيب")
+        self._receive_seq += 1
+        return json.loads(body)
+
+
+def folder_manifest(folder: Path) -> Dict[str, str]:
+    """{المسار النسبي: sha256} لملفات مجلد البوت (مشتركة بين المضيف والعقدة)"""
+    manifest = {}
+    if not folder.is_dir():
+        return manifest
+    for path in folder.rglob("*"):
+        relative = path.relative_to(folder)
+        if not path.is_file() or relative.parts[0] in SYNC_EXCLUDE or path.name == REQUIREMENTS_MARKER:
+            continue
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        manifest[relative.as_posix()] = digest.hexdigest()
+    return manifest
+
+
+def _read_tail(path: Path, max_bytes: int) -> str:
+    try:
+        with open(path, "rb") as f:
+            f.seek(0, 2)
+            f.seek(max(0, f.tell() - max_bytes))
+            return f.read().decode("utf-8", errors="replace")
+    except OSError:
+        return ""
+
+
+def _memory_mb() -> Dict[str, float]:
+    """الذاكرة الكلية والمتاحة من /proc/meminfo"""
+    values = {}
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                key, _, rest = line.partition(":")
+                if key in ("MemTotal", "MemAvailable"):
+                    values[key] = int(rest.split()[0]) / 1024
+    except OSError:
+        pass
+    return {"total": values.get("MemTotal", 0.0), "available": values.get("MemAvailable", 0.0)}
+
+
+class Agent:
+    """حالة العقدة: البوتات العاملة والاتصال الحالي بالمضيف"""
+
+    def __init__(self, root: Path, token: str, slots: int, orphan_grace: float):
+        self.root = root
+        self.token = token
+        self.slots = slots
+        self.orphan_grace = orphan_grace
+        self.bots: Dict[int, dict] = {}
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._channel: Optional[SecureChannel] = None
+        self._orphan_timer: Optional[asyncio.TimerHandle] = None
+        self._page_size = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+        self._clock_ticks = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+    # ═══════════════════════════════════════════════════════════════════════
+    # الاتصال
+    # ═══════════════════════════════════════════════════════════════════════
+
+    def _send(self, message: dict):
+        writer = self._writer
+        if writer is None or writer.is_closing():
+            return
+        writer.write(self._channel.encode(message))
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        peer = writer.get_extra_info("peername")
+        challenge = os.urandom(16).hex()
+        writer.write((json.dumps({"challenge": challenge}) + "\n").encode())
+        try:
+            line = await asyncio.wait_for(reader.readline(), timeout=10)
+            message = json.loads(line or b"{}")
+            nonce = str(message.get("nonce", ""))
+            if message.get("op") != "auth" or len(nonce) < 32 or not hmac.compare_digest(
+                str(message.get("mac", "")), sign(self.token, challenge)
+            ):
+                logger.warning(f"رفض اتصال غير مصادق من {peer}")
+                writer.close()
+                return
+        except (asyncio.TimeoutError, ValueError, AttributeError, ConnectionError):
+            writer.close()
+            return
+        # رسالة الترحيب الموقّعة بمفتاح الجلسة تثبت للمضيف أن الوكيل يملك الرمز
+        channel = SecureChannel(session_key(self.token, challenge, nonce), "agent", "host")
+
+        # اتصال مضيف واحد في كل مرة: الجديد يحل محل القديم
+        if self._writer is not None and self._writer is not writer:
+            self._writer.close()
+        self._writer = writer
+        self._channel = channel
+        if self._orphan_timer is not None:
+            self._orphan_timer.cancel()
+            self._orphan_timer = None
+        self._send({"ok": True, "node": socket.gethostname(), "slots": self.slots})
+        logger.info(f"اتصل المضيف من {peer}")
+
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                request = channel.decode(line)
+                asyncio.get_running_loop().create_task(self._dispatch(request))
+        except (ConnectionError, asyncio.LimitOverrunError, ValueError) as e:
+            logger.warning(f"انقطع الاتصال: {e}")
+        finally:
+            if self._writer is writer:
+                self._writer = None
+                self._orphan_timer = asyncio.get_running_loop().call_later(
+                    self.orphan_grace, lambda: asyncio.ensure_future(self._stop_orphans())
+                )
+                logger.warning(f"انقطع المضيف - إيقاف البوتات بعد {self.orphan_grace:.0f}s إن لم يعد")
+            writer.close()
+
+    async def _dispatch(self, request: dict):
+        handler = getattr(self, f"op_{request.get('op')}", None)
+        response = {"id": request.get("id")}
+        if handler is None:
+            response.update(ok=False, error=f"unknown op {request.get('op')}")
+        else:
+            try:
+                response.update(ok=True, result=await handler(**request.get("args", {})))
+            except Exception as e:
+                response.update(ok=False, error=f"{type(e).__name__}: {e}")
+        self._send(response)
+
+    async def _stop_orphans(self):
+        self._orphan_timer = None
+        if self._writer is not None:
+            return
+        for bot_id in list(self.bots):
+            await self._stop(bot_id)
+        logger.info("تم إيقاف البوتات بعد انقطاع المضيف")
+
+    # ═══════════════════════════════════════════════════════════════════════
+    # المسارات
+    # ═══════════════════════════════════════════════════════════════════════
+
+    def _folder(self, folder: str) -> Path:
+        path = (self.root / folder).resolve()
+        if path.parent != self.root.resolve():
+            raise ValueError(f"مجلد غير صالح: {folder}")
+        return path
+
+    def _file(self, folder: str, relative: str) -> Path:
+        base = self._folder(folder)
+        path = (base / relative).resolve()
+        if base not in path.parents:
+            raise ValueError(f"مسار غير صالح: {relative}")
+        return path
+
+    # ═══════════════════════════════════════════════════════════════════════
+    # العمليات
+    # ═══════════════════════════════════════════════════════════════════════
+
+    async def _install_requirements(self, folder: Path, requirements_hash: Optional[str]):
+        req_file = folder / "requirements.txt"
+        marker = folder / REQUIREMENTS_MARKER
+        if not req_file.exists() or not requirements_hash:
+            return
+        if marker.exists() and marker.read_text().strip() == requirements_hash:
+            return
+        process = await asyncio.create_subprocess_exec(
+            sys.executable, "-m", "pip", "install", "-q", "-r", str(req_file),
+            cwd=str(folder), env=without_agent_secrets(os.environ),
+            stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE
+        )
+        try:
+            _, stderr = await asyncio.wait_for(process.communicate(), timeout=PIP_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            process.kill()
+            raise RuntimeError("pip timeout")
+        if process.returncode != 0:
+            lines = stderr.decode("utf-8", errors="replace").strip().splitlines()
+            logger.warning(f"فشل تثبيت المتطلبات في {folder.name}: {lines[-1] if lines else process.returncode}")
+            return
+        marker.write_text(requirements_hash)
+
+    async def op_start(self, bot_id: int, folder: str, main_file: str, env: dict,
+                       setup: dict, requirements_hash: Optional[str] = None):
+        await self._stop(bot_id)
+        if len(self.bots) >= self.slots:
+            raise RuntimeError("no free slots")
+        path = self._folder(folder)
+        self._file(folder, main_file)
+        await self._install_requirements(path, requirements_hash)
+
+        logs = path / "logs"
+        logs.mkdir(exist_ok=True)
+        stdout = open(logs / "stdout.log", "a", encoding="utf-8")
+        stderr = open(logs / "stderr.log", "a", encoding="utf-8")
+        process = await asyncio.create_subprocess_exec(
+            sys.executable, main_file,
+            cwd=str(path),
+            env=bot_environment(env),
+            stdout=stdout,
+            stderr=stderr,
+            preexec_fn=functools.partial(apply_child_setup, setup or {})
+        )
+        self.bots[bot_id] = {
+            "process": process, "folder": folder, "logs": (stdout, stderr),
+            "started_at": time.time(), "cpu_sample": None,
+        }
+        asyncio.get_running_loop().create_task(self._watch(bot_id, process))
+        logger.info(f"▶️ البوت {bot_id} يعمل (PID {process.pid})")
+        return {"pid": process.pid}
+
+    async def _watch(self, bot_id: int, process):
+        await process.wait()
+        self._finish(bot_id, process)
+
+    def _finish(self, bot_id: int, process):
+        """تنظيف البوت بعد خروجه وإبلاغ المضيف (مرة واحدة لكل عملية)"""
+        data = self.bots.get(bot_id)
+        if data is None or data["process"] is not process:
+            return
+        del self.bots[bot_id]
+        for f in data["logs"]:
+            f.close()
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+        stderr_tail = _read_tail(self._folder(data["folder"]) / "logs" / "stderr.log", STDERR_TAIL_BYTES)
+        self._send({
+            "event": "exit", "bot_id": bot_id,
+            "returncode": process.returncode, "stderr_tail": stderr_tail,
+        })
+
+    async def _stop(self, bot_id: int):
+        data = self.bots.get(bot_id)
+        if data is None:
+            return
+        process = data["process"]
+        for sig in (signal.SIGCONT, signal.SIGKILL):
+            try:
+                os.killpg(process.pid, sig)
+            except (ProcessLookupError, PermissionError):
+                pass
+        try:
+            await asyncio.wait_for(process.wait(), timeout=STOP_KILL_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            logger.error(f"تعذّر حصاد البوت {bot_id}")
+            return
+        self._finish(bot_id, process)
+
+    async def op_signal(self, bot_id: int, sig: int):
+        data = self.bots.get(bot_id)
+        if data is None:
+            return False
+        try:
+            os.killpg(data["process"].pid, sig)
+        except (ProcessLookupError, PermissionError):
+            return False
+        return True
+
+    async def op_list(self):
+        return {str(bot_id): data["process"].pid for bot_id, data in self.bots.items()}
+
+    # ═══════════════════════════════════════════════════════════════════════
+    # الإحصائيات
+    # ═══════════════════════════════════════════════════════════════════════
+
+    def _bot_usage(self, data: dict):
+        """(نسبة المعالج منذ القراءة السابقة، الذاكرة بالميجابايت) للعملية الرئيسية من /proc"""
+        pid = data["process"].pid
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            cpu_seconds = (int(fields[11]) + int(fields[12])) / self._clock_ticks
+            with open(f"/proc/{pid}/statm") as f:
+                rss = int(f.read().split()[1]) * self._page_size
+        except (OSError, IndexError, ValueError):
+            return 0.0, 0.0
+        now = time.monotonic()
+        previous, data["cpu_sample"] = data["cpu_sample"], (now, cpu_seconds)
+        cpu = 0.0
+        if previous and now > previous[0]:
+            cpu = (cpu_seconds - previous[1]) / (now - previous[0]) * 100
+        return round(max(cpu, 0.0), 1), round(rss / (1024 * 1024), 1)
+
+    async def op_stats(self):
+        memory = _memory_mb()
+        try:
+            load = os.getloadavg()[0]
+        except OSError:
+            load = 0.0
+        return {
+            "slots": self.slots,
+            "running": len(self.bots),
+            "memory_total_mb": memory["total"],
+            "memory_available_mb": memory["available"],
+            "load": load,
+            "cpu_count": os.cpu_count() or 1,
+            "bots": {str(bot_id): self._bot_usage(data) for bot_id, data in self.bots.items()},
+        }
+
+    # ═══════════════════════════════════════════════════════════════════════
+    # الملفات
+    # ═══════════════════════════════════════════════════════════════════════
+
+    async def op_manifest(self, folder: str):
+        return await asyncio.to_thread(folder_manifest, self._folder(folder))
+
+    async def op_put(self, folder: str, path: str, data: str, offset: int = 0):
+        target = self._file(folder, path)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        with open(target, "r+b" if offset else "wb") as f:
+            f.seek(offset)
+            f.write(base64.b64decode(data))
+        return True
+
+    async def op_delete(self, folder: str, paths: list):
+        for path in paths:
+            try:
+                self._file(folder, path).unlink()
+            except FileNotFoundError:
+                pass
+        return True
+
+    async def op_tail(self, folder: str, stream: str = "stderr", max_bytes: int = STDERR_TAIL_BYTES):
+        if stream not in ("stdout", "stderr"):
+            raise ValueError(stream)
+        return _read_tail(self._folder(folder) / "logs" / f"{stream}.log", max_bytes)
+
+
+async def serve(host: str, port: int, agent: Agent, ssl_context: Optional[ssl.SSLContext] = None):
+    server = await asyncio.start_server(
+        agent.handle, host, port, limit=MAX_MESSAGE_BYTES, ssl=ssl_context
+    )
+    logger.info(
+        f"🛰️ وكيل التشغيل يستمع على {host}:{port} "
+        f"({'TLS' if ssl_context else 'بدون TLS'}، خانات: {agent.slots})"
+    )
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    # قبل أي شيء: البوتات بنفس المستخدم لا تقرأ الرمز من /proc/<pid>/environ
+    dumpable_off = make_non_dumpable()
+    parser = argparse.ArgumentParser(description="NeurHostX worker agent")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--root", default="agent_bots")
+    parser.add_argument("--slots", type=int, default=20)
+    parser.add_argument("--orphan-grace", type=float, default=60.0)
+    parser.add_argument("--tls-cert", default="")
+    parser.add_argument("--tls-key", default="")
+    args = parser.parse_args()
+
+    token = os.getenv("NEURHOST_AGENT_TOKEN", "")
+    if not token:
+        sys.exit("❌ NEURHOST_AGENT_TOKEN غير معيّن")
+
+    ssl_context = None
+    if args.tls_cert:
+        ssl_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        ssl_context.load_cert_chain(args.tls_cert, args.tls_key or None)
+    elif not is_loopback(args.host):
+        # ملفات البوتات و BOT_TOKEN تمر عبر الاتصال: لا نص صريح خارج الجهاز
+        sys.exit("❌ الاستماع على عنوان غير loopback يتطلب --tls-cert و --tls-key")
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    if not dumpable_off:
+        logger.warning("⚠️ تعذّر PR_SET_DUMPABLE - الرمز مقروء للبوتات من /proc/<pid>/environ")
+    root = Path(args.root)
+    root.mkdir(parents=True, exist_ok=True)
+    agent = Agent(root, token, args.slots, args.orphan_grace)
+    try:
+        asyncio.run(serve(args.host, args.port, agent, ssl_context))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
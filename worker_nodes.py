@@ -0,0 +1,402 @@
+# ============================================================================
+# توزيع البوتات على عقد التشغيل - NeurHostX V9.2
+# ============================================================================
+"""
+جهة المضيف الرئيسي لوكلاء التشغيل (worker_agent.py):
+- اتصال دائم بكل عقدة (TLS + مصادقة متبادلة + توقيع كل رسالة) مع إعادة
+  الاتصال، واستطلاع سعتها كل WORKER_STATS_INTERVAL_SECONDS
+- اختيار العقدة الأكثر ذاكرة حرة مع خانة متاحة لكل بوت جديد
+- مزامنة مجلد البوت بتجزئة المحتوى قبل التشغيل
+- RemoteProcess بديل asyncio.subprocess.Process فتعمل المراقبة والإيقاف كما هي
+"""
+
+import os
+import ssl
+import json
+import time
+import base64
+import signal
+import asyncio
+import logging
+import itertools
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from config import (
+    WORKER_AGENTS, WORKER_AGENT_TOKEN, WORKER_AGENT_CA, WORKER_STATS_INTERVAL_SECONDS,
+    WORKER_NODE_GRACE_SECONDS, WORKER_MEMORY_RESERVE_MB
+)
+from worker_agent import (
+    MAX_MESSAGE_BYTES, SecureChannel, sign, session_key, is_loopback, folder_manifest
+)
+
+logger = logging.getLogger(__name__)
+
+# حجم جزء الملف في رسالة put (قبل base64)
+_CHUNK_BYTES = 1024 * 1024
+_REQUEST_TIMEOUT_SECONDS = 30
+_START_TIMEOUT_SECONDS = 360  # يشمل تثبيت المتطلبات على العقدة
+_RECONNECT_MAX_SECONDS = 30
+
+
+class RemoteProcess:
+    """بوت يعمل على عقدة: نفس واجهة asyncio.subprocess.Process المستخدمة في مدير العمليات"""
+
+    remote = True
+
+    def __init__(self, node: "AgentNode", bot_id: int, pid: int):
+        self.node = node
+        self.bot_id = bot_id
+        self.pid = pid
+        self.returncode: Optional[int] = None
+        self.usage: Tuple[float, float] = (0.0, 0.0)
+        self.stderr_tail = ""
+        self._exited = asyncio.Event()
+
+    def _set_exit(self, code: int, stderr_tail: str = ""):
+        if self.returncode is None:
+            self.returncode = code
+            self.stderr_tail = stderr_tail
+            self._exited.set()
+
+    async def wait(self) -> int:
+        await self._exited.wait()
+        return self.returncode
+
+    def send_signal(self, sig):
+        """إرسال إشارة لمجموعة عمليات البوت على العقدة (دون انتظار الرد)"""
+        if not self.node.connected:
+            raise ProcessLookupError(f"العقدة {self.node.address} غير متصلة")
+        asyncio.get_running_loop().create_task(
+            self.node.request("signal", bot_id=self.bot_id, sig=int(sig))
+        )
+
+    def terminate(self):
+        self.send_signal(signal.SIGTERM)
+
+    def kill(self):
+        self.send_signal(signal.SIGKILL)
+
+
+class AgentNode:
+    """اتصال بوكيل تشغيل واحد"""
+
+    def __init__(self, address: str, token: str, ssl_context: Optional[ssl.SSLContext] = None):
+        self.address = address
+        host, _, port = address.rpartition(':')
+        self.host, self.port = host or '127.0.0.1', int(port)
+        self.token = token
+        self.ssl_context = ssl_context
+        self.name = address
+        self.stats: Optional[dict] = None
+        self.processes: Dict[int, RemoteProcess] = {}
+        # بوتات وُضعت على العقدة ولم تظهر في الإحصائيات بعد
+        self.pending_mb = 0
+        self.pending_slots = 0
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._channel: Optional[SecureChannel] = None
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._ids = itertools.count(1)
+        self._task: Optional[asyncio.Task] = None
+        self._lost_at: Optional[float] = None
+
+    @property
+    def connected(self) -> bool:
+        return self._writer is not None and not self._writer.is_closing()
+
+    # ═══════════════════════════════════════════════════════════════════════
+    # الاتصال
+    # ═══════════════════════════════════════════════════════════════════════
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    async def _run(self):
+        delay = 1.0
+        while True:
+            try:
+                await self._session()
+                delay = 1.0
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"🛰️ العقدة {self.address}: {e}")
+            self._disconnected()
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, _RECONNECT_MAX_SECONDS)
+
+    async def _session(self):
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(
+                self.host, self.port, limit=MAX_MESSAGE_BYTES, ssl=self.ssl_context
+            ),
+            timeout=10
+        )
+        try:
+            challenge = str(json.loads(await asyncio.wait_for(reader.readline(), timeout=10))['challenge'])
+            nonce = os.urandom(16).hex()
+            writer.write((json.dumps({'op': 'auth', 'mac': sign(self.token, challenge), 'nonce': nonce}) + "\n").encode())
+            # الترحيب موقّع بمفتاح مشتق من تحدينا: وكيل لا يملك الرمز لا يمر
+            channel = SecureChannel(session_key(self.token, challenge, nonce), "host", "agent")
+            try:
+                hello = channel.decode(await asyncio.wait_for(reader.readline(), timeout=10))
+            except ValueError:
+                raise ConnectionError("فشلت المصادقة (الرمز مرفوض أو الوكيل غير موثوق)")
+            if not hello.get('ok'):
+                raise ConnectionError("فشلت المصادقة")
+            self.name = hello.get('node', self.address)
+            self._channel = channel
+            self._writer = writer
+            self._lost_at = None
+            logger.info(f"🛰️ متصل بالعقدة {self.name} ({self.address})")
+
+            reader_task = asyncio.get_running_loop().create_task(self._read_loop(reader, channel))
+            try:
+                await self._reconcile()
+                while not reader_task.done():
+                    await self.refresh_stats()
+                    await asyncio.wait({reader_task}, timeout=WORKER_STATS_INTERVAL_SECONDS)
+            finally:
+                reader_task.cancel()
+        finally:
+            writer.close()
+
+    async def _read_loop(self, reader, channel: SecureChannel):
+        while True:
+            line = await reader.readline()
+            if not line:
+                return
+            message = channel.decode(line)
+            if message.get('event') == 'exit':
+                process = self.processes.pop(int(message['bot_id']), None)
+                if process is not None:
+                    process._set_exit(message['returncode'], message.get('stderr_tail', ''))
+                continue
+            future = self._pending.pop(message.get('id'), None)
+            if future is not None and not future.done():
+                if message.get('ok'):
+                    future.set_result(message.get('result'))
+                else:
+                    future.set_exception(RuntimeError(message.get('error', 'agent error')))
+
+    def _disconnected(self):
+        self._writer = None
+        self._channel = None
+        self.stats = None
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError(f"انقطع الاتصال بالعقدة {self.address}"))
+        self._pending.clear()
+        if self._lost_at is None:
+            self._lost_at = time.monotonic()
+        elif time.monotonic() - self._lost_at >= WORKER_NODE_GRACE_SECONDS and self.processes:
+            # العقدة لم تعد: بوتاتها تُعتبر متوقفة فيعيد مسار الأعطال تشغيلها في مكان آخر
+            logger.error(f"🛰️ العقدة {self.address} مفقودة - اعتبار {len(self.processes)} بوت متوقفاً")
+            for process in self.processes.values():
+                process._set_exit(-signal.SIGKILL, "worker node lost")
+            self.processes.clear()
+
+    async def _reconcile(self):
+        """بعد إعادة الاتصال: مطابقة بوتات العقدة مع ما يتتبعه المضيف
+
+        - بوت نتتبعه ولم يعد يعمل: يُبلّغ كمتوقف
+        - بوت يعمل على العقدة ولا نتتبعه (أُعيد تشغيل المضيف قبل انقضاء
+          --orphan-grace فأُلغي مؤقت الإيقاف): يُقتل، إذ لا مراقبة ولا محاسبة
+          ولا إيقاف له، ومسار التشغيل العادي يعيده إن لزم
+        """
+        alive = await self.request('list')
+        for bot_id in list(self.processes):
+            if str(bot_id) not in alive:
+                self.processes.pop(bot_id)._set_exit(-signal.SIGKILL, "exited while disconnected")
+        # لا تشغيل جديد على العقدة قبل انتهاء المطابقة (fits يحتاج إحصائيات الجلسة)
+        for bot_id in alive:
+            if int(bot_id) not in self.processes:
+                logger.warning(f"🛰️ العقدة {self.name}: إيقاف البوت {bot_id} غير المتتبَّع")
+                await self.request('signal', bot_id=int(bot_id), sig=int(signal.SIGKILL))
+
+    async def request(self, op: str, timeout: float = _REQUEST_TIMEOUT_SECONDS, **args):
+        """إرسال أمر للعقدة وانتظار نتيجته"""
+        if not self.connected:
+            raise ConnectionError(f"العقدة {self.address} غير متصلة")
+        request_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        self._writer.write(self._channel.encode({'id': request_id, 'op': op, 'args': args}))
+        await self._writer.drain()
+        try:
+            return await asyncio.wait_for(future, timeout=timeout)
+        finally:
+            self._pending.pop(request_id, None)
+
+    # ═══════════════════════════════════════════════════════════════════════
+    # السعة
+    # ═══════════════════════════════════════════════════════════════════════
+
+    async def refresh_stats(self):
+        stats = await self.request('stats')
+        self.stats = stats
+        self.pending_mb = self.pending_slots = 0
+        for bot_id, usage in stats.get('bots', {}).items():
+            process = self.processes.get(int(bot_id))
+            if process is not None:
+                process.usage = tuple(usage)
+
+    def free_memory_mb(self) -> float:
+        if not self.stats:
+            return 0.0
+        return self.stats['memory_available_mb'] - self.pending_mb
+
+    def fits(self, memory_mb: int) -> bool:
+        if not self.connected or not self.stats:
+            return False
+        if self.stats['running'] + self.pending_slots >= self.stats['slots']:
+            return False
+        return self.free_memory_mb() - memory_mb >= WORKER_MEMORY_RESERVE_MB
+
+
+class NodePool:
+    """كل العقد المعرّفة في WORKER_AGENTS"""
+
+    def __init__(self, addresses: List[str] = WORKER_AGENTS, token: str = WORKER_AGENT_TOKEN,
+                 ca_file: str = WORKER_AGENT_CA):
+        if addresses and not token:
+            logger.warning("⚠️ WORKER_AGENTS معرّفة بدون NEURHOST_AGENT_TOKEN - تعطيل العقد")
+            addresses = []
+        ssl_context = ssl.create_default_context(cafile=ca_file) if ca_file else None
+        self.nodes = []
+        for address in addresses:
+            node = AgentNode(address, token, ssl_context)
+            if ssl_context is None and not is_loopback(node.host):
+                # ملفات البوتات و BOT_TOKEN لا تُرسل نصاً صريحاً عبر الشبكة
+                logger.error(f"⚠️ العقدة {address} بعيدة ولا توجد NEURHOST_AGENT_CA - تعطيلها")
+                continue
+            self.nodes.append(node)
+
+    def __bool__(self):
+        return bool(self.nodes)
+
+    def start(self):
+        """بدء الاتصال بالعقد (يحتاج حلقة تعمل)"""
+        for node in self.nodes:
+            node.start()
+
+    def install(self, application) -> bool:
+        if not self.nodes:
+            return False
+        if application.job_queue is None:
+            logger.warning("⚠️ JobQueue غير متاح - الاتصال بالعقد عند أول تشغيل")
+            return False
+        application.job_queue.run_once(self._start_job, when=0, name="worker_nodes")
+        return True
+
+    async def _start_job(self, context):
+        self.start()
+
+    async def close(self):
+        for node in self.nodes:
+            await node.close()
+
+    def place(self, memory_mb: int) -> Optional[AgentNode]:
+        """العقدة ذات أكبر ذاكرة حرة تتسع للبوت، أو None (يعمل محلياً)"""
+        self.start()
+        candidates = [node for node in self.nodes if node.fits(memory_mb)]
+        if not candidates:
+            return None
+        node = max(candidates, key=AgentNode.free_memory_mb)
+        # حجز مبدئي حتى تعكسه الإحصائيات التالية، فلا تذهب تشغيلات متزامنة لنفس العقدة
+        node.pending_mb += memory_mb
+        node.pending_slots += 1
+        return node
+
+    def has_capacity(self, memory_mb: int) -> bool:
+        return any(node.fits(memory_mb) for node in self.nodes)
+
+    def node(self, address: Optional[str]) -> Optional[AgentNode]:
+        return next((node for node in self.nodes if node.address == address), None)
+
+    # ═══════════════════════════════════════════════════════════════════════
+    # المزامنة والتشغيل
+    # ═══════════════════════════════════════════════════════════════════════
+
+    async def sync_folder(self, node: AgentNode, bot_path: Path) -> int:
+        """رفع الملفات المختلفة فقط وحذف ما لم يعد موجوداً: عدد الملفات المرفوعة"""
+        local = await asyncio.to_thread(folder_manifest, bot_path)
+        remote = await node.request('manifest', folder=bot_path.name)
+
+        changed = [path for path, digest in local.items() if remote.get(path) != digest]
+        for relative in changed:
+            offset = 0
+            with open(bot_path / relative, 'rb') as f:
+                while True:
+                    chunk = f.read(_CHUNK_BYTES)
+                    if not chunk and offset:
+                        break
+                    await node.request(
+                        'put', folder=bot_path.name, path=relative,
+                        data=base64.b64encode(chunk).decode(), offset=offset
+                    )
+                    offset += len(chunk)
+                    if not chunk:
+                        break
+
+        removed = [path for path in remote if path not in local]
+        if removed:
+            await node.request('delete', folder=bot_path.name, paths=removed)
+        return len(changed)
+
+    async def start_bot(self, node: AgentNode, bot_id: int, bot_path: Path, main_file: str,
+                        env: dict, setup: dict, requirements_hash: Optional[str]) -> RemoteProcess:
+        try:
+            synced = await self.sync_folder(node, bot_path)
+            result = await node.request(
+                'start', timeout=_START_TIMEOUT_SECONDS,
+                bot_id=bot_id, folder=bot_path.name, main_file=main_file,
+                env=env, setup=setup, requirements_hash=requirements_hash
+            )
+        except Exception:
+            node.pending_slots = max(0, node.pending_slots - 1)
+            raise
+        process = RemoteProcess(node, bot_id, result['pid'])
+        node.processes[bot_id] = process
+        logger.info(f"🛰️ البوت {bot_id} على العقدة {node.name} (PID {process.pid}، {synced} ملف مُزامن)")
+        return process
+
+    async def stop_bot(self, address: Optional[str], bot_id: int):
+        """إيقاف نسخة قديمة للبوت على عقدة (بعد إعادة تشغيل المضيف مثلاً)"""
+        node = self.node(address)
+        if node is None or not node.connected:
+            return
+        try:
+            await node.request('signal', bot_id=bot_id, sig=int(signal.SIGKILL))
+        except Exception as e:
+            logger.warning(f"فشل إيقاف البوت {bot_id} على {address}: {e}")
+
+    async def tail(self, address: Optional[str], folder: str, stream: str = 'stderr') -> Optional[str]:
+        node = self.node(address)
+        if node is None or not node.connected:
+            return None
+        return await node.request('tail', folder=folder, stream=stream)
+
+    def summary(self) -> List[dict]:
+        """حالة العقد للعرض"""
+        return [
+            {
+                'address': node.address,
+                'name': node.name,
+                'connected': node.connected,
+                'running': node.stats['running'] if node.stats else len(node.processes),
+                'slots': node.stats['slots'] if node.stats else 0,
+                'memory_available_mb': node.stats['memory_available_mb'] if node.stats else 0,
+                'load': node.stats['load'] if node.stats else 0,
+            }
+            for node in self.nodes
+        ]
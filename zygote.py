@@ -0,0 +1,423 @@
+# ============================================================================
+# مفسّر مُسخَّن مسبقاً لتشغيل البوتات (Zygote) - NeurHostX V9.2
+# ============================================================================
+"""
+عملية Python دائمة تستورد المكتبات الشائعة مرة واحدة، ثم تنسخ نفسها (fork)
+لكل بوت: الابن يطبّق حدود الموارد ويغيّر المجلد والبيئة ثم يشغّل الملف
+الرئيسي عبر runpy، فلا يدفع البوت ثمن بدء المفسّر ولا استيراد telegram/httpx.
+
+هذا الملف يعتمد على المكتبة القياسية فقط: كل ما تستورده العملية الأم يرثه
+كل بوت، فلا يجوز أن تحمل وحداتٍ من المضيف (config وبيانات الاعتماد).
+
+البروتوكول: سطر JSON لكل رسالة عبر stdin/stdout للعملية الأم
+    ← {"id", "cwd", "main", "env", "stdout", "stderr", "setup"}
+    → {"id", "pid"} | {"id", "error"}
+    → {"exit": pid, "code": رمز الخروج}
+    ← {"cmd": "retire"}  إيقاف قبول البوتات والخروج بعد انتهاء الموجودين
+"""
+
+import os
+import sys
+import json
+import time
+import signal
+import asyncio
+import logging
+from pathlib import Path
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# أسرار عقد التشغيل: من يملك الرمز يجتاز تحدي HMAC على كل عقدة ويتحكم ببوتات
+# الآخرين، فلا تصل أبداً إلى بيئة كود المستخدمين (محلياً أو على العقد)
+AGENT_SECRET_ENV = ("NEURHOST_AGENT_TOKEN", "NEURHOST_AGENTS")
+
+
+def without_agent_secrets(env) -> Dict[str, str]:
+    """نسخة من البيئة بدون أسرار عقد التشغيل"""
+    return {key: value for key, value in env.items() if key not in AGENT_SECRET_ENV}
+
+
+def make_non_dumpable() -> bool:
+    """PR_SET_DUMPABLE=0 للعملية الحالية (Linux)
+
+    حذف الأسرار من بيئة الأبناء لا يكفي: البوتات تعمل بنفس المستخدم فتقرأ
+    /proc/<pid>/environ للمضيف أو الوكيل. العملية غير القابلة للتفريغ تصبح
+    ملفات /proc الخاصة بها ملكاً لـ root ولا يمكن تتبعها (ptrace)، وexecve
+    في الأبناء يعيد الخاصية فلا تتأثر البوتات.
+    """
+    if not sys.platform.startswith("linux"):
+        return False
+    import ctypes
+    PR_SET_DUMPABLE = 4
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        return libc.prctl(PR_SET_DUMPABLE, 0, 0, 0, 0) == 0
+    except (OSError, AttributeError):
+        return False
+
+
+def apply_child_setup(setup: dict):
+    """تهيئة عملية البوت قبل تشغيل كوده (تُستدعى في الابن بعد fork)
+
+    setup: {'cgroup_procs': مسار cgroup.procs} أو {'rlimits': [(اسم, قيمة)], 'nice': n}
+    """
+    os.setsid()
+    procs_file = setup.get('cgroup_procs')
+    if procs_file:
+        fd = os.open(procs_file, os.O_WRONLY)
+        try:
+            os.write(fd, str(os.getpid()).encode())
+        finally:
+            os.close(fd)
+    if setup.get('rlimits'):
+        import resource
+        for name, value in setup['rlimits']:
+            resource.setrlimit(getattr(resource, name), (value, value))
+    if setup.get('nice'):
+        os.nice(setup['nice'])
+
+
+# ═══════════════════════════════════════════════════════════════════════════
+# جهة العملية الأم (تعمل داخل المضيف)
+# ═══════════════════════════════════════════════════════════════════════════
+
+class ZygoteProcess:
+    """بديل asyncio.subprocess.Process لبوت بدأ من الـ zygote"""
+
+    def __init__(self, pid: int):
+        self.pid = pid
+        self.returncode: Optional[int] = None
+        self._exited = asyncio.Event()
+
+    def _set_exit(self, code: int):
+        if self.returncode is None:
+            self.returncode = code
+            self._exited.set()
+
+    async def wait(self) -> int:
+        await self._exited.wait()
+        return self.returncode
+
+    def send_signal(self, sig):
+        os.kill(self.pid, sig)
+
+    def terminate(self):
+        self.send_signal(signal.SIGTERM)
+
+    def kill(self):
+        self.send_signal(signal.SIGKILL)
+
+
+class _Zygote:
+    """اتصال بعملية zygote واحدة"""
+
+    def __init__(self, process):
+        self.process = process
+        self.children: Dict[int, ZygoteProcess] = {}
+        self.retired = False
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._next_id = 0
+        self._reader = asyncio.create_task(self._read_loop())
+
+    @property
+    def alive(self) -> bool:
+        return self.process.returncode is None and not self._reader.done()
+
+    def _send(self, message: dict):
+        self.process.stdin.write((json.dumps(message) + "\n").encode())
+
+    async def spawn(self, request: dict) -> ZygoteProcess:
+        self._next_id += 1
+        request = dict(request, id=self._next_id)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[self._next_id] = future
+        self._send(request)
+        await self.process.stdin.drain()
+        return await future
+
+    def retire(self):
+        """لا بوتات جديدة؛ تخرج العملية بعد انتهاء أبنائها الحاليين"""
+        self.retired = True
+        try:
+            self._send({'cmd': 'retire'})
+        except Exception:
+            pass
+
+    async def _read_loop(self):
+        try:
+            while True:
+                line = await self.process.stdout.readline()
+                if not line:
+                    break
+                message = json.loads(line)
+                if 'exit' in message:
+                    child = self.children.pop(message['exit'], None)
+                    if child:
+                        child._set_exit(message['code'])
+                    continue
+                future = self._pending.pop(message.get('id'), None)
+                if future is None or future.done():
+                    continue
+                if 'pid' in message:
+                    # التسجيل هنا قبل أي رسالة خروج لنفس الـ PID
+                    child = self.children[message['pid']] = ZygoteProcess(message['pid'])
+                    future.set_result(child)
+                else:
+                    future.set_exception(RuntimeError(message.get('error', 'zygote error')))
+        except Exception as e:
+            logger.error(f"خطأ في قراءة رسائل الـ zygote: {e}")
+        finally:
+            self._on_lost()
+
+    def _on_lost(self):
+        """انتهت عملية الـ zygote: لا يمكن معرفة خروج أبنائها بعد الآن، فتُقتل مجموعاتهم
+        ويُعاملون كتوقف مفاجئ لتتولاهم سياسة إعادة التشغيل"""
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(RuntimeError("zygote exited"))
+        self._pending.clear()
+        if self.children and not self.retired:
+            logger.error(f"❌ توقفت عملية الـ zygote مع {len(self.children)} بوت")
+        for pid, child in list(self.children.items()):
+            try:
+                os.killpg(pid, signal.SIGKILL)
+            except (ProcessLookupError, PermissionError):
+                pass
+            child._set_exit(-signal.SIGKILL)
+        self.children.clear()
+
+
+class ZygotePool:
+    """إدارة الـ zygote الحالي (يُستبدل بعد تغيّر المكتبات المثبّتة)"""
+
+    def __init__(self, preload: List[str], start_timeout: float = 60):
+        self.preload = list(preload)
+        self.start_timeout = start_timeout
+        self.preloaded: List[str] = []
+        self._current: Optional[_Zygote] = None
+        self._retired: List[_Zygote] = []
+        self._lock = asyncio.Lock()
+
+    async def _get(self) -> _Zygote:
+        async with self._lock:
+            if self._current is not None and self._current.alive:
+                return self._current
+
+            started = time.monotonic()
+            process = await asyncio.create_subprocess_exec(
+                sys.executable, str(Path(__file__).resolve()), *self.preload,
+                env=without_agent_secrets(os.environ),
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                start_new_session=True
+            )
+            try:
+                ready = json.loads(await asyncio.wait_for(process.stdout.readline(), self.start_timeout))
+            except (asyncio.TimeoutError, ValueError):
+                process.kill()
+                await process.wait()
+                raise RuntimeError("zygote لم يصبح جاهزاً")
+
+            self.preloaded = ready.get('preloaded', [])
+            self._current = _Zygote(process)
+            logger.info(
+                f"🧬 zygote جاهز (PID {process.pid}) خلال {time.monotonic() - started:.2f}s - "
+                f"مُحمّل مسبقاً: {', '.join(self.preloaded) or 'لا شيء'}"
+            )
+            return self._current
+
+    async def spawn(self, cwd: str, main: str, env: dict, stdout: str, stderr: str,
+                    setup: dict) -> ZygoteProcess:
+        """تشغيل بوت كابن للـ zygote (يعود بعد تهيئة الابن وقبل تنفيذ كود البوت)"""
+        zygote = await self._get()
+        return await zygote.spawn({
+            'cwd': cwd, 'main': main, 'env': env,
+            'stdout': stdout, 'stderr': stderr, 'setup': setup
+        })
+
+    def refresh(self):
+        """استبدال الـ zygote (بعد تثبيت متطلبات قد تغيّر المكتبات المحمّلة مسبقاً)
+
+        القديم يبقى حتى تنتهي بوتاته ليبلّغ عن رموز خروجها.
+        """
+        if self._current is not None:
+            self._current.retire()
+            self._retired.append(self._current)
+            self._current = None
+        self._retired = [z for z in self._retired if z.alive]
+
+    async def close(self):
+        self.refresh()
+        for zygote in self._retired:
+            try:
+                await asyncio.wait_for(zygote.process.wait(), timeout=5)
+            except asyncio.TimeoutError:
+                zygote.process.kill()
+
+
+# ═══════════════════════════════════════════════════════════════════════════
+# جهة الـ zygote (python zygote.py <وحدات للتحميل المسبق>)
+# ═══════════════════════════════════════════════════════════════════════════
+
+def _preload(modules: List[str]) -> List[str]:
+    import importlib
+    loaded = []
+    for name in modules:
+        try:
+            importlib.import_module(name)
+            loaded.append(name)
+        except Exception:
+            pass
+    return loaded
+
+
+def _open_log(path: str, target_fd: int):
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+    os.dup2(fd, target_fd)
+    os.close(fd)
+
+
+def _run_child(request: dict, private_fds: List[int], ready_fd: int):
+    """جسم الابن بعد fork: لا يعود أبداً إلى حلقة الـ zygote"""
+    import runpy
+    import traceback
+
+    signal.set_wakeup_fd(-1)
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    for fd in private_fds:
+        try:
+            os.close(fd)
+        except OSError:
+            pass
+
+    try:
+        apply_child_setup(request.get('setup') or {})
+        _open_log(request['stdout'], 1)
+        _open_log(request['stderr'], 2)
+        os.chdir(request['cwd'])
+        os.environ.clear()
+        os.environ.update(request['env'])
+        sys.argv = [request['main']]
+        # مجلد البوت بدل مجلد المضيف في مسار الاستيراد
+        sys.path[0] = request['cwd']
+        os.write(ready_fd, b"1")
+        os.close(ready_fd)
+    except BaseException:
+        traceback.print_exc()
+        sys.stderr.flush()
+        os._exit(127)
+
+    # الخروج عبر SystemExit كما في `python main.py` تماماً: ينتظر المفسّر
+    # الخيوط وينفّذ atexit. الـ traceback يُطبع بدون إطارات الـ zygote و runpy
+    try:
+        runpy.run_path(request['main'], run_name="__main__")
+    except SystemExit:
+        raise
+    except BaseException as e:
+        tb = e.__traceback__
+        while tb is not None and tb.tb_frame.f_code.co_filename in (__file__, "<frozen runpy>"):
+            tb = tb.tb_next
+        traceback.print_exception(type(e), e, tb)
+        sys.exit(1)
+    sys.exit(0)
+
+
+def serve(preload: List[str]):
+    import selectors
+
+    # قناة البروتوكول على واصفات خاصة؛ ما تطبعه المكتبات يذهب إلى stderr
+    proto_in = os.dup(0)
+    proto_out = os.dup(1)
+    devnull = os.open(os.devnull, os.O_RDWR)
+    os.dup2(devnull, 0)
+    os.dup2(2, 1)
+    os.close(devnull)
+
+    loaded = _preload(preload)
+
+    wake_r, wake_w = os.pipe()
+    os.set_blocking(wake_r, False)
+    os.set_blocking(wake_w, False)
+    signal.signal(signal.SIGCHLD, lambda *_: None)
+    signal.set_wakeup_fd(wake_w)
+
+    def send(message: dict):
+        data = (json.dumps(message) + "\n").encode()
+        while data:
+            data = data[os.write(proto_out, data):]
+
+    send({'ready': True, 'preloaded': loaded, 'pid': os.getpid()})
+
+    selector = selectors.DefaultSelector()
+    selector.register(proto_in, selectors.EVENT_READ)
+    selector.register(wake_r, selectors.EVENT_READ)
+    private_fds = [proto_in, proto_out, wake_r, wake_w]
+
+    children = set()
+    retiring = False
+    buffer = b""
+
+    while True:
+        for key, _ in selector.select(timeout=1.0):
+            if key.fd == wake_r:
+                try:
+                    while os.read(wake_r, 512):
+                        pass
+                except BlockingIOError:
+                    pass
+                continue
+
+            data = os.read(proto_in, 65536)
+            if not data:
+                # المضيف خرج: البوتات تستمر كما لو بدأت مباشرة
+                return
+            buffer += data
+            while b"\n" in buffer:
+                line, buffer = buffer.split(b"\n", 1)
+                request = json.loads(line)
+                if request.get('cmd') == 'retire':
+                    retiring = True
+                    continue
+                if retiring:
+                    send({'id': request.get('id'), 'error': 'retired'})
+                    continue
+
+                sys.stdout.flush()
+                sys.stderr.flush()
+                ready_r, ready_w = os.pipe()
+                try:
+                    pid = os.fork()
+                except OSError as e:
+                    os.close(ready_r)
+                    os.close(ready_w)
+                    send({'id': request.get('id'), 'error': str(e)})
+                    continue
+                if pid == 0:
+                    selector.close()
+                    os.close(ready_r)
+                    _run_child(request, private_fds, ready_w)
+
+                # الرد بعد أن يصبح الابن قائد جلسته (setsid) ليعمل killpg فوراً
+                os.close(ready_w)
+                os.read(ready_r, 1)
+                os.close(ready_r)
+                children.add(pid)
+                send({'id': request.get('id'), 'pid': pid})
+
+        while children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+            children.discard(pid)
+            send({'exit': pid, 'code': os.waitstatus_to_exitcode(status)})
+
+        if retiring and not children:
+            return
+
+
+if __name__ == "__main__":
+    serve(sys.argv[1:])